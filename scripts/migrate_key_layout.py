@@ -0,0 +1,180 @@
+# Moves the documents of the source bucket, their results in the destination bucket, and their pending job markers,
+# from one key layout to another, see src/key_layout.py. For example:
+#   python3 scripts/migrate_key_layout.py --source-bucket project-ocr-cies-bucket-source-local \
+#       --destination-bucket project-ocr-cies-bucket-destination-local --from flat --to hashed --dry-run
+# Deploy the functions with KEY_LAYOUT set to the new layout first, so that new documents are written in it.
+# A document is copied with its metadata and tags, so the ObjectCreated event of the copy does not submit it
+# to Textract again unless it was never submitted. The objects in the old layout are deleted with --delete,
+# which should be run once the copies have been checked. A document whose Textract job is in flight while it
+# is moved is completed by the reconciler (see reconcile_handler.py) rather than by its notification.
+# The migration may be re-run, the objects already in the new layout are skipped.
+import argparse
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import boto3
+from botocore.client import Config
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import key_layout
+import pending_jobs
+
+# CopyObject copies objects of up to 5GB, larger objects are copied in parts of this size
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 512 * 1024 * 1024
+METADATA_KEY_SITE_ID = "x-amz-meta-site-id"
+
+# adaptive retries slow the migration down rather than fail it when S3 answers 503 SlowDown
+s3 = boto3.client('s3', config=Config(retries={"mode": "adaptive", "max_attempts": 10}, max_pool_connections=64))
+
+
+def main():
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--source-bucket", required=True)
+    argParser.add_argument("--destination-bucket", required=True)
+    argParser.add_argument("--from", dest="from_layout", choices=key_layout.LAYOUTS, required=True)
+    argParser.add_argument("--to", dest="to_layout", choices=key_layout.LAYOUTS, required=True)
+    argParser.add_argument("--hash-prefix-length", type=int, default=key_layout.KEY_HASH_PREFIX_LENGTH)
+    argParser.add_argument("--concurrency", type=int, default=32)
+    argParser.add_argument("--delete", action="store_true", help="delete the objects in the old layout once copied")
+    argParser.add_argument("--dry-run", action="store_true")
+    args = argParser.parse_args()
+
+    migration = Migration(args.source_bucket, args.destination_bucket,
+                          key_layout.KeyLayout(args.from_layout, args.hash_prefix_length),
+                          key_layout.KeyLayout(args.to_layout, args.hash_prefix_length),
+                          args.delete, args.dry_run)
+
+    # the markers are moved first, while the documents they locate are still at their old keys
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        markers = list(list_keys(args.destination_bucket, pending_jobs.PENDING_PREFIX))
+        outcomes = Counter(f"marker {outcome}" for outcome in executor.map(migration.migrate_marker, markers))
+        outcomes.update(executor.map(migration.migrate_document, list_keys(args.source_bucket)))
+
+    for outcome, count in sorted(outcomes.items()):
+        print(f"{outcome}: {count}")
+
+
+def list_keys(bucket: str, prefix: str = ""):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            yield item['Key']
+
+
+class Migration:
+    def __init__(self, source_bucket: str, destination_bucket: str, from_layout, to_layout, delete: bool, dry_run: bool):
+        self.source_bucket = source_bucket
+        self.destination_bucket = destination_bucket
+        self.from_layout = from_layout
+        self.to_layout = to_layout
+        self.delete = delete
+        self.dry_run = dry_run
+
+    # Returns the new key of a source key, or None when the key is not in the old layout. The site_id of the
+    # metadata is used when the old layout does not hold it.
+    def plan(self, source_key: str, metadata_site_id: str = None) -> str:
+        try:
+            site_id, document_id = self.from_layout.parse_source_key(source_key)
+        except ValueError:
+            return None
+        return self.to_layout.source_key(document_id, site_id or metadata_site_id)
+
+    def migrate_document(self, source_key: str) -> str:
+        if self.in_new_layout(source_key):
+            return "already migrated"
+        try:
+            head = s3.head_object(Bucket=self.source_bucket, Key=source_key)
+            new_key = self.plan(source_key, head['Metadata'].get(METADATA_KEY_SITE_ID))
+            if new_key is None:
+                print(f"skipping {source_key}, it is not in the {self.from_layout.layout} layout")
+                return "skipped"
+            if new_key == source_key:
+                return "unchanged"
+            print(f"{source_key} -> {new_key}")
+            if self.dry_run:
+                return "planned"
+
+            tags = s3.get_object_tagging(Bucket=self.source_bucket, Key=source_key)['TagSet']
+            copy_object(self.source_bucket, source_key, new_key, head, tags)
+            # the results are moved after the document, a result is never without its document
+            for suffix in key_layout.RESULT_SUFFIXES:
+                self.move_result(source_key + suffix, new_key + suffix)
+            if self.delete:
+                s3.delete_object(Bucket=self.source_bucket, Key=source_key)
+            return "migrated"
+        except ClientError as e:
+            print(f"Error migrating {source_key}: {e}")
+            return "error"
+
+    def move_result(self, old_key: str, new_key: str):
+        try:
+            s3.copy_object(Bucket=self.destination_bucket, Key=new_key, CopySource={'Bucket': self.destination_bucket, 'Key': old_key})
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return
+            raise
+        if self.delete:
+            s3.delete_object(Bucket=self.destination_bucket, Key=old_key)
+
+    # A marker is keyed by the source key of its document, it is moved to the new source key
+    def migrate_marker(self, pending_key: str) -> str:
+        source_key = pending_jobs.source_key_from_key(pending_key)
+        if self.in_new_layout(source_key):
+            return "already migrated"
+        try:
+            head = s3.head_object(Bucket=self.source_bucket, Key=source_key)
+            new_key = self.plan(source_key, head['Metadata'].get(METADATA_KEY_SITE_ID))
+            if new_key is None or new_key == source_key:
+                return "skipped"
+            hour = pending_key[len(pending_jobs.PENDING_PREFIX):].split("/", 1)[0]
+            if not self.dry_run:
+                s3.put_object(Bucket=self.destination_bucket, Key=pending_jobs.create_pending_key(new_key, hour), Body=b"")
+                s3.delete_object(Bucket=self.destination_bucket, Key=pending_key)
+            return "migrated"
+        except ClientError as e:
+            # the document of the marker has been deleted, or moved and deleted already
+            print(f"Error migrating marker {pending_key}: {e}")
+            return "error"
+
+    def in_new_layout(self, key: str) -> bool:
+        if self.to_layout.layout == key_layout.FLAT:
+            return False
+        try:
+            self.to_layout.parse_source_key(key)
+            return True
+        except ValueError:
+            return False
+
+
+# Copies a document with its metadata and tags. The tags are given with the copy, rather than put afterwards,
+# as the ObjectCreated event of the copy decides whether the document is submitted from its status tag.
+def copy_object(bucket: str, old_key: str, new_key: str, head: dict, tags: list):
+    tagging = urlencode([(tag['Key'], tag['Value']) for tag in tags])
+    if head['ContentLength'] <= MAX_COPY_OBJECT_SIZE:
+        s3.copy_object(Bucket=bucket, Key=new_key, CopySource={'Bucket': bucket, 'Key': old_key},
+                       MetadataDirective='COPY', TaggingDirective='REPLACE', Tagging=tagging)
+        return
+
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=new_key, ContentType=head.get('ContentType', 'binary/octet-stream'),
+                                           Metadata=head['Metadata'], Tagging=tagging)['UploadId']
+    try:
+        parts = []
+        for part_number, start in enumerate(range(0, head['ContentLength'], COPY_PART_SIZE), start=1):
+            end = min(start + COPY_PART_SIZE, head['ContentLength']) - 1
+            response = s3.upload_part_copy(Bucket=bucket, Key=new_key, UploadId=upload_id, PartNumber=part_number,
+                                           CopySource={'Bucket': bucket, 'Key': old_key}, CopySourceRange=f"bytes={start}-{end}",
+                                           CopySourceIfMatch=head['ETag'])
+            parts.append({"PartNumber": part_number, "ETag": response['CopyPartResult']['ETag']})
+        s3.complete_multipart_upload(Bucket=bucket, Key=new_key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=new_key, UploadId=upload_id)
+        raise
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# This module builds the columnar (Parquet) analytics export of the OCR results.
+# When a document completes, a small journal record is written to the destination bucket:
+#   export/journal/<completion timestamp>-<document_id>.json
+# The journal keys sort by completion time, so the export job reads only the records after its high
+# water mark (the last journal key it exported) using ListObjectsV2 StartAfter, rather than rescanning
+# the results. Each run compacts the new records into Parquet files, one row per page, partitioned by
+# site and completion date:
+#   export/parquet/site_id=<site_id>/date=<YYYY-MM-DD>/part-<first journal timestamp>-<hash of the first journal key>.parquet
+
+import hashlib
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+EXPORT_PREFIX = "export/"
+JOURNAL_PREFIX = "export/journal/"
+PARQUET_PREFIX = "export/parquet/"
+HIGH_WATER_MARK_KEY = "export/_state/high_water_mark.json"
+
+JOURNAL_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+# The columns of the export, in order
+EXPORT_COLUMNS = [
+    "document_id", "site_id", "user_id", "file_name", "job_id", "completed_at", "date",
+    "content_type", "content_length", "page", "page_count", "text", "word_count",
+    "line_count", "confidence_mean", "confidence_min", "confidence_max",
+]
+
+
+# ====================================================================================================
+# Journal records
+# ====================================================================================================
+def create_journal_key(document_id: str, completed_at: datetime = None) -> str:
+    if completed_at is None:
+        completed_at = datetime.now(timezone.utc)
+    return f"{JOURNAL_PREFIX}{completed_at.strftime(JOURNAL_TIMESTAMP_FORMAT)}-{document_id}.json"
+
+
+# The completion time encoded in a journal key
+def journal_timestamp(journal_key: str) -> datetime:
+    timestamp = journal_key[len(JOURNAL_PREFIX):].split("-", 1)[0]
+    return datetime.strptime(timestamp, JOURNAL_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+# Builds the journal record of a completed document from the linearized text and the Textract result.
+# Word counts and confidence statistics are computed from the WORD and LINE blocks of each page.
+def build_journal_record(document_id: str, site_id: str, job_id: str, report_text: dict, response_json: dict, completed_at: datetime) -> dict:
+    word_pages = []
+    word_confidences = []
+    line_pages = []
+    for block in response_json.get("Blocks", []):
+        block_type = block["BlockType"]
+        if block_type == "WORD":
+            word_pages.append(block.get("Page", 1))
+            word_confidences.append(block.get("Confidence", 0.0))
+        elif block_type == "LINE":
+            line_pages.append(block.get("Page", 1))
+    word_pages = np.asarray(word_pages, dtype=np.int32)
+    word_confidences = np.asarray(word_confidences, dtype=np.float64)
+    line_pages = np.asarray(line_pages, dtype=np.int32)
+
+    page_count = response_json.get("DocumentMetadata", {}).get("Pages", len(report_text or {}))
+    pages = []
+    for page in range(1, page_count + 1):
+        confidences = word_confidences[word_pages == page]
+        pages.append({
+            "page": page,
+            "text": (report_text or {}).get(page, ""),
+            "word_count": int(confidences.size),
+            "line_count": int(np.count_nonzero(line_pages == page)),
+            "confidence_mean": float(confidences.mean()) if confidences.size else None,
+            "confidence_min": float(confidences.min()) if confidences.size else None,
+            "confidence_max": float(confidences.max()) if confidences.size else None,
+        })
+
+    return {
+        "document_id": document_id,
+        "site_id": site_id or "unknown",
+        "job_id": job_id,
+        "completed_at": completed_at.isoformat(),
+        "page_count": page_count,
+        "pages": pages,
+    }
+
+
+# ====================================================================================================
+# Parquet output
+# ====================================================================================================
+# Flattens journal records, together with the HEAD of the text result of each document (see
+# CiesOcrCore.get_export_metadata), into one row per page grouped by (site_id, date) partition.
+# The results are saved with the user_id, file_name and site_id Metadata keys, see
+# CiesOcrCore.save_document_to_destination_bucket.
+def build_partition_rows(records: list, result_metadata: dict) -> dict:
+    partitions = {}
+    for record in records:
+        head = result_metadata.get(record["document_id"]) or {}
+        metadata = head.get("Metadata") or {}
+        completed_at = datetime.fromisoformat(record["completed_at"])
+        date = completed_at.date().isoformat()
+        rows = partitions.setdefault((record["site_id"], date), [])
+        for page in record["pages"]:
+            content_length = head.get("ContentLength")
+            rows.append({
+                "document_id": record["document_id"],
+                "site_id": record["site_id"],
+                "user_id": metadata.get("user_id"),
+                "file_name": metadata.get("file_name"),
+                "job_id": record.get("job_id"),
+                "completed_at": completed_at,
+                "date": date,
+                "content_type": head.get("ContentType"),
+                "content_length": int(content_length) if content_length is not None else None,
+                "page": page["page"],
+                "page_count": record["page_count"],
+                "text": page["text"],
+                "word_count": page["word_count"],
+                "line_count": page["line_count"],
+                "confidence_mean": page["confidence_mean"],
+                "confidence_min": page["confidence_min"],
+                "confidence_max": page["confidence_max"],
+            })
+    return partitions
+
+
+# The key of a partition of a run depends only on the journal records of the run, a failed run is repeated in full
+# and overwrites the files it had written rather than writing their rows a second time
+def create_parquet_key(site_id: str, date: str, first_journal_key: str) -> str:
+    timestamp = first_journal_key[len(JOURNAL_PREFIX):].split("-", 1)[0]
+    batch = hashlib.sha256(first_journal_key.encode("utf-8")).hexdigest()[:12]
+    return f"{PARQUET_PREFIX}site_id={site_id}/date={date}/part-{timestamp}-{batch}.parquet"
+
+
+# Serializes the rows of one partition as a Parquet file, pyarrow is only required by the export job
+def rows_to_parquet(rows: list) -> bytes:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ModuleNotFoundError("The analytics export requires the pyarrow package, install it with `pip install pyarrow`")
+
+    schema = pa.schema([
+        ("document_id", pa.string()),
+        ("site_id", pa.string()),
+        ("user_id", pa.string()),
+        ("file_name", pa.string()),
+        ("job_id", pa.string()),
+        ("completed_at", pa.timestamp("us", tz="UTC")),
+        ("date", pa.string()),
+        ("content_type", pa.string()),
+        ("content_length", pa.int64()),
+        ("page", pa.int32()),
+        ("page_count", pa.int32()),
+        ("text", pa.large_string()),
+        ("word_count", pa.int32()),
+        ("line_count", pa.int32()),
+        ("confidence_mean", pa.float64()),
+        ("confidence_min", pa.float64()),
+        ("confidence_max", pa.float64()),
+    ])
+    table = pa.Table.from_pylist(rows, schema=schema)
+    sink = pa.BufferOutputStream()
+    # dictionary encoding suits the low cardinality columns, statistics allow readers to skip row groups
+    pq.write_table(table, sink, compression="zstd", write_statistics=True,
+                   use_dictionary=["document_id", "site_id", "user_id", "file_name", "job_id", "date", "content_type"])
+    return sink.getvalue().to_pybytes()
+
+
+def load_high_water_mark(body: bytes) -> str:
+    return json.loads(body).get("journal_key")
+
+
+def dump_high_water_mark(journal_key: str, exported_at: datetime) -> str:
+    return json.dumps({"journal_key": journal_key, "exported_at": exported_at.isoformat()})
@@ -0,0 +1,35 @@
+import os
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+
+from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+from logging_policy import payload
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'), 
+    os.getenv('DESTINATION_BUCKET'), 
+    os.getenv('TEXTRACT_SERVICE_ROLE'), 
+    os.getenv('TEXTRACT_STATUS_TOPIC'), 
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# This Lambda handler is triggered on a schedule.
+# It appends the documents completed since the previous run to the Parquet analytics export in the
+# destination bucket (export/parquet/site_id=<site>/date=<date>/), starting from the high water mark
+# left by the previous run. A backlog larger than EXPORT_MAX_RECORDS is worked off over several runs.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("analytics_export_handler")
+def lambda_handler(event, context):
+    result = cies_ocr_core.export_completed_documents()
+    logger.info("export result %s", payload(result))
+    return result
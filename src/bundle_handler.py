@@ -0,0 +1,97 @@
+import base64
+import io
+import json
+import os
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.logging import correlation_paths
+from aws_lambda_powertools.metrics import MetricUnit
+from botocore.exceptions import ClientError
+
+from cies_ocr_core import CiesOcrCore
+import bundle_ingest
+import http_response
+import overload
+import instrumentation
+import logging_policy
+from logging_policy import payload
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# Ingest of a bundle of documents, see bundle_ingest.py
+#   POST /bundles            a zip (Content-Type: application/zip) or multipart/mixed body holding the documents
+#                            and their manifest, for bundles under the 1MB ALB limit
+#   POST /bundles            {"bundle_key": ...} (Content-Type: application/json), a bundle PUT to an upload URL
+#   POST /bundles/upload     {"content_type": "application/zip" | "multipart/mixed"}, returns
+#                            {"bundle_key", "url", "content_type", "expires_in"}, the bundle is PUT to the url
+# The 'Siteid' and 'Userid' headers are stored with every document, as for POST /document, and the 'Priority'
+# header is the lane of the documents without a priority in the manifest. An ingest returns
+#   {"documents": [{"document_id", "status": "accepted" | "exists" | "invalid" | "failed", "error"}]}
+# in the order of the manifest, each accepted document is then submitted to Textract like a POSTed document.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("bundle_handler")
+def lambda_handler(event, context) -> dict:
+    logger.debug("OCR API - Inside bundle lambda: event %s context %s", payload(event), context)
+
+    elements = [element for element in (event.get("path") or "").split("/") if element]
+    if event.get("httpMethod") != "POST" or elements not in (["bundles"], ["bundles", "upload"]):
+        return http_response.format_400_response("expected POST /bundles or POST /bundles/upload")
+    headers = cies_ocr_core.get_headers(event)
+    user_id = headers.get('USERID', "unknown")
+    site_id = headers.get('SITEID', "unknown")
+    content_type = headers.get("CONTENT-TYPE", "")
+
+    try:
+        # the documents of a bundle are accepted while the site is within its quotas, see site_usage.py
+        cies_ocr_core.check_site_quota(site_id)
+        body = base64.b64decode(event.get("body") or "") if event.get("isBase64Encoded") else (event.get("body") or "").encode("utf-8")
+        if elements == ["bundles", "upload"]:
+            request = json.loads(body or b"{}")
+            upload = cies_ocr_core.create_bundle_upload(site_id, request.get("content_type", bundle_ingest.ZIP))
+            return json_response(upload)
+
+        if content_type.split(";")[0].strip().lower() == "application/json":
+            bundle_key = json.loads(body).get("bundle_key")
+            with cies_ocr_core.get_uploaded_bundle(site_id, bundle_key) as file:
+                results = ingest(user_id, site_id, file, bundle_ingest.content_type_of_key(bundle_key), headers.get('PRIORITY'))
+            cies_ocr_core.delete_uploaded_bundle(site_id, bundle_key)
+        else:
+            results = ingest(user_id, site_id, io.BytesIO(body), content_type, headers.get('PRIORITY'))
+        return json_response({"documents": results})
+    except overload.Overloaded as e:
+        return http_response.format_overloaded_response(e)
+    except (ValueError, AttributeError) as e:
+        return http_response.format_400_response(f"Invalid bundle request: {e}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ('404', 'NoSuchKey'):
+            return http_response.format_404_response(None)
+        logger.error(f"Error: {e}")
+        return http_response.format_500_response(str(e))
+
+
+def ingest(user_id: str, site_id: str, file, content_type: str, priority: str) -> list:
+    bundle = bundle_ingest.open_bundle(file, content_type)
+    results = cies_ocr_core.ingest_bundle(user_id, site_id, bundle, priority)
+    for status in (bundle_ingest.ACCEPTED, bundle_ingest.EXISTS, bundle_ingest.INVALID, bundle_ingest.FAILED):
+        metrics.add_metric(name=f"BundleDocuments{status.capitalize()}", unit=MetricUnit.Count,
+                           value=sum(1 for result in results if result["status"] == status))
+    return results
+
+
+def json_response(body: dict) -> dict:
+    return http_response.format_200_response({'content-type': 'application/json'}, json.dumps(body))
@@ -0,0 +1,165 @@
+# This module holds the rules of a bundle, many documents ingested in one request. Sites sending a day's worth of
+# documents used to POST each one, a separate ALB -> Lambda invocation (and base64 encoding) per document.
+# A bundle is either
+#   application/zip      a zip archive of the documents, with a manifest.json member
+#   multipart/mixed      a part per document, named by the filename of its Content-Disposition (or its Content-ID),
+#                        with a manifest.json part (or the first application/json part)
+# The manifest lists the documents of the bundle:
+#   {"documents": [{"document_id": ..., "file": <member or part name>, "file_name": ..., "content_type": ...,
+#                   "priority": ...}]}
+# only document_id and file are required, the file_name is the file when it is missing. The ALB limits a request
+# body to 1MB, so a larger bundle is PUT to a presigned URL of the destination bucket, under
+#   bundles/<site_id>/<unique>.<zip|mime>
+# and then ingested by its key. A bundle in the destination bucket raises no event, it is deleted once ingested.
+
+import email.parser
+import email.policy
+import json
+import os
+import uuid
+import zipfile
+from urllib.parse import quote
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+BUNDLES_PREFIX = "bundles/"
+MANIFEST_NAME = "manifest.json"
+ZIP = "application/zip"
+MULTIPART_MIXED = "multipart/mixed"
+SUFFIXES = {ZIP: ".zip", MULTIPART_MIXED: ".mime"}
+
+BUNDLE_MAX_DOCUMENTS = int(os.getenv('BUNDLE_MAX_DOCUMENTS', '1000'))
+# the size of a bundle read from the destination bucket, it is spooled to the ephemeral storage of the function
+BUNDLE_MAX_BYTES = int(os.getenv('BUNDLE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+# the uncompressed size of a member of a zip bundle, and of all of its members, a member is read into memory
+# (by BUNDLE_CONCURRENCY threads at once) and a small archive may expand to far more than its own size
+BUNDLE_MAX_MEMBER_BYTES = int(os.getenv('BUNDLE_MAX_MEMBER_BYTES', str(50 * 1024 * 1024)))
+BUNDLE_MAX_UNCOMPRESSED_BYTES = int(os.getenv('BUNDLE_MAX_UNCOMPRESSED_BYTES', str(4 * 1024 * 1024 * 1024)))
+# a multipart/mixed bundle is parsed in memory
+BUNDLE_MAX_MIME_BYTES = int(os.getenv('BUNDLE_MAX_MIME_BYTES', str(256 * 1024 * 1024)))
+# the documents written to the source bucket at once
+BUNDLE_CONCURRENCY = int(os.getenv('BUNDLE_CONCURRENCY', '16'))
+
+# The status of each document of a bundle
+ACCEPTED = "accepted"
+EXISTS = "exists"
+INVALID = "invalid"
+FAILED = "failed"
+
+
+class Bundle:
+    def __init__(self, manifest: dict, members: set, reader):
+        self.manifest = manifest
+        # the names of the members, each member is read by reader(name) when it is written
+        self.members = members
+        self.reader = reader
+
+    def read(self, name: str) -> bytes:
+        return self.reader(name)
+
+
+# The key of a bundle uploaded by a site
+def create_bundle_key(site_id: str, content_type: str) -> str:
+    if content_type not in SUFFIXES:
+        raise ValueError(f"a bundle is {ZIP} or {MULTIPART_MIXED}")
+    return f"{BUNDLES_PREFIX}{quote(site_id, safe='')}/{uuid.uuid4()}{SUFFIXES[content_type]}"
+
+
+# A site may only ingest the bundles it uploaded
+def validate_bundle_key(site_id: str, bundle_key: str) -> str:
+    prefix = f"{BUNDLES_PREFIX}{quote(site_id, safe='')}/"
+    if not isinstance(bundle_key, str) or not bundle_key.startswith(prefix) or ".." in bundle_key:
+        raise ValueError("bundle_key must be a key returned by the bundle upload route")
+    return bundle_key
+
+
+def content_type_of_key(bundle_key: str) -> str:
+    for content_type, suffix in SUFFIXES.items():
+        if bundle_key.endswith(suffix):
+            return content_type
+    raise ValueError(f"bundle_key must end with one of {', '.join(SUFFIXES.values())}")
+
+
+# Opens a bundle from a readable and seekable file. Raises ValueError when it is not a bundle.
+def open_bundle(file, content_type: str) -> Bundle:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in (ZIP, "application/x-zip-compressed"):
+        return _open_zip(file)
+    if media_type == MULTIPART_MIXED:
+        return _open_multipart(file, content_type)
+    raise ValueError(f"a bundle is {ZIP} or {MULTIPART_MIXED}, not {media_type or 'untyped'}")
+
+
+def _open_zip(file) -> Bundle:
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"the bundle is not a zip archive, {e}")
+    infos = [info for info in archive.infolist() if not info.is_dir()]
+    # the sizes are those of the central directory, ZipFile reads no more than the size of a member from it
+    for info in infos:
+        if info.file_size > BUNDLE_MAX_MEMBER_BYTES:
+            raise ValueError(f"a member of a bundle may be at most {BUNDLE_MAX_MEMBER_BYTES} bytes, {info.filename} is {info.file_size}")
+    if sum(info.file_size for info in infos) > BUNDLE_MAX_UNCOMPRESSED_BYTES:
+        raise ValueError(f"the members of a bundle may be at most {BUNDLE_MAX_UNCOMPRESSED_BYTES} bytes uncompressed")
+    members = {info.filename for info in infos}
+    if MANIFEST_NAME not in members:
+        raise ValueError(f"the bundle has no {MANIFEST_NAME}")
+    manifest = _parse_manifest(archive.read(MANIFEST_NAME))
+    # ZipFile reads its members under a lock, so the members may be read by concurrent threads
+    return Bundle(manifest, members - {MANIFEST_NAME}, archive.read)
+
+
+def _open_multipart(file, content_type: str) -> Bundle:
+    body = file.read(BUNDLE_MAX_MIME_BYTES + 1)
+    if len(body) > BUNDLE_MAX_MIME_BYTES:
+        raise ValueError(f"a {MULTIPART_MIXED} bundle may be at most {BUNDLE_MAX_MIME_BYTES} bytes, use a zip archive")
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    if not message.is_multipart():
+        raise ValueError(f"the bundle is not a {MULTIPART_MIXED} body")
+    manifest = None
+    members = {}
+    for part in message.iter_parts():
+        name = part.get_filename() or (part.get("Content-ID") or "").strip("<>")
+        if manifest is None and (name == MANIFEST_NAME or (not name and part.get_content_type() == "application/json")):
+            manifest = _parse_manifest(part.get_payload(decode=True))
+        elif name:
+            members[name] = part.get_payload(decode=True)
+    if manifest is None:
+        raise ValueError(f"the bundle has no {MANIFEST_NAME} part")
+    return Bundle(manifest, set(members), members.__getitem__)
+
+
+def _parse_manifest(body: bytes) -> dict:
+    try:
+        manifest = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"the {MANIFEST_NAME} of the bundle is not JSON, {e}")
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("documents"), list):
+        raise ValueError(f"the {MANIFEST_NAME} of the bundle must be an object with a list of documents")
+    if len(manifest["documents"]) > BUNDLE_MAX_DOCUMENTS:
+        raise ValueError(f"a bundle may hold at most {BUNDLE_MAX_DOCUMENTS} documents")
+    return manifest
+
+
+# Returns the documents of the manifest, each with its "error" when it cannot be ingested
+def plan_documents(bundle: Bundle) -> list:
+    documents = []
+    seen = set()
+    for entry in bundle.manifest["documents"]:
+        entry = entry if isinstance(entry, dict) else {}
+        document = {"document_id": entry.get("document_id"), "file": entry.get("file"),
+                    "file_name": entry.get("file_name") or entry.get("file"),
+                    "content_type": entry.get("content_type"), "priority": entry.get("priority")}
+        if not isinstance(document["document_id"], str) or not document["document_id"] or "/" in document["document_id"]:
+            document["error"] = "document_id must be a non empty string without '/'"
+        elif document["document_id"] in seen:
+            document["error"] = "the document_id is repeated in the manifest"
+        elif not isinstance(document["file"], str) or document["file"] not in bundle.members:
+            document["error"] = f"the bundle has no member {document['file']!r}"
+        if isinstance(document["document_id"], str):
+            seen.add(document["document_id"])
+        documents.append(document)
+    return documents
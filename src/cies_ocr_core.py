@@ -2,10 +2,15 @@
 # This class is not specific to the external facing interface. In other words there should be no dependency 
 # on whether this code is called from a Lambda, application server, etc ...
 
+import ast
 import json
 import os
-from datetime import datetime
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import mimetypes
+from urllib.parse import urlencode
 
 import boto3
 from botocore.exceptions import ClientError
@@ -18,7 +23,32 @@ from textractcaller import (
     Textract_API,
     get_full_json,
 )
-from textractprettyprinter.t_pretty_print import get_text_from_layout_json
+from layout_linearizer import get_text_from_layout_json_parallel
+import search_index
+import analytics_export
+import pending_jobs
+import completion_ledger
+import presign_cache
+import single_flight
+import result_cache
+import overload
+import resilience
+import textract_regions
+import site_usage
+import profiling
+from single_flight import coalesced
+import key_layout
+import priority_lanes
+import multipart_upload
+import bundle_ingest
+import preflight
+import page_banner
+import page_fingerprints
+import region_index
+import instrumentation
+import logging_policy
+from logging_policy import payload
+from instrumentation import traced_stage
 
 # ====================================================================================================
 # Global Constants
@@ -27,21 +57,49 @@ from textractprettyprinter.t_pretty_print import get_text_from_layout_json
 METADATA_KEY_FILE_NAME = "x-amz-meta-file-name"
 METADATA_KEY_USER_ID = "x-amz-meta-user-id"
 METADATA_KEY_SITE_ID = "x-amz-meta-site-id"
+# The lane of the submission of the document, "interactive" or "bulk", see priority_lanes.py
+METADATA_KEY_PRIORITY = "x-amz-meta-priority"
+# The content type of a document before it was converted by the pre-flight checks, see preflight.py
+METADATA_KEY_ORIGINAL_CONTENT_TYPE = "x-amz-meta-original-content-type"
 # Tags are not sent or received as HTTP headers and are not prefixed
 TAG_KEY_STATUS = "ocr-status"
 TAG_JOB_ID = "job-id"
+# The hour (YYYYMMDDHH) in which the document was submitted, which locates its pending job marker
+TAG_SUBMITTED_AT = "submitted-at"
+# The region the Textract job of the document was started in, which has its results, see textract_regions.py
+TAG_TEXTRACT_REGION = "textract-region"
+# Why a document was rejected by the pre-flight checks, with the status 'Rejected', see preflight.py
+TAG_REJECT_REASON = "ocr-reject-reason"
+STATUS_REJECTED = "Rejected"
+# The size of the chunks a document is read in by the pre-flight checks
+PREFLIGHT_CHUNK_BYTES = 1024 * 1024
 
 # ====================================================================================================
 # Global References
 # ====================================================================================================
 tracer = Tracer()
 logger = Logger()
-logger.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+logging_policy.configure(logger)
 metrics = Metrics(namespace="SpiTestApp", service="APP")
 
-s3 = boto3.client('s3',config=Config(signature_version='s3v4'))
-sns = boto3.client('sns')
-txt = boto3.client('textract')
+# every call made with these clients is timed and counted, see instrumentation.py, their throttling is seen by the
+# overload guard, see overload.py, and they are retried and broken by circuit breakers, see resilience.py
+# The clients are shared by the threads of a handler, the connection pool must allow for all of them
+MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '10'))
+
+# The client of another region has circuit breakers of its own
+def create_client(service: str, config: Config = None, region: str = None):
+    config = resilience.CLIENT_CONFIG.merge(config) if config else resilience.CLIENT_CONFIG
+    client = boto3.client(service, region_name=region, config=config)
+    return resilience.protect_client(overload.watch_client(instrumentation.instrument_client(client)), scope=region)
+
+s3 = create_client('s3', Config(signature_version='s3v4', max_pool_connections=MAX_POOL_CONNECTIONS))
+sns = create_client('sns')
+sqs = create_client('sqs')
+txt = create_client('textract', Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+ddb = create_client('dynamodb')
+# the profiles of the invocations are written with the S3 client, see profiling.py
+profiling.set_client(lambda: s3)
 
 class CiesOcrCore:
     # Documents with a size above this number must be POSTed directly to the S3 destination
@@ -54,7 +112,54 @@ class CiesOcrCore:
     textract_service_role = None
     textract_status_topic = None
     aws_region = None
-    presigned_url_expiration = 120
+    presigned_url_expiration = int(os.getenv('PRESIGNED_URL_EXPIRATION', '120'))
+    # The expiration of each kind of presigned URL, which default to presigned_url_expiration
+    presigned_post_expiration = int(os.getenv('PRESIGNED_POST_EXPIRATION', presigned_url_expiration))
+    presigned_get_expiration = int(os.getenv('PRESIGNED_GET_EXPIRATION', presigned_url_expiration))
+    # Signatures are reused for as long as the instance is warm, see presign_cache.py
+    presigned_url_cache = presign_cache.PresignCache()
+    # Identical concurrent reads of a document share one call, see single_flight.py
+    single_flight_group = single_flight.SingleFlight()
+    instrumentation.on_flush(single_flight_group.flush_metrics)
+    # Result artifacts are cached on the local disk of a warm instance, see result_cache.py
+    result_cache = result_cache.ResultCache()
+    # Requests are shed when the process or its downstream services are overloaded, see overload.py
+    overload_guard = overload.guard
+    # The usage of each site is counted, and its quotas enforced at ingest, see site_usage.py
+    usage_meter = site_usage.SiteUsage(lambda: ddb)
+    instrumentation.on_flush(usage_meter.flush)
+    # Bounds a batch presign request, so that the response stays below the 1MB ALB limit
+    presign_batch_max_items = int(os.getenv('PRESIGN_BATCH_MAX_ITEMS', '500'))
+    # The submission queue of each priority lane, a document of a lane without a queue is submitted at once
+    submission_queue_urls = {
+        priority_lanes.INTERACTIVE: os.getenv('SUBMISSION_QUEUE_INTERACTIVE'),
+        priority_lanes.BULK: os.getenv('SUBMISSION_QUEUE_BULK')
+    }
+    # lane -> (time read, number of waiting submissions)
+    submission_backlog_cache = {}
+    # How the documents and their results are keyed in the buckets, see key_layout.py
+    layout = key_layout.KeyLayout()
+    # The expiration of the part URLs of a multipart upload, which must allow for the upload of every part
+    multipart_url_expiration = int(os.getenv('MULTIPART_URL_EXPIRATION', '3600'))
+    # Multipart uploads which are not completed this long after they were initiated are aborted, and their parts deleted
+    multipart_stale_seconds = int(os.getenv('MULTIPART_STALE_SECONDS', '21600'))
+    # The number of search index segments that a site may accumulate before they are merged
+    index_merge_threshold = int(os.getenv('INDEX_MERGE_THRESHOLD', '16'))
+    # Segments are immutable, so a reader may be reused for as long as the instance is warm
+    index_segment_cache = {}
+    index_segment_cache_size = 256
+    # Journal records younger than this are not exported yet, which allows completions that are still
+    # writing their journal record (with an earlier timestamp) to land before the high water mark passes them
+    export_settle_seconds = int(os.getenv('EXPORT_SETTLE_SECONDS', '300'))
+    export_max_records = int(os.getenv('EXPORT_MAX_RECORDS', '5000'))
+    # Documents which are still 'Submitted' this long after submission are reconciled
+    reconcile_deadline_seconds = int(os.getenv('RECONCILE_DEADLINE_SECONDS', '3600'))
+    reconcile_max_jobs = int(os.getenv('RECONCILE_MAX_JOBS', '2000'))
+    # Bounds the concurrent Textract GetDocumentAnalysis calls, which share the account's TPS quota
+    reconcile_concurrency = int(os.getenv('RECONCILE_CONCURRENCY', '8'))
+    # A completion that is still 'processing' after this long is assumed to have died and may be taken over,
+    # this must be longer than the timeout of the completion function
+    completion_lease_seconds = int(os.getenv('COMPLETION_LEASE_SECONDS', '300'))
 
     def __init__(self, source_bucket: str, destination_bucket: str, textract_service_role: str, textract_status_topic: str, aws_region: str):
         logger.info(f"__init__({source_bucket}, {destination_bucket}, {textract_service_role}, {textract_status_topic}, {aws_region})")
@@ -64,21 +169,34 @@ class CiesOcrCore:
         self.textract_service_role = textract_service_role
         self.textract_status_topic = textract_status_topic
         self.aws_region = aws_region
+        # the Textract jobs are spread over the home region and those of TEXTRACT_REGIONS, see textract_regions.py
+        home = textract_regions.Region(aws_region or "home", textract_regions.HOME_REGION_WEIGHT, textract_status_topic,
+                                       textract_service_role, source_bucket, home=True)
+        self.textract_dispatcher = textract_regions.RegionDispatcher(textract_regions.load_regions(home))
+        # (service, region) -> the client of a region other than the home region
+        self.regional_clients = {}
 
     # ====================================================================================================
     # This function generates a URL that allow a client to POST a document directly to S3
-    def get_presigned_post_url(self, document_id: str):
+    # With with_expiry the time the POST expires at is returned with it, a cached POST expires before expires_in
+    @traced_stage("presign")
+    def get_presigned_post_url(self, document_id: str, expires_in: int = None, site_id: str = None, with_expiry: bool = False):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
-        
-        logger.debug(f"get_presigned_post_url({self.source_bucket}, {document_id}, {self.presigned_url_expiration})")
+        if expires_in is None:
+            expires_in = self.presigned_post_expiration
+        source_key = self.create_source_key(document_id, site_id)
+
+        logger.debug(f"get_presigned_post_url({self.source_bucket}, {source_key}, {expires_in})")
         try:
-            response = s3.generate_presigned_post(
-                Bucket=self.source_bucket,
-                Key=document_id,
-                ExpiresIn=self.presigned_url_expiration                
-            )
-            return response
+            response, expires_at = self.presigned_url_cache.get_or_sign_expiring(
+                "post_object", self.source_bucket, source_key, expires_in,
+                lambda: s3.generate_presigned_post(
+                    Bucket=self.source_bucket,
+                    Key=source_key,
+                    ExpiresIn=expires_in
+                ))
+            return (response, expires_at) if with_expiry else response
         except ClientError as e:
             logger.error(f"Error generating presigned post URL: {e}")
             raise
@@ -89,7 +207,9 @@ class CiesOcrCore:
     # The S3 bucket has an event listener lambda, which submits the document to Textract for OCR
     # NOTE: the Metadata is stored with the S3 object with the prefix "x-amz-meta-" added.
     # i.e. site_id becomes x-amz-meta-site_id in S3
-    def save_document_to_source_bucket(self, user_id : str, site_id : str, document_id : str, file_name: str, content_type: str, ocr_status: str, body : str):
+    # With create_only an existing document is not replaced, S3 raises PreconditionFailed instead.
+    @traced_stage("save_document")
+    def save_document_to_source_bucket(self, user_id : str, site_id : str, document_id : str, file_name: str, content_type: str, ocr_status: str, body : str, priority: str = None, create_only: bool = False):
         logger.debug(f"saving document: {document_id} to bucket {self.source_bucket}, body starts with {body[:32]}")
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
@@ -113,20 +233,28 @@ class CiesOcrCore:
         if not content_type:
             content_type = self.get_mime_type(file_name)
         
+        metadata = {
+            METADATA_KEY_FILE_NAME: file_name,
+            METADATA_KEY_USER_ID: user_id,
+            METADATA_KEY_SITE_ID: site_id
+        }
+        if priority:
+            metadata[METADATA_KEY_PRIORITY] = priority_lanes.lane_of(priority)
+        conditions = {"IfNoneMatch": "*"} if create_only else {}
+
         logger.debug(f"file_name={file_name}, content_type={content_type}, user_id={user_id}, site_id={site_id}, body starts with {body[:128]}")
         try:
             s3.put_object(
                 Bucket= self.source_bucket,
-                Key=document_id,
+                Key=self.create_source_key(document_id, site_id),
                 Body=body,
                 ContentType=content_type,
-                Metadata= {
-                    METADATA_KEY_FILE_NAME: file_name,
-                    METADATA_KEY_USER_ID: user_id,
-                    METADATA_KEY_SITE_ID: site_id
-                },
-                Tagging= tag_set
+                Metadata= metadata,
+                Tagging= tag_set,
+                **conditions
             )
+            # a read in flight may have read the previous document
+            self.single_flight_group.forget(document_id)
         except Exception as e:
             logger.error(f"Error saving file: {e}")
             raise
@@ -134,6 +262,7 @@ class CiesOcrCore:
     # ====================================================================================================
     # This function retrieves the original docuemnt given the document_id
     # ====================================================================================================
+    @traced_stage("get_document")
     def get_document_from_source_bucket(self, user_id: str, site_id: str, document_id: str) -> dict:
         logger.debug(f"get_document_from_source_bucket({user_id}, {site_id}, {document_id})")
         if not document_id:
@@ -142,7 +271,7 @@ class CiesOcrCore:
         try:
             result = s3.get_object(
                 Bucket= self.source_bucket,
-                Key=document_id
+                Key=self.create_source_key(document_id, site_id)
             )
         except Exception as e:
             logger.error(f"Error retreiving file: {e}")
@@ -154,26 +283,53 @@ class CiesOcrCore:
     # Submit a document to Textract for recognition and analysis.
     # This method is called by a Lambda which is triggered when a new document is added to the source S3 bucket
     # ====================================================================================================
-    def submit_document_to_analysis(self, document_id: str):
+    @traced_stage("submit")
+    def submit_document_to_analysis(self, document_id: str, site_id: str = None):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
 
         try:
-            logger.debug(f"starting text analysis of {self.source_bucket} : {document_id} as {self.textract_service_role}, with notification on {self.textract_status_topic}")
-            # the response looks something like: {'JobId': 'string'}
-            result = txt.start_document_analysis(
-                DocumentLocation={
-                    'S3Object': {
-                        'Bucket': self.source_bucket,
-                        'Name': document_id
-                    }},
-                FeatureTypes=['LAYOUT'],
-                JobTag=document_id,
-                NotificationChannel={'RoleArn': self.textract_service_role, 'SNSTopicArn': self.textract_status_topic})
+            # a replaced PDF has only its new and changed pages analysed, see page_fingerprints.py
+            analysed_key = self.create_source_key(document_id, site_id)
+            revision = self.prepare_revision(document_id, site_id)
+            if revision is not None and revision["pages"] is not None and not revision.get("partial_key"):
+                if page_fingerprints.is_unchanged(revision):
+                    logger.info(f"every page of {document_id} is unchanged, its results are kept")
+                    self.update_tag_in_S3(document_id, [{"Key": TAG_KEY_STATUS, "Value": "SUCCEEDED"},
+                                                        {"Key": TAG_JOB_ID, "Value": revision["base_job_id"]}], site_id)
+                    return
+                if self.rebuild_results(document_id, revision, site_id):
+                    return
+                revision = dict(revision, pages=None)
+            if revision is not None and revision["pages"] is not None:
+                analysed_key = revision["partial_key"]
+            if revision is not None:
+                # recorded before the job is started, a completion never finds the job without its revision
+                self.save_revision(document_id, revision, site_id)
+
+            def start(region: textract_regions.Region) -> dict:
+                logger.debug(f"starting text analysis of {region.bucket} : {analysed_key} in {region.name} as {region.role}, with notification on {region.topic}")
+                # the response looks something like: {'JobId': 'string'}
+                return self.regional_client('textract', region).start_document_analysis(
+                    DocumentLocation={
+                        'S3Object': {
+                            'Bucket': region.bucket,
+                            'Name': analysed_key
+                        }},
+                    FeatureTypes=['LAYOUT'],
+                    JobTag=document_id,
+                    NotificationChannel={'RoleArn': region.role, 'SNSTopicArn': region.topic})
+            result, region = self.textract_dispatcher.start(start, lambda region: self.stage_document(region, analysed_key))
             job_id = result['JobId']
-
-            tags = [{"Key": TAG_KEY_STATUS, "Value": "Submitted"}, {"Key": TAG_JOB_ID, "Value": job_id}]
-            self.update_tag_in_S3(document_id, tags)
+            if revision is not None:
+                revision["job_id"] = job_id
+                self.save_revision(document_id, revision, site_id)
+
+            hour = pending_jobs.submission_hour()
+            tags = [{"Key": TAG_KEY_STATUS, "Value": "Submitted"}, {"Key": TAG_JOB_ID, "Value": job_id}, {"Key": TAG_SUBMITTED_AT, "Value": hour},
+                    {"Key": TAG_TEXTRACT_REGION, "Value": region.name}]
+            self.update_tag_in_S3(document_id, tags, site_id)
+            self.record_pending_job(document_id, hour, site_id)
             return
         except Exception as e:
             logger.error(f"Error submitting job: {e}")
@@ -182,50 +338,299 @@ class CiesOcrCore:
     # ====================================================================================================
     # Submit a document to Textract for recognition only.
     # ====================================================================================================
-    def submit_document_to_ocr(self, document_id: str):
+    @traced_stage("submit")
+    def submit_document_to_ocr(self, document_id: str, site_id: str = None):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
 
         try:
-            logger.debug(f"starting text detection of {self.source_bucket} : {document_id} as {self.textract_service_role}, with notification on {self.textract_status_topic}")
-            # the response looks something like: {'JobId': 'string'}
-            result = txt.start_document_text_detection(
-                DocumentLocation={
-                    'S3Object': {
-                        'Bucket': self.source_bucket,
-                        'Name': document_id
-                    }},
-                JobTag=document_id,
-                NotificationChannel={'RoleArn': self.textract_service_role, 'SNSTopicArn': self.textract_status_topic})
-            logger.debug(f"result={result}")
+            source_key = self.create_source_key(document_id, site_id)
+
+            def start(region: textract_regions.Region) -> dict:
+                logger.debug(f"starting text detection of {region.bucket} : {source_key} in {region.name} as {region.role}, with notification on {region.topic}")
+                # the response looks something like: {'JobId': 'string'}
+                return self.regional_client('textract', region).start_document_text_detection(
+                    DocumentLocation={
+                        'S3Object': {
+                            'Bucket': region.bucket,
+                            'Name': source_key
+                        }},
+                    JobTag=document_id,
+                    NotificationChannel={'RoleArn': region.role, 'SNSTopicArn': region.topic})
+            result, region = self.textract_dispatcher.start(start, lambda region: self.stage_document(region, source_key))
+            logger.debug("result=%s", payload(result))
 
             job_id = result['JobId']
 
-            tags = [{"Key": TAG_KEY_STATUS, "Value": "Submitted"}, {"Key": TAG_JOB_ID, "Value": job_id}]
-            self.update_tag_in_S3(document_id, tags)
+            hour = pending_jobs.submission_hour()
+            tags = [{"Key": TAG_KEY_STATUS, "Value": "Submitted"}, {"Key": TAG_JOB_ID, "Value": job_id}, {"Key": TAG_SUBMITTED_AT, "Value": hour},
+                    {"Key": TAG_TEXTRACT_REGION, "Value": region.name}]
+            self.update_tag_in_S3(document_id, tags, site_id)
+            self.record_pending_job(document_id, hour, site_id)
             return
         except Exception as e:
             logger.error(f"Error submitting job: {e}")
             raise e
 
+    # ====================================================================================================
+    # Revisions of a replaced document, see page_fingerprints.py
+    # ====================================================================================================
+    # Returns the revision of a PDF about to be submitted, or None when the document is not fingerprinted.
+    # When some of its pages are unchanged the others are written to a partial PDF, whose key is "partial_key".
+    @traced_stage("revision")
+    def prepare_revision(self, document_id: str, site_id: str = None) -> dict:
+        source_key = self.create_source_key(document_id, site_id)
+        response = s3.get_object(Bucket=self.source_bucket, Key=source_key)
+        try:
+            if response['ContentLength'] > page_fingerprints.FINGERPRINT_MAX_BYTES:
+                return None
+            body = response['Body'].read()
+        finally:
+            response['Body'].close()
+        if preflight.sniff(body[:preflight.SNIFF_BYTES]) != preflight.PDF:
+            return None
+        try:
+            fingerprints = page_fingerprints.fingerprint_pages(body)
+        except Exception as e:
+            logger.warning(f"{document_id} is submitted whole, its pages cannot be fingerprinted: {e}")
+            return None
+
+        stored = self.get_fingerprints(document_id, site_id)
+        revision = page_fingerprints.build_revision(stored["fingerprints"] if stored else None, fingerprints)
+        if revision["pages"] is None:
+            return revision
+        revision["base_job_id"] = stored["job_id"]
+        pages = page_fingerprints.partial_pages(revision)
+        logger.info(f"{document_id} has {len(pages)} new or changed pages of {len(fingerprints)}")
+        if pages:
+            revision["partial_key"] = page_fingerprints.create_partial_key(source_key)
+            s3.put_object(
+                Bucket=self.source_bucket,
+                Key=revision["partial_key"],
+                Body=page_fingerprints.extract_pages(body, pages),
+                ContentType="application/pdf",
+                Tagging=f"{TAG_KEY_STATUS}={page_fingerprints.STATUS_PARTIAL}")
+        return revision
+
+    # Rebuilds the results of a document whose pages were only removed or reordered from its stored result, without
+    # Textract. Returns False when there is no stored result, the document is then analysed whole.
+    def rebuild_results(self, document_id: str, revision: dict, site_id: str = None) -> bool:
+        base_json = self.read_result_json(document_id, site_id)
+        if base_json is None:
+            logger.warning(f"the stored result of {document_id} is missing, it is analysed whole")
+            return False
+        logger.info(f"the pages of {document_id} were removed or reordered, its results are rebuilt from its stored result")
+        job_id = revision["base_job_id"]
+        metadata = dict(self.get_document_metadata(document_id, site_id), **{TAG_JOB_ID: job_id})
+        merged = page_fingerprints.merge_layout(base_json, base_json, revision)
+        self.store_results(document_id, metadata, merged, revision, job_id, site_id, ReusedPages=len(revision["pages"]))
+        self.update_tag_in_S3(document_id, [{"Key": TAG_KEY_STATUS, "Value": "SUCCEEDED"},
+                                            {"Key": TAG_JOB_ID, "Value": job_id}], site_id)
+        return True
+
+    def save_revision(self, document_id: str, revision: dict, site_id: str = None):
+        s3.put_object(
+            Bucket=self.destination_bucket,
+            Key=page_fingerprints.create_revision_key(self.create_source_key(document_id, site_id)),
+            Body=json.dumps(revision),
+            ContentType="application/json")
+
+    # Returns the revision of the job, or None when the job analysed the whole document. Raises when the revision is
+    # still being recorded, the completion is then retried.
+    def get_revision(self, document_id: str, job_id: str, site_id: str = None) -> dict:
+        revision = self.read_json_object(page_fingerprints.create_revision_key(self.create_source_key(document_id, site_id)))
+        if revision is None:
+            return None
+        if revision.get("job_id") is None:
+            raise RuntimeError(f"the revision of {document_id} is being submitted, job {job_id} is completed later")
+        return revision if revision["job_id"] == job_id else None
+
+    # The revision and the partial PDF are removed once the job has completed, or failed
+    def clear_revision(self, document_id: str, site_id: str = None):
+        source_key = self.create_source_key(document_id, site_id)
+        s3.delete_object(Bucket=self.destination_bucket, Key=page_fingerprints.create_revision_key(source_key))
+        s3.delete_object(Bucket=self.source_bucket, Key=page_fingerprints.create_partial_key(source_key))
+
+    # The fingerprints of the pages of the stored result, {"job_id", "fingerprints"}, or None
+    def get_fingerprints(self, document_id: str, site_id: str = None) -> dict:
+        return self.read_json_object(self.layout.result_key(document_id, page_fingerprints.PAGES_SUFFIX, site_id))
+
+    def save_fingerprints(self, document_id: str, job_id: str, revision: dict, site_id: str = None):
+        s3.put_object(
+            Bucket=self.destination_bucket,
+            Key=self.layout.result_key(document_id, page_fingerprints.PAGES_SUFFIX, site_id),
+            Body=json.dumps({"job_id": job_id, "fingerprints": revision["fingerprints"]}),
+            ContentType="application/json")
+
+    # The stored Textract result of a document, or None. Results stored before they were written as JSON hold the
+    # repr of the result dict.
+    def read_result_json(self, document_id: str, site_id: str = None, etag: str = None) -> dict:
+        body = self.read_result_object(self.create_json_result_id(document_id, site_id), etag)
+        if body is None:
+            return None
+        body = body.decode("utf-8")
+        try:
+            return json.loads(body)
+        except ValueError:
+            return ast.literal_eval(body)
+
+    # The body of a result of the destination bucket, or None, from the local result cache when it holds the object
+    # with the given ETag. The ETag is that of a HEAD of the object made by the caller, or it is read here.
+    @traced_stage("read_result")
+    def read_result_object(self, key: str, etag: str = None) -> bytes:
+        try:
+            if self.result_cache.enabled:
+                if etag is None:
+                    etag = s3.head_object(Bucket=self.destination_bucket, Key=key)['ETag']
+                body = self.result_cache.get(self.destination_bucket, key, etag)
+                if body is not None:
+                    return body
+            response = s3.get_object(Bucket=self.destination_bucket, Key=key)
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        body = response['Body'].read()
+        self.result_cache.put(self.destination_bucket, key, response.get('ETag'), body)
+        return body
+
+    # A JSON object of the destination bucket, or None
+    def read_json_object(self, key: str) -> dict:
+        try:
+            response = s3.get_object(Bucket=self.destination_bucket, Key=key)
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    # ====================================================================================================
+    # Pre-flight checks of a new document, see preflight.py
+    # ====================================================================================================
+    # Returns True when the document may be submitted to Textract. A document which fails the checks is tagged
+    # 'Rejected', with the reason, and is not submitted. A document which is converted is replaced by its
+    # conversion, with its metadata and tags, and it is the ObjectCreated event of the conversion that submits it.
+    @traced_stage("preflight")
+    def preflight_document(self, document_id: str, site_id: str = None) -> bool:
+        source_key = self.create_source_key(document_id, site_id)
+        response = s3.get_object(Bucket=self.source_bucket, Key=source_key)
+        body = response['Body']
+        try:
+            inspection = preflight.inspect(iter(lambda: body.read(PREFLIGHT_CHUNK_BYTES), b""), response['ContentLength'])
+        except preflight.Rejected as e:
+            logger.warning(f"rejecting {document_id}, {e}")
+            self.update_tag_in_S3(document_id, [{"Key": TAG_KEY_STATUS, "Value": STATUS_REJECTED},
+                                                {"Key": TAG_REJECT_REASON, "Value": e.reason}], site_id)
+            return False
+        finally:
+            body.close()
+
+        logger.debug(f"preflight of {document_id}: {inspection['kind']}, {inspection['pages']} pages")
+        if inspection["converted"] is None:
+            return True
+
+        converted, content_type = inspection["converted"]
+        logger.info(f"converted {document_id} from {inspection['kind']} to {content_type}, {response['ContentLength']} to {len(converted)} bytes")
+        tag_set = s3.get_object_tagging(Bucket=self.source_bucket, Key=source_key)['TagSet']
+        metadata = dict(response['Metadata'])
+        metadata[METADATA_KEY_ORIGINAL_CONTENT_TYPE] = preflight.CONTENT_TYPES[inspection['kind']]
+        # the document is only replaced when it has not been replaced since it was read
+        s3.put_object(
+            Bucket=self.source_bucket,
+            Key=source_key,
+            Body=converted,
+            ContentType=content_type,
+            Metadata=metadata,
+            Tagging=urlencode([(tag['Key'], tag['Value']) for tag in tag_set]),
+            IfMatch=response['ETag'])
+        return False
+
+    # ====================================================================================================
+    # Priority lanes, see priority_lanes.py
+    # ====================================================================================================
+    # Queues the submission of a new document in its lane, or submits it at once when the lane has no queue.
+    # Returns the lane.
+    @traced_stage("enqueue")
+    def enqueue_submission(self, document_id: str, site_id: str, priority: str = None, enqueued_at: str = None) -> str:
+        lane = priority_lanes.lane_of(priority)
+        queue_url = self.submission_queue_urls.get(lane)
+        if not queue_url:
+            self.submit_document_to_analysis(document_id, site_id)
+            return lane
+        sqs.send_message(
+            QueueUrl=queue_url,
+            MessageBody=priority_lanes.build_submission(document_id, site_id, lane, enqueued_at)
+        )
+        logger.info(f"queued the submission of {document_id} in the {lane} lane")
+        return lane
+
+    # The approximate number of submissions waiting in the queue of a lane, read at most every BACKLOG_CACHE_SECONDS
+    def get_submission_backlog(self, lane: str) -> int:
+        queue_url = self.submission_queue_urls.get(lane)
+        if not queue_url:
+            return 0
+        now = time.monotonic()
+        cached = self.submission_backlog_cache.get(lane)
+        if cached is not None and now - cached[0] < priority_lanes.BACKLOG_CACHE_SECONDS:
+            return cached[1]
+        response = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages'])
+        backlog = int(response['Attributes']['ApproximateNumberOfMessages'])
+        self.submission_backlog_cache[lane] = (now, backlog)
+        return backlog
+
+    # Sends the submissions (message bodies) to the queue of their lane again, to be received after delay_seconds
+    def defer_submissions(self, lane: str, bodies: list, delay_seconds: int = None):
+        if delay_seconds is None:
+            delay_seconds = priority_lanes.BULK_DEFER_SECONDS
+        for start in range(0, len(bodies), 10):
+            entries = [{"Id": str(index), "MessageBody": body, "DelaySeconds": delay_seconds}
+                       for index, body in enumerate(bodies[start:start + 10])]
+            response = sqs.send_message_batch(QueueUrl=self.submission_queue_urls[lane], Entries=entries)
+            if response.get('Failed'):
+                raise RuntimeError(f"failed to defer {len(response['Failed'])} submissions: {response['Failed']}")
+
     # ====================================================================================================
     # Copy a document from the Textract result to the destination bucket
     # ====================================================================================================
-    def ocr_complete(self, document_id: str, status: str):
+    @traced_stage("complete")
+    def ocr_complete(self, document_id: str, status: str, site_id: str = None):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
         if not status:
             raise ValueError("status cannot be None or an empty string")
         try:
+            metadata = None
+            revision = None
             match status:
                 case "SUCCEEDED":
                     logger.info(f"{document_id} OCR status SUCCEEDED, moving results to output bucket")
-                    self.move_text_to_destination(document_id)
-                    self.move_json_to_destination(document_id)
+                    # the Textract result is retrieved once and shared by both of the result artifacts
+                    metadata = self.get_document_metadata(document_id, site_id)
+                    # the result pages are counted by the calls of this thread, the batch completes others alongside
+                    result_pages = instrumentation.operation_total("textract.GetDocumentAnalysis")
+                    response_json = self.get_analysis_json(metadata[TAG_JOB_ID], metadata.get(TAG_TEXTRACT_REGION))
+                    result_pages = instrumentation.operation_total("textract.GetDocumentAnalysis") - result_pages
+                    # a large document is profiled from here, once its pages are known, see profiling.py
+                    with profiling.document_profile(document_id, response_json.get("DocumentMetadata", {}).get("Pages")):
+                        revision = self.get_revision(document_id, metadata[TAG_JOB_ID], site_id)
+                        reused_pages = 0
+                        if revision is not None and revision["pages"] is not None:
+                            base_json = self.read_result_json(document_id, site_id)
+                            if base_json is None:
+                                # the pages of the partial result are stored alone, and are not fingerprinted, so that
+                                # the next version of the document is analysed whole
+                                logger.warning(f"the stored result of {document_id} is missing, its unchanged pages cannot be reused")
+                                revision = dict(revision, fingerprints=None)
+                            else:
+                                response_json = page_fingerprints.merge_layout(base_json, response_json, revision)
+                                reused_pages = len(revision["pages"]) - len(page_fingerprints.partial_pages(revision))
+                        self.store_results(document_id, metadata, response_json, revision, metadata[TAG_JOB_ID], site_id,
+                                           ResultPages=result_pages, ReusedPages=reused_pages)
                     code = 200
                     msg = {"Content-Type": "application/json"}
                 case "FAILED":
                     logger.info(f"{document_id} OCR status FAILED, no results available")
+                    revision = self.read_json_object(page_fingerprints.create_revision_key(self.create_source_key(document_id, site_id)))
                     code = 500
                     msg = {"Content-Type": "application/json"}
                 case _:
@@ -234,91 +639,168 @@ class CiesOcrCore:
                     msg = {"Content-Type": "application/json"}
 
             tags = [{"Key": TAG_KEY_STATUS, "Value": status}]
-            self.update_tag_in_S3(document_id, tags)
+            self.update_tag_in_S3(document_id, tags, site_id)
+            self.clear_pending_job(document_id, metadata, site_id)
+            # only a document submitted with a revision has one, and a partial PDF, to remove
+            if revision is not None:
+                self.clear_revision(document_id, site_id)
             return code, msg
         except Exception as e:
             raise e
         
+    # Writes the results of a document from its Textract result, and records its metrics and usage. The fingerprints
+    # of the revision (or None) are stored with the results, the metrics are e.g. ResultPages=<pages read>
+    def store_results(self, document_id: str, metadata: dict, response_json: dict, revision: dict, job_id: str,
+                      site_id: str = None, **document_metrics):
+        report_text = self.move_text_to_destination(document_id, metadata, response_json, site_id)
+        stored_json = self.move_json_to_destination(document_id, metadata, response_json, site_id)
+        if revision is not None and revision.get("fingerprints") is not None:
+            self.save_fingerprints(document_id, job_id, revision, site_id)
+        compact_text = self.move_compact_text_to_destination(document_id, metadata, report_text, site_id)
+        region = self.move_region_index_to_destination(document_id, metadata, response_json, site_id)
+        self.index_document_text(document_id, metadata.get(METADATA_KEY_SITE_ID), report_text)
+        self.journal_completed_document(document_id, metadata, report_text, response_json)
+        # the artifact sizes are those of the text and json written by move_*_to_destination
+        sizes = dict(
+            TextBytes=len(report_text[1].encode("utf-8")) if report_text else 0,
+            JsonBytes=len(stored_json.encode("utf-8")),
+            CompactTextBytes=len(compact_text.encode("utf-8")),
+            RegionIndexBytes=len(region))
+        pages = response_json.get("DocumentMetadata", {}).get("Pages")
+        instrumentation.document_metrics(document_id, Pages=pages, **document_metrics, **sizes)
+        self.record_site_usage(
+            metadata.get(METADATA_KEY_SITE_ID),
+            Pages=pages,
+            ResultPages=document_metrics.get("ResultPages"),
+            BytesStored=sum(sizes.values()))
+
     # ====================================================================================================
     # Copy a document from the Textract result to the destination bucket
     # The document_id should be a UUID but it can be any string. When a file is copied
     # directly to the source bucket it may have any object ID.
     # ====================================================================================================
-    def move_text_to_destination(self, document_id: str):
+    # The metadata and the Textract result may be passed in when the caller already has them, otherwise
+    # they are retrieved. The results are keyed by the site_id of the source key, see key_layout.py
+    @traced_stage("store_text")
+    def move_text_to_destination(self, document_id: str, metadata: dict = None, responseJson: dict = None, site_id: str = None):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
 
         try:
             logger.debug(f"move_text_to_destination({document_id})")
-            metadata = self.get_document_metadata(document_id)
-            logger.debug(f"metadata={metadata}")
+            if metadata is None:
+                metadata = self.get_document_metadata(document_id, site_id)
+            logger.debug("metadata=%s", payload(metadata))
 
             job_id = metadata[TAG_JOB_ID]
             logger.info(f"document_id is {document_id}, job_id is {job_id}")
 
-            responseJson = get_full_json(job_id=job_id,
-                                boto3_textract_client=txt,
-                                textract_api= Textract_API.ANALYZE)
-            logger.debug(f"responseJson={responseJson}")
-            report_text = get_text_from_layout_json(
-                responseJson, 
-                exclude_page_header = True, 
-                exclude_page_footer = True, 
-                exclude_figure_text = True, 
-                exclude_page_number = True)
+            if responseJson is None:
+                responseJson = self.get_analysis_json(job_id, metadata.get(TAG_TEXTRACT_REGION))
+            logger.debug("responseJson=%s", payload(responseJson))
+            report_text = self.get_report_text(responseJson)
             
             text = report_text[1]
 
             user_id = metadata[METADATA_KEY_USER_ID] if METADATA_KEY_USER_ID in metadata else None
-            site_id = metadata[METADATA_KEY_SITE_ID] if METADATA_KEY_SITE_ID in metadata else None
+            metadata_site_id = metadata[METADATA_KEY_SITE_ID] if METADATA_KEY_SITE_ID in metadata else None
             file_name = metadata[METADATA_KEY_FILE_NAME] if METADATA_KEY_FILE_NAME in metadata else document_id
 
-            text_document_id = f'{document_id}.txt'
+            text_document_id = self.create_text_result_id(document_id, site_id)
 
             logger.debug(f"saving text for document {document_id}, text starts with {text[:128]}")
-            self.save_document_to_destination_bucket(user_id, site_id, text_document_id, file_name, text)
+            self.save_document_to_destination_bucket(user_id, metadata_site_id, text_document_id, file_name, text)
 
-            return
+            return report_text
 
         except Exception as e:
             raise e
 
-    def move_json_to_destination(self, document_id: str):
+    @traced_stage("store_json")
+    def move_json_to_destination(self, document_id: str, metadata: dict = None, responseJson: dict = None, site_id: str = None):
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
         try:
             logger.debug(f"move_json_to_destination({document_id})")
-            metadata = self.get_document_metadata(document_id)
-            logger.debug(f"metadata={metadata}")
+            if metadata is None:
+                metadata = self.get_document_metadata(document_id, site_id)
+            logger.debug("metadata=%s", payload(metadata))
 
             job_id = metadata[TAG_JOB_ID]
             logger.info(f"{document_id}, job_id is {job_id}")
 
-            responseJson = get_full_json(job_id=job_id,
-                                boto3_textract_client=txt,
-                                textract_api= Textract_API.ANALYZE)
-            logger.debug(f"responseJson={responseJson}")
+            if responseJson is None:
+                responseJson = self.get_analysis_json(job_id, metadata.get(TAG_TEXTRACT_REGION))
+            logger.debug("responseJson=%s", payload(responseJson))
 
             user_id = metadata[METADATA_KEY_USER_ID] if METADATA_KEY_USER_ID in metadata else None
-            site_id = metadata[METADATA_KEY_SITE_ID] if METADATA_KEY_SITE_ID in metadata else None
+            metadata_site_id = metadata[METADATA_KEY_SITE_ID] if METADATA_KEY_SITE_ID in metadata else None
             file_name = metadata[METADATA_KEY_FILE_NAME] if METADATA_KEY_FILE_NAME in metadata else document_id
 
-            json_document_id = f'{document_id}.json'
+            json_document_id = self.create_json_result_id(document_id, site_id)
 
             # safely log the first 128 characters of the JSON
             self.log_response_json(f"saving json for document {document_id}, json starts with", responseJson, 128)
             
-            self.save_document_to_destination_bucket(user_id, site_id, json_document_id, file_name, str(responseJson))
+            body = json.dumps(responseJson)
+            self.save_document_to_destination_bucket(user_id, metadata_site_id, json_document_id, file_name, body)
 
-            return
+            return body
 
         except Exception as e:
             raise e
 
 
+    # The compact form of the text of every page, with the banner and footer the pages repeat once, see page_banner.py
+    # Returns the JSON that is stored.
+    @traced_stage("store_compact")
+    def move_compact_text_to_destination(self, document_id: str, metadata: dict, report_text: dict, site_id: str = None) -> str:
+        compact = json.dumps(page_banner.collapse(report_text or {}))
+        file_name = metadata.get(METADATA_KEY_FILE_NAME, document_id)
+        logger.debug(f"saving compact text for document {document_id}, {len(compact)} characters")
+        self.save_document_to_destination_bucket(metadata.get(METADATA_KEY_USER_ID), metadata.get(METADATA_KEY_SITE_ID),
+                                                 self.create_compact_result_id(document_id, site_id), file_name, compact)
+        return compact
+
+    # Returns the compact form of the text of a document. A document completed before the compact form was stored
+    # has it derived from its full text, and stored.
+    @coalesced("get_compact_text", ignore=("user_id",))
+    def get_compact_text(self, user_id: str, site_id: str, document_id: str, etag: str = None) -> dict:
+        body = self.read_result_object(self.create_compact_result_id(document_id, site_id), etag)
+        if body is not None:
+            return json.loads(body)
+        logger.info(f"no compact text stored for {document_id}, deriving it")
+        compact = self.move_compact_text_to_destination(document_id, self.get_document_metadata(document_id, site_id),
+                                                        self.get_text(user_id, site_id, document_id), site_id)
+        return json.loads(compact)
+
+    # The spatial index of the words and lines of every page, see region_index.py. Returns the bytes that are stored.
+    @traced_stage("store_region_index")
+    def move_region_index_to_destination(self, document_id: str, metadata: dict, response_json: dict, site_id: str = None) -> bytes:
+        body = region_index.dumps(region_index.build(response_json))
+        logger.debug(f"saving region index for document {document_id}, {len(body)} bytes")
+        self.save_document_to_destination_bucket(metadata.get(METADATA_KEY_USER_ID), metadata.get(METADATA_KEY_SITE_ID),
+                                                 self.create_region_result_id(document_id, site_id),
+                                                 metadata.get(METADATA_KEY_FILE_NAME, document_id), body)
+        return body
+
+    # Returns the arrays of the region index of a document, or None when it has no results. A document completed
+    # before the index was stored has it built from its stored result, and stored.
+    def get_region_index(self, document_id: str, site_id: str = None) -> dict:
+        body = self.read_result_object(self.create_region_result_id(document_id, site_id))
+        if body is not None:
+            return region_index.loads(body)
+        response_json = self.read_result_json(document_id, site_id)
+        if response_json is None:
+            return None
+        logger.info(f"no region index stored for {document_id}, building it")
+        return region_index.loads(self.move_region_index_to_destination(
+            document_id, self.get_document_metadata(document_id, site_id), response_json, site_id))
+
     # ====================================================================================================
     # Retrieve the document status for the given document_id
     # ====================================================================================================
+    @traced_stage("status")
     def get_document_status(self, user_id: str, site_id: str, document_id: str) -> str:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
@@ -345,24 +827,90 @@ class CiesOcrCore:
     # This function retrieves the ocr'd text for the given document_id
     # Note that the destination bucket, which is where we will get the text, is always the default destination.
     # ====================================================================================================
-    def get_text(self, user_id: str, site_id: str, document_id: str) -> dict:
+    @coalesced("get_text", ignore=("user_id",))
+    @traced_stage("get_text")
+    def get_text(self, user_id: str, site_id: str, document_id: str, etag: str = None) -> dict:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
         try:
             logger.debug(f"get_text({user_id}, {site_id}, {document_id})")
-            item = self.get_document_metadata(document_id)
-            job_id = item.get(TAG_JOB_ID)
-            responseJson = get_full_json(job_id=job_id,
-                                boto3_textract_client=txt,
-                                textract_api= Textract_API.ANALYZE)
-            report_text = get_text_from_layout_json(responseJson, exclude_page_header = True, exclude_page_footer = True, exclude_figure_text = True, exclude_page_number = True)
-
-            logger.debug(f"returning {report_text}")
+            # the stored result is read rather than the Textract job, which holds only the changed pages of
+            # a revised document, see page_fingerprints.py
+            responseJson = self.read_result_json(document_id, site_id, etag)
+            if responseJson is None:
+                item = self.get_document_metadata(document_id, site_id)
+                responseJson = self.get_analysis_json(item.get(TAG_JOB_ID), item.get(TAG_TEXTRACT_REGION))
+            report_text = self.get_report_text(responseJson)
+
+            logger.debug("returning %s", payload(report_text))
             return report_text
 
         except Exception as e:
             raise e
 
+    # ====================================================================================================
+    # Retrieve the complete (all pages) Textract analysis result for a job
+    # ====================================================================================================
+    @traced_stage("get_analysis")
+    def get_analysis_json(self, job_id: str, region: str = None) -> dict:
+        if not job_id:
+            raise ValueError("job_id cannot be None or an empty string")
+        return get_full_json(job_id=job_id,
+                             boto3_textract_client=self.textract_client(region),
+                             textract_api= Textract_API.ANALYZE)
+
+    # ====================================================================================================
+    # Site usage and quotas, see site_usage.py
+    # ====================================================================================================
+    # Adds to the usage of a site (the x-amz-meta-site-id of a document), e.g. Documents=1, written when the handler completes
+    def record_site_usage(self, site_id: str, **counts):
+        self.usage_meter.add(site_id, **counts)
+
+    # Raises site_usage.QuotaExceeded, a 429, when the site is over one of its quotas and may not add a document
+    def check_site_quota(self, site_id: str):
+        self.usage_meter.check(site_id)
+
+    # ====================================================================================================
+    # Textract regions, see textract_regions.py
+    # ====================================================================================================
+    # The client of a service in a Textract region, the clients of the home region are those of the module
+    def regional_client(self, service: str, region: textract_regions.Region):
+        if region.home:
+            return txt if service == 'textract' else s3
+        client = self.regional_clients.get((service, region.name))
+        if client is None:
+            config = Config(signature_version='s3v4') if service == 's3' else Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+            client = self.regional_clients[(service, region.name)] = create_client(service, config, region.name)
+        return client
+
+    # The Textract client of the region a job was started in, the textract-region tag of its document. A job without
+    # the tag was started in the home region.
+    def textract_client(self, region: str = None):
+        return self.regional_client('textract', self.textract_dispatcher.region(region))
+
+    # Copies a document to the bucket of a Textract region, Textract reads the documents of its own region only
+    def stage_document(self, region: textract_regions.Region, key: str):
+        if region.bucket == self.source_bucket:
+            return
+        self.regional_client('s3', region).copy_object(
+            Bucket=region.bucket,
+            Key=key,
+            CopySource={'Bucket': self.source_bucket, 'Key': key})
+
+    # ====================================================================================================
+    # Linearize the Textract analysis result into a dict of page number to text.
+    # Large documents are partitioned by page and linearized on all available CPUs, smaller documents
+    # (see layout_linearizer.PARALLEL_MIN_PAGES), and documents completed alongside others in a pool of
+    # threads, are linearized in-process.
+    # ====================================================================================================
+    def get_report_text(self, responseJson: dict) -> dict:
+        return get_text_from_layout_json_parallel(
+            responseJson,
+            exclude_page_header = True,
+            exclude_page_footer = True,
+            exclude_figure_text = True,
+            exclude_page_number = True)
+
     # The document returned from get_text_from_layout_json looks something like this:
     # {
     # 1: "Patient: DOE, JOHN\\nMRN JD4USARAD\\n\\nExam Date:\\n05/25/2010\\n\\nReferring Physician: DR. DAVID LIVESEY\\n\\nDOB:\\n01/01/1961\\n\\nFAX:\\n(305) 418-8166\\n\\nPET/CT OF THE WHOLE BODY\\n\\nCLINICAL HISTORY: Melanoma January. 2008. rectum; metastases to liver and tail bone. Lymph\\nnode metastases. Vascular therapy performed on March 9th: radiation therapy June, 2009.\\n\\nTECHNIQUE A PET/CT scan was obtained from the level of the vertex of the skull to the distal toes\\nfollowing the administration of 13.4 mCi of FDG intravenously\\n\\nCOMPARISON: April 7. 2009.\\n\\nREPORT HEAD AND NECK: There is no intracranial hemorrhage. midline shift or hydrocephalus.\\n\\nThe cerebellum and brainstem are normal. The basal cistems are patent.\\n\\nThe skull is intact. The visualized paranasal sinuses and temporal mastoid bone air cells are clear.\\nThere is mild to moderate bowing of the nasal septum to the left side. The salivary glands of the\\nneck are normal\\n\\nThe epiglottic, aryepiglottic folds, true and false vocal cords and supra and subglottic airway are\\nintact. The thyroid gland is normal.\\n\\nThere is no abnormal radiotracer uplake located within the head and neck\\n\\nCHEST: The heart measures at the upper limits of normal in size There is no evidence of a\\npericardial effusion.\\n\\nThe ascending thoracic aorta is minimally ectatic measuring up to 3.2 cm in diameter. The distal tip\\nof a Port-a-Catheter device placed via the left subclavian vein resides within the superior vena cava.\\n\\nThere are stable right paratracheal lymph nodes. These lymph nodes are not radiotracer avid.\\n\\nThere is no evidence of pleural effusion.\\n\\nThere has been a significant interval increase in the size of a now 3 X 2.6 cm\\n\\n\\n\\n", 
@@ -370,15 +918,23 @@ class CiesOcrCore:
     # 3: "Patient: DOE, JOHN\\nMRN JD4USARAD\\nReferring Physician: DR. DAVID LIVESEY\\n\\nExam Date:\\n05/25/2010\\nDOB:\\n01/01/1961\\nFAX:\\n(305) 418-8166\\n\\nThere is a moderate quantity of stool located within the colon consistent with constipation. The\\nappendix is not seen.\\n\\nThere is a stable centrally hypodense mass measuring approximately 1.6 X 1.2 cm located within the\\npresacral space which exhibits increased SUV measurement of up to 4.5.\\n\\nThere has been no interval change in the size or appearance of a 1.1 cm slightly hypodense mass\\nlocated to the right side of the distal rectum. This mass is not radiotracer avid.\\n\\nThere is no extraluminal air or fluid identified within the abdomen or pelvis. This is no\\nlymphadenopathy located within the abdomen or pelvis.\\n\\nThere is no abnormal radiotracer uptake located within either lower extremity\\n\\nSKELETON I do not see evidence of metastatic disease to bone.\\n\\nCONCLUSION There has been progressive metastatic disease within the chest and liver as\\ndescribed in the body of the report. Two lung metastases have increased in size when compared to\\nthe prior examination. The degree of metabolic activity within these metastases has also increased\\nwhen compared to the prior study. There has been an interval increase in the size of several liver\\nmetastases. There is a new metastasis located within the dorsal lobe of the posterior segment of the\\nright lobe of the liver\\n\\nElectronically Signed by\\n\\n08/21/2009 8:20:56 AM\\n\\n\\n\\n"
     # }
 
-    def get_presigned_get_url(self, document_id: str, content_type: str) -> str:
+    # The form "compact" is the URL of the compact form of the text, see page_banner.py
+    # With with_expiry the time the URL expires at is returned with it, a cached URL expires before expires_in
+    @traced_stage("presign")
+    def get_presigned_get_url(self, document_id: str, content_type: str, expires_in: int = None, site_id: str = None, form: str = None,
+                              with_expiry: bool = False) -> str:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
-        if "text/plain" == content_type:
-            document_text_key = self.create_text_result_id(document_id)
+        if expires_in is None:
+            expires_in = self.presigned_get_expiration
+        if form == page_banner.COMPACT:
+            document_text_key = self.create_compact_result_id(document_id, site_id)
+        elif "text/plain" == content_type:
+            document_text_key = self.create_text_result_id(document_id, site_id)
         else:
-            document_text_key = self.create_json_result_id(document_id)
+            document_text_key = self.create_json_result_id(document_id, site_id)
 
-        logger.debug(f"get_presigned_get_url({self.destination_bucket}, {document_text_key}, {self.presigned_url_expiration})")
+        logger.debug(f"get_presigned_get_url({self.destination_bucket}, {document_text_key}, {expires_in})")
 
         # :param s3_client: A Boto3 Amazon S3 client.
         # :param client_method: The name of the client method that the URL performs.
@@ -386,19 +942,661 @@ class CiesOcrCore:
         # :param expires_in: The number of seconds the presigned URL is valid for.
         # :return: The presigned URL.
         try:
-            presigned_url_response = s3.generate_presigned_url(
-                ClientMethod="get_object", 
+            presigned_url_response, expires_at = self.presigned_url_cache.get_or_sign_expiring(
+                "get_object", self.destination_bucket, document_text_key, expires_in,
+                lambda: s3.generate_presigned_url(
+                    ClientMethod="get_object",
+                    Params={
+                        'Bucket': self.destination_bucket,
+                        'Key': document_text_key
+                    },
+                    ExpiresIn=expires_in
+                ))
+            logger.debug("Got presigned URL: %s", presigned_url_response)
+            return (presigned_url_response, expires_at) if with_expiry else presigned_url_response
+        except ClientError:
+            logger.exception(f"get_presigned_get_url({self.destination_bucket}, {document_text_key}, {expires_in})")
+            raise
+
+    # Presign many documents in one request. Each item is {"document_id": ..., "type": ..., "site_id": ...} where the type is
+    # "text" or "json" (a GET of the result) or "upload" (a POST of the document to the source bucket), the site_id is optional.
+    # Returns one entry per item, in order, holding either "url" (and "fields" for an upload) and "expires_in", the
+    # seconds the URL is still valid for, which is less than expires_in for a URL signed earlier, or "error".
+    @traced_stage("presign_batch")
+    def get_presigned_urls(self, items: list, expires_in: int = None) -> list:
+        if len(items) > self.presign_batch_max_items:
+            raise ValueError(f"a batch may presign at most {self.presign_batch_max_items} documents")
+        results = []
+        for item in items:
+            document_id = item.get("document_id") if isinstance(item, dict) else None
+            url_type = item.get("type", "text") if isinstance(item, dict) else None
+            site_id = item.get("site_id") if isinstance(item, dict) else None
+            result = {"document_id": document_id, "type": url_type}
+            try:
+                match url_type:
+                    case "text":
+                        result["url"], expires_at = self.get_presigned_get_url(document_id, "text/plain", expires_in, site_id, with_expiry=True)
+                    case "json":
+                        result["url"], expires_at = self.get_presigned_get_url(document_id, "application/json", expires_in, site_id, with_expiry=True)
+                    case "upload":
+                        post, expires_at = self.get_presigned_post_url(document_id, expires_in, site_id, with_expiry=True)
+                        result.update(post)
+                    case _:
+                        expires_at = None
+                        result["error"] = f"unknown type {url_type}, expected text, json or upload"
+                if expires_at is not None:
+                    result["expires_in"] = self.presigned_url_cache.remaining_seconds(expires_at)
+            except ValueError as e:
+                result["error"] = str(e)
+            results.append(result)
+        return results
+
+    # ====================================================================================================
+    # Bundles of documents, see bundle_ingest.py
+    # ====================================================================================================
+    # Presigns a PUT of a bundle to the destination bucket, the bundle is then ingested by its key
+    @traced_stage("bundle")
+    def create_bundle_upload(self, site_id: str, content_type: str, expires_in: int = None) -> dict:
+        bundle_key = bundle_ingest.create_bundle_key(site_id or "unknown", content_type)
+        if expires_in is None:
+            expires_in = self.multipart_url_expiration
+        url = s3.generate_presigned_url(
+            ClientMethod="put_object",
+            Params={'Bucket': self.destination_bucket, 'Key': bundle_key, 'ContentType': content_type},
+            ExpiresIn=expires_in)
+        return {"bundle_key": bundle_key, "url": url, "content_type": content_type, "expires_in": expires_in}
+
+    # Copies an uploaded bundle to a temporary file, which is returned open, the bundle is read from it
+    @traced_stage("bundle")
+    def get_uploaded_bundle(self, site_id: str, bundle_key: str):
+        bundle_key = bundle_ingest.validate_bundle_key(site_id or "unknown", bundle_key)
+        response = s3.get_object(Bucket=self.destination_bucket, Key=bundle_key)
+        try:
+            if response['ContentLength'] > bundle_ingest.BUNDLE_MAX_BYTES:
+                raise ValueError(f"a bundle may be at most {bundle_ingest.BUNDLE_MAX_BYTES} bytes")
+            file = tempfile.TemporaryFile()
+            for chunk in iter(lambda: response['Body'].read(PREFLIGHT_CHUNK_BYTES), b""):
+                file.write(chunk)
+        finally:
+            response['Body'].close()
+        file.seek(0)
+        return file
+
+    def delete_uploaded_bundle(self, site_id: str, bundle_key: str):
+        s3.delete_object(Bucket=self.destination_bucket, Key=bundle_ingest.validate_bundle_key(site_id or "unknown", bundle_key))
+
+    # Writes the documents of a bundle to the source bucket, concurrently. Each document is submitted by its own
+    # ObjectCreated event, as if it had been POSTed, and an existing document is not replaced (409 of a POST).
+    # Returns one entry per document of the manifest, in order: {"document_id", "status"} and "error" unless accepted.
+    @traced_stage("bundle")
+    def ingest_bundle(self, user_id: str, site_id: str, bundle, priority: str = None) -> list:
+        documents = bundle_ingest.plan_documents(bundle)
+
+        def ingest(document: dict) -> dict:
+            result = {"document_id": document["document_id"]}
+            if "error" in document:
+                return dict(result, status=bundle_ingest.INVALID, error=document["error"])
+            try:
+                self.save_document_to_source_bucket(user_id, site_id, document["document_id"], document["file_name"],
+                                                    document["content_type"], "New", bundle.read(document["file"]),
+                                                    document["priority"] or priority, create_only=True)
+                return dict(result, status=bundle_ingest.ACCEPTED)
+            except ClientError as cx:
+                if cx.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    return dict(result, status=bundle_ingest.EXISTS, error=f"Document {document['document_id']} already exists")
+                logger.error(f"Error ingesting {document['document_id']} of a bundle: {cx}")
+                return dict(result, status=bundle_ingest.FAILED, error=cx.response['Error']['Code'])
+            except ValueError as e:
+                return dict(result, status=bundle_ingest.INVALID, error=str(e))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(bundle_ingest.BUNDLE_CONCURRENCY, len(documents)))) as executor:
+            results = list(executor.map(ingest, documents))
+        logger.info(f"ingested a bundle of {len(results)} documents for site {site_id}, "
+                    f"{sum(1 for result in results if result['status'] == bundle_ingest.ACCEPTED)} accepted")
+        return results
+
+    # ====================================================================================================
+    # Multipart upload, see multipart_upload.py
+    # ====================================================================================================
+    # Initiates a multipart upload of a document to the source bucket. The metadata and the 'New' status are given
+    # to S3 now, and are applied to the document when the upload is completed.
+    # Returns the upload id, the part size and the URLs of the first parts.
+    @traced_stage("multipart")
+    def create_multipart_upload(self, user_id: str, site_id: str, document_id: str, file_name: str, content_type: str,
+                                size: int, part_size: int = None, expires_in: int = None, priority: str = None) -> dict:
+        if not document_id:
+            raise ValueError("document_id cannot be None or an empty string")
+        part_size, part_count = multipart_upload.plan_parts(size, part_size)
+        if not file_name:
+            file_name = document_id
+        if not content_type:
+            content_type = self.get_mime_type(file_name)
+
+        metadata = {
+            METADATA_KEY_FILE_NAME: file_name,
+            METADATA_KEY_USER_ID: user_id or "unknown",
+            METADATA_KEY_SITE_ID: site_id or "unknown"
+        }
+        if priority:
+            metadata[METADATA_KEY_PRIORITY] = priority_lanes.lane_of(priority)
+
+        logger.debug(f"create_multipart_upload({self.source_bucket}, {document_id}, {size}, {part_size}, {part_count})")
+        response = s3.create_multipart_upload(
+            Bucket=self.source_bucket,
+            Key=self.create_source_key(document_id, site_id),
+            ContentType=content_type,
+            Metadata=metadata,
+            Tagging=f"{TAG_KEY_STATUS}=New"
+        )
+        upload_id = response["UploadId"]
+        logger.info(f"initiated multipart upload of {document_id}, {part_count} parts of {part_size} bytes")
+
+        if expires_in is None:
+            expires_in = self.multipart_url_expiration
+        first_parts = list(range(1, min(part_count, multipart_upload.MULTIPART_MAX_URLS) + 1))
+        return {
+            "document_id": document_id,
+            "upload_id": upload_id,
+            "part_size": part_size,
+            "part_count": part_count,
+            "expires_in": expires_in,
+            "parts": self.get_multipart_part_urls(document_id, upload_id, first_parts, expires_in, site_id)
+        }
+
+    # Presigns a PUT of each of the given parts. The URLs are not cached, they are specific to one upload.
+    @traced_stage("multipart")
+    def get_multipart_part_urls(self, document_id: str, upload_id: str, part_numbers: list, expires_in: int = None, site_id: str = None) -> list:
+        if not document_id or not upload_id:
+            raise ValueError("document_id and upload_id are required")
+        if expires_in is None:
+            expires_in = self.multipart_url_expiration
+        return [{
+            "part_number": part_number,
+            "url": s3.generate_presigned_url(
+                ClientMethod="upload_part",
                 Params={
-                    'Bucket': self.destination_bucket,
-                    'Key': document_text_key
-                }, 
-                ExpiresIn=self.presigned_url_expiration
+                    'Bucket': self.source_bucket,
+                    'Key': self.create_source_key(document_id, site_id),
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
+                ExpiresIn=expires_in)
+        } for part_number in multipart_upload.validate_part_numbers(part_numbers)]
+
+    # The parts which have been uploaded, which is what a client resumes from
+    @traced_stage("multipart")
+    def list_multipart_parts(self, document_id: str, upload_id: str, site_id: str = None) -> list:
+        parts = []
+        paginator = s3.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=self.source_bucket, Key=self.create_source_key(document_id, site_id), UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts.append({"PartNumber": part["PartNumber"], "ETag": part["ETag"], "Size": part["Size"]})
+        return parts
+
+    # Completes an upload from the parts given by the client, or from the parts listed by S3 when none are given.
+    # S3 then raises the ObjectCreated event, which submits the document to Textract.
+    @traced_stage("multipart")
+    def complete_multipart_upload(self, document_id: str, upload_id: str, parts: list = None, site_id: str = None) -> dict:
+        if parts is None:
+            parts = self.list_multipart_parts(document_id, upload_id, site_id)
+        response = s3.complete_multipart_upload(
+            Bucket=self.source_bucket,
+            Key=self.create_source_key(document_id, site_id),
+            UploadId=upload_id,
+            MultipartUpload={"Parts": multipart_upload.completed_parts(parts)}
+        )
+        logger.info(f"completed multipart upload of {document_id}, {len(parts)} parts")
+        return {"document_id": document_id, "etag": response.get("ETag")}
+
+    @traced_stage("multipart")
+    def abort_multipart_upload(self, document_id: str, upload_id: str, site_id: str = None):
+        s3.abort_multipart_upload(Bucket=self.source_bucket, Key=self.create_source_key(document_id, site_id), UploadId=upload_id)
+        logger.info(f"aborted multipart upload of {document_id}")
+
+    # Aborts the uploads that were initiated more than max_age_seconds ago, which deletes their parts.
+    # The AbortIncompleteMultipartUpload lifecycle rule of the source bucket is the backstop, with a granularity of days.
+    # Returns the number of uploads aborted.
+    @traced_stage("multipart")
+    def abort_stale_multipart_uploads(self, max_age_seconds: int = None) -> int:
+        if max_age_seconds is None:
+            max_age_seconds = self.multipart_stale_seconds
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        aborted = 0
+        paginator = s3.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=self.source_bucket):
+            for upload in page.get("Uploads", []):
+                if upload["Initiated"] >= cutoff:
+                    continue
+                try:
+                    s3.abort_multipart_upload(Bucket=self.source_bucket, Key=upload["Key"], UploadId=upload["UploadId"])
+                    aborted += 1
+                except ClientError as e:
+                    # completed or aborted since it was listed
+                    if e.response["Error"]["Code"] != "NoSuchUpload":
+                        raise
+        if aborted:
+            logger.info(f"aborted {aborted} stale multipart uploads")
+        return aborted
+
+    # ====================================================================================================
+    # Full text search index
+    # ====================================================================================================
+    # Write the text of one document, as a new segment, to the index of its site.
+    # Indexing is not allowed to fail the completion of a document, a document which is not indexed
+    # is still available through /text.
+    @traced_stage("index")
+    def index_document_text(self, document_id: str, site_id: str, report_text: dict):
+        if not document_id:
+            raise ValueError("document_id cannot be None or an empty string")
+        try:
+            writer = search_index.SegmentWriter()
+            writer.add_document(document_id, report_text or {})
+            segment_key = search_index.create_segment_key(site_id)
+            logger.debug(f"index_document_text({document_id}, {site_id}) writing {segment_key}")
+            s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=segment_key,
+                Body=writer.to_bytes()
             )
-            logger.info("Got presigned URL: %s", presigned_url_response)
-            return presigned_url_response
-        except ClientError:
-            logger.exception(f"get_presigned_get_url({self.destination_bucket}, {document_text_key}, {self.presigned_url_expiration})")
+        except Exception as e:
+            logger.error(f"Error indexing {document_id} for site {site_id}: {e}")
+
+    # Search the index of a site, returns a list of the documents and pages containing every term of the query
+    @traced_stage("search")
+    def search(self, site_id: str, query: str, limit: int = 100) -> list:
+        if not query:
+            raise ValueError("query cannot be None or an empty string")
+        readers = [self.get_index_segment(key) for key in self.list_index_segments(site_id)]
+        return search_index.search_segments(readers, query, limit)
+
+    # Merge the segments of a site into one segment once there are at least index_merge_threshold of them.
+    # Segments written while the merge runs are newer than the merged segment and are merged the next time.
+    @traced_stage("index_merge")
+    def merge_index_segments(self, site_id: str, min_segments: int = None) -> str:
+        if min_segments is None:
+            min_segments = self.index_merge_threshold
+        segment_keys = self.list_index_segments(site_id)
+        if len(segment_keys) < max(min_segments, 2):
+            logger.debug(f"merge_index_segments({site_id}) {len(segment_keys)} segments, no merge required")
+            return None
+
+        readers = [self.get_index_segment(key) for key in segment_keys]
+        merged_level = max(search_index.segment_level(key) for key in segment_keys) + 1
+        # the merged segment takes the position of the newest segment it replaces
+        merged_key = search_index.create_segment_key(site_id, merged_level, search_index.segment_timestamp(segment_keys[-1]))
+        logger.info(f"merging {len(segment_keys)} segments of site {site_id} into {merged_key}")
+        s3.put_object(
+            Bucket=self.destination_bucket,
+            Key=merged_key,
+            Body=search_index.merge_segments(readers)
+        )
+
+        for start in range(0, len(segment_keys), 1000):
+            s3.delete_objects(
+                Bucket=self.destination_bucket,
+                Delete={'Objects': [{'Key': key} for key in segment_keys[start:start + 1000]], 'Quiet': True}
+            )
+        return merged_key
+
+    # Returns the site ids that have an index
+    def list_indexed_sites(self) -> list:
+        sites = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.destination_bucket, Prefix=search_index.INDEX_PREFIX, Delimiter='/'):
+            for prefix in page.get('CommonPrefixes', []):
+                sites.append(prefix['Prefix'][len(search_index.INDEX_PREFIX):].rstrip('/'))
+        return sites
+
+    # Returns the segment keys of a site ordered from oldest to newest
+    def list_index_segments(self, site_id: str) -> list:
+        keys = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.destination_bucket, Prefix=search_index.site_index_prefix(site_id)):
+            keys.extend(item['Key'] for item in page.get('Contents', []) if item['Key'].endswith(search_index.SEGMENT_SUFFIX))
+        return sorted(keys, key=lambda key: (search_index.segment_timestamp(key), search_index.segment_level(key)))
+
+    def get_index_segment(self, segment_key: str) -> search_index.SegmentReader:
+        reader = self.index_segment_cache.get(segment_key)
+        if reader is None:
+            response = s3.get_object(
+                Bucket=self.destination_bucket,
+                Key=segment_key
+            )
+            reader = search_index.SegmentReader(response['Body'].read())
+            if len(self.index_segment_cache) >= self.index_segment_cache_size:
+                self.index_segment_cache.pop(next(iter(self.index_segment_cache)))
+            self.index_segment_cache[segment_key] = reader
+        return reader
+
+    # ====================================================================================================
+    # Columnar analytics export
+    # ====================================================================================================
+    # Record a completed document in the export journal, like indexing this must not fail the completion
+    @traced_stage("journal")
+    def journal_completed_document(self, document_id: str, metadata: dict, report_text: dict, responseJson: dict):
+        if not document_id:
+            raise ValueError("document_id cannot be None or an empty string")
+        try:
+            completed_at = datetime.now(timezone.utc)
+            record = analytics_export.build_journal_record(
+                document_id,
+                metadata.get(METADATA_KEY_SITE_ID),
+                metadata.get(TAG_JOB_ID),
+                report_text,
+                responseJson,
+                completed_at)
+            s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=analytics_export.create_journal_key(document_id, completed_at),
+                Body=json.dumps(record),
+                ContentType="application/json"
+            )
+        except Exception as e:
+            logger.error(f"Error journaling {document_id} for export: {e}")
+
+    # Compact the journal records written since the last export into Parquet files partitioned by site and date,
+    # then advance the high water mark. Returns a summary of the run.
+    @traced_stage("export")
+    def export_completed_documents(self, max_records: int = None) -> dict:
+        if max_records is None:
+            max_records = self.export_max_records
+        high_water_mark = self.get_export_high_water_mark()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.export_settle_seconds)
+
+        journal_keys = []
+        list_parameters = {'Bucket': self.destination_bucket, 'Prefix': analytics_export.JOURNAL_PREFIX}
+        if high_water_mark:
+            list_parameters['StartAfter'] = high_water_mark
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**list_parameters):
+            keys = [item['Key'] for item in page.get('Contents', [])]
+            settled = [key for key in keys if analytics_export.journal_timestamp(key) <= cutoff]
+            journal_keys.extend(settled[:max_records - len(journal_keys)])
+            if len(settled) < len(keys) or len(journal_keys) >= max_records:
+                break
+
+        logger.info(f"exporting {len(journal_keys)} journal records after {high_water_mark}")
+        if not journal_keys:
+            return {"high_water_mark": high_water_mark, "records": 0, "files": []}
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            records = list(executor.map(self.get_journal_record, journal_keys))
+            document_sites = {record["document_id"]: record["site_id"] for record in records}
+            document_ids = sorted(document_sites)
+            result_metadata = dict(zip(document_ids, executor.map(
+                lambda document_id: self.get_export_metadata(self.create_text_result_id(document_id, document_sites[document_id])),
+                document_ids)))
+
+        files = []
+        for (site_id, date), rows in analytics_export.build_partition_rows(records, result_metadata).items():
+            parquet_key = analytics_export.create_parquet_key(site_id, date, journal_keys[0])
+            s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=parquet_key,
+                Body=analytics_export.rows_to_parquet(rows)
+            )
+            files.append(parquet_key)
+
+        # the high water mark only moves once every partition has been written, a failed run is repeated in full
+        s3.put_object(
+            Bucket=self.destination_bucket,
+            Key=analytics_export.HIGH_WATER_MARK_KEY,
+            Body=analytics_export.dump_high_water_mark(journal_keys[-1], datetime.now(timezone.utc)),
+            ContentType="application/json"
+        )
+        return {"high_water_mark": journal_keys[-1], "records": len(records), "files": files}
+
+    def get_export_high_water_mark(self) -> str:
+        try:
+            response = s3.get_object(
+                Bucket=self.destination_bucket,
+                Key=analytics_export.HIGH_WATER_MARK_KEY
+            )
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                logger.info("No export high water mark, exporting from the start of the journal")
+                return None
             raise
+        return analytics_export.load_high_water_mark(response['Body'].read())
+
+    # The HEAD of a text result, its Metadata holds the user_id, file_name and site_id it was saved with
+    def get_export_metadata(self, result_id: str) -> dict:
+        try:
+            return s3.head_object(
+                Bucket=self.destination_bucket,
+                Key=result_id
+            )
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                logger.info(f"No result metadata available for {result_id}")
+                return None
+            raise
+
+    def get_journal_record(self, journal_key: str) -> dict:
+        response = s3.get_object(
+            Bucket=self.destination_bucket,
+            Key=journal_key
+        )
+        return json.loads(response['Body'].read())
+
+    # ====================================================================================================
+    # Exactly once completion
+    # ====================================================================================================
+    # Complete the document unless the completion of the job has already been done, or is being done, by a
+    # duplicate notification, see completion_ledger.py. Returns None when the completion was skipped.
+    @traced_stage("complete_once")
+    def ocr_complete_once(self, document_id: str, status: str, job_id: str, site_id: str = None):
+        if not job_id:
+            logger.warning(f"{document_id} has no job_id, completing without the ledger")
+            return self.ocr_complete(document_id, status, site_id)
+
+        claim, etag = self.claim_completion(document_id, job_id)
+        if claim is None:
+            return None
+        try:
+            result = self.ocr_complete(document_id, status, site_id)
+        except Exception:
+            self.finish_completion(claim, etag, completion_ledger.STATE_FAILED, status)
+            raise
+        self.finish_completion(claim, etag, completion_ledger.STATE_DONE, status)
+        return result
+
+    # Returns the claim and the ETag of the ledger record, or (None, None) when the job may not be claimed
+    def claim_completion(self, document_id: str, job_id: str) -> tuple:
+        ledger_key = completion_ledger.create_ledger_key(job_id)
+        claim = completion_ledger.build_claim(document_id, job_id, completion_ledger.create_owner_id(), self.completion_lease_seconds)
+        try:
+            response = s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=ledger_key,
+                Body=completion_ledger.dumps(claim),
+                ContentType="application/json",
+                IfNoneMatch="*"
+            )
+            return claim, response['ETag']
+        except ClientError as cx:
+            if cx.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+
+        try:
+            existing = s3.get_object(
+                Bucket=self.destination_bucket,
+                Key=ledger_key
+            )
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                logger.warning(f"ledger record of job {job_id} disappeared while claiming, skipping {document_id}")
+                return None, None
+            raise
+        record = completion_ledger.loads(existing['Body'].read())
+        if not completion_ledger.is_claimable(record):
+            logger.info(f"completion of {document_id} job {job_id} is {record['state']} by {record['owner']}, skipping the duplicate")
+            return None, None
+
+        try:
+            response = s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=ledger_key,
+                Body=completion_ledger.dumps(claim),
+                ContentType="application/json",
+                IfMatch=existing['ETag']
+            )
+        except ClientError as cx:
+            if cx.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                logger.info(f"completion of {document_id} job {job_id} was taken over by another notification")
+                return None, None
+            raise
+        logger.warning(f"taking over the {record['state']} completion of {document_id} job {job_id} from {record['owner']}")
+        return claim, response['ETag']
+
+    def finish_completion(self, claim: dict, etag: str, state: str, status: str):
+        try:
+            s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=completion_ledger.create_ledger_key(claim['job_id']),
+                Body=completion_ledger.dumps(completion_ledger.build_outcome(claim, state, status)),
+                ContentType="application/json",
+                IfMatch=etag
+            )
+        except ClientError as cx:
+            # the lease expired and the completion was taken over, the new owner records the outcome
+            if cx.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                logger.error(f"Error recording the completion of job {claim['job_id']}: {cx}")
+            else:
+                logger.warning(f"completion of job {claim['job_id']} was taken over before it finished")
+
+    # ====================================================================================================
+    # Reconciliation of documents that are stuck as 'Submitted'
+    # ====================================================================================================
+    # See pending_jobs.py. Writing or deleting a marker must not fail the submission or the completion,
+    # a missing marker only means that the document is not reconciled.
+    # A marker is keyed by the source key of the document, which locates the document in every key layout.
+    def record_pending_job(self, document_id: str, hour: str, site_id: str = None):
+        try:
+            s3.put_object(
+                Bucket=self.destination_bucket,
+                Key=pending_jobs.create_pending_key(self.create_source_key(document_id, site_id), hour),
+                Body=b""
+            )
+        except Exception as e:
+            logger.error(f"Error recording pending job for {document_id}: {e}")
+
+    def clear_pending_job(self, document_id: str, metadata: dict = None, site_id: str = None):
+        try:
+            if metadata is None:
+                metadata = self.get_document_metadata(document_id, site_id) or {}
+            hour = metadata.get(TAG_SUBMITTED_AT)
+            if hour:
+                s3.delete_object(
+                    Bucket=self.destination_bucket,
+                    Key=pending_jobs.create_pending_key(self.create_source_key(document_id, site_id), hour)
+                )
+        except Exception as e:
+            logger.error(f"Error clearing pending job for {document_id}: {e}")
+
+    # Finds the markers older than the deadline, oldest first, checks the status of their Textract jobs and
+    # completes the documents whose jobs have finished. At most max_jobs are checked per run, the rest are
+    # checked by the following runs. Returns the count of each outcome and the age of the oldest marker.
+    @traced_stage("reconcile")
+    def reconcile_pending_jobs(self, deadline_seconds: int = None, max_jobs: int = None) -> dict:
+        if deadline_seconds is None:
+            deadline_seconds = self.reconcile_deadline_seconds
+        if max_jobs is None:
+            max_jobs = self.reconcile_max_jobs
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=deadline_seconds)
+
+        markers = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for hour_prefix in self.list_pending_hours():
+            # hours are listed oldest first, no marker in a later hour can be past the deadline
+            if pending_jobs.hour_from_prefix(hour_prefix) > cutoff:
+                break
+            for page in paginator.paginate(Bucket=self.destination_bucket, Prefix=hour_prefix):
+                for item in page.get('Contents', []):
+                    if item['LastModified'] <= cutoff:
+                        markers.append((item['Key'], item['LastModified']))
+            if len(markers) >= max_jobs:
+                break
+        markers = markers[:max_jobs]
+
+        summary = {"checked": len(markers), "lag_seconds": 0}
+        if markers:
+            summary["lag_seconds"] = int((now - min(last_modified for _, last_modified in markers)).total_seconds())
+        with ThreadPoolExecutor(max_workers=self.reconcile_concurrency) as executor:
+            for outcome in executor.map(lambda marker: self.reconcile_pending_job(marker[0]), markers):
+                summary[outcome] = summary.get(outcome, 0) + 1
+        logger.info(f"reconcile_pending_jobs {summary}")
+        return summary
+
+    # The marker hour prefixes, e.g. ["pending/2024061013/", "pending/2024061014/"], oldest first
+    def list_pending_hours(self) -> list:
+        hour_prefixes = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.destination_bucket, Prefix=pending_jobs.PENDING_PREFIX, Delimiter='/'):
+            hour_prefixes.extend(item['Prefix'] for item in page.get('CommonPrefixes', []))
+        return sorted(hour_prefixes)
+
+    # Returns the outcome: "completed", "failed", "in_progress", "resubmitted", "cleared" or "error"
+    def reconcile_pending_job(self, pending_key: str) -> str:
+        document_id = pending_jobs.source_key_from_key(pending_key)
+        try:
+            site_id, document_id = self.parse_source_key(document_id)
+            metadata = self.get_document_metadata(document_id, site_id)
+            if metadata is None or metadata.get(TAG_KEY_STATUS) != "Submitted" or TAG_JOB_ID not in metadata:
+                # the document was deleted, or completed without clearing its marker
+                outcome = "cleared"
+            else:
+                try:
+                    job_status = pending_jobs.call_with_backoff(
+                        lambda: self.textract_client(metadata.get(TAG_TEXTRACT_REGION)).get_document_analysis(
+                            JobId=metadata[TAG_JOB_ID], MaxResults=1)['JobStatus'])
+                except ClientError as cx:
+                    if cx.response['Error']['Code'] != 'InvalidJobIdException':
+                        raise
+                    job_status = None
+                logger.info(f"reconciling {document_id}, job {metadata[TAG_JOB_ID]} is {job_status}")
+                match job_status:
+                    case "IN_PROGRESS":
+                        return "in_progress"
+                    # the pages that were analysed are available when only some pages failed
+                    case "SUCCEEDED" | "PARTIAL_SUCCESS":
+                        if (self.ocr_complete_once(document_id, "SUCCEEDED", metadata[TAG_JOB_ID], site_id) is None and
+                                not self.retag_completed_job(document_id, metadata[TAG_JOB_ID], site_id)):
+                            # a notification is completing the document now, the marker is kept until it finishes
+                            return "in_progress"
+                        outcome = "completed"
+                    case "FAILED":
+                        if (self.ocr_complete_once(document_id, "FAILED", metadata[TAG_JOB_ID], site_id) is None and
+                                not self.retag_completed_job(document_id, metadata[TAG_JOB_ID], site_id)):
+                            # a notification is completing the document now, the marker is kept until it finishes
+                            return "in_progress"
+                        outcome = "failed"
+                    case _:
+                        # Textract no longer has the job (results are kept for 7 days), so it is submitted again.
+                        # The marker is kept until the submission succeeds, a failed submission is retried by the
+                        # next run, and it is not deleted when the submission wrote a new marker with the same key.
+                        self.submit_document_to_analysis(document_id, site_id)
+                        resubmitted = self.get_document_metadata(document_id, site_id) or {}
+                        if (resubmitted.get(TAG_KEY_STATUS) != "Submitted" or pending_key != pending_jobs.create_pending_key(
+                                self.create_source_key(document_id, site_id), resubmitted.get(TAG_SUBMITTED_AT))):
+                            s3.delete_object(Bucket=self.destination_bucket, Key=pending_key)
+                        return "resubmitted"
+            s3.delete_object(Bucket=self.destination_bucket, Key=pending_key)
+            return outcome
+        except Exception as e:
+            logger.error(f"Error reconciling {document_id}: {e}")
+            return "error"
+
+    # A job whose completion the ledger records as done was completed by a notification, the document is given the
+    # status it was completed with, in case its tag was not written. Returns False when the job is not done.
+    def retag_completed_job(self, document_id: str, job_id: str, site_id: str = None) -> bool:
+        record = self.read_json_object(completion_ledger.create_ledger_key(job_id))
+        if record is None or record.get("state") != completion_ledger.STATE_DONE:
+            return False
+        logger.info(f"completion of {document_id} job {job_id} is done, tagging it {record['status']}")
+        self.update_tag_in_S3(document_id, [{"Key": TAG_KEY_STATUS, "Value": record["status"]}], site_id)
+        return True
 
     # ====================================================================================================
     # Internal 'helper' functions
@@ -419,13 +1617,15 @@ class CiesOcrCore:
     # }
     # Note: the document status is stored as a Tag so that it can be mutated
     # Note: the result MUST not have any values of None, which confuses ALB
-    def get_document_metadata(self, document_id : str) -> dict:
+    @coalesced("get_document_metadata")
+    def get_document_metadata(self, document_id : str, site_id: str = None) -> dict:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
+        source_key = self.create_source_key(document_id, site_id)
         try:
             metadata_response = s3.head_object(
                 Bucket= self.source_bucket,
-                Key=document_id,
+                Key=source_key,
             )
         except ClientError as cx:
             logger.info(f"cx.response['Error'] is [{cx.response['Error']}]")
@@ -438,16 +1638,16 @@ class CiesOcrCore:
                 logger.warning(f"ClientError getting metadata {cx}")
                 raise
 
-        logger.debug(f"get_document_metadata metadata={metadata_response}")
+        logger.debug("get_document_metadata metadata=%s", payload(metadata_response))
         metadata = metadata_response['Metadata']
         response_metadata = metadata_response['ResponseMetadata']
         response_metadata_headers = response_metadata['HTTPHeaders']
 
         tags_response = s3.get_object_tagging(
             Bucket= self.source_bucket,
-            Key=document_id,
+            Key=source_key,
         )
-        logger.debug(f"get_document_metadata tags_response={tags_response}")
+        logger.debug("get_document_metadata tags_response=%s", payload(tags_response))
 
         result = {}
 
@@ -471,10 +1671,13 @@ class CiesOcrCore:
         if METADATA_KEY_USER_ID in metadata:
             result[METADATA_KEY_USER_ID] = metadata[METADATA_KEY_USER_ID]
 
+        if METADATA_KEY_PRIORITY in metadata:
+            result[METADATA_KEY_PRIORITY] = metadata[METADATA_KEY_PRIORITY]
+
         # add the tags that exist
-        logger.debug(f"get_document_metadata tags={tags_response}")
+        logger.debug("get_document_metadata tags=%s", payload(tags_response))
         tag_set = tags_response['TagSet']
-        logger.debug(f"get_document_metadata tag_set={tag_set}")
+        logger.debug("get_document_metadata tag_set=%s", payload(tag_set))
 
         status_element = next((item for item in tag_set if item['Key'] == TAG_KEY_STATUS), None)
         status = status_element['Value'] if status_element else None
@@ -486,29 +1689,51 @@ class CiesOcrCore:
         if job_id:
             result[TAG_JOB_ID] = job_id
 
-        logger.debug(f"get_document_metadata result={result}")
+        reason_element = next((item for item in tag_set if item['Key'] == TAG_REJECT_REASON), None)
+        if reason_element:
+            result[TAG_REJECT_REASON] = reason_element['Value']
+
+        if METADATA_KEY_ORIGINAL_CONTENT_TYPE in metadata:
+            result[METADATA_KEY_ORIGINAL_CONTENT_TYPE] = metadata[METADATA_KEY_ORIGINAL_CONTENT_TYPE]
+
+        submitted_at_element = next((item for item in tag_set if item['Key'] == TAG_SUBMITTED_AT), None)
+        if submitted_at_element:
+            result[TAG_SUBMITTED_AT] = submitted_at_element['Value']
+
+        region_element = next((item for item in tag_set if item['Key'] == TAG_TEXTRACT_REGION), None)
+        if region_element:
+            result[TAG_TEXTRACT_REGION] = region_element['Value']
+
+        logger.debug("get_document_metadata result=%s", payload(result))
         return result
 
     # This method gets the metadata (and tags if available) from the OCR'd JSON
     # The text is always assumed to be in the destination bucket and the object key is the
     # document_id suffixed with ".json"
-    def get_json_metadata(self, document_id: str) -> dict:
+    def get_json_metadata(self, document_id: str, site_id: str = None) -> dict:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
-        json_id = self.create_json_result_id(document_id)
-        return self.get_result_metadata(document_id, json_id)
+        json_id = self.create_json_result_id(document_id, site_id)
+        return self.get_result_metadata(document_id, json_id, site_id)
 
     # This method gets the metadata (and tags if available) from the OCR'd text
     # The text is always assumed to be in the destination bucket and the object key is the
     # document_id suffixed with ".txt"
-    def get_text_metadata(self, document_id: str) -> dict:
+    def get_text_metadata(self, document_id: str, site_id: str = None) -> dict:
+        if not document_id:
+            raise ValueError("document_id cannot be None or an empty string")
+        text_id = self.create_text_result_id(document_id, site_id)
+        return self.get_result_metadata(document_id, text_id, site_id)
+
+    # This method gets the metadata (and tags if available) from the compact form of the OCR'd text
+    def get_compact_metadata(self, document_id: str, site_id: str = None) -> dict:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
-        text_id = self.create_text_result_id(document_id)
-        return self.get_result_metadata(document_id, text_id)
+        return self.get_result_metadata(document_id, self.create_compact_result_id(document_id, site_id), site_id)
 
     # This method gets the metadata (and tags if available) from the OCR'd text or JSON
-    def get_result_metadata(self, document_id: str, result_id: str) -> dict:
+    @coalesced("get_result_metadata")
+    def get_result_metadata(self, document_id: str, result_id: str, site_id: str = None) -> dict:
         if not document_id:
             raise ValueError("document_id cannot be None or an empty string")
         try:
@@ -523,7 +1748,7 @@ class CiesOcrCore:
             else:
                 logger.warning(f"ClientError getting metadata for {cx}")
                 raise
-        logger.debug(f"get_result_metadata metadata={metadata_response}")
+        logger.debug("get_result_metadata metadata=%s", payload(metadata_response))
         metadata = metadata_response['Metadata']
         response_metadata = metadata_response['ResponseMetadata']
         response_metadata_headers = response_metadata['HTTPHeaders']
@@ -532,7 +1757,7 @@ class CiesOcrCore:
             # get the tags from the source document metadata
             tags_response = s3.get_object_tagging(
                 Bucket= self.source_bucket,
-                Key=document_id,
+                Key=self.create_source_key(document_id, site_id),
             )
         except ClientError as cx:
             if cx.response['Error']['Code'] == '404':
@@ -541,7 +1766,7 @@ class CiesOcrCore:
             else:
                 logger.warning(f"ClientError getting metadata for source {cx}")
                 raise
-        logger.debug(f"get_result_metadata tags_response={tags_response}")
+        logger.debug("get_result_metadata tags_response=%s", payload(tags_response))
 
         result = {}
         if "Date" in response_metadata_headers:
@@ -552,6 +1777,12 @@ class CiesOcrCore:
             result["Content-Length"] = response_metadata_headers["Content-Length"]
         if "Content-Type" in response_metadata_headers:
             result["Content-Type"] = response_metadata_headers["Content-Type"] 
+        # the version of the result, a read of the result from the local cache is validated against it
+        if "ETag" in metadata_response:
+            result["ETag"] = metadata_response["ETag"]
+        # botocore lower cases the HTTP headers, the size of the result decides whether it is returned inline
+        if "Content-Length" not in result and "ContentLength" in metadata_response:
+            result["Content-Length"] = str(metadata_response["ContentLength"])
 
         # Documents may not have the file_name, site_id or user_id specified when the original document
         # was dropped directly into the source bucket
@@ -565,9 +1796,9 @@ class CiesOcrCore:
             result[METADATA_KEY_USER_ID] = metadata[METADATA_KEY_USER_ID]
 
         # add the tags that exist
-        logger.debug(f"get_result_metadata tags={tags_response}")
+        logger.debug("get_result_metadata tags=%s", payload(tags_response))
         tag_set = tags_response['TagSet']
-        logger.debug(f"get_result_metadata tag_set={tag_set}")
+        logger.debug("get_result_metadata tag_set=%s", payload(tag_set))
 
         status_element = next((item for item in tag_set if item['Key'] == TAG_KEY_STATUS), None)
         status = status_element['Value'] if status_element else None
@@ -579,7 +1810,7 @@ class CiesOcrCore:
         if job_id:
             result[TAG_JOB_ID] = job_id
 
-        logger.debug(f"get_result_metadata result={result}")
+        logger.debug("get_result_metadata result=%s", payload(result))
         return result
 
     # ==================================================================================================================
@@ -588,10 +1819,10 @@ class CiesOcrCore:
 
     # gets the HTTP headers from an Event and returns a Map from header key to value, where the header keys are converted to uppercase
     def get_headers(self, event) -> map:
-        headers = event.get("headers")
-        logger.debug(f"headers={headers}")
+        headers = event.get("headers") or {}
+        logger.debug("headers=%s", payload(headers))
         newHeaders = {k.upper():v for k,v in headers.items()}
-        logger.debug(f"newHeaders={newHeaders}")
+        logger.debug("newHeaders=%s", payload(newHeaders))
         return newHeaders;
 
     # Get the value of a secret from AWS Secrets Manager
@@ -645,6 +1876,8 @@ class CiesOcrCore:
                 'mime-type': self.get_mime_type(file_name)
             }
         )
+            # the document_id is the key of a result, a read of its metadata in flight may have missed it
+            self.single_flight_group.forget(document_id)
         except Exception as e:
             logger.error(f"Error saving {document_id} to destination {self.destination_bucket}: {e}")
             raise e
@@ -665,37 +1898,40 @@ class CiesOcrCore:
     #         },
     #     ]
     # }
-    def update_tag_in_S3(self, document_id : str, new_tag_values: list):
-        logger.debug(f"updating document tag: {document_id}, new_tag_values {new_tag_values}")
+    def update_tag_in_S3(self, document_id : str, new_tag_values: list, site_id: str = None):
+        logger.debug("updating document tag: %s, new_tag_values %s", document_id, payload(new_tag_values))
+        source_key = self.create_source_key(document_id, site_id)
         if new_tag_values:
             try:
                 get_tagging_response = s3.get_object_tagging(
                     Bucket= self.source_bucket,
-                    Key=document_id,
+                    Key=source_key,
                 )
                 tag_set = get_tagging_response['TagSet']
                 # tag_set is a list of dictionaries, each dictionary contains a 'Key' and 'Value'
-                logger.debug(f"tag_set={tag_set} is a {type(tag_set)}")
+                logger.debug("tag_set=%s", payload(tag_set))
             except Exception as e:
                 logger.error(f"Error retrieving document tags: {e}")
                 raise
 
             try:
                 updated_tag_set = self.update_tag_set(tag_set, new_tag_values)
-                logger.debug(f"updated_tag_set={updated_tag_set} is a {type(updated_tag_set)}")
+                logger.debug("updated_tag_set=%s", payload(updated_tag_set))
 
                 s3.put_object_tagging(
                     Bucket=self.source_bucket,
-                    Key=document_id,
+                    Key=source_key,
                     Tagging={
                         'TagSet': updated_tag_set
                     }
                 )
+                # a read in flight may have read the previous tags
+                self.single_flight_group.forget(document_id)
             except Exception as e:
                 logger.error(f"Error updating document tags: {e}")
 
     def update_tag_set(self, tag_set: list, new_tag_values: list) -> list :
-        logger.debug(f"update_tag_set({tag_set}, {new_tag_values})")
+        logger.debug("update_tag_set(%s, %s)", payload(tag_set), payload(new_tag_values))
 
         for tag in new_tag_values:
             key = tag['Key']
@@ -704,12 +1940,12 @@ class CiesOcrCore:
             logger.debug(f"key={key}, value={value}")
             tag_set = self.update_tag(tag_set, key, value)
 
-        logger.debug(f"update_tag_set, updated_tag_set={tag_set}")
+        logger.debug("update_tag_set, updated_tag_set=%s", payload(tag_set))
         return tag_set
 
     # Update or add one tag into a TagSet
     def update_tag(self, tag_set: list, tag_key_to_modify, new_tag_value):
-        logger.debug(f"update_tag({tag_set}, {tag_key_to_modify}, {new_tag_value})")
+        logger.debug("update_tag(%s, %s, %s)", payload(tag_set), tag_key_to_modify, new_tag_value)
 
         modified_tag_set = []
         tag_modified = False
@@ -723,7 +1959,7 @@ class CiesOcrCore:
         if not tag_modified:
             modified_tag_set.append({'Key': tag_key_to_modify, 'Value': new_tag_value})
 
-        logger.debug(f"update_tag, modified_tag_set={modified_tag_set}")
+        logger.debug("update_tag, modified_tag_set=%s", payload(modified_tag_set))
 
         return modified_tag_set
 
@@ -757,34 +1993,64 @@ class CiesOcrCore:
         else:
             return mime_type
     
-    def create_text_result_id(self, document_id : str) -> str:
+    # The keys of a document and its results follow the key layout, see key_layout.py
+    def create_source_key(self, document_id : str, site_id : str = None) -> str:
+        if document_id:
+            return self.layout.source_key(document_id, site_id)
+        else:
+            raise ValueError("document_id cannot be None")
+
+    # Returns the (site_id, document_id) of a source key, e.g. the key of an S3 event or a Textract notification
+    def parse_source_key(self, source_key : str) -> tuple:
+        return self.layout.parse_source_key(source_key)
+
+    # The site_id of the document of a Textract notification, from the key of the object that was analysed
+    def get_notification_site_id(self, message : dict) -> str:
+        source_key = (message.get("DocumentLocation") or {}).get("S3ObjectName")
+        if not source_key:
+            return None
+        # a revision analyses the partial PDF written next to the document, see page_fingerprints.py
+        source_key = source_key.removeprefix(page_fingerprints.PARTIAL_PREFIX)
+        try:
+            return self.parse_source_key(source_key)[0]
+        except ValueError as e:
+            logger.warning(f"{e}, completing job {message.get('JobId')} without a site_id")
+            return None
+
+    def create_text_result_id(self, document_id : str, site_id : str = None) -> str:
         if document_id:
-            return f"{document_id}.txt"
+            return self.layout.result_key(document_id, ".txt", site_id)
         else:
             raise ValueError("document_id cannot be None")
 
-    def create_json_result_id(self, document_id : str) -> str:
+    def create_json_result_id(self, document_id : str, site_id : str = None) -> str:
         if document_id:
-            return f"{document_id}.json"
+            return self.layout.result_key(document_id, ".json", site_id)
+        else:
+            raise ValueError("document_id cannot be None")
+
+    def create_compact_result_id(self, document_id : str, site_id : str = None) -> str:
+        if document_id:
+            return self.layout.result_key(document_id, ".compact.json", site_id)
+        else:
+            raise ValueError("document_id cannot be None")
+
+    def create_region_result_id(self, document_id : str, site_id : str = None) -> str:
+        if document_id:
+            return self.layout.result_key(document_id, region_index.REGION_SUFFIX, site_id)
         else:
             raise ValueError("document_id cannot be None")
 
     def get_document_id_from_result_id(self, result_id : str) -> str:
         if result_id:
-            return result_id.rsplit('.', 1)[0]
+            return self.layout.parse_result_key(result_id)[1]
 
         else:
             raise ValueError("result_id cannot be None")
         
     def log_response_json(self, prefix: str, response_json, max_length: int):
-        try:
-            json_text = str(response_json)
-            if len(json_text) > max_length:
-                logger.debug(f"{prefix}: {json_text[:max_length]}...")
-            else:
-                logger.debug(f"{prefix}: {json_text}")
-        except Exception as e:
-            logger.error(f"Error logging responseJson: {e}")
+        # the response is only rendered, and then only its first max_length characters, when DEBUG is enabled
+        logger.debug("%s: %s", prefix, payload(response_json, max_length))
 
 # Notes
     # except ClientError as cx:
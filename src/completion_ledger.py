@@ -0,0 +1,76 @@
+# This module defines the completion ledger, which makes the processing of a Textract completion take
+# effect once even though SNS delivers notifications at least once.
+# There is one ledger record per Textract job in the destination bucket:
+#   ledger/<job_id>.json
+# A notification claims the job by creating the record with a conditional put (If-None-Match: *), so of
+# any number of duplicate or concurrent notifications exactly one creates it; the others find the record
+# and stop after that one request. The claim is a lease: a record that is still 'processing' after its
+# lease expired belongs to an owner that died part way through, it is taken over with a conditional put
+# on the ETag of the record (If-Match), so only one of several notifications recovers it. A completion
+# which fails marks its record 'failed', which allows the redelivered notification to claim it again.
+
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+LEDGER_PREFIX = "ledger/"
+
+STATE_PROCESSING = "processing"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+# ====================================================================================================
+# Ledger records
+# ====================================================================================================
+def create_ledger_key(job_id: str) -> str:
+    return f"{LEDGER_PREFIX}{job_id}.json"
+
+
+def create_owner_id() -> str:
+    return uuid.uuid4().hex
+
+
+def build_claim(document_id: str, job_id: str, owner: str, lease_seconds: int, now: datetime = None) -> dict:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return {
+        "job_id": job_id,
+        "document_id": document_id,
+        "state": STATE_PROCESSING,
+        "owner": owner,
+        "claimed_at": now.isoformat(),
+        "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+    }
+
+
+def build_outcome(claim: dict, state: str, status: str, now: datetime = None) -> dict:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    record = dict(claim)
+    record["state"] = state
+    record["status"] = status
+    record["finished_at"] = now.isoformat()
+    return record
+
+
+# Whether a record which already exists may be claimed
+def is_claimable(record: dict, now: datetime = None) -> bool:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    if record.get("state") == STATE_FAILED:
+        return True
+    if record.get("state") == STATE_PROCESSING:
+        return datetime.fromisoformat(record["lease_expires_at"]) <= now
+    return False
+
+
+def dumps(record: dict) -> bytes:
+    return json.dumps(record).encode("utf-8")
+
+
+def loads(body: bytes) -> dict:
+    return json.loads(body)
@@ -6,7 +6,12 @@ from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.logging import correlation_paths
 
 from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+from logging_policy import payload
 import http_response
+import overload
+import priority_lanes
 
 from cies_ocr_core import METADATA_KEY_FILE_NAME
 from cies_ocr_core import METADATA_KEY_USER_ID
@@ -17,7 +22,7 @@ from cies_ocr_core import TAG_JOB_ID
 
 tracer = Tracer()
 logger = Logger()
-logger.setLevel('DEBUG')
+logging_policy.configure(logger)
 metrics = Metrics(namespace="SpiTestApp", service="APP")
 
 s3 = boto3.client('s3')
@@ -32,82 +37,108 @@ cies_ocr_core = CiesOcrCore(
     os.getenv("AWS_REGION"))
 
 @tracer.capture_lambda_handler
-@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=True)
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
 @metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("document_handler")
 def lambda_handler(event, context) -> dict:
-    logger.info(f"OCR API - Inside OCR lambda: event {event} context {context}")
+    logger.debug("OCR API - Inside OCR lambda: event %s context %s", payload(event), context)
 
     try:
-        method = event.get("httpMethod")
-        document_id = cies_ocr_core.return_last_path_element(event.get("path"))
-
-        logger.debug(f"httpMethod={method}, document_id={document_id}")
-
-        headers = cies_ocr_core.get_headers(event)
-        user_id = headers.get('USERID') if "USERID" in headers else "unknown"
-        site_id = headers.get('SITEID') if "SITEID" in headers else "unknown"
+        # the request is shed, with a Retry-After, when the instance, S3 or the submission lane is overloaded, see overload.py,
+        # or when the site is over its quota, see site_usage.py
+        with cies_ocr_core.overload_guard.admit():
+            return get_document_response(event)
+    except overload.Overloaded as e:
+        return http_response.format_overloaded_response(e)
+    except Exception as e:
+        raise e
 
-        match method:
-            case "HEAD":
-                document_metadata = cies_ocr_core.get_document_metadata(document_id)
-                if document_metadata is None:
-                    result = http_response.format_404_response(document_id)
-                else:
-                    result = http_response.format_200_head_response(document_metadata)
 
-            case "GET":
-                document_metadata = cies_ocr_core.get_document_metadata(document_id)
-                if document_metadata is None:
-                    result = http_response.format_404_response(document_id)
+# Returns the response to a request for a document
+def get_document_response(event) -> dict:
+    method = event.get("httpMethod")
+    document_id = cies_ocr_core.return_last_path_element(event.get("path"))
+
+    logger.debug(f"httpMethod={method}, document_id={document_id}")
+
+    headers = cies_ocr_core.get_headers(event)
+    user_id = headers.get('USERID') if "USERID" in headers else "unknown"
+    site_id = headers.get('SITEID') if "SITEID" in headers else "unknown"
+    # the 'Priority' header, "interactive" or "bulk", picks the lane the document is submitted in
+    priority = headers.get('PRIORITY')
+
+    match method:
+        case "HEAD":
+            document_metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+            if document_metadata is None:
+                result = http_response.format_404_response(document_id)
+            else:
+                result = http_response.format_200_head_response(document_metadata)
+
+        case "GET":
+            document_metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+            if document_metadata is None:
+                result = http_response.format_404_response(document_id)
+            else:
+                # the stored_document result is the document body, metadata plus a bunch of other stuff
+                stored_document = cies_ocr_core.get_document_from_source_bucket(user_id, site_id, document_id)
+                body = stored_document['Body'].read()
+                body_base64 = str(base64.b64encode(body))
+                result = http_response.format_200_response(document_metadata, body_base64)
+
+        case "POST":
+            logger.info(f"lambda_handler POST {document_id}")
+            document_metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+            if document_metadata is None:
+                file_name = headers.get(METADATA_KEY_FILE_NAME) if METADATA_KEY_FILE_NAME in headers else document_id
+                base64_encoded = event.get("isBase64Encoded") if "isBase64Encoded" in event else False
+                content_type = headers.get("CONTENT-TYPE") if "CONTENT-TYPE" in headers else "text/plain"
+
+                logger.debug(f"base64_encoded={base64_encoded}, file_name={file_name},content_type={content_type}")
+                if base64_encoded:
+                    body = base64.b64decode(event['body'])
                 else:
-                    # the stored_document result is the document body, metadata plus a bunch of other stuff
-                    stored_document = cies_ocr_core.get_document_from_source_bucket(user_id, site_id, document_id)
-                    body = stored_document['Body'].read()
-                    body_base64 = str(base64.b64encode(body))
-                    result = http_response.format_200_response(document_metadata, body_base64)
-
-            case "POST":
-                logger.info(f"lambda_handler POST {document_id}")
-                document_metadata = cies_ocr_core.get_document_metadata(document_id)
-                if document_metadata is None:
-                    file_name = headers.get(METADATA_KEY_FILE_NAME) if METADATA_KEY_FILE_NAME in headers else document_id
-                    base64_encoded = event.get("isBase64Encoded") if "isBase64Encoded" in event else False
-                    content_type = headers.get("CONTENT-TYPE") if "CONTENT-TYPE" in headers else "text/plain"
-
-                    logger.debug(f"base64_encoded={base64_encoded}, file_name={file_name},content_type={content_type}")
-                    if base64_encoded:
-                        body = base64.b64decode(event['body'])
-                    else:
-                        body = event['body']
-                    logger.debug(f"body={body[:128]}")
-                    cies_ocr_core.save_document_to_source_bucket(user_id, site_id, document_id, file_name, content_type, "New", body)
-                    result = http_response.format_202_response(document_id)
+                    body = event['body']
+                logger.debug(f"body={body[:128]}")
+                check_backlog(priority)
+                cies_ocr_core.check_site_quota(site_id)
+                cies_ocr_core.save_document_to_source_bucket(user_id, site_id, document_id, file_name, content_type, "New", body, priority)
+                result = http_response.format_202_response(document_id)
+            else:
+                result = http_response.format_409_response(document_id)
+
+        case "PUT":
+            logger.info(f"lambda_handler PUT {document_id}")
+            document_metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+            if document_metadata is None:
+                result = http_response.format_404_response(document_id)
+            else:
+                file_name = headers.get("FILENAME") if "FILENAME" in headers else document_id
+                content_type = headers.get("CONTENT-TYPE") if "CONTENT-TYPE" in headers else "text/plain"
+                base64_encoded = event.get("isBase64Encoded") if "isBase64Encoded" in event else False
+
+                logger.debug(f"base64_encoded={base64_encoded}")
+                if base64_encoded:
+                    body = base64.b64decode(event['body'])
                 else:
-                    result = http_response.format_409_response(document_id)
-
-            case "PUT":
-                logger.info(f"lambda_handler PUT {document_id}")
-                document_metadata = cies_ocr_core.get_document_metadata(document_id)
-                if document_metadata is None:
-                    result = http_response.format_404_response(document_id)
-                else:
-                    file_name = headers.get("FILENAME") if "FILENAME" in headers else document_id
-                    content_type = headers.get("CONTENT-TYPE") if "CONTENT-TYPE" in headers else "text/plain"
-                    base64_encoded = event.get("isBase64Encoded") if "isBase64Encoded" in event else False
-
-                    logger.debug(f"base64_encoded={base64_encoded}")
-                    if base64_encoded:
-                        body = base64.b64decode(event['body'])
-                    else:
-                        body = event['body']
-                    logger.debug(f"body={body[:128]}")
-                    cies_ocr_core.save_document_to_source_bucket(user_id, site_id, document_id, file_name, content_type, "New", body)
-                    result = http_response.format_202_response(document_id)
-                    
-        logger.debug(f"result={result}")   
-        return result
-    except Exception as e:
-        raise e
+                    body = event['body']
+                logger.debug(f"body={body[:128]}")
+                check_backlog(priority)
+                cies_ocr_core.check_site_quota(site_id)
+                cies_ocr_core.save_document_to_source_bucket(user_id, site_id, document_id, file_name, content_type, "New", body, priority)
+                result = http_response.format_202_response(document_id)
+                
+    logger.debug("result=%s", payload(result))
+    return result
+
+
+# Raises overload.Overloaded when the lane a new document would be submitted in has too many documents waiting
+def check_backlog(priority: str):
+    if cies_ocr_core.overload_guard.max_backlog <= 0:
+        return
+    lane = priority_lanes.lane_of(priority)
+    cies_ocr_core.overload_guard.check_backlog(cies_ocr_core.get_submission_backlog(lane), lane)
 
 # ============================================================================================================================================
 # The request, from an Application Load Balancer looks something like the following.
@@ -92,13 +92,57 @@ def format_409_response(document_id : str):
 
     return result
 
+# The document was received but cannot be processed, e.g. it was rejected by the pre-flight checks
+def format_422_response(document_id : str, reason : str):
+    result = {}
+
+    result["statusCode"] = 422
+    result["statusDescription"] = "422 Unprocessable Entity"
+    result["headers"] = {"ocr-reject-reason": reason}
+    result["body"] = f"Document {document_id} was rejected: {reason}"
+
+    return result
+
+# The request was shed, the client should retry after retry_after seconds, see overload.py
+def format_429_response(retry_after : int, err_msg : str):
+    result = {}
+
+    result["statusCode"] = 429
+    result["statusDescription"] = "429 Too Many Requests"
+    result["headers"] = {"Retry-After": str(retry_after)}
+
+    if err_msg:
+        result["body"] = err_msg
+
+    return result
+
 def format_500_response(err_msg : str):
     result = {}
 
     result["statusCode"] = 500
     result["statusDescription"] = "500 Internal Server Error"
 
+    if err_msg:
+        # the body must be a string, the ALB rejects any other type
+        result["body"] = str(err_msg)
+
+    return result
+
+# The service is throttled by S3 or Textract, the client should retry after retry_after seconds, see overload.py
+def format_503_response(retry_after : int, err_msg : str):
+    result = {}
+
+    result["statusCode"] = 503
+    result["statusDescription"] = "503 Service Unavailable"
+    result["headers"] = {"Retry-After": str(retry_after)}
+
     if err_msg:
         result["body"] = err_msg
 
     return result
+
+# The response of a request shed by the overload guard, a 429 or a 503
+def format_overloaded_response(e):
+    if e.status_code == 503:
+        return format_503_response(e.retry_after, str(e))
+    return format_429_response(e.retry_after, str(e))
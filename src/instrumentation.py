@@ -0,0 +1,210 @@
+# This module records custom metrics and trace subsegments for the OCR pipeline.
+#
+# Every AWS call made through an instrumented boto3 client (see instrument_client) is timed using the
+# botocore event hooks, so calls made inside libraries (e.g. the GetDocumentAnalysis paging done by
+# textractcaller.get_full_json) are included. The calls are aggregated in-process per (stage, operation)
+# and written as CloudWatch Embedded Metric Format (EMF) records when the handler completes, one record
+# per (stage, operation) with the dimensions environment (the deployment stage), handler, stage and operation:
+#   Calls, Errors       count of calls and of failed calls
+#   Latency             milliseconds, one value per call
+#   Bytes               request body bytes sent plus response body bytes received
+#
+# The stage is the pipeline stage that made the call, e.g. "submit", "complete", "get_text". Stages are
+# marked with the traced_stage decorator, which also opens a tracer subsegment for the stage.
+# Per-document gauges (pages, Textract result pages, artifact sizes) are written with document_metrics.
+
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from aws_lambda_powertools import Logger, Tracer
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+METRICS_NAMESPACE = os.getenv('POWERTOOLS_METRICS_NAMESPACE', "SpiTestApp")
+METRICS_SERVICE = "APP"
+DEFAULT_STAGE = "unstaged"
+ENVIRONMENT = os.getenv('STAGE', "local")
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+tracer = Tracer()
+logger = Logger()
+
+_current_stage = ContextVar("cies_stage", default=DEFAULT_STAGE)
+_handler_name = os.getenv('AWS_LAMBDA_FUNCTION_NAME', "local")
+_lock = threading.Lock()
+# (stage, operation) -> {"calls": n, "errors": n, "bytes": n, "latency": [ms, ...]}
+_aggregates = {}
+# operation -> count of calls made by the thread, used for per-document deltas. The documents of a batch are
+# completed in a pool, a process wide count would include the calls of the others.
+_operation_totals = threading.local()
+# the callbacks which write other metrics when the handler completes, see on_flush
+_flushers = []
+
+
+# ====================================================================================================
+# Handler and stage context
+# ====================================================================================================
+# Decorates a Lambda handler so that the aggregated AWS call metrics are written when it completes
+def instrumented_handler(handler_name: str):
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            global _handler_name
+            _handler_name = handler_name
+            try:
+                return lambda_handler(event, context)
+            finally:
+                flush_metrics()
+                for flusher in list(_flushers):
+                    flusher()
+        return wrapper
+    return decorator
+
+
+# Decorates a method as a pipeline stage, AWS calls made while it runs are attributed to the stage
+# and the method is traced as a subsegment. The (possibly large) return value is not captured in the trace.
+def traced_stage(stage: str):
+    def decorator(method):
+        traced = tracer.capture_method(method, capture_response=False)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            token = _current_stage.set(stage)
+            try:
+                return traced(*args, **kwargs)
+            finally:
+                _current_stage.reset(token)
+        return wrapper
+    return decorator
+
+
+def current_stage() -> str:
+    return _current_stage.get()
+
+
+def handler_name() -> str:
+    return _handler_name
+
+
+# Registers a callback which writes its metrics when an instrumented handler completes, e.g. the single flight counters
+def on_flush(flusher):
+    if flusher not in _flushers:
+        _flushers.append(flusher)
+
+
+# ====================================================================================================
+# AWS client instrumentation
+# ====================================================================================================
+# Registers the timing hooks on a boto3 client, returns the client
+def instrument_client(client):
+    events = client.meta.events
+    # before-parameter-build is the first event of a call which carries the per-call context
+    events.register("before-parameter-build", _before_call, unique_id="cies-instrumentation-before-call")
+    events.register("after-call", _after_call, unique_id="cies-instrumentation-after-call")
+    events.register("after-call-error", _after_call_error, unique_id="cies-instrumentation-after-call-error")
+    return client
+
+
+def _before_call(model=None, params=None, context=None, **kwargs):
+    if context is None:
+        return
+    context["cies_start"] = time.perf_counter()
+    context["cies_stage"] = _current_stage.get()
+    context["cies_request_bytes"] = _body_length(params.get("Body") if params else None)
+
+
+def _after_call(http_response=None, parsed=None, model=None, context=None, **kwargs):
+    if context is None or "cies_start" not in context:
+        return
+    failed = http_response is not None and http_response.status_code >= 300
+    # the body of a streaming response (e.g. get_object) must not be read here, so the header is used
+    response_bytes = 0
+    if http_response is not None:
+        response_bytes = int(http_response.headers.get("content-length") or 0)
+    _record(model, context, failed, context.get("cies_request_bytes", 0) + response_bytes)
+
+
+def _after_call_error(model=None, context=None, exception=None, **kwargs):
+    if context is None or "cies_start" not in context:
+        return
+    _record(model, context, True, context.get("cies_request_bytes", 0))
+
+
+def _record(model, context, failed: bool, byte_count: int):
+    latency = (time.perf_counter() - context["cies_start"]) * 1000.0
+    operation = f"{model.service_model.service_id.hyphenize()}.{model.name}" if model is not None else "unknown"
+    with _lock:
+        aggregate = _aggregates.get((context["cies_stage"], operation))
+        if aggregate is None:
+            aggregate = _aggregates[(context["cies_stage"], operation)] = {"calls": 0, "errors": 0, "bytes": 0, "latency": []}
+        aggregate["calls"] += 1
+        aggregate["errors"] += 1 if failed else 0
+        aggregate["bytes"] += byte_count
+        aggregate["latency"].append(latency)
+    # botocore calls the handlers in the thread which made the call
+    totals = _operation_totals.__dict__.setdefault("counts", {})
+    totals[operation] = totals.get(operation, 0) + 1
+
+
+def _body_length(body) -> int:
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    # botocore wraps a bytes body in a file like object, the length of a seekable body is found without reading it
+    try:
+        position = body.tell()
+        length = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return length
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+# The number of calls of an operation (e.g. "textract.GetDocumentAnalysis") made by the current thread
+def operation_total(operation: str) -> int:
+    return getattr(_operation_totals, "counts", {}).get(operation, 0)
+
+
+# ====================================================================================================
+# Writing metrics
+# ====================================================================================================
+# Writes one EMF record per (stage, operation) and clears the aggregates
+def flush_metrics():
+    with _lock:
+        aggregates = dict(_aggregates)
+        _aggregates.clear()
+    for (stage, operation), aggregate in aggregates.items():
+        try:
+            emf = EphemeralMetrics(namespace=METRICS_NAMESPACE, service=METRICS_SERVICE)
+            emf.add_dimensions(environment=ENVIRONMENT, handler=_handler_name, stage=stage, operation=operation)
+            emf.add_metric(name="Calls", unit=MetricUnit.Count, value=aggregate["calls"])
+            emf.add_metric(name="Errors", unit=MetricUnit.Count, value=aggregate["errors"])
+            emf.add_metric(name="Bytes", unit=MetricUnit.Bytes, value=aggregate["bytes"])
+            for latency in aggregate["latency"]:
+                emf.add_metric(name="Latency", unit=MetricUnit.Milliseconds, value=latency)
+            emf.flush_metrics()
+        except Exception as e:
+            logger.warning(f"Error writing metrics for {stage} {operation}: {e}")
+
+
+# Writes the per-document gauges, e.g. document_metrics(document_id, Pages=3, TextBytes=1024).
+# Metric names ending in Bytes are recorded in bytes, all others as counts.
+def document_metrics(document_id: str, **gauges):
+    try:
+        emf = EphemeralMetrics(namespace=METRICS_NAMESPACE, service=METRICS_SERVICE)
+        emf.add_dimensions(environment=ENVIRONMENT, handler=_handler_name, stage=_current_stage.get())
+        emf.add_metadata(key="document_id", value=document_id)
+        for name, value in gauges.items():
+            if value is None:
+                continue
+            unit = MetricUnit.Bytes if name.endswith("Bytes") else MetricUnit.Count
+            emf.add_metric(name=f"Document{name}", unit=unit, value=value)
+        emf.flush_metrics()
+    except Exception as e:
+        logger.warning(f"Error writing document metrics for {document_id}: {e}")
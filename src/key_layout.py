@@ -0,0 +1,82 @@
+# This module defines how documents and their results are keyed in the source and destination buckets.
+# S3 scales its request rate per key prefix, so documents with sequential or time ordered ids, which share
+# their leading characters, all land on one partition and are throttled (503 SlowDown) during a backfill.
+# The layouts are:
+#   flat    <document_id>                             the original layout, every document at the bucket root
+#   hashed  <hash>/<document_id>                      spreads the documents over 16^KEY_HASH_PREFIX_LENGTH prefixes
+#   site    site_id=<site_id>/<hash>/<document_id>    as hashed, within a prefix per site
+# where <hash> is the first KEY_HASH_PREFIX_LENGTH hex characters of the SHA-256 of the document_id.
+# The results of a document are keyed the same way in the destination bucket, suffixed with .txt, .json,
+# .compact.json (see page_banner.py), .pages.json (see page_fingerprints.py) and .region.npz (see region_index.py).
+# The site layout needs the site_id of the document to locate it, a missing site_id is "unknown" as it is in
+# the document metadata. Existing objects are moved to another layout with scripts/migrate_key_layout.py.
+
+import hashlib
+import os
+from urllib.parse import quote, unquote
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+FLAT = "flat"
+HASHED = "hashed"
+SITE = "site"
+LAYOUTS = (FLAT, HASHED, SITE)
+
+KEY_LAYOUT = os.getenv('KEY_LAYOUT', FLAT)
+KEY_HASH_PREFIX_LENGTH = int(os.getenv('KEY_HASH_PREFIX_LENGTH', '4'))
+SITE_PREFIX = "site_id="
+UNKNOWN_SITE = "unknown"
+# The suffixes of the results of a document, the longest first, see parse_result_key
+RESULT_SUFFIXES = (".compact.json", ".pages.json", ".region.npz", ".json", ".txt")
+
+
+class KeyLayout:
+    def __init__(self, layout: str = KEY_LAYOUT, hash_prefix_length: int = KEY_HASH_PREFIX_LENGTH):
+        if layout not in LAYOUTS:
+            raise ValueError(f"unknown key layout {layout}, expected one of {', '.join(LAYOUTS)}")
+        self.layout = layout
+        self.hash_prefix_length = hash_prefix_length
+
+    def hash_prefix(self, document_id: str) -> str:
+        return hashlib.sha256(document_id.encode("utf-8")).hexdigest()[:self.hash_prefix_length]
+
+    # The key of a document in the source bucket
+    def source_key(self, document_id: str, site_id: str = None) -> str:
+        if not document_id:
+            raise ValueError("document_id cannot be None or an empty string")
+        match self.layout:
+            case "hashed":
+                return f"{self.hash_prefix(document_id)}/{document_id}"
+            case "site":
+                # a site id may hold any character, it is encoded to stay one path element
+                return f"{SITE_PREFIX}{quote(site_id or UNKNOWN_SITE, safe='')}/{self.hash_prefix(document_id)}/{document_id}"
+            case _:
+                return document_id
+
+    # The key of a result of a document in the destination bucket, e.g. the suffix ".txt"
+    def result_key(self, document_id: str, suffix: str, site_id: str = None) -> str:
+        return f"{self.source_key(document_id, site_id)}{suffix}"
+
+    # Returns the (site_id, document_id) of a source key, the site_id is None unless the layout holds it.
+    # Raises ValueError when the key does not follow the layout, e.g. an object which has not been migrated.
+    def parse_source_key(self, key: str) -> tuple:
+        if not key:
+            raise ValueError("key cannot be None or an empty string")
+        site_id = None
+        document_id = key
+        if self.layout == SITE:
+            if not key.startswith(SITE_PREFIX) or key.count("/") < 2:
+                raise ValueError(f"{key} does not follow the {self.layout} key layout")
+            site, document_id = key[len(SITE_PREFIX):].split("/", 1)
+            site_id = unquote(site)
+        if self.layout in (HASHED, SITE):
+            prefix, _, document_id = document_id.partition("/")
+            if not document_id or prefix != self.hash_prefix(document_id):
+                raise ValueError(f"{key} does not follow the {self.layout} key layout")
+        return site_id, document_id
+
+    # Returns the (site_id, document_id) of a result key
+    def parse_result_key(self, key: str) -> tuple:
+        suffix = next((suffix for suffix in RESULT_SUFFIXES if key.endswith(suffix)), None)
+        return self.parse_source_key(key[:-len(suffix)] if suffix else key.rsplit(".", 1)[0])
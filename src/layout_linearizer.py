@@ -0,0 +1,450 @@
+# This module linearizes a Textract LAYOUT response into per-page text.
+# It is a drop-in replacement for textractprettyprinter's get_text_from_layout_json and produces
+# identical output for the options used by CiesOcrCore. Rather than walking the nested dict Blocks
+# for every decision, the Blocks are loaded once into array-backed columns (type, page, geometry,
+# text and relationships as CSR index arrays) and the expensive parts of the linearization, the
+# figure containment test, the LAYOUT_TABLE to TABLE matching and the exclusion of headers, footers
+# and page numbers, are resolved with NumPy operations.
+
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from aws_lambda_powertools import Logger
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+# Block types are stored as small integer codes, any block type not listed here is BLOCK_OTHER
+BLOCK_OTHER = 0
+BLOCK_TYPE_CODES = {
+    "PAGE": 1,
+    "LINE": 2,
+    "WORD": 3,
+    "TABLE": 4,
+    "CELL": 5,
+    "MERGED_CELL": 6,
+    "SELECTION_ELEMENT": 7,
+    "LAYOUT_TITLE": 10,
+    "LAYOUT_HEADER": 11,
+    "LAYOUT_FOOTER": 12,
+    "LAYOUT_SECTION_HEADER": 13,
+    "LAYOUT_PAGE_NUMBER": 14,
+    "LAYOUT_LIST": 15,
+    "LAYOUT_FIGURE": 16,
+    "LAYOUT_TABLE": 17,
+    "LAYOUT_KEY_VALUE": 18,
+    "LAYOUT_TEXT": 19,
+}
+BLOCK_LINE = BLOCK_TYPE_CODES["LINE"]
+BLOCK_TABLE = BLOCK_TYPE_CODES["TABLE"]
+BLOCK_LAYOUT_TITLE = BLOCK_TYPE_CODES["LAYOUT_TITLE"]
+BLOCK_LAYOUT_HEADER = BLOCK_TYPE_CODES["LAYOUT_HEADER"]
+BLOCK_LAYOUT_FOOTER = BLOCK_TYPE_CODES["LAYOUT_FOOTER"]
+BLOCK_LAYOUT_SECTION_HEADER = BLOCK_TYPE_CODES["LAYOUT_SECTION_HEADER"]
+BLOCK_LAYOUT_PAGE_NUMBER = BLOCK_TYPE_CODES["LAYOUT_PAGE_NUMBER"]
+BLOCK_LAYOUT_FIGURE = BLOCK_TYPE_CODES["LAYOUT_FIGURE"]
+BLOCK_LAYOUT_TABLE = BLOCK_TYPE_CODES["LAYOUT_TABLE"]
+# Unknown LAYOUT_* types (Textract adds them from time to time) still behave as layout containers
+BLOCK_LAYOUT_UNKNOWN = 99
+
+# The tolerance used when matching a LAYOUT_TABLE bounding box to a TABLE bounding box
+TABLE_GEOMETRY_TOLERANCE = 0.1
+
+# Documents with fewer pages than this are linearized in-process, below this size the cost of starting
+# worker processes is larger than the time saved. A worker count of 0 means one worker per available CPU.
+PARALLEL_MIN_PAGES = int(os.getenv('LINEARIZE_PARALLEL_MIN_PAGES', '100'))
+PARALLEL_WORKERS = int(os.getenv('LINEARIZE_PARALLEL_WORKERS', '0'))
+# The seconds the workers are given to return their pages, after which the document is linearized in-process
+PARALLEL_TIMEOUT_SECONDS = float(os.getenv('LINEARIZE_PARALLEL_TIMEOUT_SECONDS', '60'))
+
+logger = Logger()
+
+
+# ====================================================================================================
+# Columnar representation of the Textract Blocks
+# ====================================================================================================
+# Every per-block attribute that the linearization needs is held in a NumPy array (or a list for the
+# strings) indexed by the position of the block in the Blocks list. Relationships are held in CSR
+# form: the ids of the first relationship of block i are first_rel_idx[first_rel_ptr[i]:first_rel_ptr[i+1]]
+# and the CHILD ids of a TABLE block are held the same way in table_child_ptr/table_child_idx.
+class BlockColumns:
+    def __init__(self, blocks: list):
+        count = len(blocks)
+        self.count = count
+        self.ids = [block["Id"] for block in blocks]
+        id_to_index = {block_id: index for index, block_id in enumerate(self.ids)}
+
+        block_type = np.zeros(count, dtype=np.int16)
+        page = np.ones(count, dtype=np.int32)
+        geometry = np.full((count, 4), np.nan, dtype=np.float64)
+        has_text = np.zeros(count, dtype=bool)
+        has_relationships = np.zeros(count, dtype=bool)
+        is_column_header = np.zeros(count, dtype=bool)
+        cell_position = np.zeros((count, 4), dtype=np.int32)
+        text = [""] * count
+
+        first_rel_counts = np.zeros(count, dtype=np.int64)
+        first_rel_ids = []
+        table_child_counts = np.zeros(count, dtype=np.int64)
+        table_child_ids = []
+
+        for index, block in enumerate(blocks):
+            type_name = block["BlockType"]
+            code = BLOCK_TYPE_CODES.get(type_name, BLOCK_OTHER)
+            if code == BLOCK_OTHER and type_name.startswith("LAYOUT"):
+                code = BLOCK_LAYOUT_UNKNOWN
+            block_type[index] = code
+            page[index] = block.get("Page", 1)
+
+            bounding_box = block.get("Geometry", {}).get("BoundingBox")
+            if bounding_box:
+                geometry[index] = (bounding_box["Left"], bounding_box["Top"], bounding_box["Width"], bounding_box["Height"])
+
+            if "Text" in block:
+                has_text[index] = True
+                text[index] = block["Text"]
+
+            if "RowIndex" in block:
+                cell_position[index] = (block["RowIndex"], block["ColumnIndex"], block.get("RowSpan", 1), block.get("ColumnSpan", 1))
+                is_column_header[index] = "COLUMN_HEADER" in block.get("EntityTypes", ())
+
+            relationships = block.get("Relationships")
+            if relationships is not None:
+                has_relationships[index] = True
+                if relationships:
+                    ids = relationships[0]["Ids"]
+                    first_rel_counts[index] = len(ids)
+                    first_rel_ids.extend(ids)
+                if code == BLOCK_TABLE:
+                    for relationship in relationships:
+                        if relationship["Type"] == "CHILD":
+                            table_child_counts[index] += len(relationship["Ids"])
+                            table_child_ids.extend(relationship["Ids"])
+
+        self.block_type = block_type
+        self.page = page
+        self.left = geometry[:, 0]
+        self.top = geometry[:, 1]
+        self.width = geometry[:, 2]
+        self.height = geometry[:, 3]
+        self.has_text = has_text
+        self.has_relationships = has_relationships
+        self.is_column_header = is_column_header
+        self.row_index = cell_position[:, 0]
+        self.column_index = cell_position[:, 1]
+        self.row_span = cell_position[:, 2]
+        self.column_span = cell_position[:, 3]
+        self.text = text
+
+        self.first_rel_ptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(first_rel_counts, out=self.first_rel_ptr[1:])
+        self.first_rel_idx = np.fromiter((id_to_index[x] for x in first_rel_ids), dtype=np.int64, count=len(first_rel_ids))
+
+        self.table_child_ptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(table_child_counts, out=self.table_child_ptr[1:])
+        self.table_child_idx = np.fromiter((id_to_index[x] for x in table_child_ids), dtype=np.int64, count=len(table_child_ids))
+
+        self.is_layout = block_type >= BLOCK_LAYOUT_TITLE
+
+    def first_relationship(self, index: int) -> np.ndarray:
+        return self.first_rel_idx[self.first_rel_ptr[index]:self.first_rel_ptr[index + 1]]
+
+    def table_children(self, index: int) -> np.ndarray:
+        return self.table_child_idx[self.table_child_ptr[index]:self.table_child_ptr[index + 1]]
+
+
+# ====================================================================================================
+# The linearization
+# ====================================================================================================
+# Returns a dict of page number to linearized text, e.g. {1: "Patient: DOE, JOHN\nMRN ...", 2: "..."}
+# The keyword arguments and their defaults match textractprettyprinter.get_text_from_layout_json,
+# save_txt_path is not supported.
+def get_text_from_layout_json(textract_json: dict,
+                              table_format: str = "grid",
+                              exclude_figure_text: bool = True,
+                              exclude_page_header: bool = False,
+                              exclude_page_footer: bool = False,
+                              exclude_page_number: bool = False,
+                              skip_table: bool = False,
+                              generate_markdown: bool = False) -> dict:
+    columns = BlockColumns(textract_json["Blocks"])
+    return linearize_columns(columns,
+                             table_format=table_format,
+                             exclude_figure_text=exclude_figure_text,
+                             exclude_page_header=exclude_page_header,
+                             exclude_page_footer=exclude_page_footer,
+                             exclude_page_number=exclude_page_number,
+                             skip_table=skip_table,
+                             generate_markdown=generate_markdown)
+
+
+def linearize_columns(columns: BlockColumns,
+                      table_format: str = "grid",
+                      exclude_figure_text: bool = True,
+                      exclude_page_header: bool = False,
+                      exclude_page_footer: bool = False,
+                      exclude_page_number: bool = False,
+                      skip_table: bool = False,
+                      generate_markdown: bool = False) -> dict:
+    block_type = columns.block_type
+    roots = np.flatnonzero(columns.is_layout)
+    if roots.size == 0:
+        logger.warning("No LAYOUT information found in Textract response, use the LAYOUT feature for optimum output")
+        return {}
+
+    # blocks that are dropped, along with their descendants, when they are reached
+    excluded_types = []
+    if exclude_page_header:
+        excluded_types.append(BLOCK_LAYOUT_HEADER)
+    if exclude_page_footer:
+        excluded_types.append(BLOCK_LAYOUT_FOOTER)
+    if exclude_page_number:
+        excluded_types.append(BLOCK_LAYOUT_PAGE_NUMBER)
+    skip = np.isin(block_type, excluded_types)
+
+    # the text each block contributes when it is reached, None when it contributes nothing
+    emitted = [None] * columns.count
+
+    lines = np.flatnonzero((block_type == BLOCK_LINE) & columns.has_text)
+    if exclude_figure_text:
+        lines = lines[~_inside_figures(columns, lines)]
+    for index in lines.tolist():
+        emitted[index] = columns.text[index]
+
+    titles = np.flatnonzero(np.isin(block_type, (BLOCK_LAYOUT_TITLE, BLOCK_LAYOUT_SECTION_HEADER)) & columns.has_relationships)
+    for index in titles.tolist():
+        combined_text = " ".join(columns.text[child] for child in columns.first_relationship(index).tolist())
+        if generate_markdown:
+            prefix = "# " if block_type[index] == BLOCK_LAYOUT_TITLE else "## "
+            combined_text = prefix + combined_text
+        emitted[index] = combined_text
+
+    # only layout containers are expanded, titles and section headers emit their lines' text instead
+    expand = columns.is_layout & ~np.isin(block_type, (BLOCK_LAYOUT_TITLE, BLOCK_LAYOUT_SECTION_HEADER))
+
+    if not skip_table:
+        layout_tables = np.flatnonzero(block_type == BLOCK_LAYOUT_TABLE)
+        for layout_table, table in zip(layout_tables.tolist(), _match_tables(columns, layout_tables).tolist()):
+            if table >= 0 and columns.has_relationships[table]:
+                emitted[layout_table] = _render_table(columns, table, "pipe" if generate_markdown else table_format)
+                expand[layout_table] = False
+            else:
+                logger.warning("LAYOUT_TABLE detected but TABLES feature was not provided in API call, including TABLES may improve the layout output")
+
+    # Each LAYOUT block is a root of a depth first walk, nested layout blocks (e.g. the LAYOUT_TEXT
+    # children of a LAYOUT_LIST) are both walked from their parent and as roots in their own right.
+    page_parts = {}
+    skip_list = skip.tolist()
+    expand_list = expand.tolist()
+    page_list = columns.page.tolist()
+    for root in roots.tolist():
+        texts = []
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            if skip_list[index]:
+                continue
+            if emitted[index] is not None:
+                texts.append(emitted[index])
+            if expand_list[index]:
+                stack.extend(columns.first_relationship(index)[::-1].tolist())
+        page_parts.setdefault(page_list[root], []).append("\n".join(texts) + "\n\n")
+
+    return {page: "".join(parts) for page, parts in page_parts.items()}
+
+
+# ====================================================================================================
+# Multi-core linearization
+# ====================================================================================================
+# Every Textract relationship used by the linearization (LAYOUT to LINE, TABLE to CELL to WORD, LAYOUT_LIST
+# to LAYOUT_TEXT) stays within a page, so the Blocks can be partitioned by page and each partition
+# linearized independently. Partitions are handed to worker processes, the per-page results are sent back
+# over a Pipe and reassembled in the original page order.
+# NOTE: Lambda does not provide /dev/shm, so multiprocessing.Pool and Queue (and ProcessPoolExecutor) do not
+# work there. Plain Process and Pipe do. With the 'fork' start method (the Linux default) the partitions are
+# inherited by the workers rather than pickled.
+# A forked worker has only the thread that forked it, a lock held by any other thread at the time (of the
+# logging, boto3 or the allocator) is never released in the worker. So the workers are only started when no
+# other thread is running, a document completed in a pool of threads (ocr_completion_queue_handler) is
+# linearized in-process.
+def get_text_from_layout_json_parallel(textract_json: dict, workers: int = None, min_pages: int = None,
+                                       timeout: float = None, **kwargs) -> dict:
+    if min_pages is None:
+        min_pages = PARALLEL_MIN_PAGES
+    if not workers:
+        workers = PARALLEL_WORKERS or available_cpu_count()
+    if timeout is None:
+        timeout = PARALLEL_TIMEOUT_SECONDS
+
+    page_order, page_blocks = partition_blocks_by_page(textract_json["Blocks"])
+    if workers < 2 or len(page_order) < max(min_pages, 2) or threading.active_count() > 1:
+        return get_text_from_layout_json(textract_json, **kwargs)
+
+    # round robin assignment spreads dense runs of pages over all of the workers
+    workers = min(workers, len(page_order))
+    assignments = [page_order[worker::workers] for worker in range(workers)]
+    logger.debug(f"linearizing {len(page_order)} pages with {workers} worker processes")
+
+    processes = []
+    connections = []
+    finished = False
+    try:
+        for pages in assignments:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_linearize_pages_worker,
+                args=(sender, [page_blocks[page] for page in pages], kwargs),
+                daemon=True)
+            process.start()
+            sender.close()
+            processes.append(process)
+            connections.append(receiver)
+
+        # results must be drained from the pipes before joining, a worker blocks until its result is read
+        page_texts = {}
+        pending = list(connections)
+        deadline = time.monotonic() + timeout
+        while pending:
+            ready = wait(pending, timeout=max(deadline - time.monotonic(), 0))
+            if not ready:
+                raise TimeoutError(f"{len(pending)} of {workers} workers did not finish in {timeout} seconds")
+            for connection in ready:
+                status, result = connection.recv()
+                if status != "ok":
+                    raise RuntimeError(f"linearization worker failed: {result}")
+                page_texts.update(result)
+                pending.remove(connection)
+        finished = True
+    except Exception as e:
+        logger.warning(f"parallel linearization failed, falling back to a single process: {e}")
+        return get_text_from_layout_json(textract_json, **kwargs)
+    finally:
+        for connection in connections:
+            connection.close()
+        for process in processes:
+            # the workers of a failed linearization may still be running, they are not waited for
+            if not finished:
+                process.terminate()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    return {page: page_texts[page] for page in page_order if page in page_texts}
+
+
+# Splits the Blocks into per-page lists, page_order holds the pages in the order that their first
+# LAYOUT block appears, which is the order of the keys in the result of get_text_from_layout_json.
+def partition_blocks_by_page(blocks: list) -> tuple:
+    page_order = []
+    page_blocks = {}
+    for block in blocks:
+        page = block.get("Page", 1)
+        page_list = page_blocks.get(page)
+        if page_list is None:
+            page_list = page_blocks[page] = []
+        page_list.append(block)
+    seen = set()
+    for block in blocks:
+        page = block.get("Page", 1)
+        if page not in seen and block["BlockType"].startswith("LAYOUT"):
+            seen.add(page)
+            page_order.append(page)
+    return page_order, page_blocks
+
+
+# The number of CPUs that the scheduler may run this process on (its CPU affinity), or the CPU count of the host
+# where affinity is not available. A CPU quota of the container (cgroup cpu.max) is not taken into account.
+def available_cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _linearize_pages_worker(connection, page_block_lists: list, kwargs: dict):
+    try:
+        result = {}
+        for blocks in page_block_lists:
+            result.update(linearize_columns(BlockColumns(blocks), **kwargs))
+        connection.send(("ok", result))
+    except Exception as e:
+        connection.send(("error", repr(e)))
+    finally:
+        connection.close()
+
+
+# ====================================================================================================
+# Internal 'helper' functions
+# ====================================================================================================
+
+# Returns a boolean array, parallel to line_indexes, which is True where the line is fully contained
+# in any LAYOUT_FIGURE on the same page. Containment is evaluated as a lines x figures matrix per page.
+def _inside_figures(columns: BlockColumns, line_indexes: np.ndarray) -> np.ndarray:
+    result = np.zeros(line_indexes.size, dtype=bool)
+    figures = np.flatnonzero(columns.block_type == BLOCK_LAYOUT_FIGURE)
+    if figures.size == 0 or line_indexes.size == 0:
+        return result
+
+    left, top = columns.left, columns.top
+    right, bottom = left + columns.width, top + columns.height
+    line_pages = columns.page[line_indexes]
+    for page in np.unique(columns.page[figures]).tolist():
+        on_page = np.flatnonzero(line_pages == page)
+        if on_page.size == 0:
+            continue
+        page_lines = line_indexes[on_page][:, None]
+        page_figures = figures[columns.page[figures] == page][None, :]
+        contained = ((left[page_lines] >= left[page_figures]) & (right[page_lines] <= right[page_figures]) &
+                     (top[page_lines] >= top[page_figures]) & (bottom[page_lines] <= bottom[page_figures]))
+        result[on_page] = contained.any(axis=1)
+    return result
+
+
+# Returns, for each LAYOUT_TABLE, the index of the first TABLE block (in Blocks order) on the same page
+# whose bounding box matches within TABLE_GEOMETRY_TOLERANCE, or -1 when there is no match.
+def _match_tables(columns: BlockColumns, layout_tables: np.ndarray) -> np.ndarray:
+    result = np.full(layout_tables.size, -1, dtype=np.int64)
+    tables = np.flatnonzero(columns.block_type == BLOCK_TABLE)
+    if tables.size == 0 or layout_tables.size == 0:
+        return result
+
+    geometry = np.stack((columns.width, columns.height, columns.left, columns.top), axis=1)
+    same_page = columns.page[layout_tables][:, None] == columns.page[tables][None, :]
+    close = np.abs(geometry[layout_tables][:, None, :] - geometry[tables][None, :, :]) <= TABLE_GEOMETRY_TOLERANCE
+    matches = same_page & close.all(axis=2)
+    matched = matches.any(axis=1)
+    result[matched] = tables[matches.argmax(axis=1)[matched]]
+    return result
+
+
+# Renders a TABLE block with tabulate, header cells (COLUMN_HEADER) become the tabulate headers
+def _render_table(columns: BlockColumns, table: int, table_format: str) -> str:
+    from tabulate import tabulate
+
+    table_content = {}
+    headers = {}
+    max_row = 0
+    max_col = 0
+    for cell in columns.table_children(table).tolist():
+        if not columns.has_relationships[cell]:
+            continue
+        cell_text = " ".join(columns.text[child] for child in columns.first_relationship(cell).tolist() if columns.has_text[child])
+        row_idx = int(columns.row_index[cell])
+        col_idx = int(columns.column_index[cell])
+        max_row = max(max_row, row_idx)
+        max_col = max(max_col, col_idx)
+        for r in range(int(columns.row_span[cell])):
+            for c in range(int(columns.column_span[cell])):
+                if columns.is_column_header[cell]:
+                    headers[col_idx + c] = cell_text
+                else:
+                    table_content[(row_idx + r, col_idx + c)] = cell_text
+
+    start_row = 2 if headers else 1
+    table_data = [[table_content.get((r, c), "") for c in range(1, max_col + 1)] for r in range(start_row, max_row + 1)]
+    header_list = [headers.get(c, "") for c in range(1, max_col + 1)]
+    return tabulate(table_data, headers=header_list, tablefmt=table_format)
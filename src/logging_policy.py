@@ -0,0 +1,111 @@
+# This module holds the logging policy of the handlers and of CiesOcrCore.
+#
+# Levels: the level of every logger comes from the LOG_LEVEL environment variable (the LogLevel template
+#   parameter, INFO by default) instead of being hard coded, see configure.
+# Payloads: events, tag sets, metadata and Textract results are logged through payload(), which is
+#   rendered only when the record is actually emitted and is capped at LOG_PAYLOAD_MAX_CHARS characters.
+#   Payloads must be passed as logging arguments, not formatted into an f-string, for the rendering to
+#   be lazy, e.g. logger.debug("responseJson=%s", payload(responseJson))
+# Sampling: LOG_DEBUG_SAMPLE_RATE (0.0 - 1.0) is the fraction of correlation ids (requests, documents)
+#   that are logged at DEBUG. The decision is a hash of the correlation id, so every invocation that
+#   handles the same document, e.g. submission and completion, is sampled the same way.
+# Events: LOG_EVENT controls whether inject_lambda_context logs the incoming event.
+
+import functools
+import logging
+import os
+import reprlib
+import zlib
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '1024'))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0'))
+LOG_EVENT = os.getenv('LOG_EVENT', 'false').lower() == 'true'
+
+# Bounds the work done to render a payload, a multi-MB Textract result is rendered as its first few
+# blocks rather than being converted to a string and then truncated
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxdict = 16
+_payload_repr.maxlist = 16
+_payload_repr.maxtuple = 16
+_payload_repr.maxstring = 256
+_payload_repr.maxother = 256
+
+
+# ====================================================================================================
+# Levels
+# ====================================================================================================
+# Sets the configured level, returns the logger
+def configure(logger):
+    logger.setLevel(LOG_LEVEL)
+    return logger
+
+
+# ====================================================================================================
+# Payloads
+# ====================================================================================================
+# Defers the rendering of a value until a log record containing it is emitted
+class _Payload:
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        if isinstance(self.value, str):
+            text = self.value
+        else:
+            try:
+                text = _payload_repr.repr(self.value)
+            except Exception as e:
+                text = f"<unprintable {type(self.value).__name__}: {e}>"
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...[{len(text) - self.max_chars} more characters]"
+        return text
+
+    __repr__ = __str__
+
+
+def payload(value, max_chars: int = None) -> _Payload:
+    return _Payload(value, LOG_PAYLOAD_MAX_CHARS if max_chars is None else max_chars)
+
+
+# ====================================================================================================
+# Debug sampling
+# ====================================================================================================
+def is_debug_sampled(correlation_id: str, sample_rate: float = None) -> bool:
+    if sample_rate is None:
+        sample_rate = LOG_DEBUG_SAMPLE_RATE
+    if not correlation_id or sample_rate <= 0:
+        return False
+    if sample_rate >= 1:
+        return True
+    return zlib.crc32(str(correlation_id).encode("utf-8")) < sample_rate * 0x100000000
+
+
+# Sets the level of the logger for work on behalf of the correlation id, DEBUG when the id is sampled
+# and the configured level otherwise. Also sets the correlation id of the logger.
+def sample_debug(logger, correlation_id: str):
+    logger.set_correlation_id(correlation_id)
+    logger.setLevel(logging.DEBUG if is_debug_sampled(correlation_id) else LOG_LEVEL)
+
+
+# Decorates a Lambda handler, below inject_lambda_context, so that the invocation is logged at DEBUG when
+# its correlation id (or, without one, the request id) is sampled. The configured level is restored after.
+def sampled_debug_logging(logger):
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            correlation_id = logger.get_correlation_id() or getattr(context, "aws_request_id", None)
+            logger.setLevel(logging.DEBUG if is_debug_sampled(correlation_id) else LOG_LEVEL)
+            try:
+                return lambda_handler(event, context)
+            finally:
+                logger.setLevel(LOG_LEVEL)
+        return wrapper
+    return decorator
@@ -0,0 +1,54 @@
+# This module holds the rules of an S3 multipart upload of a document, which is used for scans that are too large
+# to upload reliably in one request. The client initiates an upload, PUTs the parts (in parallel) to presigned
+# URLs, then completes it. S3 assembles the parts into the document, which raises the ObjectCreated event of the
+# source bucket, so the document is submitted to Textract exactly as if it had been POSTed.
+#   - Every part but the last must be at least 5 MiB, a part may be at most 5 GiB, an upload has at most 10000 parts
+#   - The parts already uploaded are listed by S3, which lets a client resume an upload after a failure
+
+import math
+import os
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+# The part size used unless the client asks for another one
+MULTIPART_PART_SIZE = int(os.getenv('MULTIPART_PART_SIZE', str(64 * 1024 * 1024)))
+# Bounds the number of part URLs in one response, so that the response stays below the 1MB ALB limit,
+# the URLs of the remaining parts are requested from the parts route
+MULTIPART_MAX_URLS = int(os.getenv('MULTIPART_MAX_URLS', '200'))
+
+
+# Returns the part size and the number of parts of an upload of size bytes. The requested part size is raised
+# when the document would otherwise need more than MAX_PARTS parts.
+def plan_parts(size: int, part_size: int = None) -> tuple:
+    if not isinstance(size, int) or size <= 0:
+        raise ValueError("size must be a positive number of bytes")
+    part_size = part_size or MULTIPART_PART_SIZE
+    part_size = max(MIN_PART_SIZE, part_size, math.ceil(size / MAX_PARTS))
+    if part_size > MAX_PART_SIZE:
+        raise ValueError(f"a document may be at most {MAX_PARTS * MAX_PART_SIZE} bytes")
+    return part_size, math.ceil(size / part_size)
+
+
+def validate_part_numbers(part_numbers: list) -> list:
+    if not isinstance(part_numbers, list) or not part_numbers:
+        raise ValueError("part_numbers must be a non empty list")
+    if len(part_numbers) > MULTIPART_MAX_URLS:
+        raise ValueError(f"at most {MULTIPART_MAX_URLS} part URLs may be requested at once")
+    for part_number in part_numbers:
+        if not isinstance(part_number, int) or not 1 <= part_number <= MAX_PARTS:
+            raise ValueError(f"part numbers must be between 1 and {MAX_PARTS}")
+    return sorted(set(part_numbers))
+
+
+# The parts as given to CompleteMultipartUpload, in ascending part number order
+def completed_parts(parts: list) -> list:
+    if not isinstance(parts, list) or not parts:
+        raise ValueError("parts must be a non empty list")
+    completed = {}
+    for part in parts:
+        completed[int(part["PartNumber"])] = part["ETag"]
+    return [{"PartNumber": part_number, "ETag": completed[part_number]} for part_number in sorted(completed)]
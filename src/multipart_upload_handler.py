@@ -0,0 +1,134 @@
+import base64
+import json
+import os
+from urllib.parse import unquote_plus
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.logging import correlation_paths
+from botocore.exceptions import ClientError
+
+from cies_ocr_core import CiesOcrCore
+import http_response
+import overload
+import instrumentation
+import logging_policy
+from logging_policy import payload
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# The S3 error codes which are caused by the request, rather than by the service
+CLIENT_ERROR_CODES = {"InvalidPart", "InvalidPartOrder", "EntityTooSmall", "InvalidArgument", "MalformedXML"}
+
+# ============================================================================================================
+# Multipart upload of a large document directly to S3, see multipart_upload.py
+#   POST   /uploads/<document_id>           {"size": <bytes>, "part_size": <bytes>, "file_name": ..., "content_type": ..., "priority": ...}
+#          initiates an upload, returns {"upload_id", "part_size", "part_count", "expires_in", "parts": [{"part_number", "url"}]}
+#   POST   /uploads/<document_id>/parts     {"upload_id": ..., "part_numbers": [...]}, presigns more (or expired) parts
+#   GET    /uploads/<document_id>?uploadId= lists the parts already uploaded, to resume an upload
+#   POST   /uploads/<document_id>/complete  {"upload_id": ..., "parts": [{"PartNumber", "ETag"}]}, the parts are optional
+#   DELETE /uploads/<document_id>?uploadId= aborts an upload
+# The parts are PUT to the URLs, and the ETag header of each response is the ETag of the part.
+# The 'Siteid' and 'Userid' headers are stored with the document, as for POST /document. The lane of the document
+# is the "priority" of the initiate request, or its 'Priority' header, see priority_lanes.py
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("multipart_upload_handler")
+def lambda_handler(event, context) -> dict:
+    logger.debug("OCR API - Inside multipart upload lambda: event %s context %s", payload(event), context)
+
+    method = event.get("httpMethod")
+    elements = [element for element in (event.get("path") or "").split("/") if element]
+    if len(elements) < 2 or elements[0] != "uploads" or len(elements) > 3:
+        return http_response.format_400_response("expected /uploads/<document_id>[/parts|/complete]")
+    document_id = elements[1]
+    action = elements[2] if len(elements) == 3 else None
+    parameters = event.get("queryStringParameters") or {}
+    site_id = cies_ocr_core.get_headers(event).get('SITEID', "unknown")
+
+    try:
+        match (method, action):
+            case ("POST", None):
+                return initiate(event, document_id, site_id)
+            case ("POST", "parts"):
+                body = get_json_body(event)
+                parts = cies_ocr_core.get_multipart_part_urls(document_id, body["upload_id"], body["part_numbers"], site_id=site_id)
+                return json_response({"document_id": document_id, "upload_id": body["upload_id"],
+                                      "expires_in": cies_ocr_core.multipart_url_expiration, "parts": parts})
+            case ("POST", "complete"):
+                body = get_json_body(event)
+                completed = cies_ocr_core.complete_multipart_upload(document_id, body["upload_id"], body.get("parts"), site_id)
+                return json_response(completed)
+            case ("GET", None):
+                upload_id = required_parameter(parameters, "uploadId")
+                parts = cies_ocr_core.list_multipart_parts(document_id, upload_id, site_id)
+                return json_response({"document_id": document_id, "upload_id": upload_id, "parts": parts})
+            case ("DELETE", None):
+                cies_ocr_core.abort_multipart_upload(document_id, required_parameter(parameters, "uploadId"), site_id)
+                return http_response.format_202_response(document_id)
+            case _:
+                return http_response.format_400_response(f"{method} is not supported on {event.get('path')}")
+    except overload.Overloaded as e:
+        return http_response.format_overloaded_response(e)
+    except (ValueError, KeyError, TypeError) as e:
+        return http_response.format_400_response(f"Invalid multipart upload request: {e}")
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code == "NoSuchUpload":
+            return http_response.format_404_response(document_id)
+        if code in CLIENT_ERROR_CODES:
+            return http_response.format_400_response(f"Invalid multipart upload request: {code}")
+        raise
+
+
+def initiate(event, document_id: str, site_id: str) -> dict:
+    # a document may not be re-created, as for POST /document
+    if cies_ocr_core.get_document_metadata(document_id, site_id) is not None:
+        return http_response.format_409_response(document_id)
+    cies_ocr_core.check_site_quota(site_id)
+
+    headers = cies_ocr_core.get_headers(event)
+    body = get_json_body(event)
+    upload = cies_ocr_core.create_multipart_upload(
+        headers.get('USERID', "unknown"),
+        site_id,
+        document_id,
+        body.get("file_name"),
+        body.get("content_type"),
+        body["size"],
+        body.get("part_size"),
+        priority=body.get("priority", headers.get('PRIORITY')))
+    return json_response(upload)
+
+
+def get_json_body(event) -> dict:
+    body = event.get("body") or "{}"
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode("utf-8")
+    body = json.loads(body)
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+    return body
+
+
+def required_parameter(parameters: dict, name: str) -> str:
+    if not parameters.get(name):
+        raise ValueError(f"the query parameter '{name}' is required")
+    # ALB does not URL decode query string parameters
+    return unquote_plus(parameters[name])
+
+
+def json_response(body: dict) -> dict:
+    return http_response.format_200_response({'content-type': 'application/json', 'Access-Control-Allow-Origin': '*'}, json.dumps(body))
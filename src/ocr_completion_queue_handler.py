@@ -0,0 +1,81 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.data_classes import SQSEvent, event_source
+
+from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+import profiling
+from logging_policy import payload
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+# The number of notifications of a batch that are completed at the same time. The completions share the
+# S3 and Textract clients of CiesOcrCore, see AWS_MAX_POOL_CONNECTIONS.
+COMPLETION_CONCURRENCY = int(os.getenv('COMPLETION_CONCURRENCY', '4'))
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# This Lambda handler consumes the Textract notifications from the completion queue, which is subscribed to
+# the Textract status topic. It completes a batch of notifications concurrently, each at most once through
+# the completion ledger. The notifications which fail are returned as batch item failures, so only
+# those are made visible on the queue again, and retried, and the rest of the batch is deleted.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@event_source(data_class=SQSEvent)
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("ocr_completion_queue_handler")
+@profiling.profiled_handler(logger)
+def lambda_handler(event: SQSEvent, context):
+    records = list(event.records)
+    logger.debug("Completion Queue Lambda Handler - %s records, event %s", len(records), payload(event.raw_event))
+
+    # without other threads a large document is linearized by worker processes, see layout_linearizer.py
+    if COMPLETION_CONCURRENCY <= 1 or len(records) == 1:
+        results = [complete_record(record) for record in records]
+    else:
+        with ThreadPoolExecutor(max_workers=min(COMPLETION_CONCURRENCY, len(records))) as executor:
+            results = list(executor.map(complete_record, records))
+
+    failures = [{"itemIdentifier": record.message_id} for record, succeeded in zip(records, results) if not succeeded]
+    metrics.add_metric(name="CompletionMessages", unit=MetricUnit.Count, value=len(records))
+    metrics.add_metric(name="CompletionMessageFailures", unit=MetricUnit.Count, value=len(failures))
+    return {"batchItemFailures": failures}
+
+
+# Returns False when the notification must be retried
+def complete_record(record) -> bool:
+    try:
+        message = parse_notification(record.body)
+        document_id = message["JobTag"]
+        status = message["Status"]
+        logger.debug("Completion Queue Lambda Handler - message %s", payload(message))
+        # SQS, like SNS, may deliver a notification more than once, the completion of a job takes effect once
+        cies_ocr_core.ocr_complete_once(document_id, status, message.get("JobId"), cies_ocr_core.get_notification_site_id(message))
+        return True
+    except Exception as e:
+        logger.exception(f"Error completing message {record.message_id}: {e}")
+        return False
+
+
+# The subscription uses raw message delivery, a notification wrapped in an SNS envelope is also accepted
+def parse_notification(body: str) -> dict:
+    message = json.loads(body)
+    if message.get("Type") == "Notification" and "Message" in message:
+        message = json.loads(message["Message"])
+    return message
@@ -0,0 +1,92 @@
+import os
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.data_classes import SQSEvent, event_source
+
+from cies_ocr_core import CiesOcrCore
+from cies_ocr_core import TAG_KEY_STATUS
+import instrumentation
+import logging_policy
+from logging_policy import payload
+import priority_lanes
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# This Lambda handler consumes the submission queues of the priority lanes, see priority_lanes.py, and submits
+# the documents to Textract. Each queue has its own event source mapping, so a batch holds the submissions of
+# one lane. A batch of the bulk lane is deferred, as a whole, while interactive submissions are waiting.
+# The submissions which fail are returned as batch item failures, and retried.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@event_source(data_class=SQSEvent)
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("ocr_dispatch_handler")
+def lambda_handler(event: SQSEvent, context):
+    records = list(event.records)
+    logger.debug("Dispatch Lambda Handler - %s records, event %s", len(records), payload(event.raw_event))
+
+    submissions = {}
+    failures = []
+    for record in records:
+        try:
+            submissions[record.message_id] = priority_lanes.parse_submission(record.body)
+        except ValueError as e:
+            # a malformed submission is never going to succeed, it is dropped rather than retried
+            logger.error(f"Dropping submission {record.message_id}: {e}")
+    if not submissions:
+        return {"batchItemFailures": failures}
+
+    lane = next(iter(submissions.values()))["lane"]
+    metrics.add_dimension(name="lane", value=lane)
+
+    if lane == priority_lanes.BULK:
+        backlog = cies_ocr_core.get_submission_backlog(priority_lanes.INTERACTIVE)
+        if backlog > priority_lanes.BULK_DEFER_BACKLOG:
+            logger.info(f"deferring {len(submissions)} bulk submissions, {backlog} interactive submissions are waiting")
+            bodies = [record.body for record in records if record.message_id in submissions]
+            cies_ocr_core.defer_submissions(lane, bodies)
+            metrics.add_metric(name="SubmissionsDeferred", unit=MetricUnit.Count, value=len(bodies))
+            return {"batchItemFailures": failures}
+
+    for message_id, submission in submissions.items():
+        if not submit(submission):
+            failures.append({"itemIdentifier": message_id})
+
+    metrics.add_metric(name="Submissions", unit=MetricUnit.Count, value=len(submissions) - len(failures))
+    metrics.add_metric(name="SubmissionFailures", unit=MetricUnit.Count, value=len(failures))
+    return {"batchItemFailures": failures}
+
+
+# Returns False when the submission must be retried
+def submit(submission: dict) -> bool:
+    document_id = submission["document_id"]
+    site_id = submission.get("site_id")
+    try:
+        logging_policy.sample_debug(logger, document_id)
+        # SQS may deliver a submission more than once, a document is only submitted while it is New
+        metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+        if metadata is None or metadata.get(TAG_KEY_STATUS, "New") != "New":
+            logger.info(f"{document_id} is {metadata.get(TAG_KEY_STATUS) if metadata else 'deleted'}, it is not submitted")
+            return True
+        cies_ocr_core.submit_document_to_analysis(document_id, site_id)
+        if submission.get("enqueued_at"):
+            metrics.add_metric(name="SubmissionLatency", unit=MetricUnit.Milliseconds,
+                               value=priority_lanes.latency_ms(submission["enqueued_at"]))
+        return True
+    except Exception as e:
+        logger.exception(f"Error submitting {document_id}: {e}")
+        return False
@@ -1,11 +1,15 @@
-import json
 import os
+from urllib.parse import unquote_plus
 
 import boto3
 from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.utilities.data_classes import S3Event, event_source
 
 from cies_ocr_core import CiesOcrCore;
+from cies_ocr_core import TAG_KEY_STATUS, METADATA_KEY_PRIORITY, METADATA_KEY_SITE_ID
+import instrumentation
+import logging_policy
+from logging_policy import payload
 
 # This Lambda handler is triggered by a new document message from S3.
 # It will submit the document to Textract for OCR and update the 'ocr-status' tag in S3 to reflect
@@ -13,7 +17,7 @@ from cies_ocr_core import CiesOcrCore;
 
 tracer = Tracer()
 logger = Logger()
-logger.setLevel('DEBUG')
+logging_policy.configure(logger)
 metrics = Metrics(namespace="SpiTestApp", service="APP")
 s3 = boto3.client('s3')
 sns = boto3.client('sns')
@@ -29,25 +33,49 @@ cies_ocr_core = CiesOcrCore(
 # ==========================================================================================
 # S3 Event handling, this Lambda is notified when the "source" S3 bucket receives new documents
 # ==========================================================================================
-@logger.inject_lambda_context(log_event=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("ocr_submission_handler")
 def lambda_handler(event: S3Event, context):
-    logger.info(f"S3Event Event Lambda Handler - Inside lambda: event {event} context {context}")
+    logger.debug("S3Event Event Lambda Handler - Inside lambda: event %s context %s", payload(event), context)
     # Multiple records can be delivered in a single event
     for record in event["Records"]:
-        logger.info(f"ocr_submission_handler record is {record}")
+        logger.debug("ocr_submission_handler record is %s", payload(record))
 
         s3 = record["s3"]
-        logger.info(f"ocr_submission_handler s3 is {s3}")
+        logger.debug("ocr_submission_handler s3 is %s", payload(s3))
 
         # the bucket ARN must reference the default source bucket, 'cause this value is ignored
         bucket = s3["bucket"]
         bucket_arn = bucket["arn"]
 
+        # S3 event keys are URL encoded, e.g. a space is '+'
         object = s3["object"]
-        object_key = object["key"]
+        object_key = unquote_plus(object["key"])
 
-        cies_ocr_core.submit_document_to_analysis(object_key)
-        #cies_ocr_core.submit_document_to_ocr(object_key)
+        try:
+            site_id, document_id = cies_ocr_core.parse_source_key(object_key)
+        except ValueError as e:
+            logger.warning(f"{e}, it is not submitted, see scripts/migrate_key_layout.py")
+            continue
+
+        logging_policy.sample_debug(logger, document_id)
+        # a document that is copied, e.g. by migrate_key_layout.py, keeps its tags, and is only submitted when it
+        # has not been submitted before
+        metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+        if metadata is None or metadata.get(TAG_KEY_STATUS, "New") != "New":
+            logger.info(f"{object_key} is {metadata.get(TAG_KEY_STATUS) if metadata else 'deleted'}, it is not submitted")
+            continue
+        # an unsupported, damaged or oversized document is rejected rather than submitted, see preflight.py
+        if not cies_ocr_core.preflight_document(document_id, site_id):
+            continue
+        # the document is submitted by ocr_dispatch_handler from the queue of its lane, see priority_lanes.py
+        cies_ocr_core.enqueue_submission(document_id, site_id, metadata.get(METADATA_KEY_PRIORITY), record.get("eventTime"))
+        # the usage of the site is counted here, however the document was uploaded, see site_usage.py. The site is
+        # that of the document, the key has none in the flat and hashed layouts.
+        cies_ocr_core.record_site_usage(metadata.get(METADATA_KEY_SITE_ID), Documents=1, BytesStored=object.get("size", 0))
+        #cies_ocr_core.submit_document_to_ocr(document_id, site_id)
 
 # {
 #   "Records": [
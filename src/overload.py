@@ -0,0 +1,206 @@
+# This module protects the HTTP handlers from surges. The handlers used to accept every request until S3 or
+# Textract throttled them, and the throttling errors were returned as 500s. The guard sheds the requests it
+# cannot serve early, with a status and a Retry-After header (seconds) the clients can back off by:
+#   429 Too Many Requests     the handler has OVERLOAD_MAX_IN_FLIGHT requests in progress, or the submission lane
+#                             of an upload has OVERLOAD_MAX_BACKLOG documents waiting (see priority_lanes.py)
+#   503 Service Unavailable   S3, SQS or Textract throttled OVERLOAD_THROTTLE_LIMIT calls in the last
+#                             OVERLOAD_WINDOW_SECONDS, the handler stops calling them until the window has passed
+# Retry-After is the depth of the queue in front of the request divided by the recent throughput:
+#   in flight   the requests in excess of the limit, over the requests completed per second in the window
+#   backlog     the documents in excess of the limit, over OVERLOAD_DRAIN_PER_SECOND, the rate the dispatcher
+#               submits documents at (the StartDocumentAnalysis quota), which is not observable in this process
+#   throttled   the seconds until the throttled calls leave the window
+# bounded by RETRY_AFTER_MIN_SECONDS and RETRY_AFTER_MAX_SECONDS.
+# Throttling is seen by the botocore hooks of the core's clients (see watch_client), including the throttled
+# attempts botocore retried successfully, and by the throttling errors raised to a guarded request. The state is
+# kept by the process, so a warm Lambda instance remembers the throttling of its previous invocations; a Lambda
+# instance handles one request at a time, the in-flight limit applies to a container serving concurrent requests.
+# The shed requests and the throttled calls are written as EMF records with the AWS call metrics:
+#   Shed429, Shed503, DownstreamThrottles
+
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+from botocore.exceptions import ClientError
+
+import instrumentation
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+OVERLOAD_MAX_IN_FLIGHT = int(os.getenv('OVERLOAD_MAX_IN_FLIGHT', '32'))
+# 0 disables the backlog check
+OVERLOAD_MAX_BACKLOG = int(os.getenv('OVERLOAD_MAX_BACKLOG', '0'))
+OVERLOAD_THROTTLE_LIMIT = int(os.getenv('OVERLOAD_THROTTLE_LIMIT', '5'))
+OVERLOAD_WINDOW_SECONDS = float(os.getenv('OVERLOAD_WINDOW_SECONDS', '30'))
+OVERLOAD_DRAIN_PER_SECOND = float(os.getenv('OVERLOAD_DRAIN_PER_SECOND', '2'))
+RETRY_AFTER_MIN_SECONDS = 1
+RETRY_AFTER_MAX_SECONDS = int(os.getenv('RETRY_AFTER_MAX_SECONDS', '300'))
+
+# The error codes of the throttling of S3, SQS, SNS and Textract
+THROTTLE_CODES = frozenset([
+    "Throttling", "ThrottlingException", "ThrottledException", "SlowDown", "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException", "TooManyRequestsException", "RequestThrottled",
+    "RequestThrottledException", "LimitExceededException", "ServiceUnavailable", "503"])
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def is_throttle(error: Exception) -> bool:
+    if not isinstance(error, ClientError):
+        return False
+    response = error.response or {}
+    code = response.get("Error", {}).get("Code")
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in THROTTLE_CODES or status in (429, 503)
+
+
+# Returns the seconds a client should wait for a queue of depth items served at throughput items per second
+def retry_after_seconds(depth: float, throughput: float) -> int:
+    seconds = math.ceil(depth / throughput) if throughput > 0 else RETRY_AFTER_MAX_SECONDS
+    return max(RETRY_AFTER_MIN_SECONDS, min(RETRY_AFTER_MAX_SECONDS, seconds))
+
+
+class OverloadGuard:
+    def __init__(self, max_in_flight: int = OVERLOAD_MAX_IN_FLIGHT, throttle_limit: int = OVERLOAD_THROTTLE_LIMIT,
+                 window_seconds: float = OVERLOAD_WINDOW_SECONDS, max_backlog: int = OVERLOAD_MAX_BACKLOG,
+                 drain_per_second: float = OVERLOAD_DRAIN_PER_SECOND, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.throttle_limit = throttle_limit
+        self.window_seconds = window_seconds
+        self.max_backlog = max_backlog
+        self.drain_per_second = drain_per_second
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # the times of the throttled calls and of the completed requests in the window
+        self.throttles = deque()
+        self.completions = deque()
+        # name -> count, since the metrics were last written
+        self.counters = {}
+
+    def _prune(self, now: float):
+        for times in (self.throttles, self.completions):
+            while times and times[0] <= now - self.window_seconds:
+                times.popleft()
+
+    def _count(self, name: str):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def record_throttle(self):
+        with self.lock:
+            self.throttles.append(self.clock())
+            self._count("DownstreamThrottles")
+
+    # The requests completed per second in the window
+    def throughput(self) -> float:
+        with self.lock:
+            now = self.clock()
+            self._prune(now)
+            return len(self.completions) / self.window_seconds
+
+    def _shed(self, status_code: int, retry_after: int, reason: str) -> Overloaded:
+        self._count(f"Shed{status_code}")
+        logger.warning(f"shedding a request with {status_code}, retry after {retry_after}s: {reason}")
+        return Overloaded(status_code, retry_after, reason)
+
+    # Raises Overloaded when a request cannot be served now, otherwise counts it in flight until the block exits.
+    # A throttling error raised by the block is recorded and raised as Overloaded.
+    @contextlib.contextmanager
+    def admit(self):
+        with self.lock:
+            now = self.clock()
+            self._prune(now)
+            if self.throttle_limit > 0 and len(self.throttles) >= self.throttle_limit:
+                # until enough of the throttled calls have left the window
+                cool_down = self.throttles[-self.throttle_limit] + self.window_seconds - now
+                raise self._shed(503, retry_after_seconds(cool_down, 1), f"{len(self.throttles)} downstream calls were throttled")
+            if self.in_flight >= self.max_in_flight:
+                excess = self.in_flight - self.max_in_flight + 1
+                throughput = len(self.completions) / self.window_seconds
+                raise self._shed(429, retry_after_seconds(excess, throughput), f"{self.in_flight} requests in progress")
+            self.in_flight += 1
+        try:
+            yield self
+        except ClientError as e:
+            if not is_throttle(e):
+                raise
+            self.record_throttle()
+            with self.lock:
+                self._count("Shed503")
+            logger.warning(f"a downstream call was throttled: {e}")
+            raise Overloaded(503, retry_after_seconds(self.window_seconds / max(self.throttle_limit, 1), 1), str(e)) from e
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completions.append(self.clock())
+
+    # Raises Overloaded when the queue a request would join has too many items waiting
+    def check_backlog(self, backlog: int, queue: str):
+        if self.max_backlog <= 0 or backlog < self.max_backlog:
+            return
+        with self.lock:
+            retry_after = retry_after_seconds(backlog - self.max_backlog + 1, self.drain_per_second)
+            raise self._shed(429, retry_after, f"{backlog} documents are waiting in the {queue} queue")
+
+    # Returns the counters, and clears them
+    def take_counters(self) -> dict:
+        with self.lock:
+            counters = self.counters
+            self.counters = {}
+        return counters
+
+    def flush_metrics(self):
+        counters = self.take_counters()
+        if not counters:
+            return
+        try:
+            emf = EphemeralMetrics(namespace=instrumentation.METRICS_NAMESPACE, service=instrumentation.METRICS_SERVICE)
+            emf.add_dimensions(environment=instrumentation.ENVIRONMENT, handler=instrumentation.handler_name())
+            for name, count in counters.items():
+                emf.add_metric(name=name, unit=MetricUnit.Count, value=count)
+            emf.flush_metrics()
+        except Exception as e:
+            logger.warning(f"Error writing overload metrics: {e}")
+
+
+# The guard of the process, shared by the clients and the handlers
+guard = OverloadGuard()
+instrumentation.on_flush(guard.flush_metrics)
+
+
+# ====================================================================================================
+# AWS client hooks
+# ====================================================================================================
+# Registers the throttling hook on a boto3 client, returns the client. needs-retry is emitted for each attempt of
+# a call, so the attempts botocore retries are seen too.
+def watch_client(client):
+    client.meta.events.register("needs-retry", _needs_retry, unique_id="cies-overload-needs-retry")
+    return client
+
+
+def _needs_retry(response=None, **kwargs):
+    # the hook decides nothing, it returns None so that the retry handler decides
+    if response is None:
+        return None
+    http_response, parsed = response
+    code = (parsed or {}).get("Error", {}).get("Code")
+    if code in THROTTLE_CODES or getattr(http_response, "status_code", None) in (429, 503):
+        guard.record_throttle()
+    return None
@@ -0,0 +1,123 @@
+# This module collapses the text repeated at the top (a banner, e.g. the patient name, MRN and exam date) and the
+# bottom (a footer) of the pages of a document. The linearized text of a document is a dict of page number to text
+# (see layout_linearizer.py), and every page repeats its banner, so the results carry the same block once per page.
+# Textract only labels some banners LAYOUT_HEADER, which the linearization already excludes, most are plain text.
+# A line is part of the banner when it is among the first BANNER_REGION_LINES lines of at least BANNER_MIN_FRACTION
+# of the pages (and of 2 pages at least), likewise the footer for the last lines. Lines are matched by the hash of
+# their normalized text, then approximately, to absorb OCR noise, with difflib. An approximate match must have the
+# same numbers, so "Page 1 of 3" never matches "Page 2 of 3" and no two patients or dates are ever merged.
+# The compact form of a document is:
+#   {"banner": "<banner lines>", "footer": "<footer lines>", "pages": {"<page>": "<text without banner and footer>"}}
+# The banner and footer are the lines as they appear on the first page that has them.
+
+import difflib
+import hashlib
+import os
+import re
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+BANNER_MIN_FRACTION = float(os.getenv('BANNER_MIN_FRACTION', '0.6'))
+BANNER_REGION_LINES = int(os.getenv('BANNER_REGION_LINES', '12'))
+BANNER_SIMILARITY = float(os.getenv('BANNER_SIMILARITY', '0.9'))
+# Approximate matches are only looked for among the lines of the first pages, which bounds the comparisons
+# of a document of thousands of pages. A banner is on most pages, so it is on the first ones.
+BANNER_SAMPLE_PAGES = 10
+
+# The value of the 'form' query parameter of GET /text/<document_id> that selects the compact form
+COMPACT = "compact"
+HEADER = "header"
+FOOTER = "footer"
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def normalize(line: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", line).strip().casefold()
+
+
+def line_hash(normalized: str) -> str:
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class _Candidate:
+    def __init__(self, normalized: str, line: str):
+        self.normalized = normalized
+        self.line = line
+        self.numbers = NUMBER_PATTERN.findall(normalized)
+        self.pages = set()
+
+
+# Returns the compact form of the text of a document, a document with fewer than 2 pages has no banner
+def collapse(pages: dict) -> dict:
+    page_lines = {page: text.split("\n") for page, text in pages.items()}
+    region = {page: _region_indexes(lines) for page, lines in page_lines.items()}
+
+    removed = {page: set() for page in page_lines}
+    parts = {}
+    for part in (HEADER, FOOTER):
+        regions = {page: region[page][part] - removed[page] for page in page_lines}
+        repeated, matches = _repeated_lines(page_lines, regions)
+        for page, indexes in matches.items():
+            removed[page] |= indexes
+        parts[part] = "\n".join(candidate.line for candidate in repeated)
+
+    compact_pages = {}
+    for page, lines in page_lines.items():
+        body = "\n".join(line for index, line in enumerate(lines) if index not in removed[page])
+        # a page keeps the blank lines that end it, the paragraph separators of the linearization
+        compact_pages[str(page)] = body.lstrip("\n") if removed[page] else body
+    return {"banner": parts[HEADER], "footer": parts[FOOTER], "pages": compact_pages}
+
+
+# The indexes of the first and last BANNER_REGION_LINES non-blank lines of a page
+def _region_indexes(lines: list) -> dict:
+    text_indexes = [index for index, line in enumerate(lines) if line.strip()]
+    return {HEADER: set(text_indexes[:BANNER_REGION_LINES]), FOOTER: set(text_indexes[-BANNER_REGION_LINES:])}
+
+
+# Returns the repeated candidate lines, in the order they first appear, and the indexes of their lines on each page
+def _repeated_lines(page_lines: dict, regions: dict) -> tuple:
+    if len(page_lines) < 2:
+        return [], {}
+    by_hash = {}
+    candidates = []
+    # (page, index) of each line of a region -> its candidate
+    assigned = {}
+    for page_number, (page, lines) in enumerate(page_lines.items()):
+        for index in sorted(regions[page]):
+            normalized = normalize(lines[index])
+            key = line_hash(normalized)
+            candidate = by_hash.get(key)
+            if candidate is None:
+                candidate = _similar_candidate(candidates, normalized)
+                if candidate is None:
+                    candidate = _Candidate(normalized, lines[index])
+                    if page_number < BANNER_SAMPLE_PAGES:
+                        candidates.append(candidate)
+                by_hash[key] = candidate
+            candidate.pages.add(page)
+            assigned[(page, index)] = candidate
+
+    minimum = max(2, BANNER_MIN_FRACTION * len(page_lines))
+    repeated = [candidate for candidate in candidates if len(candidate.pages) >= minimum]
+    repeated_ids = set(map(id, repeated))
+    matches = {}
+    for (page, index), candidate in assigned.items():
+        if id(candidate) in repeated_ids:
+            matches.setdefault(page, set()).add(index)
+    return repeated, matches
+
+
+def _similar_candidate(candidates: list, normalized: str):
+    numbers = NUMBER_PATTERN.findall(normalized)
+    for candidate in candidates:
+        if candidate.numbers != numbers:
+            continue
+        matcher = difflib.SequenceMatcher(None, candidate.normalized, normalized, autojunk=False)
+        if matcher.real_quick_ratio() >= BANNER_SIMILARITY and matcher.quick_ratio() >= BANNER_SIMILARITY \
+                and matcher.ratio() >= BANNER_SIMILARITY:
+            return candidate
+    return None
@@ -0,0 +1,162 @@
+# This module lets a replaced document be re-analysed only for the pages that changed. Sites mostly send a chart
+# again with a few pages appended or corrected, and a PUT of the document used to submit every page to Textract.
+# When a PDF is submitted the fingerprint of each of its pages, a SHA-256 of the page's content stream, geometry
+# and images, is recorded, and when its results are stored the fingerprints are stored with them:
+#   <result key>.pages.json     {"job_id": "<job>", "fingerprints": ["<page 1>", ...]}, the pages of the .json result
+# When the document is replaced, the fingerprints of the new version are looked up among the stored ones, a page
+# with the same fingerprint (at any position) reuses the Textract blocks of that page of the stored result, and
+# only the other pages are copied to a partial PDF which is submitted to Textract. The submission is described by
+#   revisions/<source key>.json in the destination bucket, see build_revision
+# and the partial PDF is written next to the document, with the status 'Partial' so that it is never submitted
+# as a document itself. On completion the blocks of the partial result and the reused pages are merged, in the
+# page order of the new version, and the document completes as if all of its pages had been analysed.
+# Only PDFs are fingerprinted, a multi-page TIFF is converted to a PDF by the pre-flight checks (see preflight.py).
+
+import hashlib
+import io
+import os
+
+from pypdf import PdfReader, PdfWriter
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+REVISIONS_PREFIX = "revisions/"
+PARTIAL_PREFIX = "partial/"
+PAGES_SUFFIX = ".pages.json"
+STATUS_PARTIAL = "Partial"
+# Larger documents are submitted whole, they are read into memory to be fingerprinted
+FINGERPRINT_MAX_BYTES = int(os.getenv('FINGERPRINT_MAX_BYTES', str(100 * 1024 * 1024)))
+# Form XObjects may nest, their resources are followed to this depth
+MAX_RESOURCE_DEPTH = 4
+
+
+def create_revision_key(source_key: str) -> str:
+    return f"{REVISIONS_PREFIX}{source_key}.json"
+
+
+def create_partial_key(source_key: str) -> str:
+    return f"{PARTIAL_PREFIX}{source_key}"
+
+
+# Returns the fingerprint of each page of a PDF
+def fingerprint_pages(body: bytes) -> list:
+    reader = PdfReader(io.BytesIO(body))
+    return [fingerprint_page(page) for page in reader.pages]
+
+
+def fingerprint_page(page) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr([float(value) for value in page.mediabox]).encode("utf-8"))
+    digest.update(str(page.rotation).encode("utf-8"))
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    _digest_resources(digest, page.get("/Resources"), 0)
+    return digest.hexdigest()
+
+
+# A scanned page is an image drawn by a content stream that is the same on every page, so the images count
+def _digest_resources(digest, resources, depth: int):
+    if resources is None or depth > MAX_RESOURCE_DEPTH:
+        return
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return
+    xobjects = xobjects.get_object()
+    for name in sorted(xobjects):
+        xobject = xobjects[name].get_object()
+        digest.update(name.encode("utf-8"))
+        digest.update(xobject.get_data())
+        if xobject.get("/Subtype") == "/Form":
+            _digest_resources(digest, xobject.get("/Resources"), depth + 1)
+
+
+# Returns the revision of a document from the fingerprints of its stored result and of its new version:
+#   {"fingerprints": [<new version>], "pages": {"<new page>": {"base": <stored page>} or {"partial": <partial page>}}}
+# where "pages" is None when every page must be analysed, and has no "partial" page when none must be, and
+# "base_pages" is the number of pages of the stored result.
+def build_revision(stored_fingerprints: list, fingerprints: list) -> dict:
+    if not stored_fingerprints:
+        return {"fingerprints": fingerprints, "pages": None}
+    stored_pages = {}
+    for page, fingerprint in enumerate(stored_fingerprints, start=1):
+        stored_pages.setdefault(fingerprint, page)
+
+    pages = {}
+    partial_page = 0
+    for page, fingerprint in enumerate(fingerprints, start=1):
+        if fingerprint in stored_pages:
+            pages[str(page)] = {"base": stored_pages[fingerprint]}
+        else:
+            partial_page += 1
+            pages[str(page)] = {"partial": partial_page}
+    if partial_page == len(fingerprints):
+        return {"fingerprints": fingerprints, "pages": None}
+    return {"fingerprints": fingerprints, "pages": pages, "base_pages": len(stored_fingerprints)}
+
+
+# Whether the new version has the pages of the stored result, all of them and in the same order, so that its
+# results are kept as they are. A version with pages removed or reordered has its results rebuilt.
+def is_unchanged(revision: dict) -> bool:
+    pages = revision["pages"]
+    return (pages is not None and revision.get("base_pages") == len(pages) and
+            all(source.get("base") == int(page) for page, source in pages.items()))
+
+
+# The pages of the new version which are submitted, in the order of the partial PDF
+def partial_pages(revision: dict) -> list:
+    return [int(page) for page, source in revision["pages"].items() if "partial" in source]
+
+
+# A PDF of the given (1 based) pages of a PDF
+def extract_pages(body: bytes, pages: list) -> bytes:
+    reader = PdfReader(io.BytesIO(body))
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(reader.pages[page - 1])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+# Merges the Textract result of the partial PDF with the blocks of the reused pages of the stored result.
+# Every Textract relationship stays within a page (see layout_linearizer.py), so the blocks of a page are moved
+# as a whole. A stored page reused more than once has the Ids of its copies suffixed, to keep the Ids unique.
+def merge_layout(base_json: dict, partial_json: dict, revision: dict) -> dict:
+    base_blocks = _blocks_by_page(base_json)
+    partial_blocks = _blocks_by_page(partial_json)
+    used = set()
+    blocks = []
+    for page, source in sorted(revision["pages"].items(), key=lambda item: int(item[0])):
+        if "partial" in source:
+            blocks += _move_blocks(partial_blocks.get(source["partial"], []), int(page), None)
+        else:
+            reused = source["base"] in used
+            used.add(source["base"])
+            blocks += _move_blocks(base_blocks.get(source["base"], []), int(page), f"-p{page}" if reused else None)
+
+    merged = dict(partial_json)
+    merged["Blocks"] = blocks
+    merged["DocumentMetadata"] = dict(partial_json.get("DocumentMetadata", {}), Pages=len(revision["pages"]))
+    return merged
+
+
+def _blocks_by_page(textract_json: dict) -> dict:
+    pages = {}
+    for block in textract_json.get("Blocks", []):
+        pages.setdefault(block.get("Page", 1), []).append(block)
+    return pages
+
+
+def _move_blocks(blocks: list, page: int, id_suffix: str) -> list:
+    moved = []
+    for block in blocks:
+        block = dict(block, Page=page)
+        if id_suffix:
+            block["Id"] = block["Id"] + id_suffix
+            if "Relationships" in block:
+                block["Relationships"] = [dict(relationship, Ids=[id + id_suffix for id in relationship.get("Ids", [])])
+                                          for relationship in block["Relationships"]]
+        moved.append(block)
+    return moved
@@ -0,0 +1,70 @@
+# This module defines the pending job markers used to reconcile documents that are stuck as 'Submitted'.
+# When a document is submitted to Textract an empty marker object is written to the destination bucket:
+#   pending/<submission hour, YYYYMMDDHH>/<source key>
+# where the source key is the key of the document in the source bucket, which is the document_id in the
+# flat key layout (see key_layout.py).
+# and the submission hour is saved in the 'submitted-at' tag of the document. The marker is deleted when
+# the document completes. A marker which outlives the reconciliation deadline means that the Textract
+# notification was lost, or that the completion failed part way through.
+# Grouping the markers by submission hour allows the reconciler to list only the hours that are past the
+# deadline, rather than every outstanding job, or the whole bucket.
+
+import random
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+PENDING_PREFIX = "pending/"
+HOUR_FORMAT = "%Y%m%d%H"
+
+# Textract (and S3) error codes that are retried with backoff
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+    "InternalServerError",
+    "SlowDown",
+    "ServiceUnavailable",
+}
+
+
+# ====================================================================================================
+# Marker keys
+# ====================================================================================================
+def submission_hour(submitted_at: datetime = None) -> str:
+    if submitted_at is None:
+        submitted_at = datetime.now(timezone.utc)
+    return submitted_at.strftime(HOUR_FORMAT)
+
+
+def create_pending_key(source_key: str, hour: str) -> str:
+    return f"{PENDING_PREFIX}{hour}/{source_key}"
+
+
+# The source key of a marker, source keys may contain '/'
+def source_key_from_key(pending_key: str) -> str:
+    return pending_key[len(PENDING_PREFIX):].split("/", 1)[1]
+
+
+# The start of the hour of a marker prefix, e.g. "pending/2024061014/" -> 2024-06-10 14:00 UTC
+def hour_from_prefix(hour_prefix: str) -> datetime:
+    hour = hour_prefix[len(PENDING_PREFIX):].strip("/")
+    return datetime.strptime(hour, HOUR_FORMAT).replace(tzinfo=timezone.utc)
+
+
+# ====================================================================================================
+# Backoff
+# ====================================================================================================
+# Calls function, retrying throttling and transient service errors with full jitter exponential backoff
+def call_with_backoff(function, attempts: int = 5, base_delay: float = 0.5, max_delay: float = 20.0):
+    for attempt in range(attempts):
+        try:
+            return function()
+        except ClientError as cx:
+            if cx.response['Error']['Code'] not in RETRYABLE_ERROR_CODES or attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
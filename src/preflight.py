@@ -0,0 +1,170 @@
+# This module checks a new document before it is submitted to Textract. Without it any object in the source
+# bucket is submitted, and an encrypted, truncated, oversized or unsupported file (a POST without a Content-Type
+# is stored as text/plain) only fails once a Textract job has been started and its notification received.
+# The type of a document is sniffed from its leading (magic) bytes, its Content-Type is not trusted:
+#   pdf          scanned for encryption, a missing %%EOF (a truncated upload) and its number of pages
+#   jpeg, png    submitted as they are, unless they are larger than Textract accepts for an image
+#   tiff         a multi-page TIFF is converted to a PDF
+#   gif, bmp, webp and oversized jpeg/png images are converted to a PNG (one page) or a PDF (several frames)
+# Anything else is rejected. The limits are those of the asynchronous Textract operations.
+# The page count of a PDF is an estimate from its page objects, or from the /Count of its page tree when the
+# page objects are in compressed object streams, it is only used to reject documents over MAX_PAGES.
+
+import io
+import itertools
+import os
+import re
+
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+PDF = "pdf"
+TIFF = "tiff"
+JPEG = "jpeg"
+PNG = "png"
+GIF = "gif"
+BMP = "bmp"
+WEBP = "webp"
+
+CONTENT_TYPES = {PDF: "application/pdf", TIFF: "image/tiff", JPEG: "image/jpeg", PNG: "image/png",
+                 GIF: "image/gif", BMP: "image/bmp", WEBP: "image/webp"}
+# the types Textract accepts without conversion
+TEXTRACT_TYPES = (PDF, TIFF, JPEG, PNG)
+
+# The reasons a document is rejected, the value of its ocr-reject-reason tag
+REASON_EMPTY = "empty"
+REASON_UNSUPPORTED_TYPE = "unsupported-type"
+REASON_TOO_LARGE = "too-large"
+REASON_TOO_MANY_PAGES = "too-many-pages"
+REASON_ENCRYPTED = "encrypted"
+REASON_CORRUPT = "corrupt"
+
+MAX_DOCUMENT_BYTES = int(os.getenv('PREFLIGHT_MAX_DOCUMENT_BYTES', str(500 * 1024 * 1024)))
+MAX_IMAGE_BYTES = int(os.getenv('PREFLIGHT_MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+MAX_PAGES = int(os.getenv('PREFLIGHT_MAX_PAGES', '3000'))
+# Documents are converted in memory, a TIFF larger than this is submitted as it is, any other image is rejected
+MAX_CONVERT_BYTES = int(os.getenv('PREFLIGHT_MAX_CONVERT_BYTES', str(100 * 1024 * 1024)))
+# A PDF header may be preceded by up to 1024 bytes of junk
+SNIFF_BYTES = 1024
+
+PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+COUNT_PATTERN = re.compile(rb"/Count\s+(\d+)")
+ENCRYPT_PATTERN = re.compile(rb"/Encrypt\b")
+# a match is at most this long, it is the overlap of the chunks that are scanned
+PATTERN_OVERLAP = 64
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+
+
+# The type of a document from its first SNIFF_BYTES, or None when it is not one of the known types
+def sniff(head: bytes) -> str:
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return PDF
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return TIFF
+    if head[:3] == b"\xff\xd8\xff":
+        return JPEG
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return PNG
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return GIF
+    if head[:2] == b"BM":
+        return BMP
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return WEBP
+    return None
+
+
+# Checks a document from the chunks of its body, and returns
+#   {"kind": <type>, "pages": <count>, "converted": None or (<body>, <content type>)}
+# Raises Rejected when the document cannot be submitted to Textract.
+def inspect(chunks, size: int) -> dict:
+    if not size:
+        raise Rejected(REASON_EMPTY, "the document is empty")
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+    kind = sniff(head)
+    if kind is None:
+        raise Rejected(REASON_UNSUPPORTED_TYPE, f"the document is not a PDF, TIFF, JPEG or PNG, it starts with {head[:8]!r}")
+    if size > MAX_DOCUMENT_BYTES:
+        raise Rejected(REASON_TOO_LARGE, f"the document is {size} bytes, Textract accepts at most {MAX_DOCUMENT_BYTES}")
+
+    if kind == PDF:
+        return {"kind": kind, "pages": scan_pdf(itertools.chain([head], chunks)), "converted": None}
+    if kind == TIFF and size > MAX_CONVERT_BYTES:
+        return {"kind": kind, "pages": None, "converted": None}
+    if kind != TIFF and size > MAX_CONVERT_BYTES:
+        raise Rejected(REASON_TOO_LARGE, f"the {kind} image is {size} bytes, at most {MAX_CONVERT_BYTES} are converted")
+
+    body = b"".join(itertools.chain([head], chunks))
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            pages = getattr(image, "n_frames", 1)
+            if kind in (JPEG, PNG) and size <= MAX_IMAGE_BYTES:
+                image.verify()
+                return {"kind": kind, "pages": 1, "converted": None}
+            if kind == TIFF and pages == 1:
+                return {"kind": kind, "pages": 1, "converted": None}
+            if pages > MAX_PAGES:
+                raise Rejected(REASON_TOO_MANY_PAGES, f"the {kind} has {pages} pages, Textract accepts at most {MAX_PAGES}")
+            return {"kind": kind, "pages": pages, "converted": convert_image(image, pages)}
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise Rejected(REASON_CORRUPT, f"the {kind} image cannot be read, {e}")
+
+
+# Scans the chunks of a PDF, returns its (estimated) number of pages
+def scan_pdf(chunks) -> int:
+    pages = 0
+    max_count = 0
+    encrypted = False
+    tail = b""
+    for chunk in chunks:
+        window = tail + chunk
+        # the matches that end within the overlap were counted in the previous window
+        pages += sum(1 for match in PAGE_PATTERN.finditer(window) if match.end() > len(tail))
+        max_count = max([max_count] + [int(match.group(1)) for match in COUNT_PATTERN.finditer(window) if match.end() > len(tail)])
+        encrypted = encrypted or ENCRYPT_PATTERN.search(window) is not None
+        tail = window[-max(PATTERN_OVERLAP, SNIFF_BYTES):]
+
+    if encrypted:
+        raise Rejected(REASON_ENCRYPTED, "the PDF is encrypted, Textract cannot read it")
+    if b"%%EOF" not in tail:
+        raise Rejected(REASON_CORRUPT, "the PDF has no %%EOF marker, it is truncated or damaged")
+    pages = pages or max_count
+    if pages > MAX_PAGES:
+        raise Rejected(REASON_TOO_MANY_PAGES, f"the PDF has {pages} pages, Textract accepts at most {MAX_PAGES}")
+    return pages
+
+
+# Converts an image to a PNG, or its frames to the pages of a PDF. Returns (body, content type)
+def convert_image(image, pages: int) -> tuple:
+    output = io.BytesIO()
+    if pages == 1:
+        rgb(image).save(output, format="PNG", optimize=True)
+        if output.tell() <= MAX_IMAGE_BYTES:
+            return output.getvalue(), CONTENT_TYPES[PNG]
+        output = io.BytesIO()
+    frames = [rgb(frame) for frame in ImageSequence.Iterator(image)]
+    resolution = (image.info.get("dpi") or (200, 200))[0]
+    frames[0].save(output, format="PDF", save_all=True, append_images=frames[1:], resolution=float(resolution))
+    return output.getvalue(), CONTENT_TYPES[PDF]
+
+
+# Textract reads 8 bit grayscale and RGB images, a palette, alpha or 16 bit image is converted
+def rgb(image):
+    if image.mode in ("L", "RGB"):
+        return image.copy()
+    if image.mode in ("1", "I;16", "I;16B", "I"):
+        return image.convert("L")
+    return image.convert("RGB")
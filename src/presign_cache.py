@@ -0,0 +1,65 @@
+# This module caches presigned URLs (and presigned POSTs) for as long as a Lambda instance is warm.
+# Signing is local, but it is repeated for every request of a popular document and for every key of a
+# batch. A cached signature is reused while it still has at least a margin of its lifetime left, so a
+# caller is never handed a URL that is about to expire:
+#   margin = max(PRESIGN_CACHE_MIN_REMAINING_SECONDS, PRESIGN_CACHE_MIN_REMAINING_FRACTION * expires_in)
+# The signatures use the credentials of the function, which are valid for longer than any expiration used here.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+PRESIGN_CACHE_SIZE = int(os.getenv('PRESIGN_CACHE_SIZE', '4096'))
+PRESIGN_CACHE_MIN_REMAINING_SECONDS = int(os.getenv('PRESIGN_CACHE_MIN_REMAINING_SECONDS', '30'))
+PRESIGN_CACHE_MIN_REMAINING_FRACTION = float(os.getenv('PRESIGN_CACHE_MIN_REMAINING_FRACTION', '0.5'))
+
+
+# ====================================================================================================
+# Cache
+# ====================================================================================================
+# A least recently used cache of signatures keyed by (operation, bucket, key, expires_in)
+class PresignCache:
+    def __init__(self, size: int = PRESIGN_CACHE_SIZE, clock=time.time):
+        self.size = size
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the cached signature, or signs with sign() and caches the result
+    def get_or_sign(self, operation: str, bucket: str, key: str, expires_in: int, sign):
+        return self.get_or_sign_expiring(operation, bucket, key, expires_in, sign)[0]
+
+    # Returns the signature and the time it expires at, a cached signature expires sooner than expires_in
+    def get_or_sign_expiring(self, operation: str, bucket: str, key: str, expires_in: int, sign) -> tuple:
+        cache_key = (operation, bucket, key, expires_in)
+        now = self.clock()
+        margin = max(PRESIGN_CACHE_MIN_REMAINING_SECONDS, PRESIGN_CACHE_MIN_REMAINING_FRACTION * expires_in)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[1] - now >= margin:
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = (sign(), now + expires_in)
+        with self.lock:
+            self.entries[cache_key] = entry
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    # The whole seconds until a signature which expires at expires_at expires
+    def remaining_seconds(self, expires_at: float) -> int:
+        return max(int(expires_at - self.clock()), 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
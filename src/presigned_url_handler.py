@@ -1,14 +1,24 @@
+import base64
 import os
 import json
 
 from cies_ocr_core import CiesOcrCore
+import http_response
+import overload
+import instrumentation
+import logging_policy
+from logging_policy import payload
 from aws_lambda_powertools import Logger, Metrics, Tracer
 
 tracer = Tracer()
 logger = Logger()
-logger.setLevel(os.getenv('LOG_LEVEL', 'DEBUG'))
+logging_policy.configure(logger)
 metrics = Metrics(namespace="SpiTestApp", service="APP")
 
+# The expiration, in seconds, of the URLs signed by the batch route, a URL signed by an earlier request is reused
+# while enough of its lifetime is left (see presign_cache.py), so it may expire sooner
+PRESIGNED_BATCH_EXPIRATION = int(os.getenv('PRESIGNED_BATCH_EXPIRATION', '900'))
+
 cies_ocr_core = CiesOcrCore(
     os.getenv('SOURCE_BUCKET'), 
     os.getenv('DESTINATION_BUCKET'), 
@@ -16,15 +26,27 @@ cies_ocr_core = CiesOcrCore(
     os.getenv('TEXTRACT_STATUS_TOPIC'), 
     os.getenv("AWS_REGION"))
 
-# handles only the GET method
-# Gets a "presigned" URL to allow the user to write directly to an S3 bucket/key
+# GET /presignedurl/<document_id>
+#   Gets a "presigned" URL to allow the user to write directly to an S3 bucket/key
+# POST /presignedurls
+#   Presigns many documents in one request, the body is a JSON list of documents:
+#   {"documents": [{"document_id": "<document_id>", "type": "text" | "json" | "upload", "site_id": "<site_id>"}, ...]}
+#   and the response is {"expires_in": <seconds>, "documents": [{"document_id": ..., "type": ..., "url": ..., "expires_in": <seconds>}, ...]}
+#   where the expires_in of a document is the seconds its URL is still valid for, and that of the response is the
+#   least of them, the seconds for which every URL of the response is valid
 @tracer.capture_lambda_handler
+@instrumentation.instrumented_handler("presigned_url_handler")
 def lambda_handler(event, context) -> dict:
-    logger.info(f"OCR API - Inside OCR lambda: event {event} context {context}")
+    logger.debug("OCR API - Inside OCR lambda: event %s context %s", payload(event), context)
 
     try:
+        if event.get("httpMethod") == "POST":
+            return presign_batch(event)
+
         document_id = cies_ocr_core.return_last_path_element(event.get("path"))
-        presigned_post_result = cies_ocr_core.get_presigned_post_url(document_id)
+        site_id = cies_ocr_core.get_headers(event).get('SITEID')
+        cies_ocr_core.check_site_quota(site_id)
+        presigned_post_result = cies_ocr_core.get_presigned_post_url(document_id, site_id=site_id)
 
         result = {
             'statusCode': 200,
@@ -38,12 +60,37 @@ def lambda_handler(event, context) -> dict:
             'body': json.dumps(presigned_post_result)
         }
 
-        logger.info(f"Returning {result}")
+        logger.info("Returning %s", payload(result))
         return result
-    
+
+    # the site of an upload is over its quota, see site_usage.py
+    except overload.Overloaded as e:
+        return http_response.format_overloaded_response(e)
     except Exception as e:
         raise e
 
+
+def presign_batch(event) -> dict:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode("utf-8")
+    try:
+        documents = json.loads(body)["documents"]
+        if not isinstance(documents, list):
+            raise ValueError("documents must be a list")
+        # only an upload adds a document, the quota of its site is checked once
+        for site_id in sorted({document.get("site_id") for document in documents if isinstance(document, dict) and document.get("type") == "upload"}, key=str):
+            cies_ocr_core.check_site_quota(site_id)
+        presigned = cies_ocr_core.get_presigned_urls(documents, PRESIGNED_BATCH_EXPIRATION)
+    except (ValueError, KeyError, TypeError) as e:
+        return http_response.format_400_response(f"Invalid batch presign request: {e}")
+
+    logger.info(f"presigned {len(presigned)} documents, cache hits {cies_ocr_core.presigned_url_cache.hits} misses {cies_ocr_core.presigned_url_cache.misses}")
+    expires_in = min((document["expires_in"] for document in presigned if "expires_in" in document), default=PRESIGNED_BATCH_EXPIRATION)
+    return http_response.format_200_response(
+        {'content-type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        json.dumps({"expires_in": expires_in, "documents": presigned}))
+
 # The response from get_presigned_post_url looks something like this:
 # {
 # 	"url": "https://project-ocr-cies-bucket-source-local.s3.amazonaws.com/",
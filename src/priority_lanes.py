@@ -0,0 +1,61 @@
+# This module defines the priority lanes in front of the submission of documents to Textract.
+# Interactive uploads (one document, a person waiting for it) and bulk loads (backfills of thousands of documents)
+# share the S3 trigger and the Textract quota. Rather than submitting every new document at once, the submission
+# handler routes it to the queue of its lane, from the 'priority' metadata of the document:
+#   interactive  the default, submitted as soon as it is received
+#   bulk         submitted only while the interactive queue has no backlog, otherwise it is deferred
+# Each lane is consumed by ocr_dispatch_handler through its own event source mapping, whose MaximumConcurrency
+# caps the submissions of the lane, so a bulk load can never take all of the Textract quota.
+# A deferred bulk submission is sent to the bulk queue again with a delay, rather than returned to the queue as a
+# failure, so that it does not count towards the receives that move a message to the dead letter queue.
+
+import json
+from datetime import datetime, timezone
+import os
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# The lane of documents without a (recognised) priority
+DEFAULT_PRIORITY = os.getenv('DEFAULT_PRIORITY', INTERACTIVE)
+# Bulk submissions are deferred while more than this many interactive submissions are waiting
+BULK_DEFER_BACKLOG = int(os.getenv('BULK_DEFER_BACKLOG', '0'))
+# The delay of a deferred bulk submission, SQS allows at most 900 seconds
+BULK_DEFER_SECONDS = min(int(os.getenv('BULK_DEFER_SECONDS', '60')), 900)
+# The depth of the interactive queue is read at most this often by an instance
+BACKLOG_CACHE_SECONDS = int(os.getenv('BACKLOG_CACHE_SECONDS', '5'))
+
+
+# The lane of a priority, e.g. the value of the x-amz-meta-priority metadata or of the Priority header
+def lane_of(priority: str) -> str:
+    priority = (priority or "").strip().lower()
+    return priority if priority in LANES else DEFAULT_PRIORITY
+
+
+# The message of a submission. enqueued_at is when the document was stored, it is kept when the submission
+# is deferred, so that the latency of a submission includes the time it spent in its queue(s).
+def build_submission(document_id: str, site_id: str, lane: str, enqueued_at: str = None) -> str:
+    if enqueued_at is None:
+        enqueued_at = datetime.now(timezone.utc).isoformat()
+    return json.dumps({"document_id": document_id, "site_id": site_id, "lane": lane, "enqueued_at": enqueued_at})
+
+
+def parse_submission(body: str) -> dict:
+    submission = json.loads(body)
+    if not submission.get("document_id"):
+        raise ValueError("a submission must have a document_id")
+    submission["lane"] = lane_of(submission.get("lane"))
+    return submission
+
+
+# Milliseconds from when the document was stored until now
+def latency_ms(enqueued_at: str, now: datetime = None) -> float:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    # S3 event times end with 'Z'
+    stored = datetime.fromisoformat(enqueued_at.replace("Z", "+00:00"))
+    return max(0.0, (now - stored).total_seconds() * 1000)
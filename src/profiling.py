@@ -0,0 +1,184 @@
+# This module profiles an invocation on request, so that a slow completion or text request in production can be
+# looked at with more than its logs. A profiled invocation runs under cProfile and tracemalloc, and when it ends
+# its profile is written to the PROFILE_BUCKET (the destination bucket by default) under
+#   diagnostics/<correlation id>/<handler>-<unix ms>.prof   the cProfile stats, for pstats or snakeviz
+#   diagnostics/<correlation id>/<handler>-<unix ms>.txt    the slowest functions and the top allocation sites
+# The correlation id is that of the logger, the request id of an API request, or the document id of a document.
+# An invocation is profiled when
+#   the request has the PROFILE_HEADER header, e.g. X-Cies-Profile: true, when an operator has configured one. Any
+#   caller of the API may send a header, so it is off by default and its name should not be guessable.
+#   its correlation id is sampled at PROFILE_SAMPLE_RATE (0.0 - 1.0), by the same hash as logging_policy
+# and the completion of a document of PROFILE_MIN_PAGES pages or more (0 for none) is profiled from the point its
+# Textract result has been read, which is when its pages are known, see document_profile.
+# cProfile profiles the thread it is enabled in, so the completions of a batch, which run in a pool, are profiled
+# each in its own thread when their invocation is profiled. tracemalloc traces every thread, the allocation sites
+# of a profile made while other threads run include theirs.
+# When nothing asks for a profile the cost is a header lookup and, with a sample rate, a hash of the correlation id.
+
+import cProfile
+import functools
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+from aws_lambda_powertools import Logger
+
+import instrumentation
+import logging_policy
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MIN_PAGES = int(os.getenv('PROFILE_MIN_PAGES', '0'))
+PROFILE_BUCKET = os.getenv('PROFILE_BUCKET', os.getenv('DESTINATION_BUCKET', ''))
+PROFILE_PREFIX = os.getenv('PROFILE_PREFIX', 'diagnostics')
+PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', '40'))
+PROFILE_TOP_ALLOCATIONS = int(os.getenv('PROFILE_TOP_ALLOCATIONS', '25'))
+# the frames kept of each allocation, more frames cost more memory while tracing
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '5'))
+
+REASON_HEADER = "header"
+REASON_SAMPLED = "sampled"
+REASON_PAGES = "pages"
+REASON_INVOCATION = "invocation"
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+_lock = threading.Lock()
+# the profiles which hold tracemalloc, it is stopped when the last of them ends unless it was started elsewhere
+_tracing = 0
+_started_tracing = False
+# the correlation id of the invocation being profiled, None when it is not
+_invocation = None
+# whether the thread is profiled, a thread is profiled once at a time
+_thread = threading.local()
+# returns the S3 client the profiles are written with, see set_client
+_get_client = None
+
+
+# Sets the function which returns the S3 client the profiles are written with, e.g. by CiesOcrCore
+def set_client(get_client):
+    global _get_client
+    _get_client = get_client
+
+
+# Returns why the invocation is to be profiled, None when it is not
+def invocation_reason(event, correlation_id: str):
+    headers = event.get("headers") if isinstance(event, dict) else None
+    if PROFILE_HEADER and headers:
+        value = next((value for name, value in headers.items() if name.lower() == PROFILE_HEADER.lower()), None)
+        if value is not None and str(value).lower() not in ("", "0", "false", "no"):
+            return REASON_HEADER
+    if logging_policy.is_debug_sampled(correlation_id, PROFILE_SAMPLE_RATE):
+        return REASON_SAMPLED
+    return None
+
+
+def is_profiling() -> bool:
+    return getattr(_thread, "active", False)
+
+
+# Profiles the code it wraps and writes the profile. Does nothing in a thread which is already profiled.
+@contextmanager
+def profiled(correlation_id: str, reason: str):
+    global _tracing, _started_tracing
+    if is_profiling():
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # another profiler holds the interpreter
+        logger.warning(f"{correlation_id} is not profiled: {e}")
+        yield
+        return
+    _thread.active = True
+    with _lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _started_tracing = True
+        _tracing += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        snapshot, peak = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1]
+        with _lock:
+            _tracing -= 1
+            if _tracing == 0 and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+        _thread.active = False
+        write_profile(correlation_id, reason, profiler, snapshot, peak, elapsed_ms)
+
+
+# Decorates a Lambda handler, below instrumented_handler, so that the invocation is profiled when it is asked for
+def profiled_handler(logger):
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            global _invocation
+            correlation_id = logger.get_correlation_id() or getattr(context, "aws_request_id", None)
+            reason = invocation_reason(event, correlation_id)
+            if reason is None:
+                return lambda_handler(event, context)
+            _invocation = correlation_id
+            try:
+                with profiled(correlation_id, reason):
+                    return lambda_handler(event, context)
+            finally:
+                _invocation = None
+        return wrapper
+    return decorator
+
+
+# Profiles the completion of a document from the point its pages are known, when it has PROFILE_MIN_PAGES pages or
+# more, or when its invocation is profiled and it is completed in another thread
+def document_profile(document_id: str, pages: int):
+    if PROFILE_MIN_PAGES > 0 and pages and pages >= PROFILE_MIN_PAGES:
+        return profiled(document_id, REASON_PAGES)
+    if _invocation is not None and not is_profiling():
+        return profiled(document_id, REASON_INVOCATION)
+    return nullcontext()
+
+
+# Returns the report of a profile, the slowest functions by cumulative time and the top allocation sites
+def render_report(correlation_id: str, reason: str, profiler: cProfile.Profile, snapshot, peak: int, elapsed_ms: float) -> str:
+    report = io.StringIO()
+    report.write(f"correlation id: {correlation_id}\nhandler: {instrumentation.handler_name()}\nreason: {reason}\n")
+    report.write(f"elapsed: {elapsed_ms:.1f} ms\ntraced memory peak: {peak} bytes\n\n")
+    pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+    report.write(f"top {PROFILE_TOP_ALLOCATIONS} allocation sites\n")
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    for statistic in snapshot.filter_traces(filters).statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+        report.write(f"{statistic}\n")
+    return report.getvalue()
+
+
+# Writes the profile and its report, an error is logged rather than raised
+def write_profile(correlation_id: str, reason: str, profiler: cProfile.Profile, snapshot, peak: int, elapsed_ms: float):
+    try:
+        report = render_report(correlation_id, reason, profiler, snapshot, peak, elapsed_ms)
+        profiler.create_stats()
+        key = f"{PROFILE_PREFIX}/{correlation_id}/{instrumentation.handler_name()}-{int(time.time() * 1000)}"
+        client = _get_client()
+        client.put_object(Bucket=PROFILE_BUCKET, Key=f"{key}.prof", Body=marshal.dumps(profiler.stats),
+                           ContentType="application/octet-stream")
+        client.put_object(Bucket=PROFILE_BUCKET, Key=f"{key}.txt", Body=report.encode("utf-8"),
+                          ContentType="text/plain")
+        logger.info(f"profiled {correlation_id} ({reason}) in {elapsed_ms:.0f} ms, see s3://{PROFILE_BUCKET}/{key}.txt")
+    except Exception as e:
+        logger.error(f"Error writing the profile of {correlation_id}: {e}")
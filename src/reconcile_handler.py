@@ -0,0 +1,46 @@
+import os
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+
+from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# The outcomes of reconcile_pending_job that are reported as metrics
+RECONCILE_OUTCOMES = ["completed", "failed", "in_progress", "resubmitted", "cleared", "error"]
+
+# ============================================================================================================
+# This Lambda handler is triggered on a schedule.
+# It completes the documents that are still 'Submitted' after RECONCILE_DEADLINE_SECONDS, which happens when
+# the Textract notification is lost or ocr_completion_queue_handler fails part way through a completion.
+# It also aborts the multipart uploads which were abandoned more than MULTIPART_STALE_SECONDS ago.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("reconcile_handler")
+def lambda_handler(event, context):
+    summary = cies_ocr_core.reconcile_pending_jobs()
+
+    metrics.add_metric(name="ReconcileChecked", unit=MetricUnit.Count, value=summary["checked"])
+    metrics.add_metric(name="ReconcileLag", unit=MetricUnit.Seconds, value=summary["lag_seconds"])
+    for outcome in RECONCILE_OUTCOMES:
+        metrics.add_metric(name=f"Reconcile{outcome.title().replace('_', '')}", unit=MetricUnit.Count, value=summary.get(outcome, 0))
+
+    summary["aborted_uploads"] = cies_ocr_core.abort_stale_multipart_uploads()
+    metrics.add_metric(name="MultipartUploadsAborted", unit=MetricUnit.Count, value=summary["aborted_uploads"])
+    return summary
@@ -0,0 +1,110 @@
+import json
+import math
+import os
+from urllib.parse import unquote_plus
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.logging import correlation_paths
+
+from cies_ocr_core import CiesOcrCore
+from cies_ocr_core import METADATA_KEY_SITE_ID
+import instrumentation
+import logging_policy
+from logging_policy import payload
+import http_response
+import region_index
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'),
+    os.getenv('DESTINATION_BUCKET'),
+    os.getenv('TEXTRACT_SERVICE_ROLE'),
+    os.getenv('TEXTRACT_STATUS_TOPIC'),
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# The text of a region of a page of a document: GET https://service.domain.tld/text/<document_id>/region?page=<n>&...
+#   box=<left>,<top>,<right>,<bottom>[&kind=word|line]   the words (or lines) whose centre is within the box
+#   x=<x>&y=<y>[&count=<n>]                              the n lines nearest the point, nearest first
+# Coordinates are ratios of the width and height of the page, as in the Textract results. The query is answered
+# from the region index of the document (see region_index.py), the Textract result is not read.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("region_handler")
+def lambda_handler(event, context) -> dict:
+    logger.debug("OCR API - Inside region lambda: event %s context %s", payload(event), context)
+
+    try:
+        # the path is expected to be something like: /text/<document_id>/region
+        document_id = event.get("path", "").rstrip("/").split("/")[-2]
+        headers = cies_ocr_core.get_headers(event)
+        site_id = headers.get('SITEID', headers.get(METADATA_KEY_SITE_ID.upper(), "unknown"))
+
+        # ALB does not URL decode query string parameters
+        parameters = {name: unquote_plus(value) for name, value in (event.get("queryStringParameters") or {}).items()}
+        try:
+            query = parse_query(parameters)
+        except ValueError as e:
+            return http_response.format_400_response(str(e))
+
+        arrays = cies_ocr_core.get_region_index(document_id, site_id)
+        if arrays is None:
+            return http_response.format_404_response(document_id)
+
+        if "box" in query:
+            results = region_index.query_box(arrays, query["kind"], query["page"], query["box"])
+        else:
+            results = region_index.query_nearest(arrays, query["page"], query["x"], query["y"], query["count"])
+        logger.debug(f"{len(results)} {query['kind']}s of page {query['page']} of {document_id}")
+        body = {"document_id": document_id, "page": query["page"], "kind": query["kind"], "results": results}
+        return http_response.format_200_response({"Content-Type": "application/json"}, json.dumps(body))
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return http_response.format_500_response(str(e))
+
+
+# Returns the query of the parameters, raises ValueError with the message returned to the client
+def parse_query(parameters: dict) -> dict:
+    try:
+        query = {"page": int(parameters.get("page", ""))}
+    except ValueError:
+        raise ValueError("the query parameter 'page' is required, and must be an integer")
+    if "box" in parameters:
+        try:
+            box = tuple(float(value) for value in parameters["box"].split(","))
+        except ValueError:
+            box = ()
+        # a nan coordinate is not ordered against the others, so it is rejected here rather than failing the query
+        if len(box) != 4 or not all(math.isfinite(value) for value in box) or box[0] > box[2] or box[1] > box[3]:
+            raise ValueError("the query parameter 'box' must be <left>,<top>,<right>,<bottom>")
+        kind = parameters.get("kind", region_index.LINE)
+        if kind not in region_index.KINDS:
+            raise ValueError(f"the query parameter 'kind' must be {region_index.WORD} or {region_index.LINE}")
+        return dict(query, box=box, kind=kind)
+    try:
+        query = dict(query, x=float(parameters["x"]), y=float(parameters["y"]), count=int(parameters.get("count", "1")),
+                     kind=region_index.LINE)
+    except (KeyError, ValueError):
+        raise ValueError("either the query parameter 'box', or 'x' and 'y', are required")
+    if not (math.isfinite(query["x"]) and math.isfinite(query["y"])):
+        raise ValueError("the query parameters 'x' and 'y' must be finite numbers")
+    if query["count"] < 1:
+        raise ValueError("the query parameter 'count' must be at least 1")
+    return query
+
+# The response body looks something like this:
+# {
+#   "document_id": "1DAE93F8-646C-43B7-9981-9B41AE047880",
+#   "page": 2,
+#   "kind": "line",
+#   "results": [
+#     {"text": "MRN JD4USARAD", "page": 2, "box": [0.05, 0.035, 0.21, 0.045], "confidence": 99.1, "distance": 0.0}
+#   ]
+# }
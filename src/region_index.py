@@ -0,0 +1,144 @@
+# This module implements the spatial index of the words and lines of a document, it answers "the text within this
+# box of page 2" and "the lines nearest this point of page 2" without the Textract result being read. The form
+# filling tools used to fetch the whole .json result and walk every block for each field.
+# The index is built when the results of a document are stored, and is stored next to them:
+#   <result key>.region.npz    a numpy archive (no pickled objects) of the arrays below
+# For each kind of block (WORD and LINE), sorted by page, then top, then left:
+#   <kind>_boxes           float32 (n, 4)   left, top, right, bottom as ratios of the page, as Textract gives them
+#   <kind>_confidence      float32 (n)
+#   <kind>_text            uint8            the UTF-8 text of the blocks, concatenated
+#   <kind>_text_offsets    int64 (n + 1)    block i is text[offsets[i]:offsets[i + 1]]
+#   <kind>_page_offsets    int64 (pages + 2) the blocks of page p are [page_offsets[p], page_offsets[p + 1])
+#   <kind>_cell_offsets    int64 (pages * GRID_SIZE * GRID_SIZE + 1)
+#   <kind>_cell_blocks     int32            a uniform grid over each page, the blocks overlapping each cell (CSR)
+# A box query reads the cells the box overlaps, then tests the candidate blocks against the box with numpy.
+# A block is within a box when its centre is, so a word cut by the edge of a field is selected once.
+
+import io
+
+import numpy as np
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+REGION_SUFFIX = ".region.npz"
+WORD = "word"
+LINE = "line"
+KINDS = {WORD: "WORD", LINE: "LINE"}
+# the cells of the grid over a page, per side
+GRID_SIZE = 16
+# the blocks returned by a query, at most
+MAX_RESULTS = 1000
+
+
+# ====================================================================================================
+# Building the index
+# ====================================================================================================
+# Returns the arrays of the index of a Textract result
+def build(textract_json: dict) -> dict:
+    pages = max([block.get("Page", 1) for block in textract_json.get("Blocks", [])] or [0])
+    arrays = {}
+    for kind, block_type in KINDS.items():
+        blocks = [block for block in textract_json.get("Blocks", []) if block.get("BlockType") == block_type]
+        blocks.sort(key=lambda block: (block.get("Page", 1), _box(block)[1], _box(block)[0]))
+        arrays.update(_build_kind(kind, blocks, pages))
+    return arrays
+
+
+def _box(block: dict) -> tuple:
+    box = block.get("Geometry", {}).get("BoundingBox", {})
+    left = box.get("Left", 0.0)
+    top = box.get("Top", 0.0)
+    return left, top, left + box.get("Width", 0.0), top + box.get("Height", 0.0)
+
+
+def _build_kind(kind: str, blocks: list, pages: int) -> dict:
+    boxes = np.array([_box(block) for block in blocks], dtype=np.float32).reshape(-1, 4)
+    block_pages = np.array([block.get("Page", 1) for block in blocks], dtype=np.int64)
+    text = [block.get("Text", "").encode("utf-8") for block in blocks]
+
+    cells = [[] for _ in range(pages * GRID_SIZE * GRID_SIZE)]
+    for index, (left, top, right, bottom) in enumerate(_cell_ranges(boxes)):
+        base = (block_pages[index] - 1) * GRID_SIZE * GRID_SIZE
+        for row in range(top, bottom + 1):
+            for column in range(left, right + 1):
+                cells[base + row * GRID_SIZE + column].append(index)
+
+    return {
+        f"{kind}_boxes": boxes,
+        f"{kind}_confidence": np.array([block.get("Confidence", 0.0) for block in blocks], dtype=np.float32),
+        f"{kind}_text": np.frombuffer(b"".join(text), dtype=np.uint8),
+        f"{kind}_text_offsets": np.concatenate([[0], np.cumsum([len(value) for value in text], dtype=np.int64)]).astype(np.int64),
+        f"{kind}_page_offsets": np.searchsorted(block_pages, np.arange(0, pages + 2), side="left").astype(np.int64),
+        f"{kind}_cell_offsets": np.concatenate([[0], np.cumsum([len(cell) for cell in cells], dtype=np.int64)]).astype(np.int64),
+        f"{kind}_cell_blocks": np.array([index for cell in cells for index in cell], dtype=np.int32),
+    }
+
+
+# The (left, top, right, bottom) cells of boxes, as rows of integers
+def _cell_ranges(boxes: np.ndarray) -> list:
+    return np.clip(np.floor(boxes * GRID_SIZE), 0, GRID_SIZE - 1).astype(np.int64).tolist()
+
+
+# The stored form of the index
+def dumps(arrays: dict) -> bytes:
+    output = io.BytesIO()
+    np.savez_compressed(output, **arrays)
+    return output.getvalue()
+
+
+def loads(body: bytes) -> dict:
+    with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+# ====================================================================================================
+# Queries
+# ====================================================================================================
+def page_count(arrays: dict) -> int:
+    return len(arrays[f"{LINE}_page_offsets"]) - 2
+
+
+# The blocks of a kind whose centre is within the box (left, top, right, bottom) of a page, in reading order
+def query_box(arrays: dict, kind: str, page: int, box: tuple) -> list:
+    if not 1 <= page <= page_count(arrays):
+        return []
+    left, top, right, bottom = box
+    cell_left, cell_top, cell_right, cell_bottom = _cell_ranges(np.array([box], dtype=np.float32))[0]
+    cells = (page - 1) * GRID_SIZE * GRID_SIZE + (np.arange(cell_top, cell_bottom + 1)[:, None] * GRID_SIZE
+                                                 + np.arange(cell_left, cell_right + 1)[None, :]).ravel()
+    offsets = arrays[f"{kind}_cell_offsets"]
+    cell_blocks = arrays[f"{kind}_cell_blocks"]
+    candidates = np.unique(np.concatenate([cell_blocks[offsets[cell]:offsets[cell + 1]] for cell in cells]))
+
+    boxes = arrays[f"{kind}_boxes"][candidates]
+    centre_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    centre_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    inside = (centre_x >= left) & (centre_x <= right) & (centre_y >= top) & (centre_y <= bottom)
+    # np.unique sorts the candidates, which is the reading order of the blocks
+    return [_block(arrays, kind, index, page) for index in candidates[inside][:MAX_RESULTS]]
+
+
+# The count lines of a page nearest the point (x, y), nearest first, with their distance
+def query_nearest(arrays: dict, page: int, x: float, y: float, count: int = 1) -> list:
+    if not 1 <= page <= page_count(arrays):
+        return []
+    offsets = arrays[f"{LINE}_page_offsets"]
+    start, end = offsets[page], offsets[page + 1]
+    boxes = arrays[f"{LINE}_boxes"][start:end]
+    # the distance to a box is 0 within it
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    distance = np.hypot(dx, dy)
+    count = min(count, MAX_RESULTS, len(distance))
+    nearest = np.argsort(distance, kind="stable")[:count]
+    return [dict(_block(arrays, LINE, start + index, page), distance=round(float(distance[index]), 6)) for index in nearest]
+
+
+def _block(arrays: dict, kind: str, index: int, page: int) -> dict:
+    offsets = arrays[f"{kind}_text_offsets"]
+    text = arrays[f"{kind}_text"][offsets[index]:offsets[index + 1]].tobytes().decode("utf-8")
+    return {"text": text,
+            "page": page,
+            "box": [round(float(value), 6) for value in arrays[f"{kind}_boxes"][index]],
+            "confidence": round(float(arrays[f"{kind}_confidence"][index]), 3)}
@@ -0,0 +1,249 @@
+# This module makes the S3, SQS, SNS and Textract calls of the core resilient to the brownouts of a service. Every
+# call used to succeed or raise straight through, and while Textract was failing every invocation waited out its
+# timeout on calls which could not succeed.
+# The outcome of each call is classified:
+#   throttle    the service is throttling the caller (see overload.THROTTLE_CODES)
+#   transient   a 5xx, a timeout or a connection error, the call may succeed if it is made again
+#   permanent   any other error, e.g. NoSuchKey or AccessDenied, which the service answered normally
+# The throttled and transient calls are retried by botocore in its adaptive mode (see CLIENT_CONFIG): the retries are
+# delayed by an exponential backoff with full jitter, spent from a retry quota (a budget which a success refills a
+# little, so a failing service is not retried by every call), and the client also slows the rate of its calls while
+# the service throttles it. The connect and read timeouts are bounded so that a call fails well before the handler.
+# A circuit breaker per operation (e.g. textract.StartDocumentAnalysis) sees the outcome of each call after the
+# retries. CIRCUIT_FAILURE_THRESHOLD consecutive throttled or transient failures open the circuit, and for
+# CIRCUIT_OPEN_SECONDS the calls of the operation fail at once with CircuitOpen, without calling the service.
+# The first call after that is a probe: its success closes the circuit, its failure opens it again. A permanent error
+# is an answer of the service, it does not count as a failure.
+# CircuitOpen is an overload.Overloaded, a 503 with a Retry-After of the seconds until the probe to the HTTP routes,
+# and an error of the message to the queue handlers, whose messages are received again later.
+# The hooks are registered on botocore clients (see protect_client), so the calls made by paginators and by
+# textractcaller are protected too. The counters of each operation are written as EMF records with the AWS call
+# metrics, with the dimension operation "resilience.<service>.<operation>":
+#   Calls, Retries, Failures    the calls, the attempts botocore retried, the throttled or transient failures
+#   ShortCircuited              the calls failed at once by the open circuit
+#   CircuitOpened               the times the circuit opened
+
+import math
+import os
+import threading
+import time
+
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+from botocore.client import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+import instrumentation
+import overload
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+# The attempts of a call, the first included, see botocore's retries modes
+RETRY_MODE = os.getenv('RETRY_MODE', 'adaptive')
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv('CONNECT_TIMEOUT_SECONDS', '5'))
+READ_TIMEOUT_SECONDS = float(os.getenv('READ_TIMEOUT_SECONDS', '20'))
+
+# The config of the clients, merged with their own
+CLIENT_CONFIG = Config(retries={"mode": RETRY_MODE, "total_max_attempts": RETRY_MAX_ATTEMPTS},
+                       connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS)
+
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+
+class CircuitOpen(overload.Overloaded):
+    def __init__(self, operation: str, retry_after: int):
+        super().__init__(503, retry_after, f"the circuit of {operation} is open, it is failing")
+        self.operation = operation
+
+
+# Returns the class of the outcome of a failed call, the error code and HTTP status of an error response or the exception
+def classify(code: str = None, status: int = None, exception: Exception = None) -> str:
+    if isinstance(exception, ClientError):
+        code = exception.response.get("Error", {}).get("Code")
+        status = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    elif isinstance(exception, (ConnectionError, HTTPClientError)):
+        return TRANSIENT
+    elif exception is not None:
+        return PERMANENT
+    if code in overload.THROTTLE_CODES or status == 429:
+        return THROTTLE
+    if status is not None and status >= 500 or code in ("InternalError", "InternalFailure", "InternalServerError", "RequestTimeout"):
+        return TRANSIENT
+    return PERMANENT
+
+
+class CircuitBreaker:
+    def __init__(self, operation: str, failure_threshold: int, open_seconds: float, clock):
+        self.operation = operation
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    # Raises CircuitOpen when the call must not be made. Called with the lock of the CircuitBreakers held.
+    def before_call(self):
+        if self.state == CLOSED:
+            return
+        remaining = self.opened_at + self.open_seconds - self.clock()
+        if self.state == OPEN and remaining <= 0:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        raise CircuitOpen(self.operation, max(1, math.ceil(remaining)))
+
+    # Records the outcome of a call, None for a success, returns True when it opened the circuit
+    def after_call(self, outcome: str) -> bool:
+        if outcome in (THROTTLE, TRANSIENT):
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                opened = self.state != OPEN
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self.probing = False
+                return opened
+            return False
+        self.failures = 0
+        self.state = CLOSED
+        self.probing = False
+        return False
+
+
+class CircuitBreakers:
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        # operation -> CircuitBreaker
+        self.breakers = {}
+        # operation -> {"Calls": n, "Retries": n, "Failures": n, "ShortCircuited": n, "CircuitOpened": n}
+        self.counters = {}
+
+    def _breaker(self, operation: str) -> CircuitBreaker:
+        breaker = self.breakers.get(operation)
+        if breaker is None:
+            breaker = self.breakers[operation] = CircuitBreaker(operation, self.failure_threshold, self.open_seconds, self.clock)
+        return breaker
+
+    def _count(self, operation: str, name: str, value: int = 1):
+        counters = self.counters.setdefault(operation, {"Calls": 0, "Retries": 0, "Failures": 0, "ShortCircuited": 0, "CircuitOpened": 0})
+        counters[name] += value
+
+    def state(self, operation: str) -> str:
+        with self.lock:
+            return self._breaker(operation).state
+
+    # Whether the calls of the operation would fail at once now
+    def is_open(self, operation: str) -> bool:
+        with self.lock:
+            breaker = self._breaker(operation)
+            return breaker.state == OPEN and breaker.clock() < breaker.opened_at + breaker.open_seconds
+
+    def before_call(self, operation: str):
+        with self.lock:
+            self._count(operation, "Calls")
+            try:
+                self._breaker(operation).before_call()
+            except CircuitOpen:
+                self._count(operation, "ShortCircuited")
+                raise
+
+    # Records the outcome of a call, None for a success
+    def after_call(self, operation: str, outcome: str, retries: int = 0):
+        with self.lock:
+            self._count(operation, "Retries", retries)
+            if outcome in (THROTTLE, TRANSIENT):
+                self._count(operation, "Failures")
+            opened = self._breaker(operation).after_call(outcome)
+            if opened:
+                self._count(operation, "CircuitOpened")
+        if opened:
+            logger.warning(f"opened the circuit of {operation} for {self.open_seconds}s, after a {outcome} failure")
+
+    # Returns the counters, and clears them
+    def take_counters(self) -> dict:
+        with self.lock:
+            counters = self.counters
+            self.counters = {}
+        return counters
+
+    def flush_metrics(self):
+        for operation, counters in self.take_counters().items():
+            try:
+                emf = EphemeralMetrics(namespace=instrumentation.METRICS_NAMESPACE, service=instrumentation.METRICS_SERVICE)
+                emf.add_dimensions(environment=instrumentation.ENVIRONMENT, handler=instrumentation.handler_name(),
+                                   operation=f"resilience.{operation}")
+                for name, count in counters.items():
+                    emf.add_metric(name=name, unit=MetricUnit.Count, value=count)
+                emf.flush_metrics()
+            except Exception as e:
+                logger.warning(f"Error writing resilience metrics for {operation}: {e}")
+
+
+# The circuit breakers of the process, shared by its clients
+breakers = CircuitBreakers()
+instrumentation.on_flush(breakers.flush_metrics)
+
+
+# ====================================================================================================
+# AWS client hooks
+# ====================================================================================================
+# The name of the circuit of an operation, e.g. textract.StartDocumentAnalysis, or textract.StartDocumentAnalysis@us-west-2
+# for the client of another region
+def operation_name(operation: str, scope: str = None) -> str:
+    return f"{operation}@{scope}" if scope else operation
+
+
+# Registers the circuit breaker hooks on a boto3 client, returns the client. before-call is emitted once for a call,
+# after-call and after-call-error once for its outcome, after botocore's retries. The circuits of a client with a
+# scope are its own, e.g. those of the client of another region.
+def protect_client(client, circuit_breakers: CircuitBreakers = None, scope: str = None):
+    circuit_breakers = circuit_breakers or breakers
+
+    def before_call(model=None, context=None, **kwargs):
+        operation = operation_name(f"{model.service_model.service_id.hyphenize()}.{model.name}", scope)
+        circuit_breakers.before_call(operation)
+        if context is not None:
+            context["cies_circuit"] = operation
+
+    def after_call(http_response=None, parsed=None, context=None, **kwargs):
+        if context is None or "cies_circuit" not in context:
+            return
+        parsed = parsed or {}
+        outcome = None
+        if http_response is not None and http_response.status_code >= 300:
+            outcome = classify(parsed.get("Error", {}).get("Code"), http_response.status_code)
+        circuit_breakers.after_call(context.pop("cies_circuit"), outcome,
+                                    parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+
+    def after_call_error(exception=None, context=None, **kwargs):
+        if context is None or "cies_circuit" not in context:
+            return
+        circuit_breakers.after_call(context.pop("cies_circuit"), classify(exception=exception))
+
+    events = client.meta.events
+    events.register("before-call", before_call, unique_id="cies-resilience-before-call")
+    events.register("after-call", after_call, unique_id="cies-resilience-after-call")
+    events.register("after-call-error", after_call_error, unique_id="cies-resilience-after-call-error")
+    return client
@@ -0,0 +1,117 @@
+# This module caches result artifacts (the .json, .compact.json and .region.npz objects of the destination bucket)
+# on the local disk of a warm instance, /tmp of a Lambda or the disk of a container host. The popular documents
+# used to be read from S3 by every request.
+# An artifact is cached under its key and its ETag, and a lookup is made with the ETag of the current object,
+# which the caller has from the HEAD it makes anyway (see get_result_metadata). A replaced result has another
+# ETag, so it is never served stale, and the previous body is dropped. The cache is bounded by bytes, the least
+# recently used artifacts are evicted first, and the bodies are read from their file unbuffered, in one read
+# into a bytes object of the size of the file.
+# Each file is written to a temporary name then renamed, so a reader never sees a partial file. The index is in
+# memory, the files of a previous process are removed when the cache is first used.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+RESULT_CACHE_DIRECTORY = os.getenv('RESULT_CACHE_DIRECTORY', os.path.join(tempfile.gettempdir(), "cies-results"))
+# 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# A larger artifact is not cached, it would evict too many others
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESULT_CACHE_MAX_ENTRY_BYTES', str(64 * 1024 * 1024)))
+
+
+class ResultCache:
+    def __init__(self, directory: str = RESULT_CACHE_DIRECTORY, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.lock = threading.Lock()
+        # (bucket, key) -> (etag, path, size), the least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.prepared = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # Returns the cached body of the object with the given ETag, or None
+    def get(self, bucket: str, key: str, etag: str) -> bytes:
+        with self.lock:
+            entry = self.entries.get((bucket, key))
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((bucket, key))
+            self.hits += 1
+        try:
+            # an unbuffered file is read with one copy, from the page cache into the body
+            with open(entry[1], "rb", buffering=0) as file:
+                return file.read()
+        except OSError:
+            # evicted by another thread since the lookup
+            with self.lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    # Caches the body of the object with the given ETag, in place of any other version of the object
+    def put(self, bucket: str, key: str, etag: str, body: bytes):
+        if not self.enabled or not etag or len(body) > self.max_entry_bytes:
+            return
+        self._prepare()
+        path = os.path.join(self.directory, hashlib.sha256(f"{bucket}/{key}\n{etag}".encode("utf-8")).hexdigest())
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+                file.write(body)
+            os.replace(file.name, path)
+        except OSError:
+            return
+
+        removed = []
+        with self.lock:
+            previous = self.entries.pop((bucket, key), None)
+            if previous is not None:
+                self.bytes -= previous[2]
+                if previous[1] != path:
+                    removed.append(previous[1])
+            self.entries[(bucket, key)] = (etag, path, len(body))
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_path, size) = self.entries.popitem(last=False)
+                self.bytes -= size
+                removed.append(evicted_path)
+        for removed_path in removed:
+            try:
+                os.remove(removed_path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            paths = [entry[1] for entry in self.entries.values()]
+            self.entries.clear()
+            self.bytes = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prepare(self):
+        if self.prepared:
+            return
+        with self.lock:
+            if not self.prepared:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                os.makedirs(self.directory, exist_ok=True)
+                self.prepared = True
@@ -0,0 +1,76 @@
+import json
+import os
+from urllib.parse import unquote_plus
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.logging import correlation_paths
+
+from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+from logging_policy import payload
+import http_response
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'), 
+    os.getenv('DESTINATION_BUCKET'), 
+    os.getenv('TEXTRACT_SERVICE_ROLE'), 
+    os.getenv('TEXTRACT_STATUS_TOPIC'), 
+    os.getenv("AWS_REGION"))
+
+# The maximum number of documents returned from one search
+MAX_SEARCH_RESULTS = 1000
+
+# ============================================================================================================
+# Full text search of the OCR results of a site: GET https://service.domain.tld/search?q=<query>&limit=<n>
+# The site is identified by the 'Siteid' header. The query is answered from the search index segments,
+# the OCR'd text objects are not read. Every term of the query must appear on a page for it to match.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
+@metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("search_handler")
+def lambda_handler(event, context) -> dict:
+    logger.debug("OCR API - Inside search lambda: event %s context %s", payload(event), context)
+
+    try:
+        headers = cies_ocr_core.get_headers(event)
+        site_id = headers.get('SITEID') if "SITEID" in headers else "unknown"
+
+        # ALB does not URL decode query string parameters
+        parameters = event.get("queryStringParameters") or {}
+        query = unquote_plus(parameters.get("q", ""))
+        if not query.strip():
+            return http_response.format_400_response("the query parameter 'q' is required")
+        try:
+            limit = min(int(parameters.get("limit", "100")), MAX_SEARCH_RESULTS)
+        except ValueError:
+            return http_response.format_400_response("the query parameter 'limit' must be an integer")
+
+        logger.debug(f"search site_id={site_id}, query={query}, limit={limit}")
+        results = cies_ocr_core.search(site_id, query, limit)
+        body = {"site_id": site_id, "query": query, "results": results}
+        return http_response.format_200_response({"Content-Type": "application/json"}, json.dumps(body))
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return http_response.format_500_response(str(e))
+
+# The response body looks something like this:
+# {
+#   "site_id": "site-r",
+#   "query": "metastasis liver",
+#   "results": [
+#     {
+#       "document_id": "1DAE93F8-646C-43B7-9981-9B41AE047880",
+#       "pages": [
+#         {"page": 2, "positions": {"liver": [212, 265], "metastasis": [33, 201, 248]}}
+#       ]
+#     }
+#   ]
+# }
@@ -0,0 +1,276 @@
+# This module implements the full text index over the OCR results.
+# The index is partitioned by site_id and is stored as immutable segment files in the destination bucket:
+#   index/<site_id>/<timestamp>-<level>-<unique>.seg
+# Each completed document is written as a small (level 0) segment. Periodically all of the segments of
+# a site are merged into one larger segment. A document that is re-OCR'd appears in more than one
+# segment, the newest segment (segment names sort by creation time) is authoritative for a document.
+#
+# Segment layout (all integers are unsigned LEB128 varints, strings are length prefixed UTF-8):
+#   magic                 b"CIESIDX1"
+#   document count        followed by each document_id, documents are referred to by ordinal
+#   term count            followed by, for each term in sorted order: term, postings offset, postings length
+#   postings              for each term a posting list, which is a sequence of:
+#                           document ordinal delta, page, position count, position deltas...
+# Positions are the ordinal of the token within the page text.
+
+import re
+import uuid
+from datetime import datetime, timezone
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+SEGMENT_MAGIC = b"CIESIDX1"
+SEGMENT_SUFFIX = ".seg"
+INDEX_PREFIX = "index/"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# ====================================================================================================
+# Tokenization
+# ====================================================================================================
+# Returns the lower case alphanumeric tokens of the text, e.g. "3.2 cm Metastasis" -> ["3", "2", "cm", "metastasis"]
+def tokenize(text: str) -> list:
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+# ====================================================================================================
+# Segment names and keys
+# ====================================================================================================
+def site_index_prefix(site_id: str) -> str:
+    return f"{INDEX_PREFIX}{site_id or 'unknown'}/"
+
+
+def create_segment_key(site_id: str, level: int = 0, timestamp: str = None) -> str:
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return f"{site_index_prefix(site_id)}{timestamp}-{level:02d}-{uuid.uuid4().hex[:12]}{SEGMENT_SUFFIX}"
+
+
+# The timestamp portion of a segment key, which orders segments from oldest to newest
+def segment_timestamp(segment_key: str) -> str:
+    return segment_key.rsplit("/", 1)[-1].split("-", 1)[0]
+
+
+def segment_level(segment_key: str) -> int:
+    return int(segment_key.rsplit("/", 1)[-1].split("-")[1])
+
+
+# ====================================================================================================
+# Varint encoding
+# ====================================================================================================
+def _write_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, offset: int) -> tuple:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _write_string(buffer: bytearray, value: str):
+    encoded = value.encode("utf-8")
+    _write_varint(buffer, len(encoded))
+    buffer.extend(encoded)
+
+
+def _read_string(data, offset: int) -> tuple:
+    length, offset = _read_varint(data, offset)
+    return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+
+
+# ====================================================================================================
+# Writing segments
+# ====================================================================================================
+# Accumulates the postings of one or more documents and serializes them as a segment.
+# postings is {term: {document ordinal: {page: [positions]}}}
+class SegmentWriter:
+    def __init__(self):
+        self.document_ids = []
+        self.document_ordinals = {}
+        self.postings = {}
+
+    def _ordinal(self, document_id: str) -> int:
+        ordinal = self.document_ordinals.get(document_id)
+        if ordinal is None:
+            ordinal = len(self.document_ids)
+            self.document_ids.append(document_id)
+            self.document_ordinals[document_id] = ordinal
+        return ordinal
+
+    # pages is a dict of page number to text, as returned by get_text_from_layout_json
+    def add_document(self, document_id: str, pages: dict):
+        ordinal = self._ordinal(document_id)
+        for page, text in pages.items():
+            for position, term in enumerate(tokenize(text)):
+                self.postings.setdefault(term, {}).setdefault(ordinal, {}).setdefault(int(page), []).append(position)
+
+    # Adds the postings of a document, read from another segment, without re-tokenizing
+    def add_postings(self, document_id: str, term: str, pages: dict):
+        ordinal = self._ordinal(document_id)
+        document_postings = self.postings.setdefault(term, {}).setdefault(ordinal, {})
+        for page, positions in pages.items():
+            document_postings.setdefault(page, []).extend(positions)
+
+    def to_bytes(self) -> bytes:
+        postings_blob = bytearray()
+        dictionary = []
+        for term in sorted(self.postings):
+            start = len(postings_blob)
+            previous_ordinal = 0
+            for ordinal in sorted(self.postings[term]):
+                for page, positions in sorted(self.postings[term][ordinal].items()):
+                    _write_varint(postings_blob, ordinal - previous_ordinal)
+                    previous_ordinal = ordinal
+                    _write_varint(postings_blob, page)
+                    _write_varint(postings_blob, len(positions))
+                    previous_position = 0
+                    for position in sorted(positions):
+                        _write_varint(postings_blob, position - previous_position)
+                        previous_position = position
+            dictionary.append((term, start, len(postings_blob) - start))
+
+        result = bytearray(SEGMENT_MAGIC)
+        _write_varint(result, len(self.document_ids))
+        for document_id in self.document_ids:
+            _write_string(result, document_id)
+        _write_varint(result, len(dictionary))
+        for term, start, length in dictionary:
+            _write_string(result, term)
+            _write_varint(result, start)
+            _write_varint(result, length)
+        result.extend(postings_blob)
+        return bytes(result)
+
+
+# ====================================================================================================
+# Reading segments
+# ====================================================================================================
+# Parses the document table and the term dictionary of a segment, posting lists are decoded on demand.
+class SegmentReader:
+    def __init__(self, data: bytes):
+        if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError("not a search index segment")
+        self.data = memoryview(data)
+        offset = len(SEGMENT_MAGIC)
+
+        document_count, offset = _read_varint(self.data, offset)
+        self.document_ids = []
+        for _ in range(document_count):
+            document_id, offset = _read_string(self.data, offset)
+            self.document_ids.append(document_id)
+
+        term_count, offset = _read_varint(self.data, offset)
+        self.dictionary = {}
+        for _ in range(term_count):
+            term, offset = _read_string(self.data, offset)
+            start, offset = _read_varint(self.data, offset)
+            length, offset = _read_varint(self.data, offset)
+            self.dictionary[term] = (start, length)
+        self.postings_offset = offset
+
+    def terms(self) -> list:
+        return list(self.dictionary.keys())
+
+    # Returns {document_id: {page: [positions]}} for the term, empty when the term is not in the segment
+    def postings(self, term: str) -> dict:
+        entry = self.dictionary.get(term)
+        if entry is None:
+            return {}
+        start, length = entry
+        offset = self.postings_offset + start
+        end = offset + length
+        result = {}
+        ordinal = 0
+        while offset < end:
+            delta, offset = _read_varint(self.data, offset)
+            ordinal += delta
+            page, offset = _read_varint(self.data, offset)
+            count, offset = _read_varint(self.data, offset)
+            positions = []
+            position = 0
+            for _ in range(count):
+                position_delta, offset = _read_varint(self.data, offset)
+                position += position_delta
+                positions.append(position)
+            result.setdefault(self.document_ids[ordinal], {})[page] = positions
+        return result
+
+
+# ====================================================================================================
+# Merging and querying
+# ====================================================================================================
+# Merges segments, given oldest to newest, into a single segment. When a document appears in more
+# than one segment only the postings from the newest segment are kept.
+def merge_segments(readers: list) -> bytes:
+    owner = {}
+    for index, reader in enumerate(readers):
+        for document_id in reader.document_ids:
+            owner[document_id] = index
+
+    writer = SegmentWriter()
+    for index, reader in enumerate(readers):
+        for term in reader.terms():
+            for document_id, pages in reader.postings(term).items():
+                if owner[document_id] == index:
+                    writer.add_postings(document_id, term, pages)
+    # documents without any tokens still need to be recorded so that they mask older segments
+    for document_id, index in owner.items():
+        writer._ordinal(document_id)
+    return writer.to_bytes()
+
+
+# Finds the pages that contain every token of the query.
+# readers must be ordered oldest to newest, a document is answered from the newest segment containing it.
+# Returns a list of {"document_id": ..., "pages": [{"page": n, "positions": {term: [...]}}]}
+def search_segments(readers: list, query: str, limit: int = 100) -> list:
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+
+    seen_documents = set()
+    results = []
+    for reader in reversed(readers):
+        newer_documents = seen_documents
+        seen_documents = seen_documents | set(reader.document_ids)
+
+        matches = None
+        term_postings = {}
+        for term in terms:
+            postings = reader.postings(term)
+            term_postings[term] = postings
+            documents = set(postings.keys()) - newer_documents
+            matches = documents if matches is None else matches & documents
+            if not matches:
+                break
+        if not matches:
+            continue
+
+        for document_id in sorted(matches):
+            pages = None
+            for term in terms:
+                term_pages = set(term_postings[term][document_id].keys())
+                pages = term_pages if pages is None else pages & term_pages
+            if not pages:
+                continue
+            results.append({
+                "document_id": document_id,
+                "pages": [{"page": page, "positions": {term: term_postings[term][document_id][page] for term in terms}}
+                          for page in sorted(pages)]
+            })
+            if len(results) >= limit:
+                return results
+    return results
@@ -0,0 +1,42 @@
+import os
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+
+from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+
+tracer = Tracer()
+logger = Logger()
+logging_policy.configure(logger)
+metrics = Metrics(namespace="SpiTestApp", service="APP")
+
+cies_ocr_core = CiesOcrCore(
+    os.getenv('SOURCE_BUCKET'), 
+    os.getenv('DESTINATION_BUCKET'), 
+    os.getenv('TEXTRACT_SERVICE_ROLE'), 
+    os.getenv('TEXTRACT_STATUS_TOPIC'), 
+    os.getenv("AWS_REGION"))
+
+# ============================================================================================================
+# This Lambda handler is triggered on a schedule.
+# Every completed document adds a small segment to the search index of its site, this handler merges the
+# segments of each site once there are enough of them (see INDEX_MERGE_THRESHOLD) to keep the number of
+# objects read by a search small.
+# ============================================================================================================
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(log_event=logging_policy.LOG_EVENT)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("search_index_merge_handler")
+def lambda_handler(event, context):
+    merged = {}
+    for site_id in cies_ocr_core.list_indexed_sites():
+        try:
+            merged_key = cies_ocr_core.merge_index_segments(site_id)
+            if merged_key:
+                merged[site_id] = merged_key
+        except Exception as e:
+            # one site failing to merge must not prevent the other sites from merging
+            logger.error(f"Error merging index segments of site {site_id}: {e}")
+    logger.info(f"merged index segments {merged}")
+    return merged
@@ -0,0 +1,128 @@
+# This module coalesces concurrent identical reads. When the results of a document become ready the UI, the
+# integrations and the pollers all read them at once, and each read repeated the HEAD, tagging and get_text
+# calls of the others. With single flight, a call made while an identical call (the same method and arguments)
+# is in progress waits for it and shares its result, or its exception, rather than calling S3 itself. Nothing
+# is cached, a call made after the in-flight call has completed calls S3 again.
+# Reads only overlap when the core is called from several threads of one process, e.g. the completion queue
+# handler, the bundle ingest, or a container serving concurrent requests. A Lambda invocation handles one request.
+# A write of a document forgets its in-flight reads, so a read started after the write never shares the result
+# of a read started before it.
+# The counters of each method are written as EMF records with the AWS call metrics (see instrumentation.py):
+#   Calls        the calls of the method
+#   Executions   the calls which called S3, the others shared the result of an in-flight call
+#   Coalesced    the calls which shared the result of an in-flight call
+# Under a thundering herd Coalesced approaches Calls and Executions stays near 1 per document.
+
+import copy
+import functools
+import inspect
+import threading
+
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+
+import instrumentation
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> the _Call in flight
+        self.calls = {}
+        # name -> {"calls": n, "executions": n, "coalesced": n}
+        self.counters = {}
+
+    # Returns fn(), or the result of the identical call in flight. Every caller has a shallow copy of a dict or list
+    # result, so a caller may add to it without changing the result of the others.
+    def do(self, name: str, key: tuple, fn):
+        key = (name,) + key
+        with self.lock:
+            counters = self.counters.setdefault(name, {"calls": 0, "executions": 0, "coalesced": 0})
+            counters["calls"] += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                counters["executions"] += 1
+            else:
+                counters["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _copy(call.result)
+
+        try:
+            call.result = fn()
+            return _copy(call.result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            call.done.set()
+
+    # The calls in flight whose arguments include the value are not joined by later calls
+    def forget(self, value: str):
+        with self.lock:
+            for key in [key for key in self.calls if value in key[1:]]:
+                del self.calls[key]
+
+    # Returns the counters, and clears them
+    def take_counters(self) -> dict:
+        with self.lock:
+            counters = self.counters
+            self.counters = {}
+        return counters
+
+    def flush_metrics(self):
+        for name, counters in self.take_counters().items():
+            try:
+                emf = EphemeralMetrics(namespace=instrumentation.METRICS_NAMESPACE, service=instrumentation.METRICS_SERVICE)
+                emf.add_dimensions(environment=instrumentation.ENVIRONMENT, handler=instrumentation.handler_name(),
+                                   operation=f"single_flight.{name}")
+                emf.add_metric(name="Calls", unit=MetricUnit.Count, value=counters["calls"])
+                emf.add_metric(name="Executions", unit=MetricUnit.Count, value=counters["executions"])
+                emf.add_metric(name="Coalesced", unit=MetricUnit.Count, value=counters["coalesced"])
+                emf.flush_metrics()
+            except Exception as e:
+                logger.warning(f"Error writing single flight metrics for {name}: {e}")
+
+
+def _copy(result):
+    return copy.copy(result) if isinstance(result, (dict, list)) else result
+
+
+# Decorates a method of CiesOcrCore so that identical concurrent calls share one call. The key is the arguments,
+# less those named in ignore (e.g. the user_id, which does not change the result).
+def coalesced(name: str, ignore: tuple = ()):
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(value for argument, value in list(bound.arguments.items())[1:] if argument not in ignore)
+            try:
+                hash(key)
+            except TypeError:
+                return method(self, *args, **kwargs)
+            return self.single_flight_group.do(name, key, lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
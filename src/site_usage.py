@@ -0,0 +1,189 @@
+# This module accounts for the usage of each site (the x-amz-meta-site-id of its documents) and enforces its quotas.
+# Nothing recorded what each site pushed through Textract, so one site loading a backfill could take all of the
+# shared quota from the others.
+# The usage is counted in the DynamoDB table USAGE_TABLE, an item per site and period, keyed by site_id and period:
+#   day#YYYY-MM-DD        Documents, Pages, ResultPages, BytesStored
+#   minute#YYYY-MM-DDTHH:MM   Documents
+# Documents and the BytesStored of the document are counted when a document is submitted (see ocr_submission_handler),
+# Pages, ResultPages (the GetDocumentAnalysis pages) and the BytesStored of the results when it is completed.
+# The counts are added in-process and written when the handler completes (see instrumentation.on_flush), with one
+# atomic ADD per site and period, so a batch of completions of a site is a single update. The items expire (the
+# table's TTL attribute is expires_at) after USAGE_RETENTION_DAYS, the minute items after a day.
+# The quotas are checked at ingest, by the document, upload, presigned URL and bundle routes, before a document is
+# accepted. SITE_QUOTAS is a JSON object of quotas by site, "default" for the sites without their own, e.g.
+#   {"default": {"documents_per_minute": 120, "documents_per_day": 20000, "pages_per_day": 400000},
+#    "site-backfill": {"documents_per_minute": 30}}
+# A quota that is not set is not enforced. A request over a quota is refused with a 429 and a Retry-After of the
+# seconds until the next minute or the next day (UTC). The usage of a site is read at most every USAGE_CACHE_SECONDS
+# by an instance, and concurrent requests are checked against the same counts, so a site may exceed a quota by the
+# documents it sends in that time.
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from aws_lambda_powertools import Logger
+
+import overload
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+# the usage is neither counted nor enforced without a table
+USAGE_TABLE = os.getenv('USAGE_TABLE', '')
+USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', '400'))
+USAGE_CACHE_SECONDS = float(os.getenv('USAGE_CACHE_SECONDS', '5'))
+SITE_QUOTAS = os.getenv('SITE_QUOTAS', '')
+DEFAULT_SITE = "default"
+
+DOCUMENTS = "Documents"
+PAGES = "Pages"
+RESULT_PAGES = "ResultPages"
+BYTES_STORED = "BytesStored"
+COUNTERS = (DOCUMENTS, PAGES, RESULT_PAGES, BYTES_STORED)
+
+# quota -> (the period it is counted in, the counter)
+QUOTAS = {
+    "documents_per_minute": ("minute", DOCUMENTS),
+    "documents_per_day": ("day", DOCUMENTS),
+    "pages_per_day": ("day", PAGES),
+}
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+
+class QuotaExceeded(overload.Overloaded):
+    def __init__(self, site_id: str, quota: str, limit: int, retry_after: int):
+        super().__init__(429, retry_after, f"site {site_id} has reached its quota of {limit} {quota.replace('_', ' ')}")
+        self.site_id = site_id
+        self.quota = quota
+
+
+def day_period(now: datetime) -> str:
+    return f"day#{now:%Y-%m-%d}"
+
+
+def minute_period(now: datetime) -> str:
+    return f"minute#{now:%Y-%m-%dT%H:%M}"
+
+
+# Returns the quotas by site of the configuration. Raises ValueError when the configuration is invalid.
+def load_quotas(configuration: str = None) -> dict:
+    if configuration is None:
+        configuration = SITE_QUOTAS
+    if not configuration:
+        return {}
+    try:
+        quotas = json.loads(configuration)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"SITE_QUOTAS is not JSON: {e}")
+    if not isinstance(quotas, dict) or not all(isinstance(site, dict) for site in quotas.values()):
+        raise ValueError("SITE_QUOTAS must be an object of quotas by site")
+    for site, site_quotas in quotas.items():
+        unknown = set(site_quotas) - set(QUOTAS)
+        if unknown:
+            raise ValueError(f"unknown quotas for {site}: {sorted(unknown)}")
+    return quotas
+
+
+class SiteUsage:
+    def __init__(self, get_client, table: str = USAGE_TABLE, quotas: dict = None, clock=time.time):
+        # the DynamoDB client is looked up when it is used
+        self.get_client = get_client
+        self.table = table
+        self.quotas = load_quotas() if quotas is None else quotas
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (site_id, period) -> {counter: n}, the counts not yet written
+        self.pending = {}
+        # site_id -> (time read, {period: {counter: n}})
+        self.cache = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.table)
+
+    def _now(self) -> datetime:
+        return datetime.fromtimestamp(self.clock(), timezone.utc)
+
+    # Adds to the usage of a site, the counts are written by flush
+    def add(self, site_id: str, **counts):
+        if not self.enabled or not site_id:
+            return
+        now = self._now()
+        with self.lock:
+            for period in (day_period(now), minute_period(now)):
+                pending = self.pending.setdefault((site_id, period), {})
+                for counter, count in counts.items():
+                    if count and (period.startswith("day#") or counter == DOCUMENTS):
+                        pending[counter] = pending.get(counter, 0) + int(count)
+
+    # Writes the counts added since the last flush, one update per site and period
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        for (site_id, period), counts in pending.items():
+            if not counts:
+                continue
+            retention = timedelta(days=1) if period.startswith("minute#") else timedelta(days=USAGE_RETENTION_DAYS)
+            names = {"#expires": "expires_at"}
+            values = {":expires": {"N": str(int(self.clock() + retention.total_seconds()))}}
+            additions = []
+            for index, (counter, count) in enumerate(sorted(counts.items())):
+                names[f"#c{index}"] = counter
+                values[f":c{index}"] = {"N": str(count)}
+                additions.append(f"#c{index} :c{index}")
+            try:
+                self.get_client().update_item(
+                    TableName=self.table,
+                    Key={"site_id": {"S": site_id}, "period": {"S": period}},
+                    UpdateExpression=f"SET #expires = if_not_exists(#expires, :expires) ADD {', '.join(additions)}",
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values)
+            except Exception as e:
+                logger.error(f"Error writing the usage {counts} of {site_id} in {period}: {e}")
+
+    # Returns the usage of a site in the current day and minute, {period: {counter: n}}
+    def usage(self, site_id: str) -> dict:
+        now = self._now()
+        periods = (day_period(now), minute_period(now))
+        cached = self.cache.get(site_id)
+        if cached is not None and self.clock() - cached[0] < USAGE_CACHE_SECONDS and set(cached[1]) == set(periods):
+            return cached[1]
+        response = self.get_client().batch_get_item(RequestItems={self.table: {
+            "Keys": [{"site_id": {"S": site_id}, "period": {"S": period}} for period in periods]}})
+        usage = {period: {} for period in periods}
+        for item in response.get("Responses", {}).get(self.table, []):
+            usage[item["period"]["S"]] = {counter: int(item[counter]["N"]) for counter in COUNTERS if counter in item}
+        self.cache[site_id] = (self.clock(), usage)
+        return usage
+
+    # Raises QuotaExceeded when the site may not add a document now. A request of several documents (a bundle or a
+    # batch of URLs) is accepted while the site is within its quotas, so that it is never refused for its size alone.
+    def check(self, site_id: str):
+        site_quotas = self.quotas.get(site_id, self.quotas.get(DEFAULT_SITE))
+        if not self.enabled or not site_quotas:
+            return
+        now = self._now()
+        try:
+            usage = self.usage(site_id)
+        except Exception as e:
+            # a document is not refused because its usage cannot be read
+            logger.error(f"Error reading the usage of {site_id}, its quotas are not checked: {e}")
+            return
+        for quota, limit in site_quotas.items():
+            period, counter = QUOTAS[quota]
+            used = usage.get(day_period(now) if period == "day" else minute_period(now), {}).get(counter, 0)
+            if limit is not None and used >= limit:
+                if period == "day":
+                    retry_after = (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1) - now).total_seconds()
+                else:
+                    retry_after = 60 - now.second
+                logger.warning(f"{site_id} has used {used} of its {limit} {quota}")
+                raise QuotaExceeded(site_id, quota, limit, max(1, int(retry_after)))
@@ -6,17 +6,24 @@ import json
 from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.logging import correlation_paths
 from cies_ocr_core import CiesOcrCore
+import instrumentation
+import logging_policy
+import profiling
+from logging_policy import payload
 import http_response
+import overload
+import page_banner
 
 from cies_ocr_core import METADATA_KEY_FILE_NAME
 from cies_ocr_core import METADATA_KEY_USER_ID
 from cies_ocr_core import METADATA_KEY_SITE_ID
 from cies_ocr_core import TAG_KEY_STATUS
 from cies_ocr_core import TAG_JOB_ID
+from cies_ocr_core import TAG_REJECT_REASON, STATUS_REJECTED
 
 tracer = Tracer()
 logger = Logger()
-logger.setLevel('DEBUG')
+logging_policy.configure(logger)
 metrics = Metrics(namespace="SpiTestApp", service="APP")
 
 s3 = boto3.client('s3')
@@ -31,55 +38,89 @@ cies_ocr_core = CiesOcrCore(
     os.getenv("AWS_REGION"))
 
 @tracer.capture_lambda_handler
-@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=True)
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=logging_policy.LOG_EVENT)
 @metrics.log_metrics(capture_cold_start_metric=True)
+@logging_policy.sampled_debug_logging(logger)
+@instrumentation.instrumented_handler("text_handler")
+@profiling.profiled_handler(logger)
 def lambda_handler(event, context) -> dict:
-    logger.debug(f"OCR API - Inside GET lambda: event {event} context {context}")
+    logger.debug("OCR API - Inside GET lambda: event %s context %s", payload(event), context)
 
     try:
-        path = event.get("path")
-        # the path is expected to be something like: /text/<job_id>, where text is a constant
-        document_id = cies_ocr_core.return_last_path_element(path)
-        logger.debug(f"document_id={document_id}")
-        
-        headers = cies_ocr_core.get_headers(event)
-        logger.debug(f"newHeaders={headers}")
-
-        user_id = headers.get(METADATA_KEY_USER_ID) if METADATA_KEY_USER_ID in headers else "unknown"
-        site_id = headers.get(METADATA_KEY_SITE_ID) if METADATA_KEY_SITE_ID in headers else "unknown"
-        if 'ACCEPT' in headers:
-            accept_type = headers.get('ACCEPT') 
-        else:
-            accept_type = "application/json"
+        # the request is shed, with a Retry-After, when the instance or S3 is overloaded, see overload.py
+        with cies_ocr_core.overload_guard.admit():
+            return get_text_response(event)
+    except overload.Overloaded as e:
+        return http_response.format_overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return http_response.format_500_response(str(e))
 
-        if accept_type == "application/json":
-            metadata = cies_ocr_core.get_json_metadata(document_id)
-        else:
-            metadata = cies_ocr_core.get_text_metadata(document_id)
-
-        if metadata is None:
-            return http_response.format_404_response(document_id)
-        
-        logger.debug(f"metadata={metadata}")
-        if 'Content-Length' in metadata:
-            content_length = metadata['Content-Length'] 
-        else:
-           content_length = cies_ocr_core.LARGE_FILE_THRESHOLD + 1
-        # results greater than 1MB must be retrieved directly from S3 using a presigned URL
-        logger.debug(f"content_length is {content_length}")
-        if int(content_length) >= cies_ocr_core.LARGE_FILE_THRESHOLD:
-            logger.debug(f"handling as a large file")
-            presigned_url = cies_ocr_core.get_presigned_get_url(document_id, accept_type)
-            return http_response.format_302_response(presigned_url)
+
+# Returns the response to a request for the text of a document
+def get_text_response(event) -> dict:
+    path = event.get("path")
+    # the path is expected to be something like: /text/<job_id>, where text is a constant
+    document_id = cies_ocr_core.return_last_path_element(path)
+    logger.debug(f"document_id={document_id}")
+    
+    headers = cies_ocr_core.get_headers(event)
+    logger.debug(f"newHeaders={headers}")
+
+    user_id = headers.get(METADATA_KEY_USER_ID) if METADATA_KEY_USER_ID in headers else "unknown"
+    # the site is sent in the 'Siteid' header, as for the other routes, it locates the results in the site key layout
+    site_id = headers.get('SITEID', headers.get(METADATA_KEY_SITE_ID.upper(), "unknown"))
+    if 'ACCEPT' in headers:
+        accept_type = headers.get('ACCEPT') 
+    else:
+        accept_type = "application/json"
+
+    # ?form=compact returns the compact form of the text, the banner repeated by the pages once, see page_banner.py
+    form = (event.get("queryStringParameters") or {}).get("form", "full")
+    if form not in ("full", page_banner.COMPACT):
+        return http_response.format_400_response(f"form must be full or {page_banner.COMPACT}")
+
+    if form == page_banner.COMPACT:
+        metadata = cies_ocr_core.get_compact_metadata(document_id, site_id)
+        if metadata is None and cies_ocr_core.get_json_metadata(document_id, site_id) is not None:
+            # a document completed before the compact form was stored has it derived, and stored, once
+            cies_ocr_core.get_compact_text(user_id, site_id, document_id)
+            metadata = cies_ocr_core.get_compact_metadata(document_id, site_id)
+    elif accept_type == "application/json":
+        metadata = cies_ocr_core.get_json_metadata(document_id, site_id)
+    else:
+        metadata = cies_ocr_core.get_text_metadata(document_id, site_id)
+
+    if metadata is None:
+        # a document rejected by the pre-flight checks has no results, and never will
+        document_metadata = cies_ocr_core.get_document_metadata(document_id, site_id)
+        if document_metadata and document_metadata.get(TAG_KEY_STATUS) == STATUS_REJECTED:
+            return http_response.format_422_response(document_id, document_metadata.get(TAG_REJECT_REASON, "unknown"))
+        return http_response.format_404_response(document_id)
+    
+    logger.debug("metadata=%s", payload(metadata))
+    if 'Content-Length' in metadata:
+        content_length = metadata['Content-Length'] 
+    else:
+       content_length = cies_ocr_core.LARGE_FILE_THRESHOLD + 1
+    # results greater than 1MB must be retrieved directly from S3 using a presigned URL
+    logger.debug(f"content_length is {content_length}")
+    if int(content_length) >= cies_ocr_core.LARGE_FILE_THRESHOLD:
+        logger.debug(f"handling as a large file")
+        presigned_url = cies_ocr_core.get_presigned_get_url(document_id, accept_type, site_id=site_id, form=form)
+        return http_response.format_302_response(presigned_url)
+    else:
+        # results less than 1MB may be returned as the response body
+        logger.debug(f"NOT handling as a large file")
+        # the ETag of the HEAD of the result validates the copy of the local result cache, see result_cache.py
+        if form == page_banner.COMPACT:
+            result = cies_ocr_core.get_compact_text(user_id, site_id, document_id, metadata.get("ETag"))
+        elif accept_type == "application/json":
+            result = cies_ocr_core.get_text(user_id, site_id, document_id, metadata.get("ETag"))
         else:
-            # results less than 1MB may be returned as the response body
-            logger.debug(f"NOT handling as a large file")
             result = cies_ocr_core.get_text(user_id, site_id, document_id)
-            logger.debug(f"result={result}")
-            return http_response.format_200_response(metadata, json.dumps(result))
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        return http_response.format_500_response(e)
+        logger.debug("result=%s", payload(result))
+        return http_response.format_200_response(metadata, json.dumps(result))
 
 # ============================================================================================================================================
 # The request, from an Application Load Balancer looks something like the following.
@@ -0,0 +1,157 @@
+# This module spreads the Textract jobs over several regions. The throughput of the pipeline was capped by the
+# concurrent job quota of the home region while the quotas of the other regions went unused.
+# The regions are configured by TEXTRACT_REGIONS, a JSON list, e.g.
+#   [{"region": "us-west-2", "weight": 100, "topic": "arn:aws:sns:us-west-2:...", "role": "arn:aws:iam::...",
+#     "bucket": "project-ocr-cies-bucket-staging-us-west-2"}]
+# weight is in proportion to the concurrent job quota of the region. The home region (the region of the function,
+# its topic, role and source bucket) is always a region, with the weight HOME_REGION_WEIGHT, and is the only one
+# when TEXTRACT_REGIONS is not set.
+# Textract reads a document from a bucket of its own region, so the document is copied to the bucket of the region,
+# under the same key, before its job is started; the bucket should expire the copies after a day. The topic of each
+# region notifies the completion queue of the home region.
+# A job is started in a region drawn at random, in proportion to its weight divided by the latency of its recent
+# StartDocumentAnalysis calls (an average with a decay of LATENCY_DECAY), so a slower or throttling region is given
+# less work. When the start fails with a throttling or a transient error, or the circuit of the region is open (see
+# resilience.py), the job is started in the next region drawn, and only the last error is raised.
+# The region of a job is tagged on its document (textract-region), so that its results are read from that region.
+
+import json
+import os
+import random
+import threading
+import time
+
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+import resilience
+
+# ====================================================================================================
+# Global Constants
+# ====================================================================================================
+TEXTRACT_REGIONS = os.getenv('TEXTRACT_REGIONS', '')
+HOME_REGION_WEIGHT = float(os.getenv('HOME_REGION_WEIGHT', '100'))
+LATENCY_DECAY = 0.2
+START_OPERATION = "textract.StartDocumentAnalysis"
+
+# ====================================================================================================
+# Global References
+# ====================================================================================================
+logger = Logger()
+
+
+class Region:
+    def __init__(self, name: str, weight: float, topic: str, role: str, bucket: str, home: bool = False):
+        self.name = name
+        self.weight = weight
+        self.topic = topic
+        self.role = role
+        self.bucket = bucket
+        self.home = home
+        # the average latency of the recent starts, in milliseconds, None until a job is started
+        self.latency_ms = None
+
+    # The name of the circuit breakers of the clients of the region, see resilience.protect_client
+    @property
+    def scope(self) -> str:
+        return None if self.home else self.name
+
+
+# Returns the regions of the configuration, the home region first. Raises ValueError when the configuration is invalid.
+def load_regions(home: Region, configuration: str = None) -> list:
+    if configuration is None:
+        configuration = TEXTRACT_REGIONS
+    regions = [home]
+    if not configuration:
+        return regions
+    try:
+        items = json.loads(configuration)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"TEXTRACT_REGIONS is not JSON: {e}")
+    if not isinstance(items, list):
+        raise ValueError("TEXTRACT_REGIONS must be a list")
+    for item in items:
+        if not isinstance(item, dict) or not item.get("region"):
+            raise ValueError(f"each of TEXTRACT_REGIONS must have a region: {item}")
+        if item["region"] == home.name:
+            # the home region is configured to change its weight
+            home.weight = float(item.get("weight", home.weight))
+            continue
+        if not all(item.get(field) for field in ("topic", "role", "bucket")):
+            raise ValueError(f"each of TEXTRACT_REGIONS must have a topic, role and bucket: {item}")
+        regions.append(Region(item["region"], float(item.get("weight", 1)), item["topic"], item["role"], item["bucket"]))
+    return regions
+
+
+class RegionDispatcher:
+    def __init__(self, regions: list, breakers: resilience.CircuitBreakers = None, rng: random.Random = None):
+        self.regions = regions
+        self.breakers = breakers or resilience.breakers
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+
+    # The region of a name, the home region for None. A region which is not configured (e.g. in a function which only
+    # reads the results of the jobs) has no weight, topic, role or bucket, it is only read from.
+    def region(self, name: str = None) -> Region:
+        if not name:
+            return self.regions[0]
+        return next((region for region in self.regions if region.name == name), None) or Region(name, 0, None, None, None)
+
+    def _score(self, region: Region, latencies: list) -> float:
+        # a region with no starts yet is given the latency of the others, so it is tried in proportion to its weight
+        latency = region.latency_ms if region.latency_ms is not None else (sum(latencies) / len(latencies) if latencies else 1.0)
+        return region.weight / max(latency, 1.0)
+
+    # Returns the regions in the order they are to be tried, drawn at random in proportion to their scores.
+    # The regions whose circuit is open are tried last.
+    def order(self) -> list:
+        with self.lock:
+            latencies = [region.latency_ms for region in self.regions if region.latency_ms is not None]
+            remaining = [(region, self._score(region, latencies)) for region in self.regions if region.weight > 0]
+        ordered = []
+        while remaining:
+            point = self.rng.uniform(0, sum(score for _, score in remaining))
+            for index, (region, score) in enumerate(remaining):
+                point -= score
+                if point <= 0 or index == len(remaining) - 1:
+                    ordered.append(remaining.pop(index)[0])
+                    break
+        return ([region for region in ordered if not self.is_open(region)] +
+                [region for region in ordered if self.is_open(region)])
+
+    def is_open(self, region: Region) -> bool:
+        return self.breakers.is_open(resilience.operation_name(START_OPERATION, region.scope))
+
+    def record_latency(self, region: Region, latency_ms: float):
+        with self.lock:
+            if region.latency_ms is None:
+                region.latency_ms = latency_ms
+            else:
+                region.latency_ms += LATENCY_DECAY * (latency_ms - region.latency_ms)
+
+    # Calls stage(region), e.g. the copy of the document to the bucket of the region, and then start(region) in the
+    # regions in turn until one succeeds, returns the result of start and the region. Only start is timed, the
+    # latency of a region is that of its Textract calls rather than of the size of the documents copied.
+    def start(self, start, stage=None) -> tuple:
+        error = ValueError("no Textract region has a weight")
+        for region in self.order():
+            started = None
+            try:
+                if stage is not None:
+                    stage(region)
+                started = time.perf_counter()
+                result = start(region)
+            except resilience.CircuitOpen as e:
+                error = e
+            except (ClientError, ConnectionError, HTTPClientError) as e:
+                if resilience.classify(exception=e) == resilience.PERMANENT:
+                    raise
+                # the time the failed start took, with its retries, makes the region less likely to be drawn
+                if started is not None:
+                    self.record_latency(region, (time.perf_counter() - started) * 1000.0)
+                error = e
+            else:
+                self.record_latency(region, (time.perf_counter() - started) * 1000.0)
+                return result, region
+            logger.warning(f"failing over from the Textract region {region.name}: {error}")
+        raise error
@@ -0,0 +1,102 @@
+# Benchmarks the in-house layout linearizer (src/layout_linearizer.py) against
+# textractprettyprinter.get_text_from_layout_json and verifies that both produce identical output.
+#
+# Recorded responses are the full Textract JSON for a document, as returned by get_full_json and
+# stored by CiesOcrCore as <document_id>.json in the destination bucket. Save them next to the
+# sample PDFs, e.g. samples/PET-CT1.json, samples/PET-CT3.json. Both JSON and the Python repr
+# written by older versions of move_json_to_destination are accepted.
+# When no recorded responses are found a synthetic response is generated instead.
+#
+# usage (from the project root):
+#   python tests/benchmark/benchmark_layout_linearizer.py --responses "samples/*.json" --repeat 5 --scale 50
+
+import argparse
+import ast
+import glob
+import json
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "src"))
+sys.path.insert(0, PROJECT_DIR)
+
+from textractprettyprinter.t_pretty_print import get_text_from_layout_json as library_get_text_from_layout_json
+
+import layout_linearizer
+from tests.textract_fixtures import build_layout_response
+
+CIES_OPTIONS = {
+    "exclude_page_header": True,
+    "exclude_page_footer": True,
+    "exclude_figure_text": True,
+    "exclude_page_number": True,
+}
+
+
+def load_response(path: str) -> dict:
+    with open(path, "r") as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return ast.literal_eval(content)
+
+
+# Repeats the pages of a response 'scale' times, renumbering pages and block ids, to approximate
+# the dense multi-hundred-page documents that the completion stage sees in production
+def scale_response(response: dict, scale: int) -> dict:
+    if scale <= 1:
+        return response
+    pages = max(block.get("Page", 1) for block in response["Blocks"])
+    blocks = []
+    for copy in range(scale):
+        suffix = f"-{copy}"
+        for block in response["Blocks"]:
+            scaled = dict(block)
+            scaled["Id"] = block["Id"] + suffix
+            scaled["Page"] = block.get("Page", 1) + copy * pages
+            if "Relationships" in block:
+                scaled["Relationships"] = [{"Type": r["Type"], "Ids": [x + suffix for x in r["Ids"]]} for r in block["Relationships"]]
+            blocks.append(scaled)
+    return {"DocumentMetadata": {"Pages": pages * scale}, "Blocks": blocks}
+
+
+def best_time(function, response: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(response, **CIES_OPTIONS)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-r", "--responses", help="glob of recorded Textract responses", default=os.path.join(PROJECT_DIR, "samples", "*.json"))
+    argParser.add_argument("-n", "--repeat", help="number of timed runs, the best is reported", type=int, default=5)
+    argParser.add_argument("-s", "--scale", help="repeat the pages of each response this many times", type=int, default=1)
+    args = vars(argParser.parse_args())
+
+    responses = {os.path.basename(path): load_response(path) for path in sorted(glob.glob(args["responses"]))}
+    if not responses:
+        print(f"no recorded responses match {args['responses']}, using a synthetic 3 page response")
+        responses = {"synthetic": build_layout_response(page_count=3)}
+
+    print(f"{'response':<32}{'pages':>8}{'blocks':>10}{'library (s)':>14}{'in-house (s)':>14}{'speedup':>10}")
+    for name, response in responses.items():
+        response = scale_response(response, args["scale"])
+        expected = library_get_text_from_layout_json(response, **CIES_OPTIONS)
+        actual = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+        if actual != expected:
+            raise Exception(f"Error: output of the in-house linearizer differs from the library for {name}")
+
+        library_time = best_time(library_get_text_from_layout_json, response, args["repeat"])
+        in_house_time = best_time(layout_linearizer.get_text_from_layout_json, response, args["repeat"])
+        pages = len(expected)
+        print(f"{name:<32}{pages:>8}{len(response['Blocks']):>10}{library_time:>14.4f}{in_house_time:>14.4f}{library_time / in_house_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Benchmarks the CPU time and the CloudWatch log bytes spent on logging per completed document,
+# comparing the previous logging (level hard coded to DEBUG, payloads formatted into f-strings) with the
+# logging policy of src/logging_policy.py at INFO, and at DEBUG as used for a sampled document.
+#
+# The logging of one completion is replayed: the SNS event and message, the source document metadata
+# and tags, the Textract result (logged by move_text_to_destination and move_json_to_destination) and
+# the tag updates. Output is written, as JSON, to a stream which counts the bytes that would be
+# sent to CloudWatch.
+#
+# usage (from the project root):
+#   python tests/benchmark/benchmark_logging_policy.py --pages 50 --documents 20
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "src"))
+sys.path.insert(0, PROJECT_DIR)
+
+from aws_lambda_powertools import Logger
+
+from logging_policy import payload
+from tests.textract_fixtures import build_layout_response
+
+
+class CountingStream(io.TextIOBase):
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, text):
+        self.bytes_written += len(text.encode("utf-8"))
+        return len(text)
+
+
+def build_completion(page_count: int) -> dict:
+    response_json = build_layout_response(page_count=page_count)
+    message = {"JobId": "d69cacc045ec1186bc58d995726df05b9ebe61f8892d07b89a06bcd97e538b7a", "Status": "SUCCEEDED",
+               "API": "StartDocumentAnalysis", "JobTag": "1DAE93F8-646C-43B7-9981-9B41AE047881", "Timestamp": 1717616867091,
+               "DocumentLocation": {"S3ObjectName": "1DAE93F8-646C-43B7-9981-9B41AE047881", "S3Bucket": "project-ocr-cies-bucket-source-local"}}
+    event = {"Records": [{"EventSource": "aws:sns", "Sns": {"Message": json.dumps(message), "Subject": None}}]}
+    metadata_response = {"ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": {f"x-amz-header-{i}": "value" * 4 for i in range(12)}},
+                         "ContentType": "application/pdf", "ContentLength": 183245,
+                         "Metadata": {"file-name": "PET-CT1.pdf", "user-id": "user", "site-id": "site"}}
+    tag_set = [{"Key": "ocr-status", "Value": "Submitted"}, {"Key": "job-id", "Value": message["JobId"]}]
+    return {"event": event, "message": message, "metadata_response": metadata_response, "tag_set": tag_set, "responseJson": response_json}
+
+
+# the previous logging, every payload is formatted whether or not the record is emitted
+def log_legacy(logger, completion: dict):
+    event, message, responseJson = completion["event"], completion["message"], completion["responseJson"]
+    metadata_response, tag_set = completion["metadata_response"], completion["tag_set"]
+    logger.info(f"SNS Event Lambda Handler - Inside lambda: event {event} context None")
+    logger.debug(f"SNS Event Lambda Handler - Inside lambda: message {message} subject None")
+    for _ in range(2):
+        logger.debug(f"get_document_metadata metadata={metadata_response}")
+        logger.debug(f"get_document_metadata tag_set={tag_set}")
+        logger.debug(f"metadata={metadata_response['Metadata']}")
+        logger.debug(f"responseJson={responseJson}")
+    json_text = str(responseJson)
+    logger.debug(f"saving json for document, json starts with: {json_text[:128]}...")
+    for _ in range(3):
+        logger.debug(f"update_tag_set({tag_set}, {tag_set})")
+        logger.debug(f"updated_tag_set={tag_set} is a {type(tag_set)}")
+
+
+# the logging policy, payloads are rendered (and capped) only when the record is emitted
+def log_policy(logger, completion: dict):
+    event, message, responseJson = completion["event"], completion["message"], completion["responseJson"]
+    metadata_response, tag_set = completion["metadata_response"], completion["tag_set"]
+    logger.debug("SNS Event Lambda Handler - Inside lambda: event %s context %s", payload(event), None)
+    logger.debug("SNS Event Lambda Handler - Inside lambda: message %s subject %s", payload(message), None)
+    for _ in range(2):
+        logger.debug("get_document_metadata metadata=%s", payload(metadata_response))
+        logger.debug("get_document_metadata tag_set=%s", payload(tag_set))
+        logger.debug("metadata=%s", payload(metadata_response["Metadata"]))
+        logger.debug("responseJson=%s", payload(responseJson))
+    logger.debug("%s: %s", "saving json for document, json starts with", payload(responseJson, 128))
+    for _ in range(3):
+        logger.debug("update_tag_set(%s, %s)", payload(tag_set), payload(tag_set))
+        logger.debug("updated_tag_set=%s", payload(tag_set))
+
+
+def measure(log_function, level: str, completion: dict, documents: int) -> tuple:
+    stream = CountingStream()
+    logger = Logger(service=f"benchmark-{log_function.__name__}-{level}", logger_handler=logging.StreamHandler(stream))
+    logger.setLevel(level)
+    start = time.process_time()
+    for _ in range(documents):
+        log_function(logger, completion)
+    elapsed = time.process_time() - start
+    return elapsed / documents, stream.bytes_written / documents
+
+
+def main():
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-p", "--pages", help="pages in the synthetic Textract result", type=int, default=50)
+    argParser.add_argument("-d", "--documents", help="number of completions replayed", type=int, default=20)
+    args = vars(argParser.parse_args())
+
+    completion = build_completion(args["pages"])
+    print(f"{args['pages']} page document, Textract result of {len(str(completion['responseJson'])):,} characters")
+    print(f"{'logging':<28}{'CPU ms/document':>18}{'bytes/document':>18}")
+    baseline = None
+    for name, log_function, level in [("previous (DEBUG)", log_legacy, "DEBUG"),
+                                      ("previous (INFO)", log_legacy, "INFO"),
+                                      ("policy (INFO)", log_policy, "INFO"),
+                                      ("policy (DEBUG, sampled)", log_policy, "DEBUG")]:
+        cpu, log_bytes = measure(log_function, level, completion, args["documents"])
+        if baseline is None:
+            baseline = (cpu, log_bytes)
+        print(f"{name:<28}{cpu * 1000:>18.3f}{log_bytes:>18,.0f}")
+    print("bytes saved per document at INFO, compared with the previous DEBUG default: "
+          f"{baseline[1] - measure(log_policy, 'INFO', completion, 1)[1]:,.0f}")
+
+
+if __name__ == '__main__':
+    main()
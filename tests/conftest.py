@@ -0,0 +1,24 @@
+# The environment of the functions under test. It is set before the test modules, and so the modules of the
+# functions, are imported, their module level clients and constants read it.
+import os
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("SOURCE_BUCKET", "source")
+os.environ.setdefault("DESTINATION_BUCKET", "destination")
+
+import pytest
+
+import cies_ocr_core
+from tests.stubs import InMemoryS3, TextractStub
+
+
+# The source and destination buckets in memory, and a Textract that starts a job for each document submitted.
+# Without queues the documents are submitted at once.
+@pytest.fixture
+def submission(monkeypatch):
+    s3 = InMemoryS3()
+    textract = TextractStub()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core, "txt", textract)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "submission_queue_urls", {})
+    return s3, textract
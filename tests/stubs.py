@@ -0,0 +1,308 @@
+# In-memory stand-ins for the AWS clients used by CiesOcrCore, for tests that exercise the S3 state
+# (tags, ledger records, markers) without an AWS account. Only the calls and parameters used by the
+# code under test are implemented; errors are raised as botocore ClientErrors with the codes S3 returns.
+
+import hashlib
+import io
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, quote_plus
+
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+
+# The context a handler is invoked with
+class LambdaContext:
+    def __init__(self, function_name: str = "project-cies-test", aws_request_id: str = "5e1f7a3c-8d2b-4a6e-9c0f-2b4d6f8a1e35"):
+        self.function_name = function_name
+        self.memory_limit_in_mb = 128
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:{function_name}"
+        self.aws_request_id = aws_request_id
+
+
+# A clock the test moves by setting its now
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# The event of an object created in the source bucket, S3 URL encodes the keys of its events
+def s3_event(key: str) -> dict:
+    return {"Records": [{"eventSource": "aws:s3", "eventName": "ObjectCreated:Put", "eventTime": "2024-06-10T14:00:00.000Z",
+                         "s3": {"bucket": {"name": "source", "arn": "arn:aws:s3:::source"}, "object": {"key": quote_plus(key, safe="/")}}}]}
+
+
+# The event of the completion queue, a record for each Textract notification, see ocr_completion_queue_handler.py
+def completion_event(*notifications: dict) -> dict:
+    return {"Records": [{"messageId": f"m{index}", "receiptHandle": f"handle-m{index}", "body": json.dumps(notification),
+                         "attributes": {}, "messageAttributes": {}, "eventSource": "aws:sqs",
+                         "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:completion"}
+                        for index, notification in enumerate(notifications, start=1)]}
+
+
+def client_error(code: str, operation: str, status: int = 400) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+
+class InMemoryS3:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (bucket, key) -> {"Body": bytes, "ETag": str, "Metadata": dict, "ContentType": str, "TagSet": list, "LastModified": datetime}
+        self.objects = {}
+        self.calls = []
+        # upload_id -> {"Bucket", "Key", "Initiated", "Parts": {part_number: (etag, bytes)}, "Object": put_object arguments}
+        self.uploads = {}
+
+    def _get(self, bucket: str, key: str, operation: str) -> dict:
+        item = self.objects.get((bucket, key))
+        if item is None:
+            raise client_error("NoSuchKey" if operation == "GetObject" else "404", operation, 404)
+        return item
+
+    def put_object(self, Bucket, Key, Body=b"", ContentType=None, Metadata=None, Tagging=None, IfNoneMatch=None, IfMatch=None, **kwargs):
+        body = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.calls.append(("PutObject", Key))
+            existing = self.objects.get((Bucket, Key))
+            if IfNoneMatch == "*" and existing is not None:
+                raise client_error("PreconditionFailed", "PutObject", 412)
+            if IfMatch is not None and (existing is None or existing["ETag"] != IfMatch):
+                raise client_error("PreconditionFailed" if existing is not None else "NoSuchKey", "PutObject", 412 if existing is not None else 404)
+            tag_set = []
+            if Tagging:
+                tag_set = [{"Key": key, "Value": value} for key, value in parse_qsl(Tagging, keep_blank_values=True)]
+            etag = f'"{hashlib.md5(body).hexdigest()}-{len(self.calls)}"'
+            self.objects[(Bucket, Key)] = {"Body": body, "ETag": etag, "Metadata": dict(Metadata or {}), "ContentType": ContentType,
+                                           "TagSet": tag_set, "LastModified": datetime.now(timezone.utc)}
+            return {"ETag": etag}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append(("GetObject", Key))
+            item = self._get(Bucket, Key, "GetObject")
+            return {"Body": io.BytesIO(item["Body"]), "ETag": item["ETag"], "ContentLength": len(item["Body"]),
+                    "ContentType": item["ContentType"], "Metadata": dict(item["Metadata"])}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append(("HeadObject", Key))
+            item = self._get(Bucket, Key, "HeadObject")
+            return {"ETag": item["ETag"], "ContentLength": len(item["Body"]), "ContentType": item["ContentType"],
+                    "Metadata": dict(item["Metadata"]), "LastModified": item["LastModified"],
+                    "ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": {}}}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append(("DeleteObject", Key))
+            self.objects.pop((Bucket, Key), None)
+            return {}
+
+    def get_object_tagging(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append(("GetObjectTagging", Key))
+            item = self._get(Bucket, Key, "GetObjectTagging")
+            return {"TagSet": [dict(tag) for tag in item["TagSet"]]}
+
+    def put_object_tagging(self, Bucket, Key, Tagging, **kwargs):
+        with self.lock:
+            self.calls.append(("PutObjectTagging", Key))
+            item = self._get(Bucket, Key, "PutObjectTagging")
+            item["TagSet"] = [dict(tag) for tag in Tagging["TagSet"]]
+            return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, StartAfter="", **kwargs):
+        with self.lock:
+            self.calls.append(("ListObjectsV2", Prefix))
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix) and key > StartAfter)
+            contents = []
+            common_prefixes = set()
+            for key in keys:
+                if Delimiter and Delimiter in key[len(Prefix):]:
+                    common_prefixes.add(Prefix + key[len(Prefix):].split(Delimiter, 1)[0] + Delimiter)
+                else:
+                    contents.append({"Key": key, "Size": len(self.objects[(Bucket, key)]["Body"]),
+                                     "LastModified": self.objects[(Bucket, key)]["LastModified"]})
+            return {"Contents": contents, "CommonPrefixes": [{"Prefix": prefix} for prefix in sorted(common_prefixes)], "KeyCount": len(contents)}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append(("CreateMultipartUpload", Key))
+            upload_id = f"upload-{len(self.calls)}"
+            self.uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "Initiated": datetime.now(timezone.utc), "Parts": {}, "Object": kwargs}
+            return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, Bucket, Key, UploadId, operation: str) -> dict:
+        upload = self.uploads.get(UploadId)
+        if upload is None or (upload["Bucket"], upload["Key"]) != (Bucket, Key):
+            raise client_error("NoSuchUpload", operation, 404)
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        with self.lock:
+            self.calls.append(("UploadPart", Key))
+            etag = f'"{hashlib.md5(Body).hexdigest()}"'
+            self._upload(Bucket, Key, UploadId, "UploadPart")["Parts"][PartNumber] = (etag, bytes(Body))
+            return {"ETag": etag}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.calls.append(("ListParts", Key))
+            parts = self._upload(Bucket, Key, UploadId, "ListParts")["Parts"]
+            return {"Parts": [{"PartNumber": number, "ETag": etag, "Size": len(body)} for number, (etag, body) in sorted(parts.items())]}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            upload = self._upload(Bucket, Key, UploadId, "CompleteMultipartUpload")
+            body = b""
+            for part in MultipartUpload["Parts"]:
+                etag, part_body = upload["Parts"].get(part["PartNumber"], (None, b""))
+                if etag != part["ETag"]:
+                    raise client_error("InvalidPart", "CompleteMultipartUpload")
+                body += part_body
+            del self.uploads[UploadId]
+        response = self.put_object(Bucket=Bucket, Key=Key, Body=body, **upload["Object"])
+        self.calls[-1] = ("CompleteMultipartUpload", Key)
+        return response
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.calls.append(("AbortMultipartUpload", Key))
+            self._upload(Bucket, Key, UploadId, "AbortMultipartUpload")
+            del self.uploads[UploadId]
+            return {}
+
+    def list_multipart_uploads(self, Bucket, **kwargs):
+        with self.lock:
+            self.calls.append(("ListMultipartUploads", ""))
+            return {"Uploads": [{"Key": upload["Key"], "UploadId": upload_id, "Initiated": upload["Initiated"]}
+                                for upload_id, upload in self.uploads.items() if upload["Bucket"] == Bucket]}
+
+    # the URL is not signed, it identifies the call for the assertions of a test
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs):
+        query = "&".join(f"{key}={value}" for key, value in Params.items() if key not in ("Bucket", "Key"))
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?{query}&Method={ClientMethod}&Expires={ExpiresIn}"
+
+    def get_paginator(self, operation_name: str):
+        return _SinglePagePaginator(getattr(self, operation_name))
+
+    def count(self, operation: str) -> int:
+        return sum(1 for name, _ in self.calls if name == operation)
+
+
+class _SinglePagePaginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+class InMemorySQS:
+    def __init__(self):
+        # queue_url -> [{"MessageId", "Body", "DelaySeconds"}]
+        self.queues = {}
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        messages = self.queues.setdefault(QueueUrl, [])
+        message_id = f"message-{sum(len(queue) for queue in self.queues.values()) + 1}"
+        messages.append({"MessageId": message_id, "Body": MessageBody, "DelaySeconds": DelaySeconds})
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        if len(Entries) > 10:
+            raise client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "SendMessageBatch")
+        successful = [{"Id": entry["Id"], "MessageId": self.send_message(QueueUrl, entry["MessageBody"], entry.get("DelaySeconds", 0))["MessageId"]}
+                      for entry in Entries]
+        return {"Successful": successful, "Failed": []}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames, **kwargs):
+        return {"Attributes": {"ApproximateNumberOfMessages": str(len(self.queues.get(QueueUrl, [])))}}
+
+    # An SQS event of the messages of a queue, as delivered to a function by its event source mapping
+    def receive_event(self, QueueUrl) -> dict:
+        messages = self.queues.pop(QueueUrl, [])
+        return {"Records": [{"messageId": message["MessageId"], "body": message["Body"], "eventSource": "aws:sqs",
+                             "eventSourceARN": f"arn:aws:sqs:us-east-1:123456789012:{QueueUrl.rsplit('/', 1)[-1]}",
+                             "attributes": {}, "messageAttributes": {}} for message in messages]}
+
+
+# Only the SET if_not_exists and ADD clauses of UpdateExpression are implemented, as written by site_usage.py
+class InMemoryDynamoDB:
+    def __init__(self):
+        # (table, key attributes) -> item, in the typed form of the low-level client
+        self.items = {}
+        self.updates = []
+
+    @staticmethod
+    def _key(table: str, key: dict) -> tuple:
+        return table, tuple(sorted((name, value["S"]) for name, value in key.items()))
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues, **kwargs):
+        self.updates.append((TableName, Key, UpdateExpression))
+        item = self.items.setdefault(self._key(TableName, Key), dict(Key))
+        clauses = UpdateExpression.split(" ADD ")
+        for name, value in re.findall(r"(#\w+) = if_not_exists\(#\w+, (:\w+)\)", clauses[0]):
+            item.setdefault(ExpressionAttributeNames[name], ExpressionAttributeValues[value])
+        for clause in clauses[1].split(",") if len(clauses) > 1 else []:
+            name, value = clause.split()
+            attribute = ExpressionAttributeNames[name]
+            total = int(item.get(attribute, {"N": "0"})["N"]) + int(ExpressionAttributeValues[value]["N"])
+            item[attribute] = {"N": str(total)}
+        return {}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {table: [self.items[self._key(table, key)] for key in request["Keys"] if self._key(table, key) in self.items]
+                     for table, request in RequestItems.items()}
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+# Starts a job for each document submitted, job-1, job-2, ... in the order of their submission
+class TextractStub:
+    def __init__(self):
+        self.submitted = []
+
+    def start_document_analysis(self, DocumentLocation, **kwargs):
+        self.submitted.append(DocumentLocation["S3Object"]["Name"])
+        return {"JobId": f"job-{len(self.submitted)}"}
+
+
+# Answers the calls of a real botocore client locally, with the responses queued by the test, so that the whole stack
+# of the client (its retries, and the hooks of instrumentation.py, overload.py and resilience.py) runs without a
+# network. Each response is (status, body), or an exception raised as the transport would raise it.
+class FaultInjector:
+    def __init__(self, client):
+        self.responses = []
+        self.requests = 0
+        client.meta.events.register("before-send", self._send, unique_id="tests-fault-injector")
+
+    def fail(self, code: str, status: int, times: int = 1):
+        body = json.dumps({"__type": code, "message": code}).encode("utf-8")
+        self.responses.extend([(status, body)] * times)
+
+    def succeed(self, body: dict, times: int = 1):
+        self.responses.extend([(200, json.dumps(body).encode("utf-8"))] * times)
+
+    def raise_error(self, error: Exception, times: int = 1):
+        self.responses.extend([error] * times)
+
+    def _send(self, request=None, **kwargs):
+        self.requests += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        status, body = response
+        return AWSResponse(request.url, status, {"x-amzn-RequestId": f"request-{self.requests}"}, _RawBody(body))
+
+
+class _RawBody:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
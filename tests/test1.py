@@ -1,95 +1,167 @@
+# A reference client of the multipart upload routes, see src/multipart_upload_handler.py
+# The parts of the sample are PUT directly to S3, in parallel. The progress of the upload is saved to a state
+# file after every part, so an upload which is interrupted is resumed by running the same command again:
+# the parts which S3 already holds are listed and skipped.
 import argparse
-import datetime
 import json
+import os
+import random
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
 import requests
 
+# The number of times a part is retried before the upload is given up, it may then be resumed
+PART_ATTEMPTS = 5
+
 
 def main():
     # parse cmd line arguments
     argParser = argparse.ArgumentParser()
     argParser.add_argument("-u", "--url", help="url to connect to ", required=True)
     argParser.add_argument("-s", "--sample", help="sample file", required=True)
-
+    argParser.add_argument("-p", "--part-size", help="part size in MiB", type=int, default=64)
+    argParser.add_argument("-c", "--concurrency", help="number of parts uploaded at once", type=int, default=8)
+    argParser.add_argument("--state", help="state file of the upload, used to resume it", default=None)
+    argParser.add_argument("--abort", help="abort the upload of the state file", action="store_true")
 
     args = vars(argParser.parse_args())
-
-    t = datetime.datetime.utcnow()
-    amz_date = t.strftime('%Y%m%dT%H%M%SZ')
-
-    document_id = uuid.uuid4()
-    filename = f'{document_id}.pdf'
     url = args['url']
-    earl =  url + '/' + document_id
-    #url = 'http://127.0.0.1:3000'
-    # Specify the content type
-    headers = {
-        'Content-Type': 'application/octet-stream',
-        'x-amz-date': amz_date,
-            'Filename' : filename,
-            'Siteid': 'site-r',
-            'Userid' : 'buzzard-lips',
-            'httpMethod':'POST'}
-
-    # Read the file
     samplefile = args['sample']
-    data = open(samplefile, 'rb').read()
-    response = requests.post(url=earl,
-            data=data,
-            headers=headers)
-    print(f"response: {response}")
-    jobIdJson = json.loads(response.content.decode('utf-8'))
-    print(f"jobId: {jobIdJson}")
-
-
+    state_file = args['state'] or f"{samplefile}.upload.json"
+    headers = {'Siteid': 'site-r', 'Userid': 'buzzard-lips'}
+
+    state = load_state(state_file, samplefile)
+    if args['abort']:
+        if state:
+            response = requests.delete(f"{url}/uploads/{state['document_id']}", params={"uploadId": state['upload_id']})
+            print(f"abort: {response}")
+            os.remove(state_file)
+        return
+
+    if state is None:
+        document_id = str(uuid.uuid4())
+        initiate = {"size": os.path.getsize(samplefile),
+                    "part_size": args['part_size'] * 1024 * 1024,
+                    "file_name": os.path.basename(samplefile),
+                    "content_type": "application/pdf" if samplefile.lower().endswith(".pdf") else None}
+        response = requests.post(f"{url}/uploads/{document_id}", json=initiate, headers=headers)
+        if response.status_code != 200:
+            raise Exception(f"Error: {response.status_code} {response.text}")
+        upload = response.json()
+        state = {"sample": samplefile, "document_id": document_id, "upload_id": upload['upload_id'],
+                 "part_size": upload['part_size'], "part_count": upload['part_count'], "parts": {}}
+        urls = {part['part_number']: part['url'] for part in upload['parts']}
+        print(f"initiated upload of {document_id}: {state['part_count']} parts of {state['part_size']} bytes")
+    else:
+        # S3 is the record of the parts which were uploaded, the state file may have missed the last ones
+        response = requests.get(f"{url}/uploads/{state['document_id']}", params={"uploadId": state['upload_id']})
+        if response.status_code != 200:
+            raise Exception(f"Error resuming the upload: {response.status_code} {response.text}")
+        state['parts'] = {str(part['PartNumber']): part['ETag'] for part in response.json()['parts']}
+        urls = {}
+        print(f"resuming upload of {state['document_id']}: {len(state['parts'])} of {state['part_count']} parts uploaded")
+
+    uploader = PartUploader(url, samplefile, state, state_file, urls)
+    missing = [part_number for part_number in range(1, state['part_count'] + 1) if str(part_number) not in state['parts']]
+    with ThreadPoolExecutor(max_workers=args['concurrency']) as executor:
+        list(executor.map(uploader.upload_part, missing))
+
+    parts = [{"PartNumber": int(part_number), "ETag": etag} for part_number, etag in state['parts'].items()]
+    response = requests.post(f"{url}/uploads/{state['document_id']}/complete", json={"upload_id": state['upload_id'], "parts": parts})
+    print(f"complete: {response} {response.text}")
     if response.status_code != 200:
-        raise Exception(f"Error: {response.status}")
-
-    print(f"response jobid: {jobIdJson['JobId']}")
-
-    get_response = None
-    sleep_time = 5
-    # test status retrieval
-    qstr = f"{url}/get_status?jobId={jobIdJson['JobId']}"
-    get_response = requests.get(qstr)
-    print(f"get_response: {get_response.content}")
-
-    # loop on the get_status call, this hits the database not Textract
-    # so we can bang away at it
+        raise Exception(f"Error: {response.status_code}")
+    os.remove(state_file)
+
+    wait_for_text(url, state['document_id'])
+
+
+class PartUploader:
+    def __init__(self, url: str, samplefile: str, state: dict, state_file: str, urls: dict):
+        self.url = url
+        self.samplefile = samplefile
+        self.state = state
+        self.state_file = state_file
+        self.urls = urls
+        self.lock = threading.Lock()
+
+    def upload_part(self, part_number: int):
+        part_size = self.state['part_size']
+        with open(self.samplefile, 'rb') as sample:
+            sample.seek((part_number - 1) * part_size)
+            data = sample.read(part_size)
+
+        for attempt in range(PART_ATTEMPTS):
+            try:
+                response = requests.put(self.part_url(part_number, renew=attempt > 0), data=data)
+                if response.status_code == 200:
+                    with self.lock:
+                        self.state['parts'][str(part_number)] = response.headers['ETag']
+                        save_state(self.state_file, self.state)
+                        print(f"part {part_number} uploaded, {len(self.state['parts'])} of {self.state['part_count']}")
+                    return
+                print(f"part {part_number} attempt {attempt + 1}: {response.status_code}")
+            except requests.RequestException as e:
+                print(f"part {part_number} attempt {attempt + 1}: {e}")
+            sleep(random.uniform(0, min(30, 2 ** attempt)))
+        raise Exception(f"part {part_number} failed, run the same command again to resume the upload")
+
+    # A part URL is renewed after a failure, in case it has expired
+    def part_url(self, part_number: int, renew: bool) -> str:
+        with self.lock:
+            url = self.urls.get(part_number)
+        if url is None or renew:
+            response = requests.post(f"{self.url}/uploads/{self.state['document_id']}/parts",
+                                     json={"upload_id": self.state['upload_id'], "part_numbers": [part_number]})
+            if response.status_code != 200:
+                raise requests.RequestException(f"presigning part {part_number}: {response.status_code} {response.text}")
+            url = response.json()['parts'][0]['url']
+            with self.lock:
+                self.urls[part_number] = url
+        return url
+
+
+def load_state(state_file: str, samplefile: str):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        state = json.load(f)
+    if state['sample'] != samplefile:
+        raise Exception(f"{state_file} is the upload of {state['sample']}")
+    return state
+
+
+def save_state(state_file: str, state: dict):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
+
+
+# the S3 ObjectCreated event of the completed upload submits the document to Textract
+def wait_for_text(url: str, document_id: str):
     while True:
-        get_response = requests.get(qstr)
-        content = json.loads(get_response.content.decode('utf-8'))
+        response = requests.head(f"{url}/{document_id}")
+        status = response.headers.get('ocr-status', '')
 
-        if content['status'].casefold() == 'SUCCEEDED'.casefold():
+        if status.casefold() == 'SUCCEEDED'.casefold():
             print("\nJob Suceeded")
             break
-        elif content['status'].casefold() == 'FAILED'.casefold():
-            print("Job Failed, exiting")
+        elif status.casefold() in ('FAILED'.casefold(), 'ERROR'.casefold(), 'REJECTED'.casefold()):
+            print(f"Job {status} {response.headers.get('ocr-reject-reason', '')}, exiting")
             exit(1)
-        elif content['status'].casefold() == 'ERROR'.casefold() :
-            print("Job Error, exiting")
-            exit(2)
         else:
-            print(".",end='',flush=True)
+            print(".", end='', flush=True)
         sleep(1)
 
-    # test report retrieval
-
     print("Fetching OCR'd text")
-
-    qstr = f"{url}/get_text?jobId={jobIdJson['JobId']}"
-    get_response = requests.get(qstr)
+    get_response = requests.get(f"{url}/text/{document_id}", headers={'Accept': 'text/plain'})
     print(f"get_response: {get_response}")
     if get_response.status_code == 200:
-        content = json.loads(get_response.content)
-        reportText = content["parsedText"]
-        print(reportText)
-        # pages = len(reportText)
-        # for i in range(pages):
-        #     print(list(reportText.values())[i])
+        print(get_response.text)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
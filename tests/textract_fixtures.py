@@ -0,0 +1,121 @@
+# Builds synthetic Textract StartDocumentAnalysis (LAYOUT + TABLES) responses for tests and benchmarks.
+# The responses have the same shape as the result of textractcaller.get_full_json: a single dict with
+# a 'Blocks' list holding every page, with a repeated page banner (header), footer and page number,
+# a title, section headers, paragraphs, a list, a figure containing text and a table.
+
+import uuid
+
+
+class _ResponseBuilder:
+    def __init__(self):
+        self.blocks = []
+
+    def add(self, block_type: str, page: int, left: float, top: float, width: float, height: float, **attributes) -> dict:
+        block = {
+            "BlockType": block_type,
+            "Id": str(uuid.uuid4()),
+            "Page": page,
+            "Confidence": attributes.pop("confidence", 99.0),
+            "Geometry": {"BoundingBox": {"Left": left, "Top": top, "Width": width, "Height": height}},
+        }
+        block.update(attributes)
+        self.blocks.append(block)
+        return block
+
+    def line(self, page: int, text: str, left: float, top: float, width: float = 0.6, height: float = 0.012) -> dict:
+        words = []
+        word_left = left
+        for word_text in text.split():
+            word_width = width * len(word_text) / max(len(text), 1)
+            words.append(self.add("WORD", page, word_left, top, word_width, height, Text=word_text, TextType="PRINTED"))
+            word_left += word_width
+        return self.add("LINE", page, left, top, width, height, Text=text,
+                        Relationships=[{"Type": "CHILD", "Ids": [word["Id"] for word in words]}])
+
+    def layout(self, block_type: str, page: int, children: list, left: float, top: float, width: float, height: float) -> dict:
+        return self.add(block_type, page, left, top, width, height,
+                        Relationships=[{"Type": "CHILD", "Ids": [child["Id"] for child in children]}])
+
+
+def build_layout_response(page_count: int = 3, paragraphs_per_page: int = 6, lines_per_paragraph: int = 4,
+                          with_table: bool = True, with_figure: bool = True) -> dict:
+    builder = _ResponseBuilder()
+    page_blocks = []
+    for page in range(1, page_count + 1):
+        page_block = builder.add("PAGE", page, 0.0, 0.0, 1.0, 1.0)
+        page_blocks.append(page_block)
+        layouts = []
+
+        banner = [builder.line(page, "Patient: DOE, JOHN", 0.05, 0.02),
+                  builder.line(page, "MRN JD4USARAD", 0.05, 0.035),
+                  builder.line(page, "Exam Date: 05/25/2010", 0.05, 0.05)]
+        layouts.append(builder.layout("LAYOUT_HEADER", page, banner, 0.05, 0.02, 0.6, 0.045))
+
+        title = builder.line(page, "PET/CT OF THE WHOLE BODY", 0.3, 0.08)
+        layouts.append(builder.layout("LAYOUT_TITLE", page, [title], 0.3, 0.08, 0.6, 0.012))
+
+        top = 0.1
+        for paragraph in range(paragraphs_per_page):
+            if paragraph % 3 == 0:
+                header = builder.line(page, f"SECTION {page}.{paragraph}:", 0.05, top)
+                layouts.append(builder.layout("LAYOUT_SECTION_HEADER", page, [header], 0.05, top, 0.6, 0.012))
+                top += 0.015
+            lines = []
+            for line in range(lines_per_paragraph):
+                lines.append(builder.line(page, f"Finding {page}-{paragraph}-{line}: there is no evidence of pleural effusion.", 0.05, top))
+                top += 0.013
+            layouts.append(builder.layout("LAYOUT_TEXT", page, lines, 0.05, top - 0.013 * lines_per_paragraph, 0.6, 0.013 * lines_per_paragraph))
+
+        items = []
+        for item in range(3):
+            item_line = builder.line(page, f"- metastasis {item} measures up to {item + 4}.5 SUVs", 0.07, top)
+            items.append(builder.layout("LAYOUT_TEXT", page, [item_line], 0.07, top, 0.6, 0.012))
+            top += 0.013
+        layouts.append(builder.layout("LAYOUT_LIST", page, items, 0.07, top - 0.039, 0.6, 0.039))
+        layouts.extend(items)
+
+        if with_figure:
+            caption = builder.line(page, "Figure caption inside the image", 0.1, 0.72, 0.3, 0.01)
+            layouts.append(builder.layout("LAYOUT_FIGURE", page, [caption], 0.08, 0.7, 0.4, 0.1))
+
+        if with_table:
+            cells = []
+            for row in range(1, 4):
+                for column in range(1, 3):
+                    word = builder.add("WORD", page, 0.1 * column, 0.82 + 0.02 * row, 0.05, 0.01, Text=f"r{row}c{column}", TextType="PRINTED")
+                    attributes = {"RowIndex": row, "ColumnIndex": column, "RowSpan": 1, "ColumnSpan": 1,
+                                  "Relationships": [{"Type": "CHILD", "Ids": [word["Id"]]}]}
+                    if row == 1:
+                        attributes["EntityTypes"] = ["COLUMN_HEADER"]
+                    cells.append(builder.add("CELL", page, 0.1 * column, 0.82 + 0.02 * row, 0.1, 0.02, **attributes))
+            builder.add("TABLE", page, 0.1, 0.84, 0.2, 0.06,
+                        Relationships=[{"Type": "CHILD", "Ids": [cell["Id"] for cell in cells]}])
+            table_line = builder.line(page, "r1c1 r1c2", 0.1, 0.84, 0.2, 0.01)
+            layouts.append(builder.layout("LAYOUT_TABLE", page, [table_line], 0.11, 0.845, 0.19, 0.055))
+
+        footer = builder.line(page, "Electronically Signed", 0.05, 0.95)
+        layouts.append(builder.layout("LAYOUT_FOOTER", page, [footer], 0.05, 0.95, 0.6, 0.012))
+        number = builder.line(page, f"Page {page} of {page_count}", 0.8, 0.97, 0.1, 0.01)
+        layouts.append(builder.layout("LAYOUT_PAGE_NUMBER", page, [number], 0.8, 0.97, 0.1, 0.01))
+
+        page_block["Relationships"] = [{"Type": "CHILD", "Ids": [layout["Id"] for layout in layouts]}]
+
+    return {
+        "DocumentMetadata": {"Pages": page_count},
+        "JobStatus": "SUCCEEDED",
+        "Blocks": builder.blocks,
+    }
+
+
+# A minimal PDF of blank pages, as submitted to Textract. The pages are in a compressed object stream, rather
+# than plain objects, with object_stream, so only the /Count of the page tree tells their number.
+def build_pdf(page_count: int = 1, encrypted: bool = False, object_stream: bool = False) -> bytes:
+    kids = " ".join(f"{3 + page} 0 R" for page in range(page_count))
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode()]
+    if object_stream:
+        objects.append(b"<< /Type /ObjStm /Filter /FlateDecode /Length 8 >>\nstream\nx\x9c\x03\x00\x00\x00\x00\x01\nendstream")
+    else:
+        objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"] * page_count
+    body = b"%PDF-1.7\n" + b"".join(b"%d 0 obj\n%s\nendobj\n" % (number, item) for number, item in enumerate(objects, start=1))
+    trailer = b"<< /Root 1 0 R /Size %d%s >>" % (len(objects) + 1, b" /Encrypt 9 0 R" if encrypted else b"")
+    return body + b"trailer\n" + trailer + b"\nstartxref\n0\n%%EOF\n"
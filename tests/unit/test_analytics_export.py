@@ -0,0 +1,68 @@
+import io
+
+import pyarrow.parquet as pq
+import pytest
+
+import cies_ocr_core
+from tests.stubs import InMemoryS3
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+
+def test_completed_documents_are_exported_with_their_result_metadata(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "export_settle_seconds", 0)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=2))
+    core = cies_ocr_core.CiesOcrCore("source", "destination", "role", "topic", "us-east-1")
+    core.save_document_to_source_bucket("user-7", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}])
+    core.ocr_complete("doc-1", "SUCCEEDED")
+
+    result = core.export_completed_documents()
+    (parquet_key,) = result["files"]
+    assert result["records"] == 1 and parquet_key.startswith("export/parquet/site_id=site-r/date=")
+    table = pq.read_table(io.BytesIO(s3.objects[("destination", parquet_key)]["Body"]))
+
+    assert table.schema.names == cies_ocr_core.analytics_export.EXPORT_COLUMNS
+    assert str(table.schema.field("completed_at").type) == "timestamp[us, tz=UTC]"
+    assert str(table.schema.field("content_length").type) == "int64"
+    rows = table.to_pylist()
+    assert [row["page"] for row in rows] == [1, 2]
+    text_result = s3.objects[("destination", "doc-1.txt")]
+    for row in rows:
+        assert (row["document_id"], row["site_id"], row["user_id"], row["file_name"], row["job_id"], row["page_count"]) == \
+            ("doc-1", "site-r", "user-7", "chart.pdf", "job-1", 2)
+        assert (row["content_type"], row["content_length"]) == (text_result["ContentType"], len(text_result["Body"]))
+        assert row["word_count"] > 0 and row["text"]
+
+    # the next run starts after the high water mark
+    assert core.export_completed_documents()["records"] == 0
+
+
+def test_a_failed_export_is_repeated_without_duplicating_rows(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "export_settle_seconds", 0)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=1))
+    core = cies_ocr_core.CiesOcrCore("source", "destination", "role", "topic", "us-east-1")
+    for document_id, site_id in (("doc-1", "site-r"), ("doc-2", "site-s")):
+        core.save_document_to_source_bucket("user", site_id, document_id, "chart.pdf", "application/pdf", "New", build_pdf())
+        core.update_tag_in_S3(document_id, [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": f"job-{document_id}"}])
+        core.ocr_complete(document_id, "SUCCEEDED")
+
+    # the high water mark is not written, after both partitions were
+    put_object = s3.put_object
+
+    def failing_put_object(Bucket, Key, **kwargs):
+        if Key == cies_ocr_core.analytics_export.HIGH_WATER_MARK_KEY:
+            raise RuntimeError("connection reset")
+        return put_object(Bucket=Bucket, Key=Key, **kwargs)
+    monkeypatch.setattr(s3, "put_object", failing_put_object)
+    with pytest.raises(RuntimeError):
+        core.export_completed_documents()
+    monkeypatch.setattr(s3, "put_object", put_object)
+
+    result = core.export_completed_documents()
+    parquet_keys = sorted(key for bucket, key in s3.objects if key.startswith(cies_ocr_core.analytics_export.PARQUET_PREFIX))
+    assert len(result["files"]) == 2 and parquet_keys == sorted(result["files"])
+    assert sum(pq.read_table(io.BytesIO(s3.objects[("destination", key)]["Body"])).num_rows for key in parquet_keys) == 2
@@ -0,0 +1,117 @@
+import base64
+import io
+import json
+import zipfile
+
+import pytest
+
+import bundle_handler
+import bundle_ingest
+import cies_ocr_core
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_pdf
+
+
+MANIFEST = {"documents": [
+    {"document_id": "doc-1", "file": "scans/chart-1.pdf"},
+    {"document_id": "doc-2", "file": "chart-2.pdf", "file_name": "Chart 2.pdf", "priority": "bulk"},
+    {"document_id": "doc-3", "file": "missing.pdf"},
+    {"document_id": "doc-1", "file": "chart-2.pdf"},
+]}
+
+
+def zip_bundle(manifest: dict = MANIFEST) -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as archive:
+        archive.writestr(bundle_ingest.MANIFEST_NAME, json.dumps(manifest))
+        archive.writestr("scans/chart-1.pdf", build_pdf(page_count=1))
+        archive.writestr("chart-2.pdf", build_pdf(page_count=2))
+    return output.getvalue()
+
+
+def mime_bundle() -> tuple:
+    boundary = "bundle-boundary"
+    parts = [('Content-Type: application/json\r\nContent-Disposition: attachment; filename="manifest.json"', json.dumps(MANIFEST).encode()),
+             ('Content-Type: application/pdf\r\nContent-Disposition: attachment; filename="scans/chart-1.pdf"\r\n'
+              'Content-Transfer-Encoding: base64', base64.b64encode(build_pdf(page_count=1))),
+             ('Content-Type: application/pdf\r\nContent-ID: <chart-2.pdf>\r\nContent-Transfer-Encoding: base64',
+              base64.b64encode(build_pdf(page_count=2)))]
+    body = b"".join(f"--{boundary}\r\n{headers}\r\n\r\n".encode() + content + b"\r\n" for headers, content in parts)
+    return body + f"--{boundary}--\r\n".encode(), f"multipart/mixed; boundary={boundary}"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    return s3
+
+
+def post(path: str, body: bytes, content_type: str) -> dict:
+    event = {"httpMethod": "POST", "path": path, "isBase64Encoded": True, "body": base64.b64encode(body).decode(),
+             "headers": {"content-type": content_type, "siteid": "site-r", "userid": "user-1"}}
+    return bundle_handler.lambda_handler(event, LambdaContext())
+
+
+def assert_ingested(s3, response: dict):
+    assert response["statusCode"] == 200
+    results = json.loads(response["body"])["documents"]
+    assert [result["status"] for result in results] == [bundle_ingest.ACCEPTED, bundle_ingest.ACCEPTED,
+                                                        bundle_ingest.INVALID, bundle_ingest.INVALID]
+    assert s3.objects[("source", "doc-1")]["Body"] == build_pdf(page_count=1)
+    metadata = s3.objects[("source", "doc-2")]["Metadata"]
+    assert metadata[cies_ocr_core.METADATA_KEY_FILE_NAME] == "Chart 2.pdf"
+    assert metadata[cies_ocr_core.METADATA_KEY_SITE_ID] == "site-r"
+    assert metadata[cies_ocr_core.METADATA_KEY_USER_ID] == "user-1"
+    assert metadata[cies_ocr_core.METADATA_KEY_PRIORITY] == "bulk"
+    assert s3.objects[("source", "doc-2")]["TagSet"] == [{"Key": cies_ocr_core.TAG_KEY_STATUS, "Value": "New"}]
+
+
+def test_zip_bundle(s3):
+    assert_ingested(s3, post("/bundles", zip_bundle(), bundle_ingest.ZIP))
+    # the documents exist, they are not re-created
+    results = json.loads(post("/bundles", zip_bundle(), bundle_ingest.ZIP)["body"])["documents"]
+    assert [result["status"] for result in results[:2]] == [bundle_ingest.EXISTS, bundle_ingest.EXISTS]
+
+
+def test_multipart_bundle(s3):
+    body, content_type = mime_bundle()
+    assert_ingested(s3, post("/bundles", body, content_type))
+
+
+def test_uploaded_bundle(s3):
+    upload = json.loads(post("/bundles/upload", json.dumps({"content_type": bundle_ingest.ZIP}).encode(), "application/json")["body"])
+    assert upload["bundle_key"].startswith("bundles/site-r/")
+    s3.put_object(Bucket="destination", Key=upload["bundle_key"], Body=zip_bundle())
+
+    response = post("/bundles", json.dumps({"bundle_key": upload["bundle_key"]}).encode(), "application/json")
+    assert_ingested(s3, response)
+    assert ("destination", upload["bundle_key"]) not in s3.objects
+    # another site's bundle
+    other = post("/bundles", json.dumps({"bundle_key": "bundles/site-x/a.zip"}).encode(), "application/json")
+    assert other["statusCode"] == 400
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"not a zip", bundle_ingest.ZIP),
+    (zip_bundle({"documents": "doc-1"}), bundle_ingest.ZIP),
+    (build_pdf(), "application/pdf"),
+])
+def test_bad_bundles_are_rejected(s3, body, content_type):
+    assert post("/bundles", body, content_type)["statusCode"] == 400
+    assert not [key for key in s3.objects if key[0] == "source"]
+
+
+@pytest.mark.parametrize("limit", ["BUNDLE_MAX_MEMBER_BYTES", "BUNDLE_MAX_UNCOMPRESSED_BYTES"])
+def test_a_zip_bundle_over_its_uncompressed_limits_is_rejected(s3, monkeypatch, limit):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(bundle_ingest.MANIFEST_NAME, json.dumps({"documents": [{"document_id": "doc-1", "file": "zeros.pdf"}]}))
+        # compresses to about a thousandth of its size
+        archive.writestr("zeros.pdf", bytes(1024 * 1024))
+    assert len(output.getvalue()) < 16 * 1024
+    monkeypatch.setattr(bundle_ingest, limit, 1024 * 1024 - 1)
+
+    response = post("/bundles", output.getvalue(), bundle_ingest.ZIP)
+    assert response["statusCode"] == 400 and "at most" in response["body"]
+    assert not [key for key in s3.objects if key[0] == "source"]
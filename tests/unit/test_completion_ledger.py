@@ -0,0 +1,130 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import cies_ocr_core
+import completion_ledger
+import instrumentation
+import ocr_completion_queue_handler
+import pending_jobs
+from tests.stubs import InMemoryS3, LambdaContext, completion_event
+from tests.textract_fixtures import build_layout_response
+
+DOCUMENT_ID = "1DAE93F8-646C-43B7-9981-9B41AE047881"
+JOB_ID = "d69cacc045ec1186bc58d995726df05b9ebe61f8892d07b89a06bcd97e538b7a"
+
+
+def notification_event(status: str = "SUCCEEDED") -> dict:
+    return completion_event({"JobId": JOB_ID, "Status": status, "API": "StartDocumentAnalysis", "JobTag": DOCUMENT_ID,
+                             "Timestamp": 1717616867091, "DocumentLocation": {"S3ObjectName": DOCUMENT_ID, "S3Bucket": "source"}})
+
+
+def complete() -> dict:
+    return ocr_completion_queue_handler.lambda_handler(notification_event(), LambdaContext())
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    core = ocr_completion_queue_handler.cies_ocr_core
+    s3.put_object(Bucket=core.source_bucket, Key=DOCUMENT_ID, Body=b"%PDF-1.7", ContentType="application/pdf",
+                  Metadata={cies_ocr_core.METADATA_KEY_SITE_ID: "site"},
+                  Tagging=f"{cies_ocr_core.TAG_KEY_STATUS}=Submitted&{cies_ocr_core.TAG_JOB_ID}={JOB_ID}")
+    return s3
+
+
+class AnalysisStub:
+    def __init__(self):
+        self.job_ids = []
+        self.fail_next = False
+
+    def get_analysis_json(self, job_id: str) -> dict:
+        self.job_ids.append(job_id)
+        if self.fail_next:
+            self.fail_next = False
+            raise RuntimeError("Lambda timed out")
+        return build_layout_response(page_count=2)
+
+
+@pytest.fixture
+def analysis(monkeypatch):
+    stub = AnalysisStub()
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: stub.get_analysis_json(job_id))
+    return stub
+
+
+def ledger_record(s3) -> dict:
+    body = s3.objects[(ocr_completion_queue_handler.cies_ocr_core.destination_bucket, completion_ledger.create_ledger_key(JOB_ID))]["Body"]
+    return json.loads(body)
+
+
+def text_writes(s3) -> int:
+    return sum(1 for operation, key in s3.calls if operation == "PutObject" and key == f"{DOCUMENT_ID}.txt")
+
+
+def test_duplicate_notifications_complete_once(s3, analysis):
+    complete()
+    complete()
+
+    threads = [threading.Thread(target=complete) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(analysis.job_ids) == 1
+    assert text_writes(s3) == 1
+    assert ledger_record(s3)["state"] == completion_ledger.STATE_DONE
+    tags = s3.get_object_tagging(Bucket="source", Key=DOCUMENT_ID)["TagSet"]
+    assert {"Key": cies_ocr_core.TAG_KEY_STATUS, "Value": "SUCCEEDED"} in tags
+
+
+def test_failed_completion_is_retried(s3, analysis):
+    analysis.fail_next = True
+    # the notification is returned to the queue
+    assert complete()["batchItemFailures"] == [{"itemIdentifier": "m1"}]
+    assert ledger_record(s3)["state"] == completion_ledger.STATE_FAILED
+
+    assert complete()["batchItemFailures"] == []
+    assert len(analysis.job_ids) == 2
+    assert ledger_record(s3)["state"] == completion_ledger.STATE_DONE
+
+
+@pytest.mark.parametrize("lease_expires_in, taken_over", [(-60, True), (60, False)])
+def test_abandoned_claim_is_taken_over_after_its_lease(s3, analysis, lease_expires_in, taken_over):
+    claimed_at = datetime.now(timezone.utc) + timedelta(seconds=lease_expires_in - 300)
+    claim = completion_ledger.build_claim(DOCUMENT_ID, JOB_ID, "dead-owner", 300, claimed_at)
+    s3.put_object(Bucket="destination", Key=completion_ledger.create_ledger_key(JOB_ID), Body=completion_ledger.dumps(claim))
+
+    complete()
+    assert len(analysis.job_ids) == (1 if taken_over else 0)
+    assert (ledger_record(s3)["owner"] != "dead-owner") == taken_over
+
+
+class TextractStub:
+    def get_document_analysis(self, JobId, MaxResults=None):
+        return {"JobStatus": "SUCCEEDED"}
+
+
+@pytest.mark.parametrize("state, outcome", [(completion_ledger.STATE_DONE, "completed"), (completion_ledger.STATE_PROCESSING, "in_progress")])
+def test_reconciling_a_job_the_ledger_records_as_done_tags_the_document(s3, analysis, monkeypatch, state, outcome):
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "textract_client", lambda self, region=None: TextractStub())
+    core = ocr_completion_queue_handler.cies_ocr_core
+    pending_key = pending_jobs.create_pending_key(DOCUMENT_ID, "2024061014")
+    s3.put_object(Bucket="destination", Key=pending_key, Body=b"")
+    # the completion was recorded, or is being made, but the document is still tagged Submitted
+    claim = completion_ledger.build_claim(DOCUMENT_ID, JOB_ID, "notification", 300)
+    record = completion_ledger.build_outcome(claim, state, "SUCCEEDED") if state == completion_ledger.STATE_DONE else claim
+    s3.put_object(Bucket="destination", Key=completion_ledger.create_ledger_key(JOB_ID), Body=completion_ledger.dumps(record))
+
+    # run as the reconcile handler runs it, so that the metrics of the calls are written
+    reconcile = instrumentation.instrumented_handler("reconcile_handler")(lambda event, context: core.reconcile_pending_jobs(deadline_seconds=0))
+    assert reconcile({}, LambdaContext())[outcome] == 1
+    assert analysis.job_ids == []
+    tags = s3.get_object_tagging(Bucket="source", Key=DOCUMENT_ID)["TagSet"]
+    done = state == completion_ledger.STATE_DONE
+    assert ({"Key": cies_ocr_core.TAG_KEY_STATUS, "Value": "SUCCEEDED"} in tags) == done
+    assert (("destination", pending_key) not in s3.objects) == done
@@ -0,0 +1,87 @@
+import json
+import threading
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import instrumentation
+
+
+@pytest.fixture
+def s3_client():
+    instrumentation.flush_metrics()
+    client = instrumentation.instrument_client(
+        boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test"))
+    with Stubber(client) as stubber:
+        yield client, stubber
+
+
+def emitted_records(capsys) -> list:
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+
+class Store:
+    @instrumentation.traced_stage("store")
+    def put(self, client, body):
+        client.put_object(Bucket="bucket", Key="key", Body=body)
+
+
+def test_calls_are_aggregated_by_stage_and_operation(s3_client, capsys):
+    client, stubber = s3_client
+    stubber.add_response("put_object", {})
+    stubber.add_response("put_object", {})
+    stubber.add_client_error("head_object", service_error_code="404", http_status_code=404)
+
+    Store().put(client, b"x" * 10)
+    Store().put(client, b"y" * 5)
+    with pytest.raises(Exception):
+        client.head_object(Bucket="bucket", Key="missing")
+    instrumentation.flush_metrics()
+
+    records = {(record["stage"], record["operation"]): record for record in emitted_records(capsys)}
+    put = records[("store", "s3.PutObject")]
+    assert put["Calls"] == [2.0]
+    assert put["Errors"] == [0.0]
+    assert put["Bytes"] == [15.0]
+    assert len(put["Latency"]) == 2
+    head = records[(instrumentation.DEFAULT_STAGE, "s3.HeadObject")]
+    assert head["Calls"] == [1.0]
+    assert head["Errors"] == [1.0]
+
+
+def test_handler_flushes_and_stage_is_restored(s3_client, capsys):
+    client, stubber = s3_client
+    stubber.add_response("put_object", {})
+
+    @instrumentation.instrumented_handler("test_handler")
+    def lambda_handler(event, context):
+        Store().put(client, b"z")
+        return instrumentation.current_stage()
+
+    assert lambda_handler({}, None) == instrumentation.DEFAULT_STAGE
+    records = emitted_records(capsys)
+    assert [(record["handler"], record["stage"], record["Calls"]) for record in records] == [("test_handler", "store", [1.0])]
+    assert instrumentation.operation_total("s3.PutObject") >= 1
+
+
+def test_operation_totals_are_those_of_the_thread(s3_client):
+    client, stubber = s3_client
+    stubber.add_response("put_object", {})
+    before = instrumentation.operation_total("s3.PutObject")
+    # a call made by another thread, e.g. the completion of another document of the batch, is not counted
+    thread = threading.Thread(target=Store().put, args=(client, b"x"))
+    thread.start()
+    thread.join()
+    assert instrumentation.operation_total("s3.PutObject") == before
+    stubber.add_response("put_object", {})
+    Store().put(client, b"x")
+    assert instrumentation.operation_total("s3.PutObject") == before + 1
+
+
+def test_document_metrics(capsys):
+    instrumentation.document_metrics("doc-1", Pages=3, ResultPages=1, TextBytes=100, JsonBytes=None)
+    record = emitted_records(capsys)[0]
+    assert record["document_id"] == "doc-1"
+    assert (record["DocumentPages"], record["DocumentResultPages"], record["DocumentTextBytes"]) == ([3.0], [1.0], [100.0])
+    assert "DocumentJsonBytes" not in record
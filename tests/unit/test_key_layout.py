@@ -0,0 +1,76 @@
+import pytest
+
+import cies_ocr_core
+import key_layout
+import ocr_completion_queue_handler
+import ocr_submission_handler
+import pending_jobs
+from tests.stubs import LambdaContext, completion_event, s3_event
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+PDF = build_pdf()
+DOCUMENT_ID = "2024061014-000123"
+
+
+@pytest.mark.parametrize("layout, site_id, expected", [
+    ("flat", "site-r", DOCUMENT_ID),
+    ("hashed", "site-r", f"{key_layout.KeyLayout().hash_prefix(DOCUMENT_ID)}/{DOCUMENT_ID}"),
+    ("site", "site r/2", f"site_id=site%20r%2F2/{key_layout.KeyLayout().hash_prefix(DOCUMENT_ID)}/{DOCUMENT_ID}"),
+])
+def test_keys_round_trip(layout, site_id, expected):
+    layout = key_layout.KeyLayout(layout)
+    key = layout.source_key(DOCUMENT_ID, site_id)
+    assert key == expected
+    assert layout.parse_source_key(key)[1] == DOCUMENT_ID
+    assert layout.parse_result_key(layout.result_key(DOCUMENT_ID, ".json", site_id))[1] == DOCUMENT_ID
+    if layout.layout == key_layout.SITE:
+        assert layout.parse_source_key(key)[0] == site_id
+
+
+def test_keys_outside_the_layout_are_rejected():
+    with pytest.raises(ValueError):
+        key_layout.KeyLayout("hashed").parse_source_key(DOCUMENT_ID)
+    with pytest.raises(ValueError):
+        key_layout.KeyLayout("hashed").parse_source_key(f"0000/{DOCUMENT_ID}")
+    with pytest.raises(ValueError):
+        key_layout.KeyLayout("site").parse_source_key(key_layout.KeyLayout("hashed").source_key(DOCUMENT_ID))
+
+
+@pytest.fixture
+def site_layout(submission, monkeypatch):
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "layout", key_layout.KeyLayout("site"))
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=1))
+    return submission
+
+
+def notification_event(key: str, job_id: str) -> dict:
+    return completion_event({"JobId": job_id, "Status": "SUCCEEDED", "API": "StartDocumentAnalysis", "JobTag": DOCUMENT_ID,
+                             "DocumentLocation": {"S3ObjectName": key, "S3Bucket": "source"}})
+
+
+def test_document_is_processed_under_its_site_prefix(site_layout):
+    s3, textract = site_layout
+    core = ocr_submission_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site r", DOCUMENT_ID, "chart.pdf", "application/pdf", "New", PDF)
+    source_key = core.create_source_key(DOCUMENT_ID, "site r")
+    assert ("source", source_key) in s3.objects
+
+    ocr_submission_handler.lambda_handler(s3_event(source_key), LambdaContext())
+    assert textract.submitted == [source_key]
+    metadata = core.get_document_metadata(DOCUMENT_ID, "site r")
+    assert metadata[cies_ocr_core.TAG_KEY_STATUS] == "Submitted"
+    marker = pending_jobs.create_pending_key(source_key, metadata[cies_ocr_core.TAG_SUBMITTED_AT])
+    assert ("destination", marker) in s3.objects
+
+    assert ocr_completion_queue_handler.lambda_handler(notification_event(source_key, "job-1"), LambdaContext())["batchItemFailures"] == []
+    assert ("destination", f"{source_key}.txt") in s3.objects
+    assert ("destination", f"{source_key}.json") in s3.objects
+    assert ("destination", marker) not in s3.objects
+    assert core.get_text_metadata(DOCUMENT_ID, "site r")[cies_ocr_core.TAG_KEY_STATUS] == "SUCCEEDED"
+
+    # a copy of the document, e.g. by the migration, keeps its status and is not submitted again
+    ocr_submission_handler.lambda_handler(s3_event(source_key), LambdaContext())
+    # nor is an object outside the layout
+    s3.put_object(Bucket="source", Key=DOCUMENT_ID, Body=PDF)
+    ocr_submission_handler.lambda_handler(s3_event(DOCUMENT_ID), LambdaContext())
+    assert textract.submitted == [source_key]
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+from textractprettyprinter.t_pretty_print import get_text_from_layout_json as library_get_text_from_layout_json
+
+import layout_linearizer
+from tests.textract_fixtures import build_layout_response
+
+CIES_OPTIONS = {
+    "exclude_page_header": True,
+    "exclude_page_footer": True,
+    "exclude_figure_text": True,
+    "exclude_page_number": True,
+}
+
+
+@pytest.mark.parametrize("options", [
+    CIES_OPTIONS,
+    {},
+    {"exclude_figure_text": False},
+    {"skip_table": True},
+    {"generate_markdown": True},
+])
+def test_matches_library_output(options):
+    response = build_layout_response(page_count=4)
+    expected = library_get_text_from_layout_json(response, **options)
+    actual = layout_linearizer.get_text_from_layout_json(response, **options)
+    assert actual == expected
+    assert list(actual.keys()) == list(expected.keys())
+
+
+def test_matches_library_without_tables_or_figures():
+    response = build_layout_response(page_count=2, with_table=False, with_figure=False)
+    expected = library_get_text_from_layout_json(response, **CIES_OPTIONS)
+    assert layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS) == expected
+
+
+def test_excludes_banner_and_figure_text():
+    response = build_layout_response(page_count=2)
+    report_text = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+    assert set(report_text.keys()) == {1, 2}
+    assert "Patient: DOE, JOHN" not in report_text[1]
+    assert "Figure caption" not in report_text[1]
+    assert "Page 1 of 2" not in report_text[1]
+    assert "PET/CT OF THE WHOLE BODY" in report_text[2]
+
+
+def test_response_without_layout_blocks():
+    response = {"Blocks": [{"BlockType": "PAGE", "Id": "p1", "Page": 1, "Geometry": {"BoundingBox": {"Left": 0, "Top": 0, "Width": 1, "Height": 1}}}]}
+    assert layout_linearizer.get_text_from_layout_json(response) == {}
+
+
+def test_parallel_matches_single_process():
+    response = build_layout_response(page_count=12)
+    expected = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+    actual = layout_linearizer.get_text_from_layout_json_parallel(response, workers=3, min_pages=4, **CIES_OPTIONS)
+    assert actual == expected
+    assert list(actual.keys()) == list(expected.keys())
+
+
+def test_parallel_below_threshold_stays_in_process(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("a worker process was started")
+    monkeypatch.setattr(layout_linearizer.multiprocessing, "Process", fail)
+    response = build_layout_response(page_count=3)
+    expected = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+    assert layout_linearizer.get_text_from_layout_json_parallel(response, workers=4, min_pages=10, **CIES_OPTIONS) == expected
+
+
+def test_parallel_workers_that_time_out_fall_back_to_a_single_process(monkeypatch):
+    monkeypatch.setattr(layout_linearizer, "_linearize_pages_worker", lambda connection, page_block_lists, kwargs: time.sleep(30))
+    response = build_layout_response(page_count=6)
+    expected = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+    started = time.monotonic()
+    assert layout_linearizer.get_text_from_layout_json_parallel(response, workers=2, min_pages=4, timeout=0.5, **CIES_OPTIONS) == expected
+    assert time.monotonic() - started < 10
+
+
+def test_parallel_stays_in_process_while_other_threads_run(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("a worker process was started")
+    monkeypatch.setattr(layout_linearizer.multiprocessing, "Process", fail)
+    response = build_layout_response(page_count=6)
+    expected = layout_linearizer.get_text_from_layout_json(response, **CIES_OPTIONS)
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        assert layout_linearizer.get_text_from_layout_json_parallel(response, workers=2, min_pages=4, **CIES_OPTIONS) == expected
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,33 @@
+import logging
+
+import logging_policy
+from logging_policy import payload
+
+
+class Unrenderable:
+    def __repr__(self):
+        raise AssertionError("the payload was rendered")
+
+
+def test_payload_is_capped():
+    text = str(payload({"Blocks": [{"Id": str(i), "Text": "x" * 100} for i in range(1000)]}, 200))
+    assert text.startswith("{'Blocks': [{")
+    assert len(text) < 250
+    assert text.endswith("more characters]")
+    assert str(payload("short")) == "short"
+
+
+def test_payload_is_rendered_only_when_emitted():
+    logger = logging.getLogger("test_logging_policy")
+    logger.setLevel("INFO")
+    logger.debug("value=%s", payload(Unrenderable()))
+
+
+def test_debug_sampling_is_deterministic_per_correlation_id():
+    ids = [f"document-{i}" for i in range(2000)]
+    sampled = [document_id for document_id in ids if logging_policy.is_debug_sampled(document_id, 0.1)]
+    assert 100 < len(sampled) < 300
+    assert sampled == [document_id for document_id in ids if logging_policy.is_debug_sampled(document_id, 0.1)]
+    assert not logging_policy.is_debug_sampled("document-1", 0)
+    assert logging_policy.is_debug_sampled("document-1", 1)
+    assert not logging_policy.is_debug_sampled(None, 1)
@@ -0,0 +1,88 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import cies_ocr_core
+import multipart_upload
+import multipart_upload_handler
+from tests.stubs import InMemoryS3, LambdaContext
+
+MIB = 1024 * 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    return s3
+
+
+def request(method: str, path: str, body: dict = None, parameters: dict = None) -> dict:
+    event = {"httpMethod": method, "path": path, "headers": {"Siteid": "site-r", "Userid": "buzzard-lips"},
+             "queryStringParameters": parameters or {}, "body": json.dumps(body) if body is not None else "", "isBase64Encoded": False}
+    response = multipart_upload_handler.lambda_handler(event, LambdaContext())
+    if response["statusCode"] == 200:
+        response["json"] = json.loads(response["body"])
+    return response
+
+
+@pytest.mark.parametrize("size, part_size, expected", [
+    (2 * 1024 * MIB, None, (64 * MIB, 32)),
+    (1, None, (64 * MIB, 1)),
+    (100 * MIB, MIB, (5 * MIB, 20)),
+    (10000 * 64 * MIB + 1, None, (64 * MIB + 1, 10000)),
+])
+def test_plan_parts(size, part_size, expected):
+    assert multipart_upload.plan_parts(size, part_size) == expected
+
+
+def test_upload_is_resumed_and_completed(s3):
+    document_id = "1DAE93F8-646C-43B7-9981-9B41AE047881"
+    initiated = request("POST", f"/uploads/{document_id}", {"size": 12 * MIB, "part_size": 5 * MIB, "file_name": "chart.pdf"})
+    assert initiated["statusCode"] == 200
+    upload_id = initiated["json"]["upload_id"]
+    assert [part["part_number"] for part in initiated["json"]["parts"]] == [1, 2, 3]
+    assert f"UploadId={upload_id}&PartNumber=2" in initiated["json"]["parts"][1]["url"]
+
+    # parts 1 and 3 are uploaded, then the client fails
+    body = bytes(range(256)) * (12 * MIB // 256)
+    for part_number in [1, 3]:
+        offset = (part_number - 1) * 5 * MIB
+        s3.upload_part(Bucket="source", Key=document_id, UploadId=upload_id, PartNumber=part_number, Body=body[offset:offset + 5 * MIB])
+
+    listed = request("GET", f"/uploads/{document_id}", parameters={"uploadId": upload_id})
+    assert [part["PartNumber"] for part in listed["json"]["parts"]] == [1, 3]
+    renewed = request("POST", f"/uploads/{document_id}/parts", {"upload_id": upload_id, "part_numbers": [2]})
+    assert [part["part_number"] for part in renewed["json"]["parts"]] == [2]
+    s3.upload_part(Bucket="source", Key=document_id, UploadId=upload_id, PartNumber=2, Body=body[5 * MIB:10 * MIB])
+
+    completed = request("POST", f"/uploads/{document_id}/complete", {"upload_id": upload_id})
+    assert completed["statusCode"] == 200
+    stored = s3.objects[("source", document_id)]
+    assert stored["Body"] == body
+    assert stored["Metadata"][cies_ocr_core.METADATA_KEY_SITE_ID] == "site-r"
+    assert {"Key": cies_ocr_core.TAG_KEY_STATUS, "Value": "New"} in stored["TagSet"]
+
+    # the document exists now, and may not be re-created
+    assert request("POST", f"/uploads/{document_id}", {"size": MIB})["statusCode"] == 409
+    assert request("DELETE", f"/uploads/{document_id}", parameters={"uploadId": upload_id})["statusCode"] == 404
+
+
+def test_invalid_requests(s3):
+    assert request("POST", "/uploads/doc-1", {"part_size": MIB})["statusCode"] == 400
+    assert request("POST", "/uploads/doc-1/parts", {"upload_id": "x", "part_numbers": [0]})["statusCode"] == 400
+    assert request("GET", "/uploads/doc-1")["statusCode"] == 400
+    upload_id = request("POST", "/uploads/doc-1", {"size": MIB})["json"]["upload_id"]
+    wrong = [{"PartNumber": 1, "ETag": '"not-uploaded"'}]
+    assert request("POST", "/uploads/doc-1/complete", {"upload_id": upload_id, "parts": wrong})["statusCode"] == 400
+
+
+def test_stale_uploads_are_aborted(s3):
+    core = multipart_upload_handler.cies_ocr_core
+    stale = core.create_multipart_upload("user", "site", "doc-1", None, None, MIB)["upload_id"]
+    fresh = core.create_multipart_upload("user", "site", "doc-2", None, None, MIB)["upload_id"]
+    s3.uploads[stale]["Initiated"] = datetime.now(timezone.utc) - timedelta(seconds=core.multipart_stale_seconds + 1)
+
+    assert core.abort_stale_multipart_uploads() == 1
+    assert list(s3.uploads) == [fresh]
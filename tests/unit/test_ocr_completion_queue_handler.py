@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import cies_ocr_core
+import ocr_completion_queue_handler
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response
+
+
+def sqs_record(message_id: str, document_id: str, job_id: str, envelope: bool = False) -> dict:
+    notification = json.dumps({"JobId": job_id, "Status": "SUCCEEDED", "API": "StartDocumentAnalysis", "JobTag": document_id})
+    body = json.dumps({"Type": "Notification", "Message": notification}) if envelope else notification
+    return {"messageId": message_id, "receiptHandle": f"handle-{message_id}", "body": body, "attributes": {},
+            "messageAttributes": {}, "eventSource": "aws:sqs", "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:completion"}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    for document in ["doc-1", "doc-2", "doc-3"]:
+        s3.put_object(Bucket="source", Key=document, Body=b"%PDF-1.7",
+                      Tagging=f"{cies_ocr_core.TAG_KEY_STATUS}=Submitted&{cies_ocr_core.TAG_JOB_ID}=job-{document}")
+    return s3
+
+
+def test_batch_reports_only_failed_messages(s3, monkeypatch):
+    analysed = []
+
+    def get_analysis_json(self, job_id, region=None):
+        analysed.append(job_id)
+        if job_id == "job-doc-2":
+            raise RuntimeError("ProvisionedThroughputExceededException")
+        return build_layout_response(page_count=1)
+
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", get_analysis_json)
+    event = {"Records": [sqs_record("m1", "doc-1", "job-doc-1"),
+                         sqs_record("m2", "doc-2", "job-doc-2"),
+                         sqs_record("m3", "doc-3", "job-doc-3", envelope=True),
+                         sqs_record("m4", "doc-1", "job-doc-1"),
+                         {"messageId": "m5", "body": "not json"}]}
+
+    result = ocr_completion_queue_handler.lambda_handler(event, LambdaContext())
+
+    assert sorted(item["itemIdentifier"] for item in result["batchItemFailures"]) == ["m2", "m5"]
+    # the duplicated notification of doc-1 is completed once
+    assert sorted(analysed) == ["job-doc-1", "job-doc-2", "job-doc-3"]
+    for document in ["doc-1", "doc-3"]:
+        assert ("destination", f"{document}.txt") in s3.objects
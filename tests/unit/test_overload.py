@@ -0,0 +1,94 @@
+
+import pytest
+
+import cies_ocr_core
+import document_handler
+import overload
+import text_handler
+from tests.stubs import Clock, InMemoryS3, LambdaContext, client_error
+
+
+# Throttles every HEAD, as S3 does under a surge
+class SlowDownS3(InMemoryS3):
+    def head_object(self, **kwargs):
+        raise client_error("SlowDown", "HeadObject", 503)
+
+
+def test_requests_in_excess_are_shed_with_retry_after():
+    clock = Clock()
+    guard = overload.OverloadGuard(max_in_flight=2, window_seconds=10, clock=clock)
+    for _ in range(5):
+        with guard.admit():
+            pass
+    # 5 requests completed in 10 seconds, 0.5 a second
+    with guard.admit(), guard.admit():
+        with pytest.raises(overload.Overloaded) as shed:
+            with guard.admit():
+                pass
+    assert (shed.value.status_code, shed.value.retry_after) == (429, 2)
+    assert guard.in_flight == 0
+
+    # nothing completed in the window, the longest wait
+    clock.now += 20
+    with guard.admit(), guard.admit():
+        with pytest.raises(overload.Overloaded) as shed:
+            with guard.admit():
+                pass
+    assert shed.value.retry_after == overload.RETRY_AFTER_MAX_SECONDS
+
+
+def test_downstream_throttling_is_shed_until_it_leaves_the_window():
+    clock = Clock()
+    guard = overload.OverloadGuard(throttle_limit=2, window_seconds=30, clock=clock)
+    guard.record_throttle()
+    clock.now += 10
+    with pytest.raises(overload.Overloaded) as shed:
+        with guard.admit():
+            raise client_error("ThrottlingException", "GetDocumentAnalysis")
+    assert shed.value.status_code == 503
+
+    clock.now += 5
+    with pytest.raises(overload.Overloaded) as shed:
+        with guard.admit():
+            pass
+    # the first throttle leaves the window in 15 seconds
+    assert (shed.value.status_code, shed.value.retry_after) == (503, 15)
+    clock.now += 15
+    with guard.admit():
+        pass
+    # other errors are not throttling
+    with pytest.raises(Exception) as error:
+        with guard.admit():
+            raise client_error("AccessDenied", "GetObject", 403)
+    assert not isinstance(error.value, overload.Overloaded)
+    assert guard.take_counters() == {"DownstreamThrottles": 2, "Shed503": 2}
+
+
+def test_throttled_text_request_is_a_503(monkeypatch):
+    monkeypatch.setattr(cies_ocr_core, "s3", SlowDownS3())
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "overload_guard", overload.OverloadGuard(throttle_limit=1))
+    event = {"httpMethod": "GET", "path": "/text/doc-1", "headers": {"accept": "application/json"}}
+    for _ in range(2):
+        response = text_handler.lambda_handler(event, LambdaContext())
+        assert response["statusCode"] == 503
+        assert int(response["headers"]["Retry-After"]) >= 1
+        assert isinstance(response["body"], str)
+
+
+def test_uploads_are_shed_while_the_lane_is_backed_up(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "overload_guard",
+                        overload.OverloadGuard(max_backlog=100, drain_per_second=2))
+    backlog = {"interactive": 150, "bulk": 0}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_submission_backlog", lambda self, lane: backlog[lane])
+
+    event = {"httpMethod": "POST", "path": "/doc-1", "body": "text", "headers": {"siteid": "site-r"}}
+    response = document_handler.lambda_handler(event, LambdaContext())
+    # 51 documents over the limit, submitted at 2 a second
+    assert (response["statusCode"], response["headers"]["Retry-After"]) == (429, "26")
+    assert ("source", "doc-1") not in s3.objects
+
+    event["headers"]["priority"] = "bulk"
+    assert document_handler.lambda_handler(event, LambdaContext())["statusCode"] == 202
+    assert ("source", "doc-1") in s3.objects
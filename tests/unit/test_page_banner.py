@@ -0,0 +1,63 @@
+import json
+
+import cies_ocr_core
+import page_banner
+import text_handler
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response
+
+# the banner of each page as linearized, in a different order on each page, with an OCR error on page 3
+PAGES = {
+    1: "Patient: DOE, JOHN\nMRN JD4USARAD\n\nExam Date:\n05/25/2010\n\nReferring Physician: DR. DAVID LIVESEY\n\n"
+       "PET/CT OF THE WHOLE BODY\n\nCLINICAL HISTORY: Melanoma January. 2008.\n\nPage 1 of 3\n\n\n\n",
+    2: "Patient: DOE, JOHN\nMRN JD4USARAD\n\nExam Date:\n05/25/2010\n\nReferring Physician: DR. DAVID LIVESEY\n\n"
+       "peripherally located metastasis located within the apical posterior segment\n\nPage 2 of 3\n\n\n\n",
+    3: "Patient: DOE, JOHN\nMRN JD4USARAD\nReferring Physlcian: DR. DAVID LlVESEY\n\nExam Date:\n05/25/2010\n\n"
+       "CONCLUSION There has been progressive metastatic disease\n\nPage 3 of 3\n\n\n\n",
+}
+
+
+def test_banner_is_collapsed():
+    compact = page_banner.collapse(PAGES)
+    assert compact["banner"] == "Patient: DOE, JOHN\nMRN JD4USARAD\nExam Date:\n05/25/2010\nReferring Physician: DR. DAVID LIVESEY"
+    assert compact["pages"]["1"].startswith("PET/CT OF THE WHOLE BODY\n\nCLINICAL HISTORY")
+    assert compact["pages"]["3"].startswith("CONCLUSION There has been")
+    # the page numbers differ, they are not a footer
+    assert compact["footer"] == ""
+    assert all(f"Page {page} of 3" in compact["pages"][str(page)] for page in PAGES)
+    assert len(json.dumps(compact)) < len(json.dumps(PAGES))
+
+
+def test_different_numbers_are_never_merged():
+    pages = {page: f"MRN JD4USARAD\nExam Date: 05/2{page}/2010\nbody of page {page}\n\n" for page in range(1, 5)}
+    compact = page_banner.collapse(pages)
+    assert compact["banner"] == "MRN JD4USARAD"
+    assert compact["pages"]["2"] == "Exam Date: 05/22/2010\nbody of page 2\n\n"
+
+
+def test_a_single_page_is_unchanged():
+    assert page_banner.collapse({1: PAGES[1]}) == {"banner": "", "footer": "", "pages": {"1": PAGES[1]}}
+
+
+def test_compact_form_is_stored_and_returned(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=4))
+    core = text_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", b"%PDF-1.7")
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}])
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    assert ("destination", "doc-1.compact.json") in s3.objects
+
+    event = {"httpMethod": "GET", "path": "/text/doc-1", "headers": {}, "queryStringParameters": {"form": "compact"}}
+    response = text_handler.lambda_handler(event, LambdaContext())
+    assert response["statusCode"] == 200
+    compact = json.loads(response["body"])
+    # the title repeats at the top of every page
+    assert compact["banner"].startswith("PET/CT OF THE WHOLE BODY")
+    assert "SECTION 3.0:" in compact["pages"]["3"]
+
+    event["queryStringParameters"] = {}
+    full = json.loads(text_handler.lambda_handler(event, LambdaContext())["body"])
+    assert all("PET/CT OF THE WHOLE BODY" in text for text in full.values())
+    assert core.get_document_id_from_result_id("doc-1.compact.json") == "doc-1"
@@ -0,0 +1,170 @@
+import io
+import json
+
+from PIL import Image
+
+import cies_ocr_core
+import key_layout
+import ocr_completion_queue_handler
+import ocr_submission_handler
+import page_fingerprints
+from tests.stubs import LambdaContext, completion_event, s3_event
+from tests.textract_fixtures import build_layout_response
+
+COLOURS = ["red", "green", "blue", "yellow", "purple", "orange"]
+
+
+# a scanned PDF, a page of a distinct colour for each colour
+def scanned_pdf(colours: list) -> bytes:
+    images = [Image.new("RGB", (64, 48), color=colour) for colour in colours]
+    output = io.BytesIO()
+    images[0].save(output, format="PDF", save_all=True, append_images=images[1:])
+    return output.getvalue()
+
+
+def test_pages_are_fingerprinted_by_content():
+    fingerprints = page_fingerprints.fingerprint_pages(scanned_pdf(["red", "green", "red"]))
+    assert len(fingerprints) == 3
+    assert fingerprints[0] == fingerprints[2] != fingerprints[1]
+    # the same page in another document
+    assert page_fingerprints.fingerprint_pages(scanned_pdf(["blue", "red"]))[1] == fingerprints[0]
+
+
+def test_revision_maps_the_pages_of_the_new_version():
+    assert page_fingerprints.build_revision(None, ["a", "b"])["pages"] is None
+    # nothing in common, the document is analysed whole
+    assert page_fingerprints.build_revision(["a", "b"], ["c", "d"])["pages"] is None
+
+    revision = page_fingerprints.build_revision(["a", "b", "c"], ["a", "x", "c", "b", "y"])
+    assert revision["pages"] == {"1": {"base": 1}, "2": {"partial": 1}, "3": {"base": 3}, "4": {"base": 2}, "5": {"partial": 2}}
+    assert page_fingerprints.partial_pages(revision) == [2, 5]
+    assert page_fingerprints.partial_pages(page_fingerprints.build_revision(["a", "b"], ["b", "a"])) == []
+
+
+def test_merged_layout_is_renumbered_with_unique_ids():
+    base = build_layout_response(page_count=2)
+    partial = build_layout_response(page_count=1)
+    revision = page_fingerprints.build_revision(["a", "b"], ["b", "x", "b"])
+    merged = page_fingerprints.merge_layout(base, partial, revision)
+
+    assert merged["DocumentMetadata"]["Pages"] == 3
+    pages = [block for block in merged["Blocks"] if block["BlockType"] == "PAGE"]
+    assert [page["Page"] for page in pages] == [1, 2, 3]
+    ids = [block["Id"] for block in merged["Blocks"]]
+    assert len(ids) == len(set(ids))
+    # every relationship of the reused copy of page 2 points within the copy
+    page_3_ids = {block["Id"] for block in merged["Blocks"] if block["Page"] == 3}
+    assert all(id in page_3_ids for id in pages[2]["Relationships"][0]["Ids"])
+
+
+def submit(core, body: bytes):
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", body)
+    ocr_submission_handler.lambda_handler(s3_event("doc-1"), LambdaContext())
+
+
+def test_replaced_document_submits_only_its_changed_pages(submission, monkeypatch):
+    s3, textract = submission
+    results = {"job-1": build_layout_response(page_count=3), "job-2": build_layout_response(page_count=1)}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: results[job_id])
+    core = ocr_submission_handler.cies_ocr_core
+
+    submit(core, scanned_pdf(COLOURS[:3]))
+    assert textract.submitted == ["doc-1"]
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    stored = json.loads(s3.objects[("destination", "doc-1.pages.json")]["Body"])
+    assert stored["job_id"] == "job-1" and len(stored["fingerprints"]) == 3
+
+    # a corrected page 2 is inserted, the original page 2 moves to the end
+    submit(core, scanned_pdf(["red", "white", "blue", "green"]))
+    assert textract.submitted == ["doc-1", "partial/doc-1"]
+    assert len(page_fingerprints.fingerprint_pages(s3.objects[("source", "partial/doc-1")]["Body"])) == 1
+    core.ocr_complete("doc-1", "SUCCEEDED")
+
+    merged = core.read_result_json("doc-1")
+    assert merged["DocumentMetadata"]["Pages"] == 4
+    page_blocks = {block["Page"]: block["Id"] for block in merged["Blocks"] if block["BlockType"] == "PAGE"}
+    original = {block["Page"]: block["Id"] for block in results["job-1"]["Blocks"] if block["BlockType"] == "PAGE"}
+    assert page_blocks[1] == original[1] and page_blocks[3] == original[3] and page_blocks[4] == original[2]
+    assert set(core.get_text("user", "site-r", "doc-1")) == {1, 2, 3, 4}
+    # the revision and the partial PDF are removed once the results are stored
+    assert ("source", "partial/doc-1") not in s3.objects
+    assert ("destination", "revisions/doc-1.json") not in s3.objects
+
+    # an identical document keeps its results
+    submit(core, scanned_pdf(["red", "white", "blue", "green"]))
+    assert len(textract.submitted) == 2
+    assert core.get_document_metadata("doc-1")[cies_ocr_core.TAG_JOB_ID] == "job-2"
+
+
+def test_removed_or_reordered_pages_are_rebuilt_without_textract(submission, monkeypatch):
+    s3, textract = submission
+    results = {"job-1": build_layout_response(page_count=5)}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: results[job_id])
+    core = ocr_submission_handler.cies_ocr_core
+    submit(core, scanned_pdf(COLOURS[:5]))
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    original = {block["Page"]: block["Id"] for block in results["job-1"]["Blocks"] if block["BlockType"] == "PAGE"}
+
+    def page_ids() -> dict:
+        return {block["Page"]: block["Id"] for block in core.read_result_json("doc-1")["Blocks"] if block["BlockType"] == "PAGE"}
+
+    # the last two pages are removed
+    submit(core, scanned_pdf(COLOURS[:3]))
+    assert textract.submitted == ["doc-1"]
+    assert page_ids() == {page: original[page] for page in (1, 2, 3)}
+    assert set(core.get_text("user", "site-r", "doc-1")) == {1, 2, 3}
+    metadata = core.get_document_metadata("doc-1")
+    assert (metadata[cies_ocr_core.TAG_KEY_STATUS], metadata[cies_ocr_core.TAG_JOB_ID]) == ("SUCCEEDED", "job-1")
+
+    # and the others reordered
+    submit(core, scanned_pdf(["blue", "red", "green"]))
+    assert textract.submitted == ["doc-1"]
+    assert page_ids() == {1: original[3], 2: original[1], 3: original[2]}
+    assert json.loads(s3.objects[("destination", "doc-1.pages.json")]["Body"])["fingerprints"] == \
+        page_fingerprints.fingerprint_pages(scanned_pdf(["blue", "red", "green"]))
+
+
+def test_a_partial_result_without_its_stored_result_is_stored_alone(submission, monkeypatch):
+    s3, textract = submission
+    results = {"job-1": build_layout_response(page_count=2), "job-2": build_layout_response(page_count=1)}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: results[job_id])
+    core = ocr_submission_handler.cies_ocr_core
+    submit(core, scanned_pdf(COLOURS[:2]))
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    # a document which is not fingerprinted has no revision to remove
+    core.save_document_to_source_bucket("user", "site-r", "doc-2", "note.txt", "text/plain", "New", b"text")
+    core.update_tag_in_S3("doc-2", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}])
+    core.ocr_complete("doc-2", "SUCCEEDED")
+    assert not [key for operation, key in s3.calls if operation == "DeleteObject" and key.endswith("doc-2")]
+
+    submit(core, scanned_pdf(["red", "white"]))
+    assert textract.submitted == ["doc-1", "partial/doc-1"]
+    del s3.objects[("destination", "doc-1.json")]
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    assert core.read_result_json("doc-1")["DocumentMetadata"]["Pages"] == 1
+    # the fingerprints are those of the first version, the next version is not merged with the partial result
+    assert json.loads(s3.objects[("destination", "doc-1.pages.json")]["Body"])["job_id"] == "job-1"
+    assert ("source", "partial/doc-1") not in s3.objects
+
+
+def test_a_partial_job_is_completed_under_the_site_layout(submission, monkeypatch):
+    s3, textract = submission
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "layout", key_layout.KeyLayout("site"))
+    results = {"job-1": build_layout_response(page_count=2), "job-2": build_layout_response(page_count=1)}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: results[job_id])
+    core = ocr_submission_handler.cies_ocr_core
+    source_key = core.create_source_key("doc-1", "site-r")
+
+    def submit_and_complete(body: bytes):
+        core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", body)
+        ocr_submission_handler.lambda_handler(s3_event(source_key), LambdaContext())
+        message = {"JobId": f"job-{len(textract.submitted)}", "Status": "SUCCEEDED", "API": "StartDocumentAnalysis",
+                   "JobTag": "doc-1", "DocumentLocation": {"S3ObjectName": textract.submitted[-1], "S3Bucket": "source"}}
+        assert ocr_completion_queue_handler.lambda_handler(completion_event(message), LambdaContext())["batchItemFailures"] == []
+
+    submit_and_complete(scanned_pdf(COLOURS[:2]))
+    submit_and_complete(scanned_pdf(["red", "white", "green"]))
+    assert textract.submitted == [source_key, f"partial/{source_key}"]
+    assert core.get_text_metadata("doc-1", "site-r")[cies_ocr_core.TAG_KEY_STATUS] == "SUCCEEDED"
+    assert core.read_result_json("doc-1", "site-r")["DocumentMetadata"]["Pages"] == 3
+    assert ("source", f"partial/{source_key}") not in s3.objects
@@ -0,0 +1,161 @@
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+import cies_ocr_core
+import pending_jobs
+import reconcile_handler
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "GetDocumentAnalysis")
+
+
+def test_pending_keys():
+    hour = pending_jobs.submission_hour(datetime(2024, 6, 10, 14, 35, tzinfo=timezone.utc))
+    assert hour == "2024061014"
+    key = pending_jobs.create_pending_key("site/1DAE93F8", hour)
+    assert key == "pending/2024061014/site/1DAE93F8"
+    assert pending_jobs.source_key_from_key(key) == "site/1DAE93F8"
+    assert pending_jobs.hour_from_prefix("pending/2024061014/") == datetime(2024, 6, 10, 14, tzinfo=timezone.utc)
+
+
+def test_backoff_retries_throttling(monkeypatch):
+    monkeypatch.setattr(pending_jobs.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        if len(calls) < 3:
+            raise client_error("ThrottlingException")
+        return "SUCCEEDED"
+
+    assert pending_jobs.call_with_backoff(throttled) == "SUCCEEDED"
+    assert len(calls) == 3
+
+
+def test_backoff_does_not_retry_other_errors(monkeypatch):
+    monkeypatch.setattr(pending_jobs.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def invalid():
+        calls.append(1)
+        raise client_error("InvalidJobIdException")
+
+    with pytest.raises(ClientError):
+        pending_jobs.call_with_backoff(invalid)
+    assert len(calls) == 1
+
+    def always_throttled():
+        calls.append(1)
+        raise client_error("ThrottlingException")
+
+    with pytest.raises(ClientError):
+        pending_jobs.call_with_backoff(always_throttled, attempts=3)
+    assert len(calls) == 4
+
+
+class ReconcileTextractStub:
+    def __init__(self):
+        self.job_status = "IN_PROGRESS"
+        self.start_error = None
+        self.submitted = []
+
+    def get_document_analysis(self, JobId, **kwargs):
+        if self.job_status is None:
+            raise client_error("InvalidJobIdException")
+        return {"JobStatus": self.job_status}
+
+    def start_document_analysis(self, DocumentLocation, **kwargs):
+        if self.start_error is not None:
+            raise self.start_error
+        self.submitted.append(DocumentLocation["S3Object"]["Name"])
+        return {"JobId": f"job-{len(self.submitted) + 1}"}
+
+
+@pytest.fixture
+def reconcile(monkeypatch):
+    s3, textract = InMemoryS3(), ReconcileTextractStub()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core, "txt", textract)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "reconcile_deadline_seconds", 0)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=1))
+    core = reconcile_handler.cies_ocr_core
+    # a document submitted in 2020, whose notification was lost
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_KEY_STATUS, "Value": "Submitted"}, {"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"},
+                                    {"Key": cies_ocr_core.TAG_SUBMITTED_AT, "Value": "2020010100"}])
+    core.record_pending_job("doc-1", "2020010100")
+    return s3, textract
+
+
+def markers(s3) -> list:
+    return sorted(key for bucket, key in s3.objects if bucket == "destination" and key.startswith(pending_jobs.PENDING_PREFIX))
+
+
+def run(outcome: str) -> dict:
+    summary = reconcile_handler.lambda_handler({}, LambdaContext())
+    assert summary.get(outcome) == 1, summary
+    return summary
+
+
+def status(s3) -> str:
+    return next(tag["Value"] for tag in s3.objects[("source", "doc-1")]["TagSet"] if tag["Key"] == cies_ocr_core.TAG_KEY_STATUS)
+
+
+def test_a_job_in_progress_keeps_its_marker(reconcile):
+    s3, textract = reconcile
+    run("in_progress")
+    assert markers(s3) == ["pending/2020010100/doc-1"] and status(s3) == "Submitted"
+
+
+@pytest.mark.parametrize("job_status, outcome", [("SUCCEEDED", "completed"), ("PARTIAL_SUCCESS", "completed"), ("FAILED", "failed")])
+def test_a_finished_job_is_completed(reconcile, job_status, outcome):
+    s3, textract = reconcile
+    textract.job_status = job_status
+    run(outcome)
+    assert markers(s3) == [] and status(s3) == ("FAILED" if outcome == "failed" else "SUCCEEDED")
+    assert (("destination", "doc-1.txt") in s3.objects) == (outcome == "completed")
+
+
+def test_a_job_textract_no_longer_has_is_resubmitted(reconcile):
+    s3, textract = reconcile
+    textract.job_status = None
+    run("resubmitted")
+    assert textract.submitted == ["doc-1"] and status(s3) == "Submitted"
+    # the marker of the new submission replaces the old one
+    assert markers(s3) == [f"pending/{pending_jobs.submission_hour()}/doc-1"]
+
+
+def test_a_failed_resubmission_keeps_its_marker(reconcile):
+    s3, textract = reconcile
+    textract.job_status = None
+    textract.start_error = client_error("LimitExceededException")
+    run("error")
+    assert markers(s3) == ["pending/2020010100/doc-1"] and status(s3) == "Submitted"
+
+    # and the next run submits it again
+    textract.start_error = None
+    run("resubmitted")
+    assert markers(s3) == [f"pending/{pending_jobs.submission_hour()}/doc-1"]
+
+
+def test_a_resubmission_in_the_hour_of_its_marker_keeps_it(reconcile):
+    s3, textract = reconcile
+    textract.job_status = None
+    core = reconcile_handler.cies_ocr_core
+    s3.delete_object(Bucket="destination", Key="pending/2020010100/doc-1")
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_SUBMITTED_AT, "Value": pending_jobs.submission_hour()}])
+    core.record_pending_job("doc-1", pending_jobs.submission_hour())
+    run("resubmitted")
+    assert markers(s3) == [f"pending/{pending_jobs.submission_hour()}/doc-1"]
+
+
+def test_the_marker_of_a_deleted_or_completed_document_is_cleared(reconcile):
+    s3, textract = reconcile
+    s3.delete_object(Bucket="source", Key="doc-1")
+    run("cleared")
+    assert markers(s3) == []
@@ -0,0 +1,101 @@
+import io
+
+import pytest
+from PIL import Image
+
+import cies_ocr_core
+import ocr_submission_handler
+import preflight
+import text_handler
+from tests.stubs import LambdaContext, s3_event
+from tests.textract_fixtures import build_pdf
+
+
+def image(format: str, frames: int = 1, mode: str = "RGB") -> bytes:
+    images = [Image.new(mode, (64, 48), color=index * 40) for index in range(frames)]
+    output = io.BytesIO()
+    images[0].save(output, format=format, save_all=frames > 1, append_images=images[1:])
+    return output.getvalue()
+
+
+def inspect(body: bytes, chunk_size: int = 1024 * 1024) -> dict:
+    return preflight.inspect((body[start:start + chunk_size] for start in range(0, len(body), chunk_size)), len(body))
+
+
+@pytest.mark.parametrize("body, expected", [
+    (build_pdf(), preflight.PDF),
+    (b"\x00" * 100 + build_pdf(), preflight.PDF),
+    (image("TIFF"), preflight.TIFF),
+    (image("JPEG"), preflight.JPEG),
+    (image("PNG"), preflight.PNG),
+    (image("GIF", mode="P"), preflight.GIF),
+    (image("BMP"), preflight.BMP),
+    (b"patient name: ...", None),
+])
+def test_sniff(body, expected):
+    assert preflight.sniff(body[:preflight.SNIFF_BYTES]) == expected
+
+
+def test_pdf_pages_are_counted_across_chunks():
+    assert inspect(build_pdf(page_count=40), chunk_size=7) == {"kind": preflight.PDF, "pages": 40, "converted": None}
+    assert inspect(build_pdf(page_count=12, object_stream=True))["pages"] == 12
+
+
+@pytest.mark.parametrize("body, reason", [
+    (b"", preflight.REASON_EMPTY),
+    (b"patient name: ...", preflight.REASON_UNSUPPORTED_TYPE),
+    (build_pdf(encrypted=True), preflight.REASON_ENCRYPTED),
+    (build_pdf()[:-20], preflight.REASON_CORRUPT),
+    (build_pdf(page_count=3001), preflight.REASON_TOO_MANY_PAGES),
+    (image("PNG")[:40], preflight.REASON_CORRUPT),
+])
+def test_bad_documents_are_rejected(body, reason):
+    with pytest.raises(preflight.Rejected) as rejected:
+        inspect(body)
+    assert rejected.value.reason == reason
+
+
+def test_images_are_converted():
+    assert inspect(image("TIFF"))["converted"] is None
+    assert inspect(image("JPEG"))["converted"] is None
+
+    converted = inspect(image("TIFF", frames=3, mode="L"))
+    assert converted["pages"] == 3
+    assert converted["converted"][1] == "application/pdf"
+    assert preflight.inspect([converted["converted"][0]], len(converted["converted"][0]))["pages"] == 3
+
+    body, content_type = inspect(image("GIF", mode="P"))["converted"]
+    assert content_type == "image/png"
+    assert preflight.sniff(body) == preflight.PNG
+
+
+def test_rejected_document_is_not_submitted(submission):
+    s3, textract = submission
+    core = ocr_submission_handler.cies_ocr_core
+    # a POST without a Content-Type
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "doc-1", "text/plain", "New", "patient name: ...")
+    ocr_submission_handler.lambda_handler(s3_event("doc-1"), LambdaContext())
+    assert textract.submitted == []
+    metadata = core.get_document_metadata("doc-1")
+    assert metadata[cies_ocr_core.TAG_KEY_STATUS] == "Rejected"
+    assert metadata[cies_ocr_core.TAG_REJECT_REASON] == preflight.REASON_UNSUPPORTED_TYPE
+
+    response = text_handler.lambda_handler({"httpMethod": "GET", "path": "/text/doc-1", "headers": {"Accept": "text/plain"}}, LambdaContext())
+    assert response["statusCode"] == 422
+    assert response["headers"]["ocr-reject-reason"] == preflight.REASON_UNSUPPORTED_TYPE
+
+
+def test_converted_document_is_submitted_by_its_own_event(submission):
+    s3, textract = submission
+    core = ocr_submission_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "scan.tif", "image/tiff", "New", image("TIFF", frames=2))
+    ocr_submission_handler.lambda_handler(s3_event("doc-1"), LambdaContext())
+    assert textract.submitted == []
+    converted = s3.objects[("source", "doc-1")]
+    assert converted["ContentType"] == "application/pdf"
+    assert converted["Metadata"][cies_ocr_core.METADATA_KEY_FILE_NAME] == "scan.tif"
+    assert converted["Metadata"][cies_ocr_core.METADATA_KEY_ORIGINAL_CONTENT_TYPE] == "image/tiff"
+
+    # the ObjectCreated event of the conversion
+    ocr_submission_handler.lambda_handler(s3_event("doc-1"), LambdaContext())
+    assert textract.submitted == ["doc-1"]
@@ -0,0 +1,78 @@
+import json
+
+import boto3
+import pytest
+from botocore.client import Config
+
+import cies_ocr_core
+import presign_cache
+import presigned_url_handler
+from tests.stubs import Clock
+
+
+def test_signature_is_reused_until_the_margin():
+    clock = Clock()
+    cache = presign_cache.PresignCache(clock=clock)
+    signed = []
+
+    def sign():
+        signed.append(clock.now)
+        return f"url-{len(signed)}"
+
+    assert cache.get_or_sign("get_object", "bucket", "key", 120, sign) == "url-1"
+    clock.now += 59
+    assert cache.get_or_sign("get_object", "bucket", "key", 120, sign) == "url-1"
+    # less than half of the lifetime remains
+    clock.now += 2
+    assert cache.get_or_sign("get_object", "bucket", "key", 120, sign) == "url-2"
+    # a different expiration is a different signature
+    assert cache.get_or_sign("get_object", "bucket", "key", 900, sign) == "url-3"
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_is_bounded():
+    cache = presign_cache.PresignCache(size=2)
+    for key in ["a", "b", "c"]:
+        cache.get_or_sign("get_object", "bucket", key, 120, lambda: key)
+    assert [entry[2] for entry in cache.entries] == ["b", "c"]
+
+
+@pytest.fixture
+def signing_client(monkeypatch):
+    # signing is local, it only needs credentials
+    monkeypatch.setattr(cies_ocr_core, "s3", boto3.client("s3", region_name="us-east-1", aws_access_key_id="test",
+                                                          aws_secret_access_key="test", config=Config(signature_version="s3v4")))
+
+
+def test_batch_route_presigns_each_document(signing_client, monkeypatch):
+    cache = presigned_url_handler.cies_ocr_core.presigned_url_cache
+    cache.clear()
+    clock = Clock()
+    monkeypatch.setattr(cache, "clock", clock)
+    documents = [{"document_id": "doc-1", "type": "text"}, {"document_id": "doc-1", "type": "text"},
+                 {"document_id": "doc-2", "type": "upload"}, {"document_id": "doc-3", "type": "pdf"}, {"type": "json"}]
+    event = {"httpMethod": "POST", "path": "/presignedurls", "body": json.dumps({"documents": documents})}
+
+    response = presigned_url_handler.lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert body["expires_in"] == presigned_url_handler.PRESIGNED_BATCH_EXPIRATION
+    results = body["documents"]
+    assert len(results) == 5
+    assert "/doc-1.txt?" in results[0]["url"] and results[0]["url"] == results[1]["url"]
+    assert results[2]["fields"]["key"] == "doc-2"
+    assert "error" in results[3] and "error" in results[4]
+    assert [result.get("expires_in") for result in results] == [presigned_url_handler.PRESIGNED_BATCH_EXPIRATION] * 3 + [None, None]
+
+    # the URLs signed by the first request are reused, each is valid for the rest of its lifetime
+    clock.now += 300
+    documents.append({"document_id": "doc-4", "type": "json"})
+    body = json.loads(presigned_url_handler.lambda_handler(event | {"body": json.dumps({"documents": documents})}, None)["body"])
+    assert [result.get("expires_in") for result in body["documents"]] == [600, 600, 600, None, None, 900]
+    assert body["expires_in"] == 600
+
+
+def test_batch_route_rejects_malformed_requests():
+    event = {"httpMethod": "POST", "path": "/presignedurls", "body": "{\"documents\": 1}"}
+    assert presigned_url_handler.lambda_handler(event, None)["statusCode"] == 400
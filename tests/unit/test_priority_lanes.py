@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import cies_ocr_core
+import ocr_dispatch_handler
+import ocr_submission_handler
+import priority_lanes
+from tests.stubs import InMemoryS3, InMemorySQS, LambdaContext, TextractStub
+from tests.textract_fixtures import build_pdf
+
+PDF = build_pdf()
+INTERACTIVE_QUEUE = "https://sqs.us-east-1.amazonaws.com/123456789012/submission-interactive"
+BULK_QUEUE = "https://sqs.us-east-1.amazonaws.com/123456789012/submission-bulk"
+
+
+@pytest.fixture
+def lanes(monkeypatch):
+    s3, sqs, textract = InMemoryS3(), InMemorySQS(), TextractStub()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core, "sqs", sqs)
+    monkeypatch.setattr(cies_ocr_core, "txt", textract)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "submission_queue_urls",
+                        {priority_lanes.INTERACTIVE: INTERACTIVE_QUEUE, priority_lanes.BULK: BULK_QUEUE})
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "submission_backlog_cache", {})
+    return s3, sqs, textract
+
+
+def store(document_id: str, priority: str = None):
+    core = ocr_submission_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site-r", document_id, "chart.pdf", "application/pdf", "New", PDF, priority)
+    event = {"Records": [{"eventSource": "aws:s3", "eventName": "ObjectCreated:Put", "eventTime": "2024-06-10T14:00:00.000Z",
+                          "s3": {"bucket": {"name": "source", "arn": "arn:aws:s3:::source"}, "object": {"key": document_id}}}]}
+    ocr_submission_handler.lambda_handler(event, LambdaContext())
+
+
+@pytest.mark.parametrize("priority, expected", [
+    (None, priority_lanes.INTERACTIVE),
+    ("BULK ", priority_lanes.BULK),
+    ("urgent", priority_lanes.INTERACTIVE),
+])
+def test_lane_of(priority, expected):
+    assert priority_lanes.lane_of(priority) == expected
+
+
+def test_documents_are_queued_in_their_lane(lanes):
+    s3, sqs, textract = lanes
+    store("doc-1")
+    store("doc-2", "bulk")
+    assert textract.submitted == []
+    assert [json.loads(message["Body"])["document_id"] for message in sqs.queues[INTERACTIVE_QUEUE]] == ["doc-1"]
+    submission = json.loads(sqs.queues[BULK_QUEUE][0]["Body"])
+    assert submission["lane"] == priority_lanes.BULK
+    assert submission["enqueued_at"] == "2024-06-10T14:00:00.000Z"
+
+
+def test_interactive_submissions_are_submitted_once(lanes, capsys):
+    s3, sqs, textract = lanes
+    store("doc-1")
+    # SQS delivers the submission twice
+    event = sqs.receive_event(INTERACTIVE_QUEUE)
+    event["Records"].append(dict(event["Records"][0], messageId="duplicate"))
+    assert ocr_dispatch_handler.lambda_handler(event, LambdaContext()) == {"batchItemFailures": []}
+    assert textract.submitted == ["doc-1"]
+    assert ocr_dispatch_handler.cies_ocr_core.get_document_metadata("doc-1")[cies_ocr_core.TAG_KEY_STATUS] == "Submitted"
+
+    emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    latency = next(record for record in emitted if "SubmissionLatency" in record)
+    assert latency["lane"] == priority_lanes.INTERACTIVE
+    assert latency["Submissions"] == [2.0]
+
+
+def test_bulk_submissions_wait_for_the_interactive_backlog(lanes):
+    s3, sqs, textract = lanes
+    store("doc-1", "bulk")
+    store("doc-2", "bulk")
+    store("doc-3")
+    bulk = sqs.receive_event(BULK_QUEUE)
+    assert ocr_dispatch_handler.lambda_handler(bulk, LambdaContext()) == {"batchItemFailures": []}
+    assert textract.submitted == []
+    deferred = sqs.queues[BULK_QUEUE]
+    assert [message["DelaySeconds"] for message in deferred] == [priority_lanes.BULK_DEFER_SECONDS] * 2
+    # the deferred submissions keep the time their documents were stored
+    assert json.loads(deferred[0]["Body"])["enqueued_at"] == "2024-06-10T14:00:00.000Z"
+
+    ocr_dispatch_handler.lambda_handler(sqs.receive_event(INTERACTIVE_QUEUE), LambdaContext())
+    cies_ocr_core.CiesOcrCore.submission_backlog_cache.clear()
+    ocr_dispatch_handler.lambda_handler(sqs.receive_event(BULK_QUEUE), LambdaContext())
+    assert textract.submitted == ["doc-3", "doc-1", "doc-2"]
+
+
+def test_latency_ms():
+    now = datetime(2024, 6, 10, 14, 0, 1, 500000, tzinfo=timezone.utc)
+    assert priority_lanes.latency_ms("2024-06-10T14:00:00.000Z", now) == 1500.0
@@ -0,0 +1,64 @@
+import marshal
+
+import cies_ocr_core
+import profiling
+import text_handler
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+
+def profiles(s3: InMemoryS3, correlation_id: str) -> dict:
+    prefix = f"diagnostics/{correlation_id}/"
+    return {key.rsplit(".", 1)[1]: value["Body"] for (bucket, key), value in s3.objects.items()
+            if bucket == "destination" and key.startswith(prefix)}
+
+
+def test_invocations_are_profiled_by_header_or_sample(monkeypatch):
+    # no header profiles a request unless one is configured
+    assert profiling.invocation_reason({"headers": {"X-Cies-Profile": "true"}}, "req-1") is None
+    monkeypatch.setattr(profiling, "PROFILE_HEADER", "X-Cies-Profile")
+    assert profiling.invocation_reason({"headers": {"x-cies-profile": "true"}}, "req-1") == profiling.REASON_HEADER
+    assert profiling.invocation_reason({"headers": {"X-Cies-Profile": "false"}}, "req-1") is None
+    assert profiling.invocation_reason({"headers": {}}, "req-1") is None
+    assert profiling.invocation_reason(None, None) is None
+
+
+def test_a_text_request_with_the_header_is_profiled(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(profiling, "PROFILE_BUCKET", "destination")
+    monkeypatch.setattr(profiling, "PROFILE_HEADER", "X-Cies-Profile")
+    event = {"httpMethod": "GET", "path": "/text/doc-1", "headers": {"accept": "application/json"},
+             "requestContext": {"requestId": "req-1"}}
+    assert text_handler.lambda_handler(event, LambdaContext())["statusCode"] == 404
+    assert profiles(s3, "req-1") == {}
+
+    event["headers"]["X-Cies-Profile"] = "1"
+    assert text_handler.lambda_handler(event, LambdaContext())["statusCode"] == 404
+    written = profiles(s3, "req-1")
+    assert set(written) == {"prof", "txt"}
+    # the stats are those pstats reads, keyed by (file, line, function)
+    assert any(function == "get_text_response" for _, _, function in marshal.loads(written["prof"]))
+    report = written["txt"].decode("utf-8")
+    assert "reason: header" in report and "allocation sites" in report
+    assert not profiling.is_profiling()
+
+
+def test_a_large_document_is_profiled_at_completion(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(profiling, "PROFILE_BUCKET", "destination")
+    monkeypatch.setattr(profiling, "PROFILE_MIN_PAGES", 3)
+    pages = {"doc-1": 2, "doc-2": 3}
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json",
+                        lambda self, job_id, region=None: build_layout_response(page_count=pages[job_id]))
+    core = cies_ocr_core.CiesOcrCore("source", "destination", "role", "topic", "us-east-1")
+    for document_id in pages:
+        core.save_document_to_source_bucket("user", "site-r", document_id, "chart.pdf", "application/pdf", "New", build_pdf())
+        core.update_tag_in_S3(document_id, [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": document_id}])
+        core.ocr_complete(document_id, "SUCCEEDED")
+
+    assert profiles(s3, "doc-1") == {}
+    report = profiles(s3, "doc-2")["txt"].decode("utf-8")
+    assert "reason: pages" in report and "move_text_to_destination" in report
+    assert ("destination", "doc-2.txt") in s3.objects
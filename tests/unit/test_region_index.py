@@ -0,0 +1,82 @@
+import json
+import random
+
+import cies_ocr_core
+import region_handler
+import region_index
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+
+def centre_within(block: dict, page: int, box: tuple) -> bool:
+    geometry = block["Geometry"]["BoundingBox"]
+    x = geometry["Left"] + geometry["Width"] / 2
+    y = geometry["Top"] + geometry["Height"] / 2
+    return block["Page"] == page and box[0] <= x <= box[2] and box[1] <= y <= box[3]
+
+
+def test_box_query_matches_a_scan_of_the_blocks():
+    response = build_layout_response(page_count=3)
+    arrays = region_index.loads(region_index.dumps(region_index.build(response)))
+    assert region_index.page_count(arrays) == 3
+
+    lines = region_index.query_box(arrays, region_index.LINE, 2, (0.0, 0.03, 1.0, 0.048))
+    assert [line["text"] for line in lines] == ["MRN JD4USARAD"]
+    assert [word["text"] for word in region_index.query_box(arrays, region_index.WORD, 2, (0.0, 0.03, 0.2, 0.048))] == ["MRN"]
+
+    generator = random.Random(42)
+    for _ in range(50):
+        left, right = sorted(generator.random() for _ in range(2))
+        top, bottom = sorted(generator.random() for _ in range(2))
+        page = generator.randint(1, 3)
+        expected = sorted(block["Text"] for block in response["Blocks"]
+                          if block["BlockType"] == "WORD" and centre_within(block, page, (left, top, right, bottom)))
+        found = region_index.query_box(arrays, region_index.WORD, page, (left, top, right, bottom))
+        assert sorted(word["text"] for word in found) == expected
+    assert region_index.query_box(arrays, region_index.LINE, 4, (0, 0, 1, 1)) == []
+
+
+def test_nearest_lines():
+    arrays = region_index.build(build_layout_response(page_count=2))
+    nearest = region_index.query_nearest(arrays, 1, 0.02, 0.041, count=2)
+    assert nearest[0]["text"] == "MRN JD4USARAD"
+    assert abs(nearest[0]["distance"] - 0.03) < 1e-4
+    assert nearest[0]["distance"] <= nearest[1]["distance"]
+    # within a line
+    assert region_index.query_nearest(arrays, 2, 0.1, 0.04)[0]["distance"] == 0.0
+
+
+def test_region_route(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=2))
+    core = region_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf(page_count=2))
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}])
+    core.ocr_complete("doc-1", "SUCCEEDED")
+    assert ("destination", "doc-1.region.npz") in s3.objects
+    assert core.get_document_id_from_result_id("doc-1.region.npz") == "doc-1"
+
+    def get(document_id: str, parameters: dict) -> dict:
+        return region_handler.lambda_handler({"httpMethod": "GET", "path": f"/text/{document_id}/region", "headers": {},
+                                              "queryStringParameters": parameters}, LambdaContext())
+
+    response = get("doc-1", {"page": "2", "box": "0%2C0.03%2C1%2C0.048"})
+    assert response["statusCode"] == 200
+    assert [line["text"] for line in json.loads(response["body"])["results"]] == ["MRN JD4USARAD"]
+    response = get("doc-1", {"page": "1", "x": "0.9", "y": "0.041", "count": "3"})
+    assert len(json.loads(response["body"])["results"]) == 3
+
+    assert get("doc-1", {"page": "1", "box": "0.5,0,0.2,1"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1", "box": "nan,0,1,1"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1", "box": "0,0,inf,1"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1", "x": "nan", "y": "0"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1", "x": "0.9", "y": "0.041", "count": "0"})["statusCode"] == 400
+    assert get("doc-1", {"page": "1", "x": "0.9", "y": "0.041", "count": "-1"})["statusCode"] == 400
+    assert get("doc-2", {"page": "1", "x": "0", "y": "0"})["statusCode"] == 404
+
+    # a document completed before the index was stored has it built from its result
+    del s3.objects[("destination", "doc-1.region.npz")]
+    assert get("doc-1", {"page": "1", "x": "0.9", "y": "0.041"})["statusCode"] == 200
+    assert ("destination", "doc-1.region.npz") in s3.objects
@@ -0,0 +1,97 @@
+import time
+
+import boto3
+import pytest
+from botocore.client import Config
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import cies_ocr_core
+import resilience
+import text_handler
+from tests.stubs import Clock, FaultInjector, InMemoryS3, LambdaContext
+
+OPERATION = "textract.StartDocumentAnalysis"
+DOCUMENT = {"S3Object": {"Bucket": "source", "Name": "doc-1"}}
+
+
+@pytest.fixture
+def textract(monkeypatch):
+    # the backoff of botocore's retries is not waited for
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    clock = Clock()
+    breakers = resilience.CircuitBreakers(failure_threshold=2, open_seconds=30, clock=clock)
+    client = boto3.client("textract", region_name="us-east-1", aws_access_key_id="testing", aws_secret_access_key="testing",
+                          config=Config(retries={"mode": "standard", "total_max_attempts": 3}))
+    resilience.protect_client(client, breakers)
+    return client, FaultInjector(client), breakers, clock
+
+
+def start(client) -> str:
+    return client.start_document_analysis(DocumentLocation=DOCUMENT, FeatureTypes=["LAYOUT"])["JobId"]
+
+
+def test_errors_are_classified():
+    assert resilience.classify("ThrottlingException", 400) == resilience.THROTTLE
+    assert resilience.classify("SlowDown", 503) == resilience.THROTTLE
+    assert resilience.classify("InternalServerError", 500) == resilience.TRANSIENT
+    assert resilience.classify("AccessDenied", 403) == resilience.PERMANENT
+    assert resilience.classify(exception=EndpointConnectionError(endpoint_url="https://textract")) == resilience.TRANSIENT
+    assert resilience.classify(exception=ValueError("bad")) == resilience.PERMANENT
+
+
+def test_the_circuit_opens_fails_fast_and_closes_after_a_probe(textract):
+    client, injector, breakers, clock = textract
+    # a transient failure is retried
+    injector.fail("InternalServerError", 500)
+    injector.succeed({"JobId": "job-1"})
+    assert start(client) == "job-1"
+    assert injector.requests == 2
+
+    # two calls fail after their retries, which opens the circuit
+    injector.fail("ThrottlingException", 400, times=6)
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            start(client)
+    assert injector.requests == 8
+    assert breakers.state(OPERATION) == resilience.OPEN
+
+    # the service is not called while the circuit is open
+    clock.now += 10
+    with pytest.raises(resilience.CircuitOpen) as open_circuit:
+        start(client)
+    assert (open_circuit.value.status_code, open_circuit.value.retry_after) == (503, 20)
+    assert injector.requests == 8
+
+    # a failed probe opens the circuit again
+    clock.now += 20
+    injector.fail("ThrottlingException", 400, times=3)
+    with pytest.raises(ClientError):
+        start(client)
+    assert breakers.state(OPERATION) == resilience.OPEN
+
+    clock.now += 30
+    injector.succeed({"JobId": "job-2"})
+    assert start(client) == "job-2"
+    assert breakers.state(OPERATION) == resilience.CLOSED
+    assert breakers.take_counters() == {OPERATION: {"Calls": 6, "Retries": 7, "Failures": 3, "ShortCircuited": 1, "CircuitOpened": 2}}
+
+
+def test_permanent_errors_are_not_retried_and_do_not_open_the_circuit(textract):
+    client, injector, breakers, clock = textract
+    injector.fail("AccessDeniedException", 400, times=3)
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            start(client)
+    assert injector.requests == 3
+    assert breakers.state(OPERATION) == resilience.CLOSED
+
+
+def test_an_open_circuit_is_a_503(monkeypatch):
+    class OpenCircuitS3(InMemoryS3):
+        def head_object(self, **kwargs):
+            raise resilience.CircuitOpen("s3.HeadObject", 12)
+
+    monkeypatch.setattr(cies_ocr_core, "s3", OpenCircuitS3())
+    event = {"httpMethod": "GET", "path": "/text/doc-1", "headers": {"accept": "application/json"}}
+    response = text_handler.lambda_handler(event, LambdaContext())
+    assert (response["statusCode"], response["headers"]["Retry-After"]) == (503, "12")
@@ -0,0 +1,63 @@
+import json
+import os
+
+import cies_ocr_core
+import result_cache
+import text_handler
+from tests.stubs import InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+
+def test_entries_are_validated_by_etag(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=1024)
+    cache.put("destination", "doc-1.json", '"v1"', b'{"Blocks": []}')
+    assert cache.get("destination", "doc-1.json", '"v1"') == b'{"Blocks": []}'
+    assert cache.get("destination", "doc-1.json", '"v2"') is None
+
+    # the new version replaces the previous one
+    cache.put("destination", "doc-1.json", '"v2"', b'{"Blocks": [1]}')
+    assert cache.get("destination", "doc-1.json", '"v1"') is None
+    assert cache.get("destination", "doc-1.json", '"v2"') == b'{"Blocks": [1]}'
+    assert len(os.listdir(tmp_path)) == 1
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_least_recently_used_are_evicted_by_bytes(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=300, max_entry_bytes=200)
+    for name in ("a", "b", "c"):
+        cache.put("destination", name, f'"{name}"', name.encode() * 100)
+    assert cache.get("destination", "a", '"a"') == b"a" * 100
+    cache.put("destination", "d", '"d"', b"d" * 100)
+
+    # b was the least recently used
+    assert cache.get("destination", "b", '"b"') is None
+    assert [cache.get("destination", name, f'"{name}"') is not None for name in ("a", "c", "d")] == [True, True, True]
+    assert cache.bytes == 300 and len(os.listdir(tmp_path)) == 3
+    # too large to be cached
+    cache.put("destination", "e", '"e"', b"e" * 201)
+    assert cache.get("destination", "e", '"e"') is None
+
+
+def test_hot_text_is_served_without_a_get(monkeypatch, tmp_path):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "result_cache", result_cache.ResultCache(str(tmp_path)))
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=2))
+    core = text_handler.cies_ocr_core
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}])
+    core.ocr_complete("doc-1", "SUCCEEDED")
+
+    event = {"httpMethod": "GET", "path": "/text/doc-1", "headers": {"accept": "application/json"}}
+    first = text_handler.lambda_handler(event, LambdaContext())
+    s3.calls.clear()
+    second = text_handler.lambda_handler(event, LambdaContext())
+    assert second["statusCode"] == 200 and second["body"] == first["body"]
+    assert second["headers"]["ETag"] == s3.objects[("destination", "doc-1.json")]["ETag"]
+    assert ("GetObject", "doc-1.json") not in s3.calls
+
+    # a replaced result is read again
+    s3.put_object(Bucket="destination", Key="doc-1.json", Body=json.dumps(build_layout_response(page_count=1)))
+    third = text_handler.lambda_handler(event, LambdaContext())
+    assert ("GetObject", "doc-1.json") in s3.calls
+    assert set(json.loads(third["body"])) == {"1"}
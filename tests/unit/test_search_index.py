@@ -0,0 +1,48 @@
+import search_index
+
+
+def make_segment(documents: dict) -> search_index.SegmentReader:
+    writer = search_index.SegmentWriter()
+    for document_id, pages in documents.items():
+        writer.add_document(document_id, pages)
+    return search_index.SegmentReader(writer.to_bytes())
+
+
+def test_tokenize():
+    assert search_index.tokenize("CLINICAL HISTORY: Melanoma, 3.2 cm") == ["clinical", "history", "melanoma", "3", "2", "cm"]
+
+
+def test_segment_round_trip():
+    reader = make_segment({"doc-1": {1: "Lung metastasis", 2: "liver metastasis metastasis"}})
+    assert reader.document_ids == ["doc-1"]
+    assert reader.postings("metastasis") == {"doc-1": {1: [1], 2: [1, 2]}}
+    assert reader.postings("absent") == {}
+
+
+def test_search_requires_every_term_on_a_page():
+    reader = make_segment({
+        "doc-1": {1: "metastasis located within the liver", 2: "lung"},
+        "doc-2": {1: "metastasis of the lung", 2: "liver is normal"},
+    })
+    results = search_index.search_segments([reader], "Liver metastasis")
+    assert [result["document_id"] for result in results] == ["doc-1"]
+    assert results[0]["pages"] == [{"page": 1, "positions": {"liver": [4], "metastasis": [0]}}]
+
+
+def test_newest_segment_is_authoritative():
+    old = make_segment({"doc-1": {1: "metastasis"}, "doc-2": {1: "metastasis"}})
+    new = make_segment({"doc-1": {1: "no evidence of disease"}})
+    assert [r["document_id"] for r in search_index.search_segments([old, new], "metastasis")] == ["doc-2"]
+
+    merged = search_index.SegmentReader(search_index.merge_segments([old, new]))
+    assert sorted(merged.document_ids) == ["doc-1", "doc-2"]
+    assert merged.postings("metastasis") == {"doc-2": {1: [0]}}
+    assert [r["document_id"] for r in search_index.search_segments([merged], "disease")] == ["doc-1"]
+
+
+def test_segment_keys_order_by_creation():
+    first = search_index.create_segment_key("site-r", 0, "20240601T000000000000Z")
+    second = search_index.create_segment_key("site-r", 1, "20240602T000000000000Z")
+    assert first.startswith("index/site-r/")
+    assert search_index.segment_level(second) == 1
+    assert search_index.segment_timestamp(first) < search_index.segment_timestamp(second)
@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import cies_ocr_core
+import single_flight
+from tests.stubs import InMemoryS3
+from tests.textract_fixtures import build_pdf
+
+CLIENTS = 20
+
+
+# Holds every HEAD until released, so that the calls of all of the clients overlap
+class GatedS3(InMemoryS3):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+
+    def head_object(self, **kwargs):
+        self.gate.wait(5)
+        return super().head_object(**kwargs)
+
+
+def wait_for_calls(group: single_flight.SingleFlight, name: str, calls: int):
+    deadline = time.time() + 5
+    while group.counters.get(name, {}).get("calls", 0) < calls and time.time() < deadline:
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def core(monkeypatch):
+    s3 = GatedS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "single_flight_group", single_flight.SingleFlight())
+    core = cies_ocr_core.CiesOcrCore("source", "destination", None, None, "us-east-1")
+    s3.gate.set()
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    s3.gate.clear()
+    return core, s3
+
+
+def test_concurrent_metadata_reads_share_one_call(core):
+    core, s3 = core
+    s3.calls.clear()
+    with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+        futures = [executor.submit(core.get_document_metadata, "doc-1") for _ in range(CLIENTS)]
+        wait_for_calls(core.single_flight_group, "get_document_metadata", CLIENTS)
+        s3.gate.set()
+        results = [future.result() for future in futures]
+
+    assert all(result == results[0] for result in results)
+    assert len({id(result) for result in results}) == CLIENTS
+    assert [call for call in s3.calls if call[0] == "HeadObject"] == [("HeadObject", "doc-1")]
+    assert core.single_flight_group.take_counters() == {
+        "get_document_metadata": {"calls": CLIENTS, "executions": 1, "coalesced": CLIENTS - 1}}
+
+    # nothing is cached, a later read calls S3
+    core.get_document_metadata("doc-1")
+    assert len([call for call in s3.calls if call[0] == "HeadObject"]) == 2
+
+
+def test_errors_are_shared():
+    group = single_flight.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("throttled")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(group.do, "read", ("doc-1",), failing)
+        started.wait(5)
+        follower = executor.submit(group.do, "read", ("doc-1",), lambda: "not called")
+        wait_for_calls(group, "read", 2)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert group.take_counters()["read"]["executions"] == 1
+
+
+def test_a_write_is_not_hidden_by_a_read_in_flight():
+    group = single_flight.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def stale():
+        started.set()
+        release.wait(5)
+        return "New"
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        before = executor.submit(group.do, "status", ("doc-1", None), stale)
+        started.wait(5)
+        group.forget("doc-1")
+        assert group.do("status", ("doc-1", None), lambda: "SUCCEEDED") == "SUCCEEDED"
+        release.set()
+        assert before.result() == "New"
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import cies_ocr_core
+import document_handler
+import ocr_submission_handler
+import site_usage
+from tests.stubs import Clock, InMemoryDynamoDB, InMemoryS3, LambdaContext
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+# 30 seconds into a minute
+NOW = datetime(2026, 10, 19, 12, 0, 30, tzinfo=timezone.utc).timestamp()
+
+
+def test_usage_is_written_in_one_update_per_site_and_period():
+    ddb = InMemoryDynamoDB()
+    usage = site_usage.SiteUsage(lambda: ddb, "usage", quotas={}, clock=Clock(NOW))
+    for _ in range(3):
+        usage.add("site-a", Documents=1, BytesStored=1000)
+    usage.add("site-a", Pages=12, ResultPages=2, BytesStored=500)
+    usage.add("site-b", Documents=1)
+    usage.flush()
+
+    assert len(ddb.updates) == 4
+    day = ddb.batch_get_item(RequestItems={"usage": {"Keys": [{"site_id": {"S": "site-a"}, "period": {"S": "day#2026-10-19"}}]}})
+    item = day["Responses"]["usage"][0]
+    assert {counter: item[counter]["N"] for counter in site_usage.COUNTERS} == \
+        {"Documents": "3", "Pages": "12", "ResultPages": "2", "BytesStored": "3500"}
+    assert int(item["expires_at"]["N"]) == int(NOW) + site_usage.USAGE_RETENTION_DAYS * 86400
+    assert usage.usage("site-a")["minute#2026-10-19T12:00"] == {"Documents": 3}
+
+    # the counts are added to those already written
+    usage.add("site-a", Documents=1)
+    usage.flush()
+    usage.cache.clear()
+    assert usage.usage("site-a")["day#2026-10-19"]["Documents"] == 4
+    # nothing is counted without a table
+    disabled = site_usage.SiteUsage(lambda: ddb, "", quotas={})
+    disabled.add("site-a", Documents=1)
+    assert disabled.pending == {}
+
+
+def test_quotas_are_loaded_and_validated():
+    assert site_usage.load_quotas('{"default": {"documents_per_day": 10}}') == {"default": {"documents_per_day": 10}}
+    assert site_usage.load_quotas("") == {}
+    for configuration in ("not json", '{"default": 10}', '{"default": {"bytes_per_day": 10}}'):
+        with pytest.raises(ValueError):
+            site_usage.load_quotas(configuration)
+
+
+def test_a_site_over_its_quota_is_refused_with_retry_after(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    ddb, clock = InMemoryDynamoDB(), Clock(NOW)
+    usage = site_usage.SiteUsage(lambda: ddb, "usage", clock=clock, quotas={
+        "default": {"documents_per_day": 100}, "site-backfill": {"documents_per_minute": 2, "pages_per_day": 50}})
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "usage_meter", usage)
+    usage.add("site-backfill", Documents=2)
+    usage.flush()
+
+    event = {"httpMethod": "POST", "path": "/doc-1", "body": "text", "headers": {"siteid": "site-backfill"}}
+    response = document_handler.lambda_handler(event, LambdaContext())
+    assert (response["statusCode"], response["headers"]["Retry-After"]) == (429, "30")
+    assert ("source", "doc-1") not in s3.objects
+    # the other sites have the default quotas
+    event["headers"]["siteid"] = "site-r"
+    assert document_handler.lambda_handler(event, LambdaContext())["statusCode"] == 202
+
+    # in the next minute the site is over its pages, until midnight
+    clock.now += 60
+    usage.add("site-backfill", Pages=50)
+    usage.flush()
+    with pytest.raises(site_usage.QuotaExceeded) as exceeded:
+        usage.check("site-backfill")
+    assert (exceeded.value.quota, exceeded.value.retry_after) == ("pages_per_day", 12 * 3600 - 90)
+
+
+def test_completion_counts_the_pages_and_results_of_the_site(monkeypatch):
+    monkeypatch.setattr(cies_ocr_core, "s3", InMemoryS3())
+    usage = site_usage.SiteUsage(lambda: InMemoryDynamoDB(), "usage", quotas={})
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "usage_meter", usage)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json", lambda self, job_id, region=None: build_layout_response(page_count=3))
+    core = cies_ocr_core.CiesOcrCore("source", "destination", "role", "topic", "us-east-1")
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    core.update_tag_in_S3("doc-1", [{"Key": cies_ocr_core.TAG_JOB_ID, "Value": "job-1"}], "site-r")
+    core.ocr_complete("doc-1", "SUCCEEDED", "site-r")
+
+    (key, counts), = [(key, counts) for key, counts in usage.pending.items() if key[1].startswith("day#")]
+    assert key[0] == "site-r"
+    # the analysis is not read through the client, there are no result pages to count
+    assert counts["Pages"] == 3 and "ResultPages" not in counts and counts["BytesStored"] > 0
+    assert "Documents" not in counts
+
+
+def test_submission_counts_the_document_of_its_site(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "submission_queue_urls", {})
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "submit_document_to_analysis", lambda self, document_id, site_id=None: None)
+    usage = site_usage.SiteUsage(lambda: InMemoryDynamoDB(), "usage", quotas={})
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "usage_meter", usage)
+    core = ocr_submission_handler.cies_ocr_core
+    # the flat layout, the key of the document has no site
+    assert core.layout.layout == "flat"
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    event = {"Records": [{"eventSource": "aws:s3", "eventName": "ObjectCreated:Put", "eventTime": "2024-06-10T14:00:00.000Z",
+                          "s3": {"bucket": {"name": "source", "arn": "arn:aws:s3:::source"}, "object": {"key": "doc-1", "size": 2048}}}]}
+    ocr_submission_handler.lambda_handler(event, LambdaContext())
+
+    counts = {period.split("#")[0]: counts for (site_id, period), counts in usage.pending.items() if site_id == "site-r"}
+    assert counts == {"day": {"Documents": 1, "BytesStored": 2048}, "minute": {"Documents": 1}}
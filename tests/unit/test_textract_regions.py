@@ -0,0 +1,126 @@
+import json
+import random
+import time
+
+import pytest
+
+import cies_ocr_core
+import resilience
+import textract_regions
+from tests.stubs import InMemoryS3, client_error
+from tests.textract_fixtures import build_layout_response, build_pdf
+
+WEST = {"region": "us-west-2", "weight": 300, "topic": "arn:aws:sns:us-west-2:123456789012:status",
+        "role": "arn:aws:iam::123456789012:role/textract", "bucket": "staging-us-west-2"}
+
+
+class TextractStub:
+    def __init__(self, region: str):
+        self.region = region
+        self.started = []
+
+    def start_document_analysis(self, DocumentLocation, NotificationChannel, **kwargs):
+        self.started.append((DocumentLocation["S3Object"]["Bucket"], DocumentLocation["S3Object"]["Name"], NotificationChannel["SNSTopicArn"]))
+        return {"JobId": f"job-{self.region}-{len(self.started)}"}
+
+
+class StagingS3:
+    def __init__(self):
+        self.copies = []
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.copies.append((CopySource["Bucket"], Bucket, Key))
+
+
+def home() -> textract_regions.Region:
+    return textract_regions.Region("us-east-1", 100, "arn:aws:sns:us-east-1:123456789012:status", "role", "source", home=True)
+
+
+def test_regions_are_loaded_and_validated():
+    regions = textract_regions.load_regions(home(), json.dumps([WEST, {"region": "us-east-1", "weight": 50}]))
+    assert [(region.name, region.weight, region.home) for region in regions] == [("us-east-1", 50, True), ("us-west-2", 300, False)]
+    assert [region.name for region in textract_regions.load_regions(home(), "")] == ["us-east-1"]
+    for configuration in ("not json", json.dumps({"region": "us-west-2"}), json.dumps([{"region": "us-west-2", "weight": 1}])):
+        with pytest.raises(ValueError):
+            textract_regions.load_regions(home(), configuration)
+
+
+def test_regions_are_drawn_by_weight_and_latency():
+    regions = textract_regions.load_regions(home(), json.dumps([WEST]))
+    dispatcher = textract_regions.RegionDispatcher(regions, resilience.CircuitBreakers(), random.Random(7))
+
+    def first_choices() -> float:
+        return sum(dispatcher.order()[0].name == "us-west-2" for _ in range(2000)) / 2000
+
+    # three times the quota of the home region
+    assert first_choices() == pytest.approx(0.75, abs=0.05)
+    # and now six times its latency
+    dispatcher.record_latency(regions[0], 100)
+    dispatcher.record_latency(regions[1], 600)
+    assert first_choices() == pytest.approx(1 / 3, abs=0.05)
+
+
+def test_a_throttled_or_open_region_fails_over():
+    regions = textract_regions.load_regions(home(), json.dumps([WEST]))
+    breakers = resilience.CircuitBreakers(failure_threshold=1)
+    dispatcher = textract_regions.RegionDispatcher(regions, breakers, random.Random(1))
+    attempts = []
+
+    def start(region):
+        attempts.append(region.name)
+        if region.name == "us-west-2":
+            raise client_error("LimitExceededException", "StartDocumentAnalysis")
+        return {"JobId": "job-1"}
+
+    for _ in range(5):
+        result, region = dispatcher.start(start)
+        assert (result["JobId"], region.name) == ("job-1", "us-east-1")
+    assert "us-west-2" in attempts
+
+    # the open region is tried last
+    breakers.after_call(resilience.operation_name(textract_regions.START_OPERATION, "us-west-2"), resilience.THROTTLE)
+    assert [region.name for region in dispatcher.order()] == ["us-east-1", "us-west-2"]
+
+    # a permanent error is not failed over
+    def invalid(region):
+        raise client_error("InvalidS3ObjectException", "StartDocumentAnalysis")
+    with pytest.raises(Exception) as error:
+        dispatcher.start(invalid)
+    assert error.value.response["Error"]["Code"] == "InvalidS3ObjectException"
+
+
+def test_only_the_start_of_a_job_is_timed():
+    regions = textract_regions.load_regions(home(), "")
+    dispatcher = textract_regions.RegionDispatcher(regions, resilience.CircuitBreakers(), random.Random(1))
+    # the copy of a large document to the bucket of the region
+    result, region = dispatcher.start(lambda region: {"JobId": "job-1"}, lambda region: time.sleep(0.3))
+    assert result["JobId"] == "job-1" and region.latency_ms < 100
+
+
+def test_a_job_is_staged_tagged_and_read_in_its_region(monkeypatch):
+    s3 = InMemoryS3()
+    monkeypatch.setattr(cies_ocr_core, "s3", s3)
+    # every job is started in us-west-2
+    monkeypatch.setattr(textract_regions, "HOME_REGION_WEIGHT", 0)
+    monkeypatch.setattr(textract_regions, "TEXTRACT_REGIONS", json.dumps([WEST]))
+    monkeypatch.setattr(cies_ocr_core, "txt", TextractStub("us-east-1"))
+    core = cies_ocr_core.CiesOcrCore("source", "destination", "role", "arn:aws:sns:us-east-1:123456789012:status", "us-east-1")
+    west, staging = TextractStub("us-west-2"), StagingS3()
+    core.regional_clients.update({("textract", "us-west-2"): west, ("s3", "us-west-2"): staging})
+
+    core.save_document_to_source_bucket("user", "site-r", "doc-1", "chart.pdf", "application/pdf", "New", build_pdf())
+    core.submit_document_to_analysis("doc-1", "site-r")
+    key = core.create_source_key("doc-1", "site-r")
+    assert staging.copies == [("source", "staging-us-west-2", key)]
+    assert west.started == [("staging-us-west-2", key, WEST["topic"])]
+    metadata = core.get_document_metadata("doc-1", "site-r")
+    assert (metadata[cies_ocr_core.TAG_JOB_ID], metadata[cies_ocr_core.TAG_TEXTRACT_REGION]) == ("job-us-west-2-1", "us-west-2")
+
+    regions = []
+    monkeypatch.setattr(cies_ocr_core.CiesOcrCore, "get_analysis_json",
+                        lambda self, job_id, region=None: regions.append(region) or build_layout_response(page_count=1))
+    core.ocr_complete("doc-1", "SUCCEEDED", "site-r")
+    assert regions == ["us-west-2"]
+    assert core.textract_client("us-west-2") is west and core.textract_client(None) is cies_ocr_core.txt
+    # a region which is not configured is read from too
+    assert core.textract_dispatcher.region("eu-west-1").name == "eu-west-1"